@@ -19,7 +19,7 @@ import { useData } from '../contexts/DataContext';
 import { useAuth } from '../contexts/AuthContext';
 import { useToast } from '../contexts/ToastContext';
 import { Quiz } from '../types';
-import { generateQuestions } from '../services/gemini';
+import { generateQuestionsStream } from '../services/gemini';
 import DefaultKeyLockedModal from './DefaultKeyLockedModal';
 import { AlertTriangle } from 'lucide-react';
 
@@ -39,7 +39,8 @@ const chapterTopics: { [chapter: string]: string[] } = {
     'Sự hình thành và phát triển mạng máy tính',
     'Các thành phần cơ bản (host, switch, router)',
     'Phân loại mạng (LAN, WAN, MAN, topology)',
-    'Kiến trúc phân tầng (OSI, TCP/IP)'
+    'Kiến trúc phân tầng (OSI, TCP/IP)',
+    'Độ trễ, thông lượng và băng thông'
   ],
   'Chương 2 - Tầng vật lý': [
     'Vai trò và chức năng tầng vật lý',
@@ -119,6 +120,7 @@ export default function CreateQuiz() {
   const [questionCount, setQuestionCount] = useState(10);
   const [duration, setDuration] = useState(30);
   const [generating, setGenerating] = useState(false);
+  const [generatedCount, setGeneratedCount] = useState(0);
   const [showKeyLockedModal, setShowKeyLockedModal] = useState(false);
 
   const handleGoToSettings = () => {
@@ -158,15 +160,20 @@ export default function CreateQuiz() {
     }
 
     setGenerating(true);
+    setGeneratedCount(0);
 
     try {
-      const questions = await generateQuestions({
+      const questions = await generateQuestionsStream({
         chapter: selectedChapter,
         topics: selectedTopics,
         knowledgeTypes: selectedKnowledgeTypes,
         difficulty: selectedDifficulty,
         count: questionCount
-      });
+      }, (_question, received) => setGeneratedCount(received));
+
+      if (questions.length === 0) {
+        throw new Error('AI không tạo được câu hỏi nào. Vui lòng thử lại.');
+      }
 
       const newQuiz: Quiz = {
         id: `quiz-${Date.now()}`,
@@ -181,12 +188,16 @@ export default function CreateQuiz() {
           topic: selectedTopics[0] || '',
           knowledgeTypes: selectedKnowledgeTypes,
           difficulty: selectedDifficulty,
-          questionCount
+          questionCount: questions.length
         }
       };
 
       await addQuiz(newQuiz);
-      showToast('Tạo đề thành công!', 'success');
+      if (questions.length < questionCount) {
+        showToast(`Chỉ tạo được ${questions.length}/${questionCount} câu hỏi. Đề thi đã được lưu với ${questions.length} câu.`, 'warning');
+      } else {
+        showToast('Tạo đề thành công!', 'success');
+      }
       resetForm();
     } catch (error) {
       const errorMessage = error instanceof Error ? error.message : 'Có lỗi xảy ra khi tạo đề. Vui lòng thử lại.';
@@ -422,7 +433,7 @@ export default function CreateQuiz() {
             disabled={generating}
             className="w-full bg-[#124874] text-white py-2 rounded-lg hover:bg-[#0d3351] transition-colors disabled:opacity-50 disabled:cursor-not-allowed flex items-center justify-center gap-2 text-sm md:text-base"
           >
-            {generating ? 'Đang tạo đề...' : 'Tạo đề thi tự động'}
+            {generating ? `Đang tạo đề... (${generatedCount}/${questionCount} câu)` : 'Tạo đề thi tự động'}
           </button>
 
           <div className="flex items-center gap-2 text-xs text-amber-700 bg-amber-50 border border-amber-200 rounded-lg px-3 py-2 mt-3">
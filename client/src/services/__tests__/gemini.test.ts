@@ -17,6 +17,7 @@
 import { describe, it, expect, vi, beforeEach, afterEach } from 'vitest';
 import {
     generateQuestions,
+    generateQuestionsStream,
     analyzeResult,
     analyzeOverall,
     analyzeProgress,
@@ -26,6 +27,7 @@ import * as api from '../api';
 // Mock the apiRequest function
 vi.mock('../api', () => ({
     apiRequest: vi.fn(),
+    getAuthToken: vi.fn(() => 'token'),
 }));
 
 describe('Gemini Service', () => {
@@ -111,6 +113,45 @@ describe('Gemini Service', () => {
         });
     });
 
+    describe('generateQuestionsStream', () => {
+        afterEach(() => {
+            vi.unstubAllGlobals();
+        });
+
+        it('trả về từng câu hỏi khi nhận được sự kiện', async () => {
+            const question = {
+                id: 'q1',
+                content: 'What is TCP?',
+                options: ['A', 'B', 'C', 'D'],
+                correctAnswer: 0,
+                chapter: 'Ch1',
+                topic: 'Networking',
+                knowledgeType: 'concept',
+                difficulty: 'easy',
+            };
+            const body = `event: question\ndata: ${JSON.stringify(question)}\n\nevent: done\ndata: {"count": 1}\n\n`;
+            const fetchMock = vi.fn().mockResolvedValueOnce(new Response(body, { status: 200 }));
+            vi.stubGlobal('fetch', fetchMock);
+            const onQuestion = vi.fn();
+
+            const result = await generateQuestionsStream({ count: 1 }, onQuestion);
+
+            expect(fetchMock).toHaveBeenCalledWith('/api/generate-questions/stream', expect.objectContaining({
+                method: 'POST',
+                body: JSON.stringify({ count: 1 }),
+            }));
+            expect(result).toEqual([question]);
+            expect(onQuestion).toHaveBeenCalledWith(question, 1);
+        });
+
+        it('ném lỗi khi nhận sự kiện error', async () => {
+            const body = 'event: error\ndata: {"status": 429, "detail": "Quá số lần gọi API"}\n\n';
+            vi.stubGlobal('fetch', vi.fn().mockResolvedValueOnce(new Response(body, { status: 200 })));
+
+            await expect(generateQuestionsStream({ count: 1 })).rejects.toThrow('Quá số lần gọi API');
+        });
+    });
+
     describe('analyzeResult', () => {
         const mockFeedback = {
             overallFeedback: 'Good job!',
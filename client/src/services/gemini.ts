@@ -15,7 +15,7 @@
  */
 
 import { Question, AiResultFeedback, KnowledgeAnalysis } from '../types';
-import { apiRequest } from './api';
+import { apiRequest, getAuthToken } from './api';
 
 interface GenerateQuestionsParams {
   chapter?: string;
@@ -53,6 +53,63 @@ export async function generateQuestions(params: GenerateQuestionsParams): Promis
   }
 }
 
+export async function generateQuestionsStream(
+  params: GenerateQuestionsParams,
+  onQuestion?: (question: Question, received: number) => void
+): Promise<Question[]> {
+  const token = getAuthToken();
+  const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+  if (token) {
+    headers['Authorization'] = `Bearer ${token}`;
+  }
+
+  const response = await fetch('/api/generate-questions/stream', {
+    method: 'POST',
+    headers,
+    body: JSON.stringify(params),
+  });
+
+  if (!response.ok || !response.body) {
+    const error = await response.json().catch(() => ({ detail: 'Đã xảy ra lỗi' }));
+    throw new Error(error.detail || `Lỗi HTTP! Mã trạng thái: ${response.status}`);
+  }
+
+  const questions: Question[] = [];
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+
+      let event = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+
+      if (event === 'question') {
+        const question = JSON.parse(data) as Question;
+        questions.push(question);
+        onQuestion?.(question, questions.length);
+      } else if (event === 'error') {
+        throw new Error(JSON.parse(data).detail || 'Đã xảy ra lỗi');
+      }
+    }
+  }
+
+  return questions;
+}
+
 export async function analyzeResult(params: AnalyzeResultParams): Promise<AiResultFeedback> {
   try {
     const data = await apiRequest<AiResultFeedback>('/api/analyze-result', {
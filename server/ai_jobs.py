@@ -0,0 +1,167 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+MongoDB-backed queue for AI analysis jobs.
+
+Jobs are stored in the `ai_jobs` collection and claimed by a fixed number of
+worker tasks. A claimed job holds a lease; if the server dies mid-job the
+lease expires and another worker picks the job up again, up to
+`AI_JOB_MAX_ATTEMPTS` times, so accepted work survives restarts and client
+disconnects. A job is not claimed before its `availableAt` time, which lets
+work that needs Gemini to recover first wait in the queue.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from pymongo import ReturnDocument
+from pymongo.database import Database
+from starlette.concurrency import run_in_threadpool
+
+AI_JOB_WORKERS = int(os.getenv("AI_JOB_WORKERS", "4"))
+AI_JOB_LEASE_SECONDS = int(os.getenv("AI_JOB_LEASE_SECONDS", "300"))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "3"))
+AI_JOB_POLL_INTERVAL = float(os.getenv("AI_JOB_POLL_INTERVAL", "5"))
+
+_wakeup: Optional[asyncio.Event] = None
+
+def notify_job_available() -> None:
+    """Wake an idle worker instead of waiting for the next poll"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+def create_job(
+    db: Database, user_id: str, analysis_type: str, payload: dict, delay: float = 0, history_id: Optional[str] = None
+) -> dict:
+    """Queue an analysis; a `delay` keeps it from being claimed before that many seconds have passed"""
+    now = datetime.now()
+    job = {
+        "id": f"job-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}",
+        "userId": user_id,
+        "analysisType": analysis_type,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "createdAt": now,
+        "availableAt": now + timedelta(seconds=delay),
+    }
+    if history_id:
+        # Replaces an existing history entry (a local analysis) instead of adding one
+        job["historyId"] = history_id
+    db.ai_jobs.insert_one(job)
+    job.pop("_id", None)
+    return job
+
+def get_job(db: Database, job_id: str) -> Optional[dict]:
+    return db.ai_jobs.find_one({"id": job_id}, {"_id": 0})
+
+def fail_abandoned_jobs(db: Database) -> int:
+    """Give up on jobs whose lease expired after the last allowed attempt"""
+    now = datetime.now()
+    result = db.ai_jobs.update_many(
+        {"status": "running", "leaseExpiresAt": {"$lt": now}, "attempts": {"$gte": AI_JOB_MAX_ATTEMPTS}},
+        {"$set": {
+            "status": "failed",
+            "error": {"status": 500, "detail": "Xử lý phân tích bị gián đoạn quá nhiều lần."},
+            "finishedAt": now,
+        }},
+    )
+    return result.modified_count
+
+def claim_next_job(db: Database) -> Optional[dict]:
+    """Atomically take the oldest queued job (or one whose lease expired)"""
+    fail_abandoned_jobs(db)
+    now = datetime.now()
+    job = db.ai_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "availableAt": {"$not": {"$gt": now}}},
+            {"status": "running", "leaseExpiresAt": {"$lt": now}, "attempts": {"$lt": AI_JOB_MAX_ATTEMPTS}},
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "startedAt": now,
+                "leaseExpiresAt": now + timedelta(seconds=AI_JOB_LEASE_SECONDS),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("createdAt", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    if job:
+        job.pop("_id", None)
+    return job
+
+def complete_job(db: Database, job_id: str, result: dict, history_id: str) -> None:
+    db.ai_jobs.update_one(
+        {"id": job_id},
+        {"$set": {"status": "done", "result": result, "historyId": history_id, "finishedAt": datetime.now()},
+         "$unset": {"leaseExpiresAt": ""}},
+    )
+
+def requeue_job(db: Database, job_id: str, delay: float) -> None:
+    """Put a claimed job back in the queue to be tried again after `delay` seconds"""
+    db.ai_jobs.update_one(
+        {"id": job_id},
+        {"$set": {"status": "queued", "availableAt": datetime.now() + timedelta(seconds=delay)},
+         "$unset": {"leaseExpiresAt": ""}},
+    )
+
+def fail_job(db: Database, job_id: str, error: dict) -> None:
+    db.ai_jobs.update_one(
+        {"id": job_id},
+        {"$set": {"status": "failed", "error": error, "finishedAt": datetime.now()},
+         "$unset": {"leaseExpiresAt": ""}},
+    )
+
+async def _worker(get_database: Callable[[], Database], process: Callable[[Database, dict], Awaitable[None]]) -> None:
+    while True:
+        try:
+            db = get_database()
+            job = await run_in_threadpool(claim_next_job, db)
+        except Exception as exc:
+            print("AI job worker could not claim a job:", exc)
+            job = None
+
+        if job is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), AI_JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+            continue
+
+        # There may be more queued work; let another idle worker look for it
+        _wakeup.set()
+        try:
+            await process(db, job)
+        except Exception as exc:
+            print(f"AI job {job['id']} failed unexpectedly:", exc)
+
+async def run_job_workers(
+    get_database: Callable[[], Database],
+    process: Callable[[Database, dict], Awaitable[None]],
+    concurrency: int = AI_JOB_WORKERS,
+) -> None:
+    """Run `concurrency` workers until cancelled"""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    try:
+        await asyncio.gather(*(_worker(get_database, process) for _ in range(concurrency)))
+    finally:
+        _wakeup = None
@@ -0,0 +1,235 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Prompts for the result, overall and progress analysis endpoints.
+
+By default (`ANALYSIS_PROMPT_COMPACT`) an attempt is not sent as indented
+JSON but described by per-chapter/topic statistics (with knowledge type and
+difficulty breakdowns), every incorrect answer on one line, and a few
+correctly answered questions as examples. Incorrect answers are added until
+the `ANALYSIS_PROMPT_MAX_CHARS` budget is used up; the rest are still
+counted in the statistics. The progress prompt lists each attempt of a
+chapter with its date and score, along with the score trend.
+"""
+
+import json
+import math
+import os
+from dtos import AnalyzeOverallRequest, AnalyzeProgressRequest, AnalyzeResultRequest, KnowledgeAnalysisItem, Question
+
+ANALYSIS_PROMPT_COMPACT = os.getenv("ANALYSIS_PROMPT_COMPACT", "true").lower() == "true"
+ANALYSIS_PROMPT_MAX_CHARS = int(os.getenv("ANALYSIS_PROMPT_MAX_CHARS", "8000"))
+REPRESENTATIVE_CORRECT_LIMIT = 5
+OPTION_LABELS = "ABCDEFGH"
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 bytes of UTF-8 per token) for offline comparisons"""
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+def _option(question: Question, index) -> str:
+    if not isinstance(index, int) or not 0 <= index < len(question.options):
+        return "bỏ trống"
+    label = OPTION_LABELS[index] if index < len(OPTION_LABELS) else str(index)
+    return f"{label}. {question.options[index]}"
+
+def _ratio(counts: dict[str, list[int]]) -> str:
+    return ", ".join(f"{key} {correct}/{total}" for key, (correct, total) in counts.items())
+
+def topic_statistics(params: AnalyzeResultRequest) -> list[str]:
+    """One line per chapter/topic: correct/total with knowledge type and difficulty breakdowns"""
+    groups: dict[tuple[str, str], dict] = {}
+    for question in params.questions:
+        correct = int(params.answers.get(question.id) == question.correctAnswer)
+        group = groups.setdefault((question.chapter, question.topic), {"correct": 0, "total": 0, "kinds": {}, "levels": {}})
+        group["correct"] += correct
+        group["total"] += 1
+        for breakdown, key in (("kinds", question.knowledgeType), ("levels", question.difficulty)):
+            counts = group[breakdown].setdefault(key, [0, 0])
+            counts[0] += correct
+            counts[1] += 1
+
+    return [
+        f"- {chapter} / {topic}: {group['correct']}/{group['total']} đúng"
+        f" (loại: {_ratio(group['kinds'])}; độ khó: {_ratio(group['levels'])})"
+        for (chapter, topic), group in groups.items()
+    ]
+
+def _question_line(question: Question, answer) -> str:
+    return (
+        f"- [{question.topic}|{question.knowledgeType}|{question.difficulty}] {question.content}"
+        f" | đúng: {_option(question, question.correctAnswer)} | chọn: {_option(question, answer)}"
+    )
+
+def encode_attempt(params: AnalyzeResultRequest, max_chars: int = ANALYSIS_PROMPT_MAX_CHARS) -> str:
+    """Statistics, incorrect answers and a few correct examples, within `max_chars`"""
+    incorrect = [q for q in params.questions if params.answers.get(q.id) != q.correctAnswer]
+    correct = [q for q in params.questions if params.answers.get(q.id) == q.correctAnswer]
+
+    lines = ["Thống kê theo chương / chủ đề (số câu đúng / tổng số câu):", *topic_statistics(params)]
+    used = sum(len(line) + 1 for line in lines)
+
+    def add_section(title: str, questions: list[Question]) -> int:
+        nonlocal used
+        section = []
+        for question in questions:
+            line = _question_line(question, params.answers.get(question.id))
+            if used + len(title) + len(line) + 2 > max_chars:
+                break
+            section.append(line)
+            used += len(line) + 1
+        if section:
+            lines.extend(["", title, *section])
+            used += len(title) + 2
+        return len(section)
+
+    if incorrect:
+        shown = add_section(
+            "Các câu trả lời sai ([chủ đề|loại kiến thức|độ khó] nội dung | đáp án đúng | đáp án đã chọn):",
+            incorrect,
+        )
+        if shown < len(incorrect):
+            lines.append(f"(còn {len(incorrect) - shown} câu sai khác, đã được tính trong thống kê)")
+
+    # One correctly answered question per topic shows what the student does master
+    examples = []
+    seen_topics = set()
+    for question in correct:
+        if question.topic not in seen_topics:
+            seen_topics.add(question.topic)
+            examples.append(question)
+    add_section("Một số câu trả lời đúng tiêu biểu:", examples[:REPRESENTATIVE_CORRECT_LIMIT])
+
+    return "\n".join(lines)
+
+def encode_knowledge_groups(items: list[KnowledgeAnalysisItem]) -> str:
+    """One line per knowledge group instead of indented JSON"""
+    return "\n".join(
+        f"- {item.chapter} / {item.topic} / {item.knowledgeType}: "
+        f"{item.correctAnswers}/{item.totalQuestions} đúng ({item.accuracy:.0f}%)"
+        for item in items
+    )
+
+def build_overall_analysis_prompt(params: AnalyzeOverallRequest, compact: bool = ANALYSIS_PROMPT_COMPACT) -> str:
+    if compact:
+        knowledge_section = (
+            "Phân tích theo nhóm kiến thức (mỗi dòng: chương / chủ đề / loại kiến thức: số câu đúng/tổng số câu, tỉ lệ đúng):\n"
+            + encode_knowledge_groups(params.knowledgeAnalysis)
+        )
+    else:
+        knowledge_payload = [item.model_dump() for item in params.knowledgeAnalysis]
+        knowledge_section = (
+            "Phân tích theo nhóm kiến thức (ở dạng JSON, mỗi phần tử mô tả một nhóm kiến thức với tỉ lệ trả lời đúng):\n"
+            + json.dumps(knowledge_payload, ensure_ascii=False, indent=2)
+        )
+
+    prompt = f"""
+Bạn là trợ lý dạy học môn Mạng máy tính. Hãy phân tích TỔNG QUAN lịch sử làm bài trắc nghiệm của một sinh viên.
+
+Thông tin tổng quan:
+- Tên sinh viên: {params.studentName or "Không xác định"}
+- Số bài đã làm: {params.attemptCount}
+- Điểm trung bình: {params.avgScore:.1f}/100
+
+{knowledge_section}
+
+Yêu cầu:
+1. Đưa ra nhận xét tổng quan về năng lực hiện tại (mạnh/yếu, mức độ nắm vững kiến thức, xu hướng tiến bộ hoặc chững lại nếu có thể suy ra).
+2. Chỉ ra các nhóm kiến thức/chương/chủ đề mà sinh viên làm tốt.
+3. Chỉ ra các nhóm kiến thức/chương/chủ đề mà sinh viên làm chưa tốt, cần ưu tiên ôn lại.
+4. Đề xuất các chủ đề/chương nên ôn luyện tiếp theo.
+5. Đề xuất một số hành động cụ thể để cải thiện (ví dụ: dạng bài nên luyện, chiến lược làm bài, cách phân bổ thời gian).
+
+Trả lời bằng tiếng Việt.
+"""
+
+    return prompt
+
+def build_analysis_prompt(params: AnalyzeResultRequest, compact: bool = ANALYSIS_PROMPT_COMPACT) -> str:
+    if compact:
+        questions_section = encode_attempt(params)
+    else:
+        questions_payload = []
+        for q in params.questions:
+            questions_payload.append(
+                {
+                    "id": q.id,
+                    "content": q.content,
+                    "options": q.options,
+                    "correctAnswer": q.correctAnswer,
+                    "userAnswer": params.answers.get(q.id),
+                    "chapter": q.chapter,
+                    "topic": q.topic,
+                    "knowledgeType": q.knowledgeType,
+                    "difficulty": q.difficulty,
+                }
+            )
+        questions_section = (
+            "Danh sách câu hỏi (ở dạng JSON, mỗi phần tử là một câu hỏi với cả đáp án đúng và đáp án học sinh chọn):\n"
+            + json.dumps(questions_payload, ensure_ascii=False, indent=2)
+        )
+
+    prompt = f"""
+Bạn là trợ lý dạy học môn Mạng máy tính. Hãy phân tích kết quả làm bài trắc nghiệm của một sinh viên.
+
+Thông tin tổng quan:
+- Tên đề: {params.quizTitle}
+- Điểm: {params.score:.1f}/100
+- Thời gian làm bài: {params.timeSpent} giây
+- Số câu: {len(params.questions)}
+
+{questions_section}
+
+Yêu cầu:
+1. Nhận xét tổng quan về mức độ hiểu bài, điểm mạnh/yếu tổng quát.
+2. Chỉ ra những nhóm kiến thức, chương, chủ đề mà sinh viên làm tốt.
+3. Chỉ ra những nhóm kiến thức, chương, chủ đề mà sinh viên hay sai, cần củng cố thêm.
+4. Gợi ý một số chủ đề/chương nên ôn luyện tiếp theo.
+5. Đề xuất một số hành động cụ thể để cải thiện (ví dụ: luyện thêm dạng bài nào, chiến lược làm bài...).
+
+Trả lời bằng tiếng Việt.
+"""
+
+    return prompt
+
+def build_progress_analysis_prompt(params: AnalyzeProgressRequest) -> str:
+    progress_text = "\n".join([
+        f"- {p.date}: {p.score:.1f} điểm ({p.quizTitle})" 
+        for p in params.progressData
+    ])
+    
+    trend_vi = {
+        "improving": "đang tiến bộ",
+        "declining": "đang giảm sút", 
+        "stable": "ổn định"
+    }.get(params.trend, params.trend)
+    
+    prompt = f"""Bạn là một chuyên gia giáo dục. Hãy phân tích sự tiến triển học tập của sinh viên dựa trên dữ liệu sau:
+
+Sinh viên: {params.studentName or 'Không xác định'}
+Chương/Chủ đề: {params.chapter}
+Xu hướng hiện tại: {trend_vi}
+Điểm trung bình: {params.avgScore:.1f}
+
+Lịch sử làm bài (theo thời gian):
+{progress_text}
+
+Hãy phân tích:
+1. Đánh giá tổng quan về sự tiến triển
+2. Điểm mạnh trong quá trình học
+3. Điểm cần cải thiện
+4. Đề xuất các bước tiếp theo
+
+Trả lời bằng tiếng Việt."""
+    return prompt
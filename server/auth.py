@@ -99,8 +99,17 @@ def unlock_user(db: Database, user_id: str) -> bool:
     )
     return result.modified_count > 0
 
+def get_quiz_version(db: Database, quiz_id: str) -> Optional[dict]:
+    """Get a quiz's version counter and owner without loading its questions.
+    Always read from MongoDB, so every worker sees edits made by the others."""
+    quiz = db.quizzes.find_one({"id": quiz_id}, {"_id": 0, "version": 1, "createdBy": 1})
+    if not quiz:
+        return None
+    return {"version": quiz.get("version", 0), "createdBy": quiz["createdBy"]}
+
 def create_quiz(db: Database, quiz_data: dict) -> dict:
     """Create a new quiz"""
+    quiz_data.setdefault("version", 1)
     db.quizzes.insert_one(quiz_data)
     return quiz_data
 
@@ -129,7 +138,7 @@ def update_quiz(db: Database, quiz_id: str, updates: dict) -> Optional[dict]:
     
     result = db.quizzes.update_one(
         {"id": quiz_id},
-        {"$set": update_data}
+        {"$set": update_data, "$inc": {"version": 1}}
     )
     
     if result.modified_count > 0 or result.matched_count > 0:
@@ -163,7 +172,7 @@ def update_question_in_quiz(db: Database, quiz_id: str, question_id: str, update
     
     result = db.quizzes.update_one(
         {"id": quiz_id},
-        {"$set": {"questions": updated_questions}}
+        {"$set": {"questions": updated_questions}, "$inc": {"version": 1}}
     )
     
     if result.modified_count > 0:
@@ -184,7 +193,7 @@ def delete_question_from_quiz(db: Database, quiz_id: str, question_id: str) -> O
     
     result = db.quizzes.update_one(
         {"id": quiz_id},
-        {"$set": {"questions": updated_questions, "settings": settings}}
+        {"$set": {"questions": updated_questions, "settings": settings}, "$inc": {"version": 1}}
     )
     
     if result.modified_count > 0:
@@ -208,6 +217,10 @@ def get_attempts_by_quiz(db: Database, quiz_id: str) -> List[dict]:
     """Get all attempts for a quiz"""
     return list(db.attempts.find({"quizId": quiz_id}).sort("completedAt", -1))
 
+def has_attempts_since(db: Database, student_id: str, since: datetime) -> bool:
+    """Check whether a student completed any attempt after `since`"""
+    return db.attempts.count_documents({"studentId": student_id, "completedAt": {"$gt": since}}, limit=1) > 0
+
 def update_user(db: Database, user_id: str, updates: dict) -> Optional[dict]:
     """Update user information"""
     update_data = {k: v for k, v in updates.items() if v is not None and k != "id"}
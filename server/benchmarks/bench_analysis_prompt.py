@@ -0,0 +1,122 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+So sánh kích thước prompt phân tích (kết quả bài làm và tổng quan): định dạng
+cũ (JSON có thụt lề) so với định dạng gọn (analysis_prompt.py).
+
+Số token được ước lượng offline; nếu có biến môi trường GOOGLE_API_KEY thì
+đếm thêm bằng API count_tokens của Gemini.
+
+Chạy từ thư mục server:
+    python benchmarks/bench_analysis_prompt.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dtos import AnalyzeOverallRequest, AnalyzeResultRequest, KnowledgeAnalysisItem, Question
+from gemini_client import get_client
+from analysis_prompt import build_analysis_prompt, build_overall_analysis_prompt, estimate_tokens
+
+QUESTION_COUNTS = (10, 25, 50)
+WRONG_RATIO = 0.3
+TOPICS = ("Mô hình OSI", "Tầng vận chuyển", "Định tuyến", "Địa chỉ IP", "DNS")
+MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash")
+API_KEY = os.getenv("GOOGLE_API_KEY")
+client = get_client(API_KEY) if API_KEY else None
+
+def make_attempt(question_count: int) -> AnalyzeResultRequest:
+    questions = [
+        Question(
+            id=f"q-1735000000000-{i}",
+            content=f"Câu hỏi số {i}: Giao thức nào hoạt động ở tầng vận chuyển và đảm bảo truyền tin cậy giữa hai tiến trình?",
+            options=["TCP", "UDP", "IP", "ICMP"],
+            correctAnswer=i % 4,
+            chapter=f"Chương {i % 3 + 1}",
+            topic=TOPICS[i % len(TOPICS)],
+            knowledgeType=("concept", "mechanism", "example")[i % 3],
+            difficulty=("easy", "medium", "hard")[i % 3],
+            explanation="TCP cung cấp dịch vụ truyền tin cậy, hướng kết nối với cơ chế ACK và truyền lại.",
+        )
+        for i in range(question_count)
+    ]
+    wrong_every = round(1 / WRONG_RATIO)
+    answers = {
+        q.id: (q.correctAnswer + 1) % 4 if i % wrong_every == 0 else q.correctAnswer
+        for i, q in enumerate(questions)
+    }
+    score = 100 * sum(answers[q.id] == q.correctAnswer for q in questions) / question_count
+    return AnalyzeResultRequest(
+        quizTitle="Đề kiểm tra tổng hợp", questions=questions, answers=answers, score=score, timeSpent=1200
+    )
+
+def make_overall(attempt: AnalyzeResultRequest) -> AnalyzeOverallRequest:
+    groups: dict[tuple, list[int]] = {}
+    for q in attempt.questions:
+        counts = groups.setdefault((q.chapter, q.topic, q.knowledgeType), [0, 0])
+        counts[0] += attempt.answers[q.id] == q.correctAnswer
+        counts[1] += 1
+    return AnalyzeOverallRequest(
+        studentName="Sinh viên",
+        attemptCount=12,
+        avgScore=attempt.score,
+        knowledgeAnalysis=[
+            KnowledgeAnalysisItem(
+                chapter=chapter,
+                topic=topic,
+                knowledgeType=knowledge_type,
+                totalQuestions=total,
+                correctAnswers=correct,
+                accuracy=100 * correct / total,
+            )
+            for (chapter, topic, knowledge_type), (correct, total) in groups.items()
+        ],
+    )
+
+def count_tokens(prompt: str):
+    if client is None:
+        return None
+    return client.models.count_tokens(model=MODEL_NAME, contents=prompt).total_tokens
+
+def report(name: str, legacy: str, compact: str):
+    legacy_tokens = count_tokens(legacy) or estimate_tokens(legacy)
+    compact_tokens = count_tokens(compact) or estimate_tokens(compact)
+    print(
+        f"{name:>18} | {len(legacy):>9} {len(compact):>9} | "
+        f"{legacy_tokens:>9} {compact_tokens:>9} | {1 - compact_tokens / legacy_tokens:>6.0%}"
+    )
+
+def main():
+    print(f"{'Prompt':>18} | {'ký tự cũ':>9} {'ký tự gọn':>9} | {'token cũ':>9} {'token gọn':>9} | {'giảm':>6}")
+    for question_count in QUESTION_COUNTS:
+        attempt = make_attempt(question_count)
+        report(
+            f"kết quả {question_count} câu",
+            build_analysis_prompt(attempt, compact=False),
+            build_analysis_prompt(attempt, compact=True),
+        )
+        overall = make_overall(attempt)
+        report(
+            f"tổng quan {len(overall.knowledgeAnalysis)} nhóm",
+            build_overall_analysis_prompt(overall, compact=False),
+            build_overall_analysis_prompt(overall, compact=True),
+        )
+    source = "Gemini count_tokens" if client is not None else "ước lượng offline (~4 byte UTF-8 / token)"
+    print(f"Token: {source}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Đo chi phí serialize một đề thi 50 câu hỏi: đường cũ (dựng QuizResponse rồi
+FastAPI validate lại qua response_model) so với đường nhanh (serializers.py).
+
+Chạy từ thư mục server:
+    python benchmarks/bench_quiz_serialization.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from dtos import QuizResponse, QuizSettings
+from serializers import FastJSONResponse, quiz_to_dict
+
+QUESTION_COUNT = 50
+ITERATIONS = 2000
+
+def make_quiz_document(question_count: int = QUESTION_COUNT) -> dict:
+    questions = [
+        {
+            "id": f"q-1735000000000-{i}",
+            "content": f"Câu hỏi số {i}: Giao thức nào hoạt động ở tầng vận chuyển và đảm bảo truyền tin cậy?",
+            "options": ["TCP", "UDP", "IP", "ICMP"],
+            "correctAnswer": i % 4,
+            "chapter": "Chương 3",
+            "topic": "Tầng vận chuyển",
+            "knowledgeType": "concept",
+            "difficulty": ("easy", "medium", "hard")[i % 3],
+            "explanation": "TCP cung cấp dịch vụ truyền tin cậy, hướng kết nối với cơ chế ACK và truyền lại.",
+        }
+        for i in range(question_count)
+    ]
+    return {
+        "_id": "ignored",
+        "id": "quiz-1735000000000",
+        "title": "Đề kiểm tra tầng vận chuyển",
+        "description": "Đề thi dùng cho benchmark",
+        "questions": questions,
+        "duration": 45,
+        "createdBy": "user-1",
+        "createdAt": datetime(2025, 12, 30, 10, 0, 0, 123000),
+        "settings": {
+            "chapter": "Chương 3",
+            "topic": "Tầng vận chuyển",
+            "knowledgeTypes": ["concept"],
+            "difficulty": None,
+            "questionCount": question_count,
+        },
+    }
+
+async def legacy_path(field, quiz: dict) -> bytes:
+    response = QuizResponse(
+        id=quiz["id"],
+        title=quiz["title"],
+        description=quiz.get("description", ""),
+        questions=quiz["questions"],
+        duration=quiz["duration"],
+        createdBy=quiz["createdBy"],
+        createdAt=quiz.get("createdAt", datetime.now()),
+        settings=QuizSettings(**quiz.get("settings", {"questionCount": len(quiz.get("questions", []))})),
+    )
+    content = await serialize_response(field=field, response_content=response)
+    return JSONResponse(content).body
+
+async def fast_path(field, quiz: dict) -> bytes:
+    return FastJSONResponse(quiz_to_dict(quiz)).body
+
+async def measure(path, field, quiz: dict) -> float:
+    for _ in range(50):
+        await path(field, quiz)
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await path(field, quiz)
+    return (time.perf_counter() - start) / ITERATIONS * 1_000_000
+
+async def main():
+    field = create_model_field(name="Response_get_quiz", type_=QuizResponse, mode="serialization")
+    quiz = make_quiz_document()
+
+    legacy_us = await measure(legacy_path, field, quiz)
+    fast_us = await measure(fast_path, field, quiz)
+
+    print(f"Đề thi {QUESTION_COUNT} câu, {ITERATIONS} lần lặp")
+    print(f"  response_model (cũ): {legacy_us:8.1f} µs/đề")
+    print(f"  fast path (mới):     {fast_us:8.1f} µs/đề")
+    print(f"  nhanh hơn:           {legacy_us / fast_us:8.1f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
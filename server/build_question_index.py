@@ -0,0 +1,30 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Xây dựng lại chỉ mục câu hỏi gần trùng (collection `question_index`) từ các đề thi đã lưu.
+
+Chạy một lần sau khi nâng cấp (các đề thi tạo hoặc sửa sau đó được cập nhật tự động):
+    python build_question_index.py
+"""
+
+from database import get_database
+from question_similarity import rebuild_question_index
+
+def main():
+    db = get_database()
+    total = rebuild_question_index(db)
+    print(f"question_index: indexed={total}")
+
+if __name__ == "__main__":
+    main()
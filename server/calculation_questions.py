@@ -0,0 +1,405 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Locally generated calculation questions.
+
+Subnetting and delay/bandwidth exercises (knowledgeType "example") are built
+from templates with random parameters and solved with the `ipaddress`
+module and closed-form formulas, so the correct option, the distractors
+(answers of typical mistakes) and the worked explanation always agree and
+no Gemini call is needed.
+
+`plan_local_calculations` decides how much of a generation request the
+templates serve: the "example" share of the requested knowledge types, when
+every requested topic (or, without topics, the chapter) is one the templates
+cover. Requests about other topics are left to the LLM.
+"""
+
+import ipaddress
+import math
+import os
+import random
+import re
+from fractions import Fraction
+from typing import Callable, Optional
+from dtos import GenerateQuestionsRequest, Question
+from question_generation import fold_accents, split_difficulties
+
+LOCAL_CALCULATION_QUESTIONS = os.getenv("LOCAL_CALCULATION_QUESTIONS", "true").lower() == "true"
+CALCULATION_KNOWLEDGE_TYPE = "example"
+PROPAGATION_SPEED = 2 * 10**8  # m/s, usual value for copper and fiber
+MAX_DRAFT_ATTEMPTS = 20
+
+Draft = tuple[str, str, list[str], str]  # content, answer, distractor candidates, explanation
+
+def _number(value) -> str:
+    """Vietnamese number formatting: at most 3 decimals, comma as decimal separator"""
+    text = f"{float(value):.3f}".rstrip("0").rstrip(".")
+    return text.replace(".", ",")
+
+def _duration(seconds: Fraction) -> str:
+    if seconds >= 1:
+        return f"{_number(seconds)} s"
+    if seconds * 1000 >= Fraction(1, 100):
+        return f"{_number(seconds * 1000)} ms"
+    return f"{_number(seconds * 10**6)} µs"
+
+def _binary(address: ipaddress.IPv4Address) -> str:
+    return ".".join(f"{octet:08b}" for octet in address.packed)
+
+def _random_interface(rng: random.Random, prefix: int) -> ipaddress.IPv4Interface:
+    """A host address (neither network nor broadcast) in a private range"""
+    base = rng.choice([
+        (10, rng.randrange(256)),
+        (172, rng.randrange(16, 32)),
+        (192, 168),
+    ])
+    address = ipaddress.IPv4Address(f"{base[0]}.{base[1]}.{rng.randrange(256)}.{rng.randrange(256)}")
+    network = ipaddress.IPv4Network(f"{address}/{prefix}", strict=False)
+    offset = rng.randrange(1, network.num_addresses - 1)
+    return ipaddress.IPv4Interface(f"{network.network_address + offset}/{prefix}")
+
+def _mask(prefix: int) -> str:
+    return str(ipaddress.IPv4Network(f"0.0.0.0/{prefix}").netmask)
+
+# ---------------------------------------------------------------------------
+# Subnetting
+# ---------------------------------------------------------------------------
+
+def subnet_mask(rng: random.Random) -> Draft:
+    prefix = rng.randint(17, 30)
+    answer = _mask(prefix)
+    candidates = [_mask(p) for p in (prefix + 1, prefix - 1, prefix - 8, prefix + 2, prefix - 2) if 8 <= p <= 32]
+    return (
+        f"Subnet mask tương ứng với độ dài tiền tố /{prefix} là gì?",
+        answer,
+        candidates,
+        f"/{prefix} nghĩa là {prefix} bit đầu của mask bằng 1: "
+        f"{_binary(ipaddress.IPv4Address(answer))} = {answer}.",
+    )
+
+def usable_hosts(rng: random.Random) -> Draft:
+    prefix = rng.randint(20, 30)
+    host_bits = 32 - prefix
+    answer = 2**host_bits - 2
+    candidates = [2**host_bits, 2**host_bits - 1, 2**(host_bits + 1) - 2, 2**(host_bits - 1) - 2]
+    return (
+        f"Một mạng IPv4 có tiền tố /{prefix} có bao nhiêu địa chỉ host có thể gán cho thiết bị?",
+        str(answer),
+        [str(value) for value in candidates],
+        f"Số bit host = 32 − {prefix} = {host_bits}; số host dùng được = 2^{host_bits} − 2 = {answer} "
+        f"(trừ địa chỉ mạng và địa chỉ broadcast).",
+    )
+
+def network_address(rng: random.Random) -> Draft:
+    prefix = rng.randint(18, 29)
+    interface = _random_interface(rng, prefix)
+    network = interface.network
+    naive = ipaddress.IPv4Address(int(interface.ip) & 0xFFFFFF00)
+    candidates = [
+        network.broadcast_address,
+        naive,
+        network.network_address + 1,
+        ipaddress.IPv4Interface(f"{interface.ip}/{prefix - 1}").network.network_address,
+        ipaddress.IPv4Interface(f"{interface.ip}/{prefix + 1}").network.network_address,
+        network.network_address + network.num_addresses,
+    ]
+    return (
+        f"Host có địa chỉ {interface} thuộc mạng có địa chỉ mạng nào?",
+        str(network.network_address),
+        [str(value) for value in candidates],
+        f"Mask /{prefix} = {network.netmask}. Địa chỉ mạng = {interface.ip} AND {network.netmask} "
+        f"= {network.network_address}.",
+    )
+
+def broadcast_address(rng: random.Random) -> Draft:
+    prefix = rng.randint(18, 29)
+    interface = _random_interface(rng, prefix)
+    network = interface.network
+    candidates = [
+        network.network_address,
+        network.broadcast_address - 1,
+        ipaddress.IPv4Interface(f"{interface.ip}/{prefix + 1}").network.broadcast_address,
+        ipaddress.IPv4Interface(f"{interface.ip}/{prefix - 1}").network.broadcast_address,
+        network.broadcast_address + network.num_addresses,
+    ]
+    return (
+        f"Địa chỉ broadcast của mạng chứa host {interface} là gì?",
+        str(network.broadcast_address),
+        [str(value) for value in candidates],
+        f"Địa chỉ mạng = {interface.ip} AND {network.netmask} = {network.network_address}; đặt {32 - prefix} "
+        f"bit host bằng 1 được địa chỉ broadcast {network.broadcast_address}.",
+    )
+
+def hosts_per_subnet(rng: random.Random) -> Draft:
+    prefix = rng.randint(16, 26)
+    subnets = rng.choice([n for n in (3, 5, 6, 7, 10, 12, 14, 20, 30) if prefix + math.ceil(math.log2(n)) <= 30])
+    borrowed = math.ceil(math.log2(subnets))
+    new_prefix = prefix + borrowed
+    network = _random_interface(rng, prefix).network
+    host_bits = 32 - new_prefix
+    answer = 2**host_bits - 2
+    candidates = [
+        2**host_bits,
+        2**(host_bits - 1) - 2,
+        2**(host_bits + 1) - 2,
+        2**(32 - prefix) // subnets - 2,
+    ]
+    return (
+        f"Cần chia mạng {network} thành ít nhất {subnets} mạng con có kích thước bằng nhau, mượn ít bit nhất có thể. "
+        f"Mỗi mạng con có bao nhiêu địa chỉ host dùng được?",
+        str(answer),
+        [str(value) for value in candidates],
+        f"2^{borrowed} = {2**borrowed} ≥ {subnets} nên mượn {borrowed} bit, tiền tố mới là /{new_prefix}; "
+        f"còn {host_bits} bit host, số host dùng được = 2^{host_bits} − 2 = {answer}.",
+    )
+
+def same_subnet(rng: random.Random) -> Draft:
+    prefix = rng.randint(20, 28)
+    interface = _random_interface(rng, prefix)
+    network = interface.network
+    size = network.num_addresses
+
+    def host_in(base: int) -> ipaddress.IPv4Address:
+        return ipaddress.IPv4Address(base + rng.randrange(1, size - 1))
+
+    start = int(network.network_address)
+    answer = host_in(start)
+    while answer == interface.ip:
+        answer = host_in(start)
+    candidates = [
+        host_in(start + step * size)
+        for step in (1, -1, 2, -2, 3)
+        if 0 <= start + step * size and start + (step + 1) * size <= 2**32
+    ]
+    return (
+        f"Địa chỉ nào sau đây cùng mạng con với host {interface}?",
+        str(answer),
+        [str(value) for value in candidates],
+        f"Mạng của {interface} là {network}, dải host từ {network.network_address + 1} đến "
+        f"{network.broadcast_address - 1}; chỉ {answer} nằm trong dải này.",
+    )
+
+# ---------------------------------------------------------------------------
+# Delay and bandwidth
+# ---------------------------------------------------------------------------
+
+def transmission_delay(rng: random.Random) -> Draft:
+    length = rng.choice([500, 1000, 1250, 1500, 2000, 4000])
+    rate = rng.choice([1, 2, 4, 5, 8, 10, 100])
+    answer = Fraction(length * 8, rate * 10**6)
+    candidates = [answer / 8, answer * 10, answer / 10, answer * 8]
+    return (
+        f"Thời gian truyền (transmission delay) một gói tin {length} byte lên đường truyền {rate} Mbps là bao nhiêu?",
+        _duration(answer),
+        [_duration(value) for value in candidates],
+        f"d_trans = L / R = {length} × 8 bit / ({rate} × 10^6 bit/s) = {_duration(answer)}.",
+    )
+
+def file_transfer_time(rng: random.Random) -> Draft:
+    size = rng.choice([1, 2, 5, 10, 25, 50, 100])
+    rate = rng.choice([2, 4, 5, 8, 10, 20, 100])
+    answer = Fraction(size * 8, rate)
+    candidates = [answer / 8, answer * 2, answer / 2, answer * 10]
+    return (
+        f"Truyền một tệp {size} MB qua đường truyền {rate} Mbps mất bao lâu? "
+        f"(1 MB = 10^6 byte, bỏ qua các độ trễ khác)",
+        _duration(answer),
+        [_duration(value) for value in candidates],
+        f"Thời gian = kích thước / tốc độ = {size} × 8 × 10^6 bit / ({rate} × 10^6 bit/s) = {_duration(answer)}.",
+    )
+
+def propagation_delay(rng: random.Random) -> Draft:
+    distance = rng.choice([100, 200, 400, 500, 1000, 2000, 2500, 4000, 5000])
+    answer = Fraction(distance * 1000, PROPAGATION_SPEED)
+    candidates = [Fraction(distance * 1000, 3 * 10**8), answer * 10, answer / 10, answer * 2]
+    return (
+        f"Hai nút mạng cách nhau {distance} km, tín hiệu lan truyền với tốc độ 2 × 10^8 m/s. "
+        f"Độ trễ lan truyền (propagation delay) là bao nhiêu?",
+        _duration(answer),
+        [_duration(value) for value in candidates],
+        f"d_prop = khoảng cách / tốc độ lan truyền = {distance} × 10^3 m / (2 × 10^8 m/s) = {_duration(answer)}.",
+    )
+
+def end_to_end_delay(rng: random.Random) -> Draft:
+    length = rng.choice([1000, 1250, 1500, 2000])
+    rate = rng.choice([1, 2, 5, 10])
+    distance = rng.choice([200, 400, 1000, 2000])
+    links = rng.choice([2, 3, 4])
+    transmission = Fraction(length * 8, rate * 10**6)
+    propagation = Fraction(distance * 1000, PROPAGATION_SPEED)
+    answer = links * (transmission + propagation)
+    candidates = [
+        transmission + propagation,
+        links * transmission + propagation,
+        transmission + links * propagation,
+        links * propagation,
+        (links + 1) * (transmission + propagation),
+    ]
+    return (
+        f"Một gói tin {length} byte đi qua {links} liên kết nối tiếp theo cơ chế store-and-forward; mỗi liên kết "
+        f"có tốc độ {rate} Mbps, dài {distance} km, tốc độ lan truyền 2 × 10^8 m/s. Bỏ qua độ trễ xử lý và "
+        f"hàng đợi, độ trễ đầu-cuối là bao nhiêu?",
+        _duration(answer),
+        [_duration(value) for value in candidates],
+        f"Mỗi liên kết: d_trans = {length} × 8 / ({rate} × 10^6) = {_duration(transmission)}, "
+        f"d_prop = {distance} × 10^3 / (2 × 10^8) = {_duration(propagation)}. Gói tin được truyền lại ở mỗi "
+        f"liên kết nên tổng = {links} × ({_duration(transmission)} + {_duration(propagation)}) = {_duration(answer)}.",
+    )
+
+# Families of templates per difficulty, with the phrases (accent-folded, matched as whole words) of
+# topics they cover. A family is skipped for topics that name a word of "excluded_without" but not the
+# word it maps to: the subnet templates are IPv4 only.
+FAMILIES: dict[str, dict] = {
+    "subnet": {
+        "topic": "Địa chỉ IP và chia mạng con",
+        "keywords": (
+            "subnet", "subnets", "subnetting", "subnet mask", "mang con", "chia mang", "dia chi ip", "ip address",
+            "ipv4", "cidr", "vlsm",
+        ),
+        "excluded_without": {"ipv6": "ipv4"},
+        "templates": {
+            "easy": [subnet_mask, usable_hosts],
+            "medium": [network_address, broadcast_address],
+            "hard": [hosts_per_subnet, same_subnet],
+        },
+    },
+    "delay": {
+        "topic": "Độ trễ và băng thông",
+        "keywords": (
+            "delay", "do tre", "bang thong", "bandwidth", "throughput", "thong luong", "latency",
+            "thoi gian truyen", "toc do truyen",
+        ),
+        "excluded_without": {},
+        "templates": {
+            "easy": [transmission_delay, file_transfer_time],
+            "medium": [propagation_delay],
+            "hard": [end_to_end_delay],
+        },
+    },
+}
+
+def _words(text: str) -> tuple[str, ...]:
+    return tuple(re.findall(r"[a-z0-9]+", fold_accents(text)))
+
+def _mentions(words: tuple[str, ...], phrase: str) -> bool:
+    """Whether `phrase` occurs in `words` as a run of whole words"""
+    target = _words(phrase)
+    return any(words[i:i + len(target)] == target for i in range(len(words) - len(target) + 1))
+
+def _families_for(text: str) -> list[str]:
+    words = _words(text)
+    return [
+        name for name, family in FAMILIES.items()
+        if any(_mentions(words, keyword) for keyword in family["keywords"])
+        and not any(
+            _mentions(words, excluded) and not _mentions(words, required)
+            for excluded, required in family["excluded_without"].items()
+        )
+    ]
+
+def matching_families(params: GenerateQuestionsRequest) -> list[tuple[str, str]]:
+    """(family, topic label) pairs covering the request, or [] when some requested topic is not covered"""
+    if params.topics:
+        pairs = []
+        for topic in params.topics:
+            families = _families_for(topic)
+            if not families:
+                return []
+            pairs.extend((family, topic) for family in families)
+        return pairs
+    names = _families_for(params.chapter) if params.chapter else list(FAMILIES)
+    return [(name, FAMILIES[name]["topic"]) for name in names]
+
+def plan_local_calculations(
+    params: GenerateQuestionsRequest,
+) -> tuple[int, Optional[GenerateQuestionsRequest]]:
+    """Number of questions served locally, and the request left for the LLM (None when nothing is left)"""
+    knowledge_types = params.knowledgeTypes or []
+    if (
+        not LOCAL_CALCULATION_QUESTIONS
+        or CALCULATION_KNOWLEDGE_TYPE not in knowledge_types
+        or not matching_families(params)
+    ):
+        return 0, params
+
+    local = -(-params.count // len(knowledge_types))
+    if local >= params.count:
+        return params.count, None
+    rest = params.model_copy(update={
+        "count": params.count - local,
+        "knowledgeTypes": [t for t in knowledge_types if t != CALCULATION_KNOWLEDGE_TYPE],
+    })
+    return local, rest
+
+def _build(draft: Draft, rng: random.Random) -> tuple[str, list[str], int, str]:
+    content, answer, candidates, explanation = draft
+    distractors = []
+    for candidate in candidates:
+        if candidate != answer and candidate not in distractors:
+            distractors.append(candidate)
+    if len(distractors) < 3:
+        raise ValueError(f"not enough distinct distractors for: {content}")
+    options = [answer] + rng.sample(distractors, 3)
+    rng.shuffle(options)
+    return content, options, options.index(answer), explanation
+
+def generate_calculation_questions(
+    params: GenerateQuestionsRequest, count: int, rng: Optional[random.Random] = None
+) -> list[Question]:
+    """`count` distinct calculation questions for the topics of the request; fewer only when the
+    templates have no distinct exercise left for a difficulty"""
+    rng = rng or random.Random()
+    pairs = matching_families(params)
+    if params.difficulty in ("easy", "medium", "hard"):
+        difficulties = [params.difficulty] * count
+    else:
+        difficulties = [level for level, n in split_difficulties(count).items() for _ in range(n)]
+        rng.shuffle(difficulties)
+
+    questions: list[Question] = []
+    seen: set[str] = set()
+    for position, difficulty in enumerate(difficulties):
+        drafted = None
+        # The position's own topic first; when its templates keep repeating, the other topics of the request
+        for offset in range(len(pairs)):
+            family, topic = pairs[(position + offset) % len(pairs)]
+            templates: list[Callable[[random.Random], Draft]] = FAMILIES[family]["templates"][difficulty]
+            for _ in range(MAX_DRAFT_ATTEMPTS):
+                try:
+                    built = _build(rng.choice(templates)(rng), rng)
+                except ValueError:
+                    continue
+                if built[0] not in seen:
+                    drafted = built
+                    break
+            if drafted:
+                break
+        if drafted is None:
+            continue
+        content, options, answer, explanation = drafted
+        seen.add(content)
+        questions.append(Question(
+            id=f"local-{position}",
+            content=content,
+            options=options,
+            correctAnswer=answer,
+            chapter=params.chapter or "Chương 1",
+            topic=topic,
+            knowledgeType=CALCULATION_KNOWLEDGE_TYPE,
+            difficulty=difficulty,
+            explanation=explanation,
+        ))
+    return questions
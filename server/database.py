@@ -23,6 +23,21 @@ load_dotenv()
 
 MONGODB_URL = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "networking-quiz")
+AI_JOB_RETENTION_SECONDS = int(os.getenv("AI_JOB_RETENTION_SECONDS", "604800"))
+LLM_USAGE_RETENTION_DAYS = int(os.getenv("LLM_USAGE_RETENTION_DAYS", "90"))
+
+# Timestamp fields that older versions stored as ISO 8601 strings
+TIMESTAMP_FIELDS = {
+    "quizzes": ["createdAt"],
+    "attempts": ["completedAt"],
+    "analysis_history": ["createdAt"],
+    "chat_messages": ["timestamp"],
+    "private_messages": ["timestamp"],
+    "quiz_discussions": ["addedAt"],
+    "discussion_messages": ["timestamp"],
+    "user_settings": ["updatedAt"],
+    "system_settings": ["updatedAt"],
+}
 
 _client: Optional[MongoClient] = None
 _db: Optional[Database] = None
@@ -74,6 +89,7 @@ def init_db():
     db.analysis_history.create_index("userId")
     db.analysis_history.create_index("analysisType")
     db.analysis_history.create_index("createdAt")
+    db.analysis_history.create_index([("userId", 1), ("analysisType", 1), ("fingerprint", 1), ("createdAt", -1)])
     db.chat_messages.create_index("id", unique=True)
     db.chat_messages.create_index("timestamp")
     db.private_messages.create_index("id", unique=True)
@@ -87,6 +103,18 @@ def init_db():
     db.discussion_messages.create_index("timestamp")
     db.otp_codes.create_index("email", unique=True)
     db.otp_codes.create_index("expiresAt", expireAfterSeconds=0)  
+    db.generation_cache.create_index("key", unique=True)
+    db.generation_cache.create_index("expiresAt", expireAfterSeconds=0)
+    db.question_stock.create_index([("slot.chapter", 1), ("slot.topic", 1), ("slot.knowledgeType", 1), ("slot.difficulty", 1), ("createdAt", 1)])
+    db.question_stock_slots.create_index("slot", unique=True)
+    db.question_stock_slots.create_index("lastRequestedAt")
+    db.question_index.create_index([("userId", 1), ("bands", 1)])
+    db.question_index.create_index("quizId")
+    db.ai_jobs.create_index("id", unique=True)
+    db.ai_jobs.create_index([("status", 1), ("createdAt", 1)])
+    db.ai_jobs.create_index("finishedAt", expireAfterSeconds=AI_JOB_RETENTION_SECONDS)
+    db.llm_usage.create_index([("bucket", 1), ("model", 1), ("endpoint", 1)], unique=True)
+    db.llm_usage.create_index("bucket", expireAfterSeconds=LLM_USAGE_RETENTION_DAYS * 86400)
     seed_admin_user()
 
 def create_analysis_history(db: Database, data: dict) -> dict:
@@ -94,6 +122,11 @@ def create_analysis_history(db: Database, data: dict) -> dict:
     db.analysis_history.insert_one(data)
     return data
 
+def save_analysis_history(db: Database, data: dict) -> dict:
+    """Create an analysis history record, or replace the one with the same id"""
+    db.analysis_history.replace_one({"id": data["id"]}, data, upsert=True)
+    return data
+
 def get_analysis_history_by_user(db: Database, user_id: str, skip: int = 0, limit: int = 20) -> dict:
     """Get analysis history for a user with pagination"""
     query = {"userId": user_id}
@@ -105,6 +138,13 @@ def get_analysis_history_by_id(db: Database, id: str) -> dict:
     """Get a specific analysis history record by ID"""
     return db.analysis_history.find_one({"id": id})
 
+def find_analysis_by_fingerprint(db: Database, user_id: str, analysis_type: str, fingerprint: str) -> Optional[dict]:
+    """Get the latest analysis of a user produced from the same input"""
+    return db.analysis_history.find_one(
+        {"userId": user_id, "analysisType": analysis_type, "fingerprint": fingerprint},
+        sort=[("createdAt", -1)],
+    )
+
 def delete_analysis_history(db: Database, id: str, user_id: str) -> bool:
     """Delete an analysis history record (only if owned by user)"""
     result = db.analysis_history.delete_one({"id": id, "userId": user_id})
@@ -190,7 +230,7 @@ def save_user_settings(db: Database, user_id: str, settings: dict) -> dict:
     data = {
         "userId": user_id,
         **settings,
-        "updatedAt": datetime.now().isoformat()
+        "updatedAt": datetime.now()
     }
     db.user_settings.update_one(
         {"userId": user_id},
@@ -209,11 +249,43 @@ def save_system_settings(db: Database, settings: dict) -> dict:
     data = {
         "_id": "system",
         **settings,
-        "updatedAt": datetime.now().isoformat()
+        "updatedAt": datetime.now()
     }
     db.system_settings.update_one(
         {"_id": "system"},
         {"$set": data},
         upsert=True
     )
-    return data
\ No newline at end of file
+    return data
+
+def parse_legacy_timestamp(value: str) -> Optional[datetime]:
+    """Parse an ISO 8601 string stored by older versions into a naive local datetime"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+def migrate_timestamps_to_datetime(db: Database) -> dict:
+    """Convert ISO string timestamps to native BSON datetimes.
+
+    Safe to run repeatedly: only documents whose field is still a string are touched.
+    Returns a per-collection summary of converted and unparseable documents.
+    """
+    summary = {}
+    for collection_name, fields in TIMESTAMP_FIELDS.items():
+        collection = db[collection_name]
+        converted = 0
+        skipped = 0
+        for field in fields:
+            for doc in list(collection.find({field: {"$type": "string"}}, {field: 1})):
+                parsed = parse_legacy_timestamp(doc[field])
+                if parsed is None:
+                    skipped += 1
+                    continue
+                collection.update_one({"_id": doc["_id"]}, {"$set": {field: parsed}})
+                converted += 1
+        summary[collection_name] = {"converted": converted, "skipped": skipped}
+    return summary
@@ -46,6 +46,14 @@ class Question(BaseModel):
 class GenerateQuestionsResponse(BaseModel):
     questions: List[Question]
 
+class GeneratedQuestion(BaseModel):
+    """Response schema for Gemini: the fields of `Question` the model writes itself"""
+    content: str = Field(..., max_length=2000)
+    options: List[str] = Field(..., min_length=4, max_length=4)
+    correctAnswer: int = Field(..., ge=0, le=3, description="Chỉ số của đáp án đúng trong options, bắt đầu từ 0")
+    difficulty: Literal["easy", "medium", "hard"]
+    explanation: Optional[str] = Field(None, max_length=1000, description="Giải thích ngắn gọn vì sao đáp án đúng")
+
 class AnalyzeResultRequest(BaseModel):
     quizTitle: str = Field(..., max_length=150)
     questions: List[Question]
@@ -54,11 +62,11 @@ class AnalyzeResultRequest(BaseModel):
     timeSpent: int
 
 class AnalyzeResultResponse(BaseModel):
-    overallFeedback: str
-    strengths: List[str]
-    weaknesses: List[str]
-    suggestedTopics: List[str]
-    suggestedNextActions: List[str]
+    overallFeedback: str = Field(..., description="Nhận xét tổng quan")
+    strengths: List[str] = Field(..., description="Điểm mạnh")
+    weaknesses: List[str] = Field(..., description="Điểm yếu cần củng cố")
+    suggestedTopics: List[str] = Field(..., description="Chương/chủ đề nên ôn tiếp")
+    suggestedNextActions: List[str] = Field(..., description="Hành động cụ thể để cải thiện")
 
 class KnowledgeAnalysisItem(BaseModel):
     knowledgeType: str = Field(..., max_length=50)
@@ -170,7 +178,7 @@ class QuizResponse(BaseModel):
     questions: List[Question]
     duration: int
     createdBy: str
-    createdAt: str
+    createdAt: datetime
     settings: QuizSettings
 
 class UpdateQuestionRequest(BaseModel):
@@ -195,7 +203,7 @@ class AttemptResponse(BaseModel):
     studentId: str
     answers: Dict[str, int]
     score: float
-    completedAt: str
+    completedAt: datetime
     timeSpent: int
 
 class AnalysisResultData(BaseModel):
@@ -212,7 +220,21 @@ class AnalysisHistoryResponse(BaseModel):
     title: str
     result: AnalysisResultData
     context: Optional[Dict[str, Any]] = None
-    createdAt: str
+    createdAt: datetime
+
+class AIJobAcceptedResponse(BaseModel):
+    jobId: str
+    status: Literal["queued"]
+
+class AIJobResponse(BaseModel):
+    id: str
+    analysisType: Literal["result", "overall", "progress"]
+    status: Literal["queued", "running", "done", "failed"]
+    result: Optional[AnalysisResultData] = None
+    historyId: Optional[str] = None
+    error: Optional[Dict[str, Any]] = None
+    createdAt: datetime
+    finishedAt: Optional[datetime] = None
 
 class AddToDiscussionRequest(BaseModel):
     quizId: str = Field(..., max_length=100)
@@ -224,7 +246,7 @@ class QuizDiscussionResponse(BaseModel):
     quizDescription: Optional[str] = None
     addedBy: str
     addedByName: str
-    addedAt: str
+    addedAt: datetime
     messageCount: int
 
 class DiscussionMessageResponse(BaseModel):
@@ -233,7 +255,7 @@ class DiscussionMessageResponse(BaseModel):
     userId: str
     userName: str
     content: str
-    timestamp: str
+    timestamp: datetime
 
 class GeminiSettingsRequest(BaseModel):
     model: Optional[str] = Field(None, max_length=50)
@@ -247,4 +269,32 @@ class SystemSettingsResponse(BaseModel):
     defaultKeyLocked: bool = False
 
 class LockDefaultKeyRequest(BaseModel):
-    locked: bool
\ No newline at end of file
+    locked: bool
+
+class LLMUsageStats(BaseModel):
+    key: str
+    calls: int
+    errors: int
+    promptTokens: int
+    responseTokens: int
+    thoughtTokens: int
+    cachedTokens: int = 0
+    totalTokens: int
+    p50Ms: Optional[float] = None
+    p95Ms: Optional[float] = None
+    maxWaiting: int = 0
+    minConcurrencyLimit: Optional[int] = None
+    maxConcurrencyLimit: Optional[int] = None
+
+class DefaultKeyStats(BaseModel):
+    key: str
+    load: int
+    callsLastMinute: int
+    rateLimited: int
+    coolingDownFor: float
+
+class LLMUsageResponse(BaseModel):
+    since: datetime
+    byModel: List[LLMUsageStats]
+    byEndpoint: List[LLMUsageStats]
+    defaultKeys: List[DefaultKeyStats] = []
\ No newline at end of file
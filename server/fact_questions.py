@@ -0,0 +1,407 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Locally generated fact questions.
+
+A curated table of well-known ports, transport protocols, OSI layers and
+device layers backs template questions of knowledgeType "concept" and
+"rule" (the facts the generation prompt warns Gemini not to invent).
+Distractors are drawn from the same table, so they are plausible but wrong.
+
+Facts are picked by the protocol and device names that appear in the
+requested topics (the client's topics list them, e.g. "Thư điện tử (SMTP,
+POP3, IMAP)"), by the OSI/TCP-IP topics, or, without topics, by the layer
+the chapter is about. `fact_share` is the part of a request the table may
+serve; whatever the matching facts cannot cover is left to the LLM.
+"""
+
+import math
+import os
+import random
+from typing import Callable, Optional
+from dtos import GenerateQuestionsRequest, Question
+from question_generation import normalize_content, split_difficulties
+
+LOCAL_FACT_QUESTIONS_SHARE = float(os.getenv("LOCAL_FACT_QUESTIONS_SHARE", "1"))
+FACT_KNOWLEDGE_TYPES = ("concept", "rule")
+
+OSI_LAYERS = {
+    1: "Vật lý (Physical)",
+    2: "Liên kết dữ liệu (Data Link)",
+    3: "Mạng (Network)",
+    4: "Giao vận (Transport)",
+    5: "Phiên (Session)",
+    6: "Trình diễn (Presentation)",
+    7: "Ứng dụng (Application)",
+}
+TCPIP_LAYERS = {
+    1: "Truy cập mạng (Network Access)",
+    2: "Truy cập mạng (Network Access)",
+    3: "Internet",
+    4: "Giao vận (Transport)",
+    5: "Ứng dụng (Application)",
+    6: "Ứng dụng (Application)",
+    7: "Ứng dụng (Application)",
+}
+PDU_NAMES = {1: "Bit", 2: "Frame (khung)", 3: "Packet (gói tin)", 4: "Segment (đoạn)"}
+TRANSPORT_OPTIONS = ["TCP", "UDP", "Cả TCP và UDP", "SCTP"]
+
+# port: default server port(s); transport: "TCP", "UDP" or "Cả TCP và UDP"; layer: OSI layer,
+# None where textbooks disagree (ARP, TLS) or for routing protocols carried by TCP/UDP
+PROTOCOLS = [
+    {"name": "HTTP", "port": "80", "transport": "TCP", "layer": 7,
+     "purpose": "truyền tải trang web giữa trình duyệt và máy chủ web"},
+    {"name": "HTTPS", "port": "443", "transport": "TCP", "layer": 7,
+     "purpose": "truyền tải trang web được mã hóa bằng TLS"},
+    {"name": "FTP", "port": "21", "transport": "TCP", "layer": 7,
+     "purpose": "truyền tệp với kênh điều khiển tách riêng khỏi kênh dữ liệu"},
+    {"name": "TFTP", "port": "69", "transport": "UDP", "layer": 7,
+     "purpose": "truyền tệp đơn giản, không xác thực người dùng"},
+    {"name": "SSH", "port": "22", "transport": "TCP", "layer": 7,
+     "purpose": "đăng nhập và điều khiển máy từ xa qua kênh được mã hóa"},
+    {"name": "Telnet", "port": "23", "transport": "TCP", "layer": 7,
+     "purpose": "đăng nhập từ xa dạng dòng lệnh, dữ liệu không được mã hóa"},
+    {"name": "SMTP", "port": "25", "transport": "TCP", "layer": 7,
+     "purpose": "gửi thư điện tử và chuyển thư giữa các máy chủ thư"},
+    {"name": "POP3", "port": "110", "transport": "TCP", "layer": 7,
+     "purpose": "tải thư từ máy chủ về máy khách để đọc ngoại tuyến"},
+    {"name": "IMAP", "port": "143", "transport": "TCP", "layer": 7,
+     "purpose": "đọc và quản lý thư ngay trên máy chủ, đồng bộ giữa nhiều thiết bị"},
+    {"name": "DNS", "port": "53", "transport": "Cả TCP và UDP", "layer": 7,
+     "purpose": "phân giải tên miền thành địa chỉ IP",
+     "note": "Truy vấn thông thường dùng UDP; TCP dùng cho phản hồi lớn và chuyển vùng (zone transfer)."},
+    {"name": "DHCP", "port": "67/68", "transport": "UDP", "layer": 7,
+     "purpose": "cấp phát địa chỉ IP và cấu hình mạng tự động cho máy trạm",
+     "note": "Máy chủ DHCP nghe ở cổng 67, máy khách dùng cổng 68."},
+    {"name": "SNMP", "port": "161", "transport": "UDP", "layer": 7,
+     "purpose": "giám sát và quản lý các thiết bị mạng"},
+    {"name": "NTP", "port": "123", "transport": "UDP", "layer": 7,
+     "purpose": "đồng bộ thời gian giữa các máy tính"},
+    {"name": "LDAP", "port": "389", "transport": "TCP", "layer": 7,
+     "purpose": "truy vấn và cập nhật dịch vụ thư mục"},
+    {"name": "RDP", "port": "3389", "transport": "TCP", "layer": 7,
+     "purpose": "điều khiển màn hình máy tính Windows từ xa"},
+    {"name": "BGP", "port": "179", "transport": "TCP", "layer": None,
+     "purpose": "trao đổi thông tin định tuyến giữa các hệ tự trị (AS)"},
+    {"name": "RIP", "port": "520", "transport": "UDP", "layer": None,
+     "purpose": "định tuyến nội miền theo vectơ khoảng cách với metric là số bước nhảy"},
+    {"name": "OSPF", "port": None, "transport": None, "layer": 3,
+     "purpose": "định tuyến nội miền theo trạng thái liên kết"},
+    {"name": "IP", "port": None, "transport": None, "layer": 3,
+     "purpose": "định địa chỉ và chuyển tiếp gói tin giữa các mạng"},
+    {"name": "ICMP", "port": None, "transport": None, "layer": 3,
+     "purpose": "báo lỗi và chẩn đoán mạng, được dùng bởi lệnh ping"},
+    {"name": "IPSec", "port": None, "transport": None, "layer": 3,
+     "purpose": "mã hóa và xác thực từng gói tin IP"},
+    {"name": "ARP", "port": None, "transport": None, "layer": None,
+     "purpose": "tìm địa chỉ MAC tương ứng với một địa chỉ IPv4 trong mạng LAN"},
+    {"name": "TCP", "port": None, "transport": None, "layer": 4,
+     "purpose": "truyền dữ liệu tin cậy, có kết nối và đúng thứ tự"},
+    {"name": "UDP", "port": None, "transport": None, "layer": 4,
+     "purpose": "truyền datagram không kết nối, không đảm bảo tin cậy"},
+    {"name": "TLS", "port": None, "transport": None, "layer": None,
+     "purpose": "mã hóa và xác thực kết nối giữa hai ứng dụng"},
+    {"name": "Ethernet", "port": None, "transport": None, "layer": 2,
+     "purpose": "đóng khung và truyền dữ liệu trong mạng LAN có dây"},
+    {"name": "PPP", "port": None, "transport": None, "layer": 2,
+     "purpose": "đóng gói dữ liệu trên liên kết điểm-điểm"},
+]
+DEVICES = [
+    {"name": "Hub", "layer": 1},
+    {"name": "Repeater", "layer": 1},
+    {"name": "Switch", "layer": 2},
+    {"name": "Bridge", "layer": 2},
+    {"name": "Router", "layer": 3},
+]
+# Accent-folded chapter words and the OSI layer the chapter is about
+CHAPTER_LAYERS = {
+    "tang ung dung": 7,
+    "tang giao van": 4,
+    "tang van chuyen": 4,
+    "tang mang": 3,
+    "tang lien ket du lieu": 2,
+    "tang vat ly": 1,
+}
+OVERVIEW_WORDS = ("osi", "phan tang", "tong quan")
+# Protocols close enough in purpose that each would also answer a purpose question about the other,
+# so they are never distractors for one another
+OVERLAPPING_PROTOCOLS = [{"HTTP", "HTTPS"}, {"FTP", "TFTP"}, {"SSH", "RDP"}]
+
+Item = tuple[str, str, str, list[str], str]  # content, answer, explanation, distractor candidates, knowledgeType
+Template = tuple[str, str, Callable[[dict, random.Random], Item]]  # difficulty, fact kind, builder
+
+def _others(key: str, value, rng: random.Random, prefer: Optional[Callable[[dict], bool]] = None) -> list:
+    """Values of `key` in other protocols, preferred ones first, each group shuffled"""
+    entries = [entry for entry in PROTOCOLS if entry.get(key) and entry.get(key) != value]
+    preferred = [entry[key] for entry in entries if prefer and prefer(entry)]
+    rest = [entry[key] for entry in entries if entry[key] not in preferred]
+    rng.shuffle(preferred)
+    rng.shuffle(rest)
+    return preferred + rest
+
+def _near_layers(layer: int, rng: random.Random) -> list[str]:
+    others = sorted((n for n in OSI_LAYERS if n != layer), key=lambda n: (abs(n - layer), rng.random()))
+    return [OSI_LAYERS[n] for n in others[:4]]
+
+def _describe(fact: dict) -> str:
+    text = f"{fact['name']} dùng cổng {fact['port']} trên {fact['transport']}."
+    return f"{text} {fact['note']}" if fact.get("note") else text
+
+def port_of(fact: dict, rng: random.Random) -> Item:
+    return (
+        f"Giao thức {fact['name']} mặc định sử dụng cổng (port) nào?",
+        fact["port"],
+        _describe(fact),
+        _others("port", fact["port"], rng, lambda entry: entry["transport"] == fact["transport"]),
+        "rule",
+    )
+
+def protocol_on_port(fact: dict, rng: random.Random) -> Item:
+    return (
+        f"Cổng {fact['port']} ({fact['transport']}) là cổng mặc định của giao thức nào?",
+        fact["name"],
+        _describe(fact),
+        _others("name", fact["name"], rng, lambda entry: entry.get("port") and entry["transport"] == fact["transport"]),
+        "rule",
+    )
+
+def transport_of(fact: dict, rng: random.Random) -> Item:
+    return (
+        f"Giao thức {fact['name']} sử dụng giao thức tầng giao vận nào?",
+        fact["transport"],
+        _describe(fact),
+        list(TRANSPORT_OPTIONS),
+        "rule",
+    )
+
+def server_endpoint(fact: dict, rng: random.Random) -> Item:
+    transport = "UDP" if fact["transport"] == "Cả TCP và UDP" else fact["transport"]
+    port = fact["port"].split("/")[0]
+    answer = f"{transport} {port}"
+    candidates = [
+        f"{'UDP' if entry['transport'] != 'TCP' else 'TCP'} {entry['port'].split('/')[0]}"
+        for entry in PROTOCOLS
+        if entry.get("port") and entry["port"] != fact["port"]
+    ]
+    rng.shuffle(candidates)
+    return (
+        f"Máy khách gửi yêu cầu {fact['name']} tới máy chủ theo cấu hình mặc định. "
+        f"Gói tin dùng giao thức tầng giao vận và cổng đích nào?",
+        answer,
+        _describe(fact),
+        candidates,
+        "rule",
+    )
+
+def _overlapping(name: str) -> set[str]:
+    return set().union(*(group for group in OVERLAPPING_PROTOCOLS if name in group))
+
+def purpose_of(fact: dict, rng: random.Random) -> Item:
+    overlapping = _overlapping(fact["name"])
+    candidates = _others("name", fact["name"], rng, lambda entry: entry["layer"] == fact["layer"])
+    return (
+        f"Giao thức nào được dùng để {fact['purpose']}?",
+        fact["name"],
+        f"{fact['name']} là giao thức {fact['purpose']}.",
+        [name for name in candidates if name not in overlapping],
+        "concept",
+    )
+
+def layer_of(fact: dict, rng: random.Random) -> Item:
+    layer = fact["layer"]
+    return (
+        f"Giao thức {fact['name']} hoạt động ở tầng nào của mô hình OSI?",
+        OSI_LAYERS[layer],
+        f"{fact['name']} ({fact['purpose']}) thuộc tầng {layer} - {OSI_LAYERS[layer]} của mô hình OSI.",
+        _near_layers(layer, rng),
+        "concept",
+    )
+
+def not_on_layer(fact: dict, rng: random.Random) -> Item:
+    layer = 3 if fact["layer"] == 7 else 7
+    members = [entry["name"] for entry in PROTOCOLS if entry["layer"] == layer]
+    rng.shuffle(members)
+    return (
+        f"Giao thức nào sau đây KHÔNG hoạt động ở tầng {OSI_LAYERS[layer]} của mô hình OSI?",
+        fact["name"],
+        f"{fact['name']} thuộc tầng {OSI_LAYERS[fact['layer']]}; các giao thức còn lại thuộc tầng {OSI_LAYERS[layer]}.",
+        members,
+        "concept",
+    )
+
+def layer_number(fact: dict, rng: random.Random) -> Item:
+    layer = fact["layer"]
+    return (
+        f"Tầng {OSI_LAYERS[layer]} là tầng thứ mấy trong mô hình OSI (tính từ dưới lên)?",
+        f"Tầng {layer}",
+        "Thứ tự các tầng OSI từ dưới lên: " + ", ".join(f"{n}. {name}" for n, name in OSI_LAYERS.items()) + ".",
+        [f"Tầng {n}" for n in sorted(OSI_LAYERS, key=lambda n: (abs(n - layer), rng.random())) if n != layer],
+        "concept",
+    )
+
+def tcpip_layer(fact: dict, rng: random.Random) -> Item:
+    layer = fact["layer"]
+    return (
+        f"Chức năng của tầng {OSI_LAYERS[layer]} trong mô hình OSI thuộc tầng nào của mô hình TCP/IP 4 tầng?",
+        TCPIP_LAYERS[layer],
+        "Mô hình TCP/IP gộp tầng Phiên, Trình diễn và Ứng dụng thành tầng Ứng dụng; tầng Mạng tương ứng tầng "
+        "Internet; tầng Vật lý và Liên kết dữ liệu gộp thành tầng Truy cập mạng.",
+        sorted(set(TCPIP_LAYERS.values())),
+        "concept",
+    )
+
+def pdu_name(fact: dict, rng: random.Random) -> Item:
+    layer = fact["layer"]
+    return (
+        f"Đơn vị dữ liệu (PDU) ở tầng {OSI_LAYERS[layer]} của mô hình OSI được gọi là gì?",
+        PDU_NAMES[layer],
+        "PDU theo từng tầng: " + ", ".join(f"{OSI_LAYERS[n]} - {name}" for n, name in PDU_NAMES.items()) + ".",
+        [name for n, name in PDU_NAMES.items() if n != layer],
+        "concept",
+    )
+
+def device_layer(fact: dict, rng: random.Random) -> Item:
+    layer = fact["layer"]
+    return (
+        f"Thiết bị {fact['name']} hoạt động chủ yếu ở tầng nào của mô hình OSI?",
+        OSI_LAYERS[layer],
+        f"{fact['name']} xử lý dữ liệu ở tầng {layer} - {OSI_LAYERS[layer]}: "
+        + {1: "chỉ khuếch đại và chuyển tiếp tín hiệu (bit).", 2: "chuyển tiếp khung theo địa chỉ MAC.",
+           3: "định tuyến gói tin theo địa chỉ IP."}[layer],
+        [OSI_LAYERS[n] for n in (1, 2, 3, 4, 7) if n != layer],
+        "concept",
+    )
+
+# (difficulty, fact kind, builder); a builder only applies to facts having the fields it reads
+TEMPLATES: list[Template] = [
+    ("easy", "protocol", port_of),
+    ("medium", "protocol", protocol_on_port),
+    ("medium", "protocol", transport_of),
+    ("hard", "protocol", server_endpoint),
+    ("easy", "protocol", purpose_of),
+    ("medium", "protocol", layer_of),
+    ("hard", "protocol", not_on_layer),
+    ("easy", "layer", layer_number),
+    ("hard", "layer", tcpip_layer),
+    ("medium", "layer", pdu_name),
+    ("easy", "device", device_layer),
+]
+REQUIRED_FIELDS = {
+    port_of: ("port",), protocol_on_port: ("port",), transport_of: ("port",), server_endpoint: ("port",),
+    layer_of: ("layer",), not_on_layer: ("layer",), pdu_name: ("pdu",),
+}
+
+def _facts(kind: str) -> list[dict]:
+    if kind == "protocol":
+        return PROTOCOLS
+    if kind == "device":
+        return DEVICES
+    return [{"name": name, "layer": layer, "pdu": layer in PDU_NAMES} for layer, name in OSI_LAYERS.items()]
+
+def matching_facts(params: GenerateQuestionsRequest) -> list[tuple[str, dict, str]]:
+    """(fact kind, fact, topic label) for the facts the topics name, or the chapter's layer without topics"""
+    matched = []
+    for topic in params.topics or []:
+        text = normalize_content(topic)
+        words = set(text.split())
+        for kind in ("protocol", "device"):
+            matched += [(kind, fact, topic) for fact in _facts(kind) if fact["name"].casefold() in words]
+        if any(word in text for word in OVERVIEW_WORDS):
+            matched += [("layer", fact, topic) for fact in _facts("layer")]
+    if params.topics:
+        return matched
+
+    chapter = normalize_content(params.chapter or "")
+    label = "Tổng quan"
+    if any(word in chapter for word in OVERVIEW_WORDS):
+        return [(kind, fact, label) for kind in ("layer", "device") for fact in _facts(kind)]
+    layers = [layer for words, layer in CHAPTER_LAYERS.items() if words in chapter]
+    return [
+        (kind, fact, label)
+        for kind in ("protocol", "device")
+        for fact in _facts(kind)
+        if layers and fact["layer"] == layers[0]
+    ]
+
+def fact_share(params: GenerateQuestionsRequest) -> int:
+    """How many questions of the request the fact table may serve"""
+    knowledge_types = params.knowledgeTypes or []
+    covered = [t for t in knowledge_types if t in FACT_KNOWLEDGE_TYPES]
+    if not covered or LOCAL_FACT_QUESTIONS_SHARE <= 0:
+        return 0
+    return min(params.count, math.ceil(params.count * len(covered) / len(knowledge_types) * LOCAL_FACT_QUESTIONS_SHARE))
+
+def _build(item: Item, rng: random.Random) -> Optional[tuple[str, list[str], int, str, str]]:
+    content, answer, explanation, candidates, knowledge_type = item
+    distractors = []
+    for candidate in candidates:
+        if candidate != answer and candidate not in distractors:
+            distractors.append(candidate)
+    if len(distractors) < 3:
+        return None
+    options = [answer] + distractors[:3]
+    rng.shuffle(options)
+    return content, options, options.index(answer), explanation, knowledge_type
+
+def generate_fact_questions(
+    params: GenerateQuestionsRequest, count: int, rng: Optional[random.Random] = None
+) -> list[Question]:
+    """Up to `count` distinct questions from the facts matching the request"""
+    if count <= 0:
+        return []
+    rng = rng or random.Random()
+    allowed = set(params.knowledgeTypes or []) & set(FACT_KNOWLEDGE_TYPES)
+    pool: dict[str, list] = {"easy": [], "medium": [], "hard": []}
+    seen: set[str] = set()
+    facts = matching_facts(params)
+    rng.shuffle(facts)
+    for kind, fact, topic in facts:
+        for difficulty, template_kind, builder in TEMPLATES:
+            if template_kind != kind or not all(fact.get(field) for field in REQUIRED_FIELDS.get(builder, ())):
+                continue
+            built = _build(builder(fact, rng), rng)
+            if built is None or built[4] not in allowed or built[0] in seen:
+                continue
+            seen.add(built[0])
+            pool[difficulty].append((topic, built))
+
+    for candidates in pool.values():
+        rng.shuffle(candidates)
+    if params.difficulty in pool:
+        picked = [(params.difficulty, item) for item in pool[params.difficulty][:count]]
+    else:
+        picked = []
+        for difficulty, wanted in split_difficulties(count).items():
+            picked += [(difficulty, item) for item in pool[difficulty][:wanted]]
+        # Levels short of facts are made up from the others
+        leftovers = [(d, item) for d in pool for item in pool[d] if (d, item) not in picked]
+        rng.shuffle(leftovers)
+        picked += leftovers[:count - len(picked)]
+        rng.shuffle(picked)
+
+    return [
+        Question(
+            id=f"fact-{position}",
+            content=content,
+            options=options,
+            correctAnswer=answer,
+            chapter=params.chapter or "Chương 1",
+            topic=topic,
+            knowledgeType=knowledge_type,
+            difficulty=difficulty,
+            explanation=explanation,
+        )
+        for position, (difficulty, (topic, (content, options, answer, explanation, knowledge_type))) in enumerate(picked)
+    ]
@@ -0,0 +1,793 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Async access to the Gemini API.
+
+All LLM calls go through the SDK's async client so a slow completion only
+holds a coroutine, never a request threadpool thread. Calls are limited per
+API key and model: a limited number run at once, up to
+`GEMINI_MAX_QUEUE_PER_KEY` wait (for at most `GEMINI_QUEUE_TIMEOUT` seconds),
+and anything beyond that is rejected with `GeminiBusyError`.
+
+The concurrency limit adapts to what Gemini accepts (AIMD): it starts at
+`GEMINI_MAX_CONCURRENCY_PER_KEY`, grows by about one for every window of
+successful calls up to `GEMINI_ADAPTIVE_MAX_CONCURRENCY`, and is halved
+(down to `GEMINI_ADAPTIVE_MIN_CONCURRENCY`) when a call answers 429 or 503.
+Failures of calls admitted before the last decrease belong to the same burst
+and do not halve it again. The learned limit of a key and model is forgotten
+once nothing has used it for `GEMINI_ADAPTIVE_IDLE_TTL` seconds. The limit and
+the queue length seen by each call are recorded in the usage statistics.
+
+Transient upstream errors (429, 5xx, timeouts) are retried with jittered
+exponential backoff, honouring the retry delay Gemini sends back. A per-model
+circuit breaker opens after `GEMINI_BREAKER_THRESHOLD` consecutive upstream
+failures; while open, calls fail at once with `GeminiUnavailableError`, and
+after `GEMINI_BREAKER_COOLDOWN` seconds a single probe call decides whether
+it closes again.
+
+Two tail-latency measures can be enabled per endpoint (the `endpoint`
+argument of the call helpers): hedging fires a second identical request when
+the first is slower than the model's recent p90 latency and keeps whichever
+answers first, and model fallback retries an overloaded call on the models
+in `GEMINI_FALLBACK_MODELS`, in order.
+
+Static system instructions are served from Gemini's context cache for the
+model actually called (see prompt_cache.py), so fallbacks and hedged
+requests use the right cache too.
+
+Users without a personal key share the system keys in `key_pool`. Each call
+goes to the least-loaded key that is neither cooling down nor over its
+`GEMINI_KEY_RPM` budget; a key answering 429 cools down for
+`GEMINI_KEY_COOLDOWN` seconds (or as long as Gemini asks) and the call moves
+on to another key of the pool instead of backing off on the throttled one.
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import re
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+import httpx
+from google import genai
+from llm_usage import usage
+from prompt_cache import prompt_cache
+
+GEMINI_MAX_CONCURRENCY_PER_KEY = int(os.getenv("GEMINI_MAX_CONCURRENCY_PER_KEY", "4"))
+GEMINI_ADAPTIVE_CONCURRENCY = os.getenv("GEMINI_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+GEMINI_ADAPTIVE_MIN_CONCURRENCY = int(os.getenv("GEMINI_ADAPTIVE_MIN_CONCURRENCY", "1"))
+GEMINI_ADAPTIVE_MAX_CONCURRENCY = int(os.getenv("GEMINI_ADAPTIVE_MAX_CONCURRENCY", "32"))
+GEMINI_ADAPTIVE_IDLE_TTL = float(os.getenv("GEMINI_ADAPTIVE_IDLE_TTL", "600"))
+GEMINI_MAX_QUEUE_PER_KEY = int(os.getenv("GEMINI_MAX_QUEUE_PER_KEY", "16"))
+GEMINI_QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "30"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2"))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1"))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "20"))
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+GEMINI_KEY_COOLDOWN = float(os.getenv("GEMINI_KEY_COOLDOWN", "60"))
+GEMINI_KEY_RPM = int(os.getenv("GEMINI_KEY_RPM", "0"))
+CLIENT_CACHE_SIZE = 128
+
+def _env_list(name: str, default: str = "") -> list[str]:
+    return [item.strip() for item in os.getenv(name, default).split(",") if item.strip()]
+
+GEMINI_HEDGE_ENDPOINTS = set(_env_list("GEMINI_HEDGE_ENDPOINTS"))
+GEMINI_HEDGE_QUANTILE = float(os.getenv("GEMINI_HEDGE_QUANTILE", "0.9"))
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "1"))
+GEMINI_FALLBACK_MODELS = _env_list("GEMINI_FALLBACK_MODELS")
+GEMINI_FALLBACK_ENDPOINTS = set(_env_list("GEMINI_FALLBACK_ENDPOINTS", "questions,stream,analysis"))
+LATENCY_WINDOW = 200
+QUOTA_WINDOW = 60
+HEDGE_MIN_SAMPLES = 20
+OVERLOAD_STATUS_CODES = {429, 503}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+UPSTREAM_FAILURE_STATUS_CODES = {500, 502, 503, 504}
+STALE_CACHE_STATUS_CODES = {400, 403, 404}
+
+class GeminiBusyError(Exception):
+    """Raised when an API key's wait queue is full or the wait timed out"""
+
+class GeminiUnavailableError(Exception):
+    """Raised without calling Gemini while the model's circuit breaker is open"""
+
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"Circuit open for model {model}, retry in {retry_after:.0f}s")
+        self.model = model
+        self.retry_after = retry_after
+
+def api_key_id(api_key: str) -> str:
+    """Stable, non-reversible identifier for an API key (safe to log and use as a dict key)"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+def client_key_id(client) -> str:
+    api_key = getattr(getattr(client, "_api_client", None), "api_key", None)
+    if isinstance(api_key, str) and api_key:
+        return api_key_id(api_key)
+    return f"client-{id(client)}"
+
+_clients: "OrderedDict[str, genai.Client]" = OrderedDict()
+
+def get_client(api_key: str) -> genai.Client:
+    """Return a cached client per API key so connections are reused between requests"""
+    key_id = api_key_id(api_key)
+    client = _clients.get(key_id)
+    if client is None:
+        client = genai.Client(api_key=api_key)
+        _clients[key_id] = client
+        if len(_clients) > CLIENT_CACHE_SIZE:
+            _clients.popitem(last=False)
+    else:
+        _clients.move_to_end(key_id)
+    return client
+
+def slot_id(key_id: str, model: str) -> str:
+    """Limiter key of one model on one API key"""
+    return f"{key_id}:{model}"
+
+class _KeySlots:
+    def __init__(self, key_id: str):
+        self.key_id = key_id
+        self.active = 0
+        self.waiters: deque = deque()
+
+class KeyConcurrencyLimiter:
+    """Per-key concurrency limit with a bounded FIFO wait queue.
+    Keys are usually `slot_id(key_id, model)`; `is_idle` and `load` also accept a bare key id
+    and then cover all of its models. Idle slots are dropped, so only keys in use are tracked."""
+
+    def __init__(self, max_concurrency: int, max_waiting: int, wait_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._slots: dict[str, _KeySlots] = {}
+        # Bare key id -> its tracked slot ids
+        self._by_key: dict[str, set[str]] = {}
+
+    def limit_for(self, key_id: str) -> int:
+        return self.max_concurrency
+
+    def _slots_of(self, key_id: str) -> list[_KeySlots]:
+        return [self._slots[slot] for slot in self._by_key.get(key_id, ())]
+
+    def _get_or_create(self, slot: str) -> _KeySlots:
+        slots = self._slots.get(slot)
+        if slots is None:
+            slots = self._slots[slot] = _KeySlots(slot)
+            self._by_key.setdefault(slot.split(":", 1)[0], set()).add(slot)
+            self._on_busy(slot)
+        return slots
+
+    def _on_busy(self, slot: str) -> None:
+        """Hook for a slot that starts being used"""
+
+    def _on_idle(self, slot: str) -> None:
+        """Hook for a slot that nothing runs or waits on any more"""
+
+    def _discard_if_idle(self, slots: _KeySlots) -> None:
+        if slots.active > 0 or slots.waiters or self._slots.get(slots.key_id) is not slots:
+            return
+        del self._slots[slots.key_id]
+        key_id = slots.key_id.split(":", 1)[0]
+        siblings = self._by_key[key_id]
+        siblings.discard(slots.key_id)
+        if not siblings:
+            del self._by_key[key_id]
+        self._on_idle(slots.key_id)
+
+    def has_free_slot(self, key_id: str) -> bool:
+        slots = self._slots.get(key_id)
+        return slots is None or (slots.active < self.limit_for(key_id) and not slots.waiters)
+
+    def is_idle(self, key_id: str) -> bool:
+        return all(slots.active == 0 and not slots.waiters for slots in self._slots_of(key_id))
+
+    def load(self, key_id: str) -> int:
+        """Running plus waiting calls of a key"""
+        return sum(slots.active + len(slots.waiters) for slots in self._slots_of(key_id))
+
+    def waiting(self, key_id: str) -> int:
+        slots = self._slots.get(key_id)
+        return 0 if slots is None else len(slots.waiters)
+
+    def stats(self) -> dict:
+        return {
+            key_id: {"active": slots.active, "waiting": len(slots.waiters), "limit": self.limit_for(key_id)}
+            for key_id, slots in self._slots.items()
+        }
+
+    def _release(self, slots: _KeySlots) -> None:
+        # Hand the slot straight to the next live waiter so it cannot be stolen,
+        # unless the limit was lowered below the running calls
+        while slots.waiters and slots.active <= self.limit_for(slots.key_id):
+            waiter = slots.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        slots.active -= 1
+        self._discard_if_idle(slots)
+
+    def _admit_waiters(self, key_id: str) -> None:
+        """Start waiting calls for which a raised limit made room"""
+        slots = self._slots.get(key_id)
+        while slots is not None and slots.waiters and slots.active < self.limit_for(key_id):
+            waiter = slots.waiters.popleft()
+            if not waiter.done():
+                slots.active += 1
+                waiter.set_result(None)
+
+    async def _acquire(self, key_id: str) -> _KeySlots:
+        slots = self._get_or_create(key_id)
+        if slots.active < self.limit_for(key_id) and not slots.waiters:
+            slots.active += 1
+            return slots
+
+        if len(slots.waiters) >= self.max_waiting:
+            raise GeminiBusyError(f"Wait queue full for key {key_id}")
+
+        waiter = asyncio.get_running_loop().create_future()
+        slots.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.wait_timeout)
+        except BaseException as exc:
+            if waiter.done() and not waiter.cancelled():
+                self._release(slots)
+            elif waiter in slots.waiters:
+                slots.waiters.remove(waiter)
+                self._discard_if_idle(slots)
+            if isinstance(exc, asyncio.TimeoutError):
+                raise GeminiBusyError(f"Timed out waiting for key {key_id}") from exc
+            raise
+        return slots
+
+    @asynccontextmanager
+    async def acquire(self, key_id: str):
+        slots = await self._acquire(key_id)
+        try:
+            yield
+        finally:
+            self._release(slots)
+
+class AdaptiveConcurrencyLimiter(KeyConcurrencyLimiter):
+    """Limiter whose per-key limit follows additive increase / multiplicative decrease"""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_waiting: int,
+        wait_timeout: float,
+        min_limit: int = GEMINI_ADAPTIVE_MIN_CONCURRENCY,
+        max_limit: int = GEMINI_ADAPTIVE_MAX_CONCURRENCY,
+        enabled: bool = GEMINI_ADAPTIVE_CONCURRENCY,
+        idle_ttl: float = GEMINI_ADAPTIVE_IDLE_TTL,
+    ):
+        super().__init__(max_concurrency, max_waiting, wait_timeout)
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.enabled = enabled
+        self.idle_ttl = idle_ttl
+        self._limits: dict[str, float] = {}
+        self._decreased_at: dict[str, float] = {}
+        # Slots with adapted state but no running call, oldest first, with the time they went idle
+        self._idle_since: OrderedDict[str, float] = OrderedDict()
+
+    def _on_busy(self, slot: str) -> None:
+        self._idle_since.pop(slot, None)
+
+    def _on_idle(self, slot: str) -> None:
+        if slot in self._limits:
+            self._idle_since[slot] = time.monotonic()
+            self._idle_since.move_to_end(slot)
+        self._forget_stale()
+
+    def _forget_stale(self) -> None:
+        """Drop the adapted state of slots idle for longer than `idle_ttl`, so per-user keys do not pile up"""
+        expired = time.monotonic() - self.idle_ttl
+        while self._idle_since:
+            slot, since = next(iter(self._idle_since.items()))
+            if since > expired:
+                break
+            del self._idle_since[slot]
+            self._limits.pop(slot, None)
+            self._decreased_at.pop(slot, None)
+
+    def _touch(self, key_id: str) -> None:
+        """Track state set on a slot with no running call, which no release would ever expire"""
+        if key_id not in self._slots:
+            self._on_idle(key_id)
+
+    def limit_for(self, key_id: str) -> int:
+        if not self.enabled:
+            return self.max_concurrency
+        return int(self._limits.get(key_id, self.max_concurrency))
+
+    def record_success(self, key_id: str) -> None:
+        if not self.enabled:
+            return
+        limit = self._limits.get(key_id, float(self.max_concurrency))
+        # +1/limit per success: about one more slot once a full window of calls succeeded
+        self._limits[key_id] = min(float(self.max_limit), limit + 1 / limit)
+        self._admit_waiters(key_id)
+        self._touch(key_id)
+
+    def record_overload(self, key_id: str, started: float) -> None:
+        """Halve the limit after a 429/503 of a call admitted at monotonic time `started`"""
+        if not self.enabled or started < self._decreased_at.get(key_id, float("-inf")):
+            return
+        limit = self._limits.get(key_id, float(self.max_concurrency))
+        self._limits[key_id] = max(float(self.min_limit), limit / 2)
+        self._decreased_at[key_id] = time.monotonic()
+        self._touch(key_id)
+
+    def reset(self) -> None:
+        self._limits.clear()
+        self._decreased_at.clear()
+        self._idle_since.clear()
+
+limiter = AdaptiveConcurrencyLimiter(
+    GEMINI_MAX_CONCURRENCY_PER_KEY,
+    GEMINI_MAX_QUEUE_PER_KEY,
+    GEMINI_QUEUE_TIMEOUT,
+)
+
+class _PooledKey:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.key_id = api_key_id(api_key)
+        self.cooldown_until = 0.0
+        self.calls: deque = deque()
+        self.rate_limited = 0
+
+class KeyPool:
+    """System API keys shared by users without a personal key"""
+
+    def __init__(self, api_keys=(), cooldown: float = GEMINI_KEY_COOLDOWN, requests_per_minute: int = GEMINI_KEY_RPM):
+        self.cooldown = cooldown
+        self.requests_per_minute = requests_per_minute
+        self._keys: dict[str, _PooledKey] = {}
+        self.configure(api_keys)
+
+    def configure(self, api_keys) -> None:
+        keys = [_PooledKey(api_key) for api_key in api_keys if api_key]
+        self._keys = {key.key_id: key for key in keys}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key_id: str) -> bool:
+        return key_id in self._keys
+
+    def _calls_in_window(self, key: _PooledKey, now: float) -> int:
+        while key.calls and key.calls[0] <= now - QUOTA_WINDOW:
+            key.calls.popleft()
+        return len(key.calls)
+
+    def _available_at(self, key: _PooledKey, now: float) -> float:
+        """When the key may be used again: after its cooldown and once it is under its per-minute budget"""
+        available = key.cooldown_until
+        if self.requests_per_minute > 0 and self._calls_in_window(key, now) >= self.requests_per_minute:
+            available = max(available, key.calls[-self.requests_per_minute] + QUOTA_WINDOW)
+        return available
+
+    def _usable(self, now: float, exclude=()) -> list[_PooledKey]:
+        return [
+            key for key in self._keys.values()
+            if key.key_id not in exclude and self._available_at(key, now) <= now
+        ]
+
+    def choose(self, exclude=()) -> Optional[genai.Client]:
+        """Client of the least-loaded usable key. When every key is throttled, the one usable
+        soonest, so the call gets Gemini's own 429; None if only excluded keys are left"""
+        now = time.monotonic()
+        usable = self._usable(now, exclude)
+        if usable:
+            key = min(usable, key=lambda key: (limiter.load(key.key_id), self._calls_in_window(key, now)))
+        elif exclude or not self._keys:
+            return None
+        else:
+            key = min(self._keys.values(), key=lambda key: self._available_at(key, now))
+        return get_client(key.api_key)
+
+    def has_idle_key(self) -> bool:
+        now = time.monotonic()
+        return any(limiter.is_idle(key.key_id) for key in self._usable(now))
+
+    def record_call(self, key_id: str) -> None:
+        key = self._keys.get(key_id)
+        if key is not None:
+            key.calls.append(time.monotonic())
+
+    def record_rate_limited(self, key_id: str, retry_after: Optional[float] = None) -> None:
+        key = self._keys.get(key_id)
+        if key is not None:
+            key.rate_limited += 1
+            key.cooldown_until = time.monotonic() + max(self.cooldown, retry_after or 0)
+
+    def has_alternative(self, key_id: str) -> bool:
+        return key_id in self._keys and bool(self._usable(time.monotonic(), {key_id}))
+
+    def reset(self) -> None:
+        for key in self._keys.values():
+            key.cooldown_until = 0.0
+            key.calls.clear()
+            key.rate_limited = 0
+
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "key": key.key_id,
+                "load": limiter.load(key.key_id),
+                "callsLastMinute": self._calls_in_window(key, now),
+                "rateLimited": key.rate_limited,
+                "coolingDownFor": round(max(0.0, key.cooldown_until - now), 1),
+            }
+            for key in self._keys.values()
+        ]
+
+key_pool = KeyPool()
+
+def error_status(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    return status if isinstance(status, int) else None
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Errors that mean the model itself is unhealthy (as opposed to a bad request or an exhausted quota)"""
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    return error_status(exc) in UPSTREAM_FAILURE_STATUS_CODES
+
+def is_retryable(exc: BaseException) -> bool:
+    return is_upstream_failure(exc) or error_status(exc) in RETRYABLE_STATUS_CODES
+
+def _parse_seconds(value) -> Optional[float]:
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)s?\s*", str(value))
+    return float(match.group(1)) if match else None
+
+def retry_after_hint(exc: BaseException) -> Optional[float]:
+    """Delay requested by Gemini, from a Retry-After header or a RetryInfo error detail"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    hint = _parse_seconds(headers.get("retry-after")) if headers else None
+    if hint is not None:
+        return hint
+
+    details = getattr(exc, "details", None)
+    error = details.get("error", details) if isinstance(details, dict) else None
+    if isinstance(error, dict):
+        for item in error.get("details") or []:
+            if isinstance(item, dict) and "retryDelay" in item:
+                return _parse_seconds(item["retryDelay"])
+    return None
+
+def retry_delay(exc: BaseException, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying after `attempt` failed retries, or None to give up"""
+    if attempt >= GEMINI_MAX_RETRIES or not is_retryable(exc):
+        return None
+    hint = retry_after_hint(exc)
+    if hint is not None:
+        # Waiting longer than the cap would only hold the user's request; let them retry later
+        return hint if hint <= GEMINI_RETRY_MAX_DELAY else None
+    # Full jitter, so clients that failed together do not retry together
+    return random.uniform(0, min(GEMINI_RETRY_MAX_DELAY, GEMINI_RETRY_BASE_DELAY * 2 ** attempt))
+
+class _BreakerState:
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+class CircuitBreaker:
+    """Per-model breaker: opens after consecutive upstream failures, lets one probe through after the cooldown"""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._states: dict[str, _BreakerState] = {}
+
+    def before_call(self, model: str) -> None:
+        state = self._states.get(model)
+        if state is None or state.opened_at is None:
+            return
+        remaining = state.opened_at + self.cooldown - time.monotonic()
+        if remaining > 0 or state.probing:
+            raise GeminiUnavailableError(model, max(remaining, 1.0))
+        state.probing = True
+
+    def record_success(self, model: str) -> None:
+        self._states.pop(model, None)
+
+    def record_failure(self, model: str) -> None:
+        state = self._states.setdefault(model, _BreakerState())
+        state.failures += 1
+        state.probing = False
+        if self.failure_threshold > 0 and (state.opened_at is not None or state.failures >= self.failure_threshold):
+            state.opened_at = time.monotonic()
+
+    def release_probe(self, model: str) -> None:
+        """Let another call probe when this one ended without telling whether the model is healthy"""
+        state = self._states.get(model)
+        if state is not None:
+            state.probing = False
+
+    def reset(self) -> None:
+        self._states.clear()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            model: {
+                "failures": state.failures,
+                "open": state.opened_at is not None,
+                "retryAfter": max(0.0, state.opened_at + self.cooldown - now) if state.opened_at is not None else 0.0,
+            }
+            for model, state in self._states.items()
+        }
+
+breaker = CircuitBreaker(GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_COOLDOWN)
+
+async def call_with_retries(model: str, call: Callable[[], Awaitable], key_id: Optional[str] = None):
+    """Run `call` behind the model's circuit breaker, retrying transient upstream errors"""
+    attempt = 0
+    while True:
+        breaker.before_call(model)
+        try:
+            result = await call()
+        except GeminiBusyError:
+            breaker.release_probe(model)
+            raise
+        except Exception as exc:
+            if is_upstream_failure(exc):
+                breaker.record_failure(model)
+            else:
+                breaker.record_success(model)
+            if error_status(exc) == 429 and key_id is not None and key_pool.has_alternative(key_id):
+                # Another pooled key can take the call right away
+                raise
+            delay = retry_delay(exc, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            print(f"Gemini call failed ({exc}); retry {attempt}/{GEMINI_MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            breaker.release_probe(model)
+            raise
+        breaker.record_success(model)
+        return result
+
+class LatencyTracker:
+    """Latencies of recent successful calls per model"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: dict[str, deque] = {}
+
+    def record(self, model: str, seconds: float) -> None:
+        self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, model: str, q: float) -> Optional[float]:
+        samples = self._samples.get(model)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def reset(self) -> None:
+        self._samples.clear()
+
+latency = LatencyTracker()
+
+def hedge_delay(model: str) -> Optional[float]:
+    """How long to wait for a call before hedging it; None until enough latencies are known"""
+    p90 = latency.quantile(model, GEMINI_HEDGE_QUANTILE)
+    return None if p90 is None else max(GEMINI_HEDGE_MIN_DELAY, p90)
+
+def models_for(endpoint: Optional[str], model: str) -> list[str]:
+    if endpoint not in GEMINI_FALLBACK_ENDPOINTS:
+        return [model]
+    return [model] + [fallback for fallback in GEMINI_FALLBACK_MODELS if fallback != model]
+
+def is_overloaded(exc: BaseException) -> bool:
+    """Errors worth moving to the next model for: the model is down, throttled or too slow"""
+    if isinstance(exc, GeminiUnavailableError):
+        return True
+    if isinstance(exc, GeminiBusyError):
+        # The local queue of the API key is full; another model would use the same key
+        return False
+    return is_upstream_failure(exc) or error_status(exc) in OVERLOAD_STATUS_CODES
+
+def should_fall_back(exc: BaseException, key_id: str) -> bool:
+    """Whether to move to the next model. A 429 on a pooled key goes to another key of the pool first,
+    so the requested model is only given up once the pool has no usable key left"""
+    if error_status(exc) == 429 and key_pool.has_alternative(key_id):
+        return False
+    return is_overloaded(exc)
+
+def record_overload(key_id: str, model: str, exc: BaseException, started: float) -> None:
+    """Let the key pool and the adaptive limit react to a throttled call"""
+    status = error_status(exc)
+    if status == 429:
+        key_pool.record_rate_limited(key_id, retry_after_hint(exc))
+    if status in OVERLOAD_STATUS_CODES:
+        limiter.record_overload(slot_id(key_id, model), started)
+
+async def _with_prompt_cache(client, model: str, config, key_id: str, call: Callable[[object], Awaitable]):
+    """Run `call(config)` with the system instruction taken from the context cache when possible"""
+    cached_config = await prompt_cache.apply(client, model, config, key_id)
+    if cached_config is config:
+        return await call(config)
+    try:
+        return await call(cached_config)
+    except Exception as exc:
+        if error_status(exc) not in STALE_CACHE_STATUS_CODES:
+            raise
+        # The cache may have expired or been deleted on Gemini's side; send the instruction inline once
+        prompt_cache.invalidate(key_id, model, config.system_instruction)
+        return await call(config)
+
+async def _call(client, model: str, contents, config, key_id: str, endpoint: Optional[str], user_id: Optional[str]):
+    async def attempt(call_config):
+        # The key slot is released while backing off, so other requests can use it
+        slot = slot_id(key_id, model)
+        async with limiter.acquire(slot):
+            started = time.monotonic()
+            key_pool.record_call(key_id)
+            usage.record_concurrency(model, endpoint, limiter.limit_for(slot), limiter.waiting(slot))
+            try:
+                response = await client.aio.models.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=call_config,
+                )
+            except Exception as exc:
+                usage.record(model, endpoint, user_id, time.monotonic() - started, error=True)
+                record_overload(key_id, model, exc, started)
+                raise
+            limiter.record_success(slot)
+            elapsed = time.monotonic() - started
+            latency.record(model, elapsed)
+            usage.record(model, endpoint, user_id, elapsed, getattr(response, "usage_metadata", None))
+            return response
+
+    return await _with_prompt_cache(
+        client, model, config, key_id,
+        lambda call_config: call_with_retries(model, lambda: attempt(call_config), key_id),
+    )
+
+async def _hedged_call(client, model: str, contents, config, key_id: str, endpoint: Optional[str], user_id: Optional[str]):
+    """Send a second request if the first is slower than usual and return the first success"""
+    delay = hedge_delay(model)
+    if delay is None:
+        return await _call(client, model, contents, config, key_id, endpoint, user_id)
+
+    tasks = [asyncio.ensure_future(_call(client, model, contents, config, key_id, endpoint, user_id))]
+    try:
+        await asyncio.wait(tasks, timeout=delay)
+        if tasks[0].done() or not limiter.has_free_slot(slot_id(key_id, model)):
+            return await tasks[0]
+
+        tasks.append(asyncio.ensure_future(_call(client, model, contents, config, key_id, endpoint, user_id)))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def generate_content(
+    client,
+    model: str,
+    contents,
+    config,
+    key_id: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    user_id: Optional[str] = None,
+):
+    """Call Gemini within the per-key budget, with retries and the endpoint's hedging and fallback.
+    A pooled key answering 429 hands the call over to another key of the pool"""
+    key_id = key_id or client_key_id(client)
+    throttled = set()
+    while True:
+        try:
+            return await _generate(client, model, contents, config, key_id, endpoint, user_id)
+        except Exception as exc:
+            if error_status(exc) != 429 or key_id not in key_pool:
+                raise
+            throttled.add(key_id)
+            other = key_pool.choose(exclude=throttled)
+            if other is None:
+                raise
+            client, key_id = other, client_key_id(other)
+            print(f"API key is rate limited ({exc}); switching to key {key_id}")
+
+async def _generate(client, model: str, contents, config, key_id: str, endpoint: Optional[str], user_id: Optional[str]):
+    models = models_for(endpoint, model)
+    for index, candidate in enumerate(models):
+        try:
+            if endpoint in GEMINI_HEDGE_ENDPOINTS:
+                return await _hedged_call(client, candidate, contents, config, key_id, endpoint, user_id)
+            return await _call(client, candidate, contents, config, key_id, endpoint, user_id)
+        except Exception as exc:
+            if index == len(models) - 1 or not should_fall_back(exc, key_id):
+                raise
+            print(f"Model {candidate} is overloaded ({exc}); falling back to {models[index + 1]}")
+
+async def generate_content_stream(
+    client,
+    model: str,
+    contents,
+    config,
+    key_id: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    user_id: Optional[str] = None,
+):
+    """Stream Gemini output chunk by chunk, holding a key slot until the stream ends"""
+    key_id = key_id or client_key_id(client)
+    models = models_for(endpoint, model)
+    # The slot of the requested model is held even if the stream moves to a fallback model
+    slot = slot_id(key_id, model)
+    async with limiter.acquire(slot):
+        # Only opening the stream is retried or moved to a fallback model; once chunks
+        # were yielded a retry would repeat them
+        started = time.monotonic()
+        usage.record_concurrency(model, endpoint, limiter.limit_for(slot), limiter.waiting(slot))
+        for index, candidate in enumerate(models):
+            key_pool.record_call(key_id)
+            try:
+                stream = await _with_prompt_cache(
+                    client, candidate, config, key_id,
+                    lambda call_config: call_with_retries(candidate, lambda: client.aio.models.generate_content_stream(
+                        model=candidate,
+                        contents=contents,
+                        config=call_config,
+                    )),
+                )
+                limiter.record_success(slot)
+                break
+            except Exception as exc:
+                usage.record(candidate, endpoint, user_id, time.monotonic() - started, error=True)
+                # The held slot is the one whose limit governs this stream, whichever model failed
+                record_overload(key_id, model, exc, started)
+                if index == len(models) - 1 or not is_overloaded(exc):
+                    raise
+                print(f"Model {candidate} is overloaded ({exc}); falling back to {models[index + 1]}")
+                started = time.monotonic()
+
+        # Usage metadata comes with the last chunks; record whatever was seen, also when the
+        # consumer stops reading early
+        usage_metadata = None
+        failed = False
+        try:
+            async for chunk in stream:
+                usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+                yield chunk
+        except Exception as exc:
+            failed = True
+            if is_upstream_failure(exc):
+                breaker.record_failure(candidate)
+            raise
+        finally:
+            usage.record(candidate, endpoint, user_id, time.monotonic() - started, usage_metadata, error=failed)
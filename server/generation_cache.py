@@ -0,0 +1,136 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of generated questions shared between identical requests.
+
+Questions are pooled per normalized (chapter, topics, knowledgeTypes,
+difficulty) and model. The count is not part of the key: a request is
+served from the pool whenever the pool holds at least `count` questions,
+by sampling a random subset, so repeated requests still get different
+quizzes. Pools live in the `generation_cache` collection (expired by a TTL
+index) with a small in-memory front.
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from pymongo.database import Database
+from dtos import GenerateQuestionsRequest
+from question_generation import normalize_content, split_difficulties
+
+GENERATION_CACHE_TTL = int(os.getenv("GENERATION_CACHE_TTL", "86400"))
+GENERATION_CACHE_POOL_FACTOR = float(os.getenv("GENERATION_CACHE_POOL_FACTOR", "1"))
+GENERATION_CACHE_MAX_POOL = int(os.getenv("GENERATION_CACHE_MAX_POOL", "100"))
+MEMORY_CACHE_SIZE = 256
+
+_memory_cache: dict[str, tuple[float, list[dict]]] = {}
+
+def _normalize_list(values: Optional[list[str]]) -> list[str]:
+    return sorted({value.strip().casefold() for value in values or [] if value.strip()})
+
+def normalize_request(params: GenerateQuestionsRequest) -> dict:
+    """Request fields that decide which questions fit, in a canonical form"""
+    return {
+        "chapter": (params.chapter or "").strip().casefold(),
+        "topics": _normalize_list(params.topics),
+        "knowledgeTypes": _normalize_list(params.knowledgeTypes),
+        "difficulty": params.difficulty or "mixed",
+    }
+
+def cache_key(params: GenerateQuestionsRequest, model: str) -> str:
+    payload = json.dumps({"model": model, **normalize_request(params)}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def pool_size_for(count: int) -> int:
+    """How many questions a cache miss should leave in the pool so later requests can be sampled"""
+    return max(count, min(GENERATION_CACHE_MAX_POOL, math.ceil(count * GENERATION_CACHE_POOL_FACTOR)))
+
+def _remember(key: str, questions: list[dict], expires_in: float) -> None:
+    _memory_cache[key] = (time.monotonic() + expires_in, questions)
+    if len(_memory_cache) > MEMORY_CACHE_SIZE:
+        _memory_cache.pop(next(iter(_memory_cache)))
+
+def clear_generation_cache() -> None:
+    _memory_cache.clear()
+
+def get_cached_pool(db: Database, key: str) -> Optional[list[dict]]:
+    """Get the pooled questions for a cache key, from memory when possible"""
+    cached = _memory_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    now = datetime.now()
+    entry = db.generation_cache.find_one({"key": key, "expiresAt": {"$gt": now}}, {"_id": 0})
+    if not entry:
+        _memory_cache.pop(key, None)
+        return None
+    _remember(key, entry["questions"], (entry["expiresAt"] - now).total_seconds())
+    return entry["questions"]
+
+def store_pool(db: Database, key: str, model: str, params: GenerateQuestionsRequest, questions: list[dict]) -> list[dict]:
+    """Merge new questions into the pool (newest first, deduplicated) and refresh its TTL"""
+    existing = get_cached_pool(db, key) or []
+    pool = []
+    seen = set()
+    for question in questions + existing:
+        normalized = normalize_content(question["content"])
+        if normalized in seen:
+            continue
+        seen.add(normalized)
+        pool.append(question)
+    pool = pool[:GENERATION_CACHE_MAX_POOL]
+
+    now = datetime.now()
+    db.generation_cache.update_one(
+        {"key": key},
+        {"$set": {
+            "key": key,
+            "model": model,
+            "params": normalize_request(params),
+            "questions": pool,
+            "updatedAt": now,
+            "expiresAt": now + timedelta(seconds=GENERATION_CACHE_TTL),
+        }},
+        upsert=True,
+    )
+    _remember(key, pool, GENERATION_CACHE_TTL)
+    return pool
+
+def sample_questions(pool: list[dict], count: int, mixed: bool) -> list[dict]:
+    """Pick `count` random questions, keeping the 30/40/30 mix for mixed difficulty when possible"""
+    if not mixed:
+        return random.sample(pool, min(count, len(pool)))
+
+    by_level: dict[str, list[dict]] = {}
+    for question in pool:
+        by_level.setdefault(question.get("difficulty", "medium"), []).append(question)
+
+    selected = []
+    for level, wanted in split_difficulties(count).items():
+        candidates = by_level.get(level, [])
+        selected += random.sample(candidates, min(wanted, len(candidates)))
+
+    if len(selected) < count:
+        chosen = {id(question) for question in selected}
+        leftovers = [question for question in pool if id(question) not in chosen]
+        selected += random.sample(leftovers, min(count - len(selected), len(leftovers)))
+
+    random.shuffle(selected)
+    return selected
@@ -0,0 +1,156 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Incremental extraction of JSON objects from LLM output.
+
+Gemini wraps its JSON in prose or Markdown fences and, when streaming, cuts
+it at arbitrary points. `JsonObjectStream` is fed the text chunk by chunk and
+returns the source of every top-level `{...}` object as soon as its closing
+brace arrives, tracking string literals so braces inside them are ignored.
+Each character is looked at once, so the cost is linear in the response size.
+
+Objects that still fail to decode (after dropping trailing commas, a common
+LLM slip) are skipped and described in `diagnostics` instead of discarding
+the whole response.
+
+Gemini calls are schema-constrained, so callers first validate a complete
+response against the schema model; these helpers are the fallback for
+replies that fail it, e.g. an array with one bad item or JSON wrapped in
+prose.
+"""
+
+import json
+import re
+from typing import Optional
+
+_SPECIAL = re.compile(r'[{}"\\]')
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+DIAGNOSTIC_SNIPPET_LENGTH = 80
+
+class JsonObjectStream:
+    """Collect complete top-level JSON objects from text fed in chunks"""
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._escape_pos = -1
+        self._parts: list[str] = []
+        self._offset = 0
+        self._object_offset = 0
+        self._last_offsets: list[int] = []
+        self.diagnostics: list[str] = []
+
+    def feed(self, text: str) -> list[str]:
+        objects: list[str] = []
+        offsets: list[int] = []
+        start = 0 if self._depth else None
+        for match in _SPECIAL.finditer(text):
+            char = match.group()
+            pos = match.start()
+            if self._escaped:
+                self._escaped = False
+                if pos == self._escape_pos + 1:
+                    continue
+            if self._in_string:
+                if char == "\\":
+                    self._escaped = True
+                    self._escape_pos = pos
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                if self._depth:
+                    self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    start = pos
+                    self._object_offset = self._offset + pos
+                self._depth += 1
+            elif char == "}" and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(text[start:pos + 1])
+                    objects.append("".join(self._parts))
+                    offsets.append(self._object_offset)
+                    self._parts = []
+                    start = None
+        if self._depth and start is not None:
+            self._parts.append(text[start:])
+        if self._escaped:
+            # The escaped character is the first one of the next chunk
+            self._escape_pos = -1
+        self._offset += len(text)
+        self._last_offsets = offsets
+        return objects
+
+    def feed_decoded(self, text: str) -> list[dict]:
+        """Like `feed`, but decode each object and skip the ones that are broken"""
+        decoded = []
+        raws = self.feed(text)
+        for raw, offset in zip(raws, self._last_offsets):
+            value = self._decode(raw, offset)
+            if value is not None:
+                decoded.append(value)
+        return decoded
+
+    def close(self) -> None:
+        """Record a diagnostic if the text ended inside an object"""
+        if self._depth:
+            self._diagnose("unterminated object", "".join(self._parts), self._object_offset)
+            self._depth = 0
+            self._in_string = False
+            self._parts = []
+
+    def _decode(self, raw: str, offset: int) -> Optional[dict]:
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as exc:
+            try:
+                return json.loads(_TRAILING_COMMA.sub(r"\1", raw))
+            except json.JSONDecodeError:
+                self._diagnose(exc.msg, raw, offset)
+                return None
+
+    def _diagnose(self, reason: str, raw: str, offset: int) -> None:
+        snippet = raw[:DIAGNOSTIC_SNIPPET_LENGTH].replace("\n", " ")
+        self.diagnostics.append(f"offset {offset}: {reason}: {snippet}")
+
+def extract_objects(text: str) -> tuple[list[dict], list[str]]:
+    """Decode every top-level object in a complete response, with diagnostics for skipped ones"""
+    # Schema-constrained responses are plain JSON: one object or an array of objects
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        value = None
+    if isinstance(value, dict):
+        return [value], []
+    if isinstance(value, list):
+        objects = [item for item in value if isinstance(item, dict)]
+        diagnostics = [f"index {index}: not an object" for index, item in enumerate(value) if not isinstance(item, dict)]
+        return objects, diagnostics
+
+    stream = JsonObjectStream()
+    objects = stream.feed_decoded(text)
+    stream.close()
+    return objects, stream.diagnostics
+
+def extract_object(text: str) -> dict:
+    """Return the first decodable top-level object in a response"""
+    objects, diagnostics = extract_objects(text)
+    if not objects:
+        details = "; ".join(diagnostics) or "no JSON object in response"
+        raise ValueError(f"No valid JSON object found in LLM response ({details})")
+    return objects[0]
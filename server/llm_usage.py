@@ -0,0 +1,210 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Token and latency accounting for Gemini calls.
+
+Every call is recorded in memory and periodically flushed to the
+`llm_usage` collection as `$inc` updates on one document per
+(time bucket, model, endpoint). A document holds call and error counts,
+token sums, a fixed latency histogram and per-user call/token counts, so
+its size does not grow with traffic and p50/p95 latencies can be computed
+by merging histograms. It also keeps the longest wait queue and the lowest
+and highest adaptive concurrency limit seen by the calls of the bucket,
+written with `$max` / `$min`.
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from typing import Callable, Optional
+from pymongo.database import Database
+from starlette.concurrency import run_in_threadpool
+
+LLM_USAGE_BUCKET_SECONDS = int(os.getenv("LLM_USAGE_BUCKET_SECONDS", "3600"))
+LLM_USAGE_FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "10"))
+LATENCY_BOUNDS_MS = (250, 500, 750, 1000, 1500, 2000, 3000, 4000, 5000, 7500, 10000, 15000, 20000, 30000, 60000, 120000)
+TOKEN_FIELDS = {
+    "promptTokens": "prompt_token_count",
+    "responseTokens": "candidates_token_count",
+    "thoughtTokens": "thoughts_token_count",
+    "cachedTokens": "cached_content_token_count",
+    "totalTokens": "total_token_count",
+}
+
+def bucket_start(moment: datetime) -> datetime:
+    seconds = int(moment.timestamp()) // LLM_USAGE_BUCKET_SECONDS * LLM_USAGE_BUCKET_SECONDS
+    return datetime.fromtimestamp(seconds)
+
+def latency_label(seconds: float) -> str:
+    milliseconds = seconds * 1000
+    for bound in LATENCY_BOUNDS_MS:
+        if milliseconds <= bound:
+            return str(bound)
+    return "inf"
+
+def token_counts(usage_metadata) -> dict[str, int]:
+    """Token counts from a response's usage metadata; missing counts are 0"""
+    counts = {}
+    for field, attribute in TOKEN_FIELDS.items():
+        value = getattr(usage_metadata, attribute, None)
+        counts[field] = value if isinstance(value, int) else 0
+    return counts
+
+class UsageRecorder:
+    """Aggregate call records in memory until they are flushed as `$inc` updates"""
+
+    def __init__(self):
+        self._pending: dict[tuple, dict[str, int]] = {}
+        self._maxima: dict[tuple, dict[str, int]] = {}
+        self._minima: dict[tuple, dict[str, int]] = {}
+
+    def record(
+        self,
+        model: str,
+        endpoint: Optional[str],
+        user_id: Optional[str],
+        seconds: float,
+        usage_metadata=None,
+        error: bool = False,
+    ) -> None:
+        key = (bucket_start(datetime.now()), model, endpoint or "other")
+        increments = self._pending.setdefault(key, {})
+
+        def add(field: str, amount: int) -> None:
+            if amount:
+                increments[field] = increments.get(field, 0) + amount
+
+        add("calls", 1)
+        if error:
+            add("errors", 1)
+            tokens = {}
+        else:
+            add(f"latency.{latency_label(seconds)}", 1)
+            tokens = token_counts(usage_metadata)
+            for field, amount in tokens.items():
+                add(field, amount)
+        if user_id:
+            user_key = user_id.replace(".", "_")
+            add(f"users.{user_key}.calls", 1)
+            add(f"users.{user_key}.tokens", tokens.get("totalTokens", 0))
+
+    def record_concurrency(self, model: str, endpoint: Optional[str], limit: int, waiting: int) -> None:
+        """Concurrency limit of a call's key and model, and the calls queued behind it"""
+        key = (bucket_start(datetime.now()), model, endpoint or "other")
+        maxima = self._maxima.setdefault(key, {})
+        minima = self._minima.setdefault(key, {})
+        maxima["maxWaiting"] = max(maxima.get("maxWaiting", 0), waiting)
+        maxima["maxConcurrencyLimit"] = max(maxima.get("maxConcurrencyLimit", 0), limit)
+        minima["minConcurrencyLimit"] = min(minima.get("minConcurrencyLimit", limit), limit)
+
+    def drain(self) -> dict[tuple, dict[str, int]]:
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def drain_gauges(self) -> tuple[dict[tuple, dict[str, int]], dict[tuple, dict[str, int]]]:
+        maxima, minima = self._maxima, self._minima
+        self._maxima, self._minima = {}, {}
+        return maxima, minima
+
+    def clear(self) -> None:
+        self._pending.clear()
+        self._maxima.clear()
+        self._minima.clear()
+
+usage = UsageRecorder()
+
+def flush_usage(db: Database) -> int:
+    """Write the pending records to `llm_usage`; returns the number of bucket documents updated"""
+    pending = usage.drain()
+    maxima, minima = usage.drain_gauges()
+    keys = set(pending) | set(maxima) | set(minima)
+    for bucket, model, endpoint in keys:
+        update = {}
+        for operator, values in (("$inc", pending), ("$max", maxima), ("$min", minima)):
+            fields = values.get((bucket, model, endpoint))
+            if fields:
+                update[operator] = fields
+        db.llm_usage.update_one(
+            {"bucket": bucket, "model": model, "endpoint": endpoint},
+            update,
+            upsert=True,
+        )
+    return len(keys)
+
+async def run_usage_flusher(get_database: Callable[[], Database]) -> None:
+    """Background loop flushing usage records; flushes once more when cancelled"""
+    try:
+        while True:
+            await asyncio.sleep(LLM_USAGE_FLUSH_INTERVAL)
+            try:
+                await run_in_threadpool(flush_usage, get_database())
+            except Exception as exc:
+                print("Could not flush LLM usage:", exc)
+    except asyncio.CancelledError:
+        try:
+            flush_usage(get_database())
+        except Exception as exc:
+            print("Could not flush LLM usage:", exc)
+        raise
+
+def histogram_quantile(histogram: dict[str, int], q: float) -> Optional[float]:
+    """Upper bound (ms) of the histogram bucket holding the q-quantile"""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for bound in LATENCY_BOUNDS_MS:
+        seen += histogram.get(str(bound), 0)
+        if seen >= q * total:
+            return float(bound)
+    return float(LATENCY_BOUNDS_MS[-1])
+
+def _summary(documents: list[dict], field: str) -> list[dict]:
+    groups: dict[str, dict] = {}
+    for document in documents:
+        group = groups.setdefault(document[field], {
+            "key": document[field],
+            "calls": 0,
+            "errors": 0,
+            **{token_field: 0 for token_field in TOKEN_FIELDS},
+            "latency": {},
+            "maxWaiting": 0,
+            "minConcurrencyLimit": None,
+            "maxConcurrencyLimit": None,
+        })
+        for counter in ("calls", "errors", *TOKEN_FIELDS):
+            group[counter] += document.get(counter, 0)
+        for label, count in document.get("latency", {}).items():
+            group["latency"][label] = group["latency"].get(label, 0) + count
+        group["maxWaiting"] = max(group["maxWaiting"], document.get("maxWaiting", 0))
+        for gauge, pick in (("minConcurrencyLimit", min), ("maxConcurrencyLimit", max)):
+            if document.get(gauge) is not None:
+                group[gauge] = document[gauge] if group[gauge] is None else pick(group[gauge], document[gauge])
+
+    summary = []
+    for group in groups.values():
+        histogram = group.pop("latency")
+        group["p50Ms"] = histogram_quantile(histogram, 0.5)
+        group["p95Ms"] = histogram_quantile(histogram, 0.95)
+        summary.append(group)
+    return sorted(summary, key=lambda group: group["totalTokens"], reverse=True)
+
+def summarize_usage(db: Database, since: datetime) -> dict:
+    """Calls, errors, tokens and p50/p95 latency per model and per endpoint since `since`"""
+    documents = list(db.llm_usage.find({"bucket": {"$gte": bucket_start(since)}}, {"_id": 0, "users": 0}))
+    return {
+        "byModel": _summary(documents, "model"),
+        "byEndpoint": _summary(documents, "endpoint"),
+    }
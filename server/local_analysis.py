@@ -0,0 +1,259 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Rule-based analyses used when Gemini cannot answer.
+
+The three analysis types are computed from the numbers the request already
+carries: accuracy per chapter/topic, knowledge type and difficulty for a
+result, the per-group totals for the overall analysis, and the score series
+for progress. Groups at or above `STRONG_ACCURACY` become strengths, groups
+below `WEAK_ACCURACY` weaknesses, and every group below `STRONG_ACCURACY` is
+suggested for review, weakest first. The output has the same shape as the
+Gemini analysis, so clients need no special handling.
+"""
+
+import os
+from dtos import AnalyzeOverallRequest, AnalyzeProgressRequest, AnalyzeResultRequest, AnalyzeResultResponse
+
+LOCAL_ANALYSIS_FALLBACK = os.getenv("LOCAL_ANALYSIS_FALLBACK", "true").lower() == "true"
+LOCAL_ANALYSIS_ENRICH = os.getenv("LOCAL_ANALYSIS_ENRICH", "true").lower() == "true"
+LOCAL_ANALYSIS_ENRICH_DELAY = float(os.getenv("LOCAL_ANALYSIS_ENRICH_DELAY", "60"))
+STRONG_ACCURACY = 80
+WEAK_ACCURACY = 50
+MAX_SUGGESTED_TOPICS = 5
+UNSTEADY_SCORE_SPREAD = 30
+LOCAL_ANALYSIS_NOTE = "Đây là nhận xét nhanh được tính tự động từ kết quả làm bài."
+
+KNOWLEDGE_TYPE_NAMES = {
+    "concept": "khái niệm",
+    "property": "tính chất",
+    "mechanism": "cơ chế hoạt động",
+    "rule": "quy tắc và tiêu chuẩn",
+    "scenario": "tình huống",
+    "example": "bài tập tính toán",
+}
+
+TREND_NAMES = {"improving": "đang tiến bộ", "declining": "đang giảm sút", "stable": "ổn định"}
+
+def _percent(correct: int, total: int) -> float:
+    return 100 * correct / total if total else 0.0
+
+def _verdict(score: float) -> str:
+    if score >= 85:
+        return "Kết quả rất tốt"
+    if score >= 70:
+        return "Kết quả khá"
+    if score >= WEAK_ACCURACY:
+        return "Kết quả trung bình"
+    return "Kết quả chưa đạt"
+
+def _count(groups: dict, key, correct: int, total: int) -> None:
+    counts = groups.setdefault(key, [0, 0])
+    counts[0] += correct
+    counts[1] += total
+
+def _ranked(groups: dict) -> list[tuple]:
+    """(key, correct, total, accuracy) for every group with questions, best first"""
+    rows = [(key, correct, total, _percent(correct, total)) for key, (correct, total) in groups.items() if total]
+    return sorted(rows, key=lambda row: -row[3])
+
+def _kind_name(kind: str) -> str:
+    return KNOWLEDGE_TYPE_NAMES.get(kind, kind)
+
+def _suggested_topics(topics: list[tuple]) -> list[str]:
+    suggested = []
+    for (_, topic), _, _, accuracy in reversed(topics):
+        if accuracy < STRONG_ACCURACY and topic not in suggested:
+            suggested.append(topic)
+    return suggested[:MAX_SUGGESTED_TOPICS]
+
+def _group_findings(topics: list[tuple], kinds: list[tuple]) -> tuple[list[str], list[str]]:
+    """Strengths and weaknesses of the chapter/topic and knowledge type groups"""
+    strengths = [
+        f"Nắm vững {topic} ({chapter}): đúng {correct}/{total} câu"
+        for (chapter, topic), correct, total, accuracy in topics if accuracy >= STRONG_ACCURACY
+    ]
+    strengths += [
+        f"Làm tốt dạng câu hỏi {_kind_name(kind)}: đúng {correct}/{total} câu"
+        for kind, correct, total, accuracy in kinds if accuracy >= STRONG_ACCURACY
+    ]
+    weaknesses = [
+        f"Chưa vững {topic} ({chapter}): đúng {correct}/{total} câu"
+        for (chapter, topic), correct, total, accuracy in reversed(topics) if accuracy < WEAK_ACCURACY
+    ]
+    weaknesses += [
+        f"Còn yếu ở dạng câu hỏi {_kind_name(kind)}: đúng {correct}/{total} câu"
+        for kind, correct, total, accuracy in reversed(kinds) if accuracy < WEAK_ACCURACY
+    ]
+    return strengths, weaknesses
+
+def _review_actions(suggested: list[str], kinds: list[tuple]) -> list[str]:
+    actions = []
+    if suggested:
+        actions.append(f"Ôn lại lý thuyết về {', '.join(suggested[:3])} rồi làm một đề mới cùng chủ đề")
+    weak_kinds = [kind for kind, _, _, accuracy in reversed(kinds) if accuracy < WEAK_ACCURACY]
+    if weak_kinds:
+        actions.append(f"Luyện thêm câu hỏi dạng {_kind_name(weak_kinds[0])}")
+    return actions
+
+def _feedback(opening: str, topics: list[tuple]) -> str:
+    sentences = [opening]
+    best = [topic for (_, topic), _, _, accuracy in topics if accuracy >= STRONG_ACCURACY]
+    weakest = [topic for (_, topic), _, _, accuracy in reversed(topics) if accuracy < WEAK_ACCURACY]
+    if best:
+        sentences.append(f"Bạn làm tốt nhất ở chủ đề {best[0]}.")
+    if weakest:
+        sentences.append(f"Chủ đề cần ôn thêm nhiều nhất là {weakest[0]}.")
+    sentences.append(LOCAL_ANALYSIS_NOTE)
+    return " ".join(sentences)
+
+def analyze_result_locally(params: AnalyzeResultRequest) -> AnalyzeResultResponse:
+    """Strengths, weaknesses and suggestions for one attempt from its per-group accuracy"""
+    if not params.questions:
+        return AnalyzeResultResponse(
+            overallFeedback=f"Bài làm không có câu hỏi nào để phân tích. {LOCAL_ANALYSIS_NOTE}",
+            strengths=[], weaknesses=[], suggestedTopics=[], suggestedNextActions=[],
+        )
+
+    topics: dict = {}
+    kinds: dict = {}
+    levels: dict = {}
+    unanswered = 0
+    for question in params.questions:
+        answer = params.answers.get(question.id)
+        correct = int(answer == question.correctAnswer)
+        unanswered += answer is None
+        _count(topics, (question.chapter, question.topic), correct, 1)
+        _count(kinds, question.knowledgeType, correct, 1)
+        _count(levels, question.difficulty, correct, 1)
+
+    total = len(params.questions)
+    correct_total = sum(correct for correct, _ in topics.values())
+    score = _percent(correct_total, total)
+    ranked_topics, ranked_kinds = _ranked(topics), _ranked(kinds)
+
+    strengths, weaknesses = _group_findings(ranked_topics, ranked_kinds)
+    hard_correct, hard_total = levels.get("hard", (0, 0))
+    if hard_total and _percent(hard_correct, hard_total) >= STRONG_ACCURACY:
+        strengths.append(f"Làm tốt các câu hỏi khó: đúng {hard_correct}/{hard_total} câu")
+    easy_correct, easy_total = levels.get("easy", (0, 0))
+    if easy_total and _percent(easy_correct, easy_total) < STRONG_ACCURACY:
+        weaknesses.append(f"Còn sai {easy_total - easy_correct}/{easy_total} câu dễ, cần củng cố kiến thức nền tảng")
+    if unanswered:
+        weaknesses.append(f"Bỏ trống {unanswered} câu")
+
+    suggested = _suggested_topics(ranked_topics)
+    actions = _review_actions(suggested, ranked_kinds)
+    if correct_total < total:
+        actions.append("Đọc kỹ phần giải thích của các câu trả lời sai")
+    if unanswered:
+        actions.append("Phân bổ thời gian để trả lời hết các câu hỏi")
+    if score >= STRONG_ACCURACY:
+        actions.append("Thử sức với đề có độ khó cao hơn")
+
+    opening = f"{_verdict(score)}: bạn trả lời đúng {correct_total}/{total} câu ({score:.0f}%)."
+    return AnalyzeResultResponse(
+        overallFeedback=_feedback(opening, ranked_topics),
+        strengths=strengths,
+        weaknesses=weaknesses,
+        suggestedTopics=suggested,
+        suggestedNextActions=actions,
+    )
+
+def analyze_overall_locally(params: AnalyzeOverallRequest) -> AnalyzeResultResponse:
+    """Strengths, weaknesses and suggestions from the accuracy of every knowledge group"""
+    topics: dict = {}
+    kinds: dict = {}
+    for item in params.knowledgeAnalysis:
+        _count(topics, (item.chapter, item.topic), item.correctAnswers, item.totalQuestions)
+        _count(kinds, item.knowledgeType, item.correctAnswers, item.totalQuestions)
+
+    ranked_topics, ranked_kinds = _ranked(topics), _ranked(kinds)
+    strengths, weaknesses = _group_findings(ranked_topics, ranked_kinds)
+    suggested = _suggested_topics(ranked_topics)
+    actions = _review_actions(suggested, ranked_kinds)
+    if params.avgScore >= STRONG_ACCURACY:
+        actions.append("Thử sức với đề có độ khó cao hơn hoặc chuyển sang chương mới")
+    if params.attemptCount < 3:
+        actions.append("Làm thêm vài đề để có đủ dữ liệu đánh giá")
+
+    opening = (
+        f"{_verdict(params.avgScore)}: sau {params.attemptCount} lần làm bài, "
+        f"điểm trung bình của bạn là {params.avgScore:.1f}."
+    )
+    return AnalyzeResultResponse(
+        overallFeedback=_feedback(opening, ranked_topics),
+        strengths=strengths,
+        weaknesses=weaknesses,
+        suggestedTopics=suggested,
+        suggestedNextActions=actions,
+    )
+
+def analyze_progress_locally(params: AnalyzeProgressRequest) -> AnalyzeResultResponse:
+    """Strengths, weaknesses and suggestions from the trend and spread of the scores"""
+    points = params.progressData
+    trend = TREND_NAMES.get(params.trend, params.trend)
+    opening = (
+        f"{_verdict(params.avgScore)} ở {params.chapter}: điểm trung bình {params.avgScore:.1f} "
+        f"qua {len(points)} lần làm bài, xu hướng {trend}."
+    )
+    strengths, weaknesses, actions = [], [], []
+
+    if points:
+        first, last = points[0].score, points[-1].score
+        best = max(points, key=lambda point: point.score)
+        worst = min(points, key=lambda point: point.score)
+        strengths.append(f"Điểm cao nhất {best.score:.1f} ở bài \"{best.quizTitle}\" ({best.date})")
+        if params.trend == "improving":
+            strengths.append(f"Điểm số tăng từ {first:.1f} lên {last:.1f}")
+        elif params.trend == "declining":
+            weaknesses.append(f"Điểm số giảm từ {first:.1f} xuống {last:.1f}")
+            actions.append("Xem lại các câu sai của những lần làm bài gần đây để tìm phần kiến thức bị hổng")
+        if worst.score < WEAK_ACCURACY:
+            weaknesses.append(f"Điểm thấp nhất {worst.score:.1f} ở bài \"{worst.quizTitle}\" ({worst.date})")
+        if best.score - worst.score > UNSTEADY_SCORE_SPREAD:
+            weaknesses.append(f"Điểm số chưa ổn định giữa các lần làm bài (chênh lệch {best.score - worst.score:.1f} điểm)")
+
+    if params.trend == "stable":
+        if params.avgScore >= STRONG_ACCURACY:
+            strengths.append("Giữ phong độ ổn định ở mức cao")
+        else:
+            weaknesses.append("Điểm số chưa có tiến bộ rõ rệt")
+
+    if params.avgScore < WEAK_ACCURACY:
+        actions.append(f"Ôn lại lý thuyết {params.chapter} trước khi làm đề mới")
+    elif params.avgScore >= STRONG_ACCURACY:
+        actions.append("Thử sức với đề có độ khó cao hơn")
+    if params.trend == "improving":
+        actions.append("Duy trì lịch ôn tập hiện tại")
+    if len(points) < 3:
+        actions.append("Làm thêm vài đề để có đủ dữ liệu đánh giá xu hướng")
+
+    return AnalyzeResultResponse(
+        overallFeedback=f"{opening} {LOCAL_ANALYSIS_NOTE}",
+        strengths=strengths,
+        weaknesses=weaknesses,
+        suggestedTopics=[params.chapter] if params.avgScore < STRONG_ACCURACY else [],
+        suggestedNextActions=actions,
+    )
+
+LOCAL_ANALYZERS = {
+    "result": analyze_result_locally,
+    "overall": analyze_overall_locally,
+    "progress": analyze_progress_locally,
+}
+
+def analyze_locally(analysis_type: str, params) -> AnalyzeResultResponse:
+    return LOCAL_ANALYZERS[analysis_type](params)
@@ -12,20 +12,88 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from fastapi import FastAPI, HTTPException, Depends, Header, Query, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Depends, Header, BackgroundTasks, Query, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
+from contextlib import aclosing, asynccontextmanager
 from typing import List, Optional
 from datetime import datetime, timedelta
+import asyncio
 import os
 import json
-import re
 import time
+import hashlib
+import math
 from dotenv import load_dotenv
-from google import genai
 from google.genai import types
+from pydantic import TypeAdapter, ValidationError
 from pymongo.database import Database
 from email_service import generate_otp, send_otp_email, send_reset_password_otp_email, validate_email_address, send_password_changed_email
+from compression import CompressionMiddleware
+from gemini_client import (
+    GeminiBusyError,
+    GeminiUnavailableError,
+    generate_content,
+    generate_content_stream,
+    get_client,
+    is_retryable,
+    key_pool,
+    retry_after_hint,
+)
+from llm_json import JsonObjectStream, extract_object, extract_objects
+from generation_cache import (
+    GENERATION_CACHE_TTL,
+    cache_key,
+    get_cached_pool,
+    pool_size_for,
+    sample_questions,
+    store_pool,
+)
+from analysis_prompt import build_analysis_prompt, build_overall_analysis_prompt, build_progress_analysis_prompt
+from calculation_questions import generate_calculation_questions, plan_local_calculations
+from fact_questions import fact_share, generate_fact_questions
+from local_analysis import LOCAL_ANALYSIS_ENRICH, LOCAL_ANALYSIS_ENRICH_DELAY, LOCAL_ANALYSIS_FALLBACK, analyze_locally
+from question_similarity import (
+    SimilarityIndex,
+    drop_near_duplicates,
+    index_quiz,
+    remove_quiz_from_index,
+    split_stored_duplicates,
+)
+from llm_usage import flush_usage, run_usage_flusher, summarize_usage
+from ai_jobs import (
+    AI_JOB_MAX_ATTEMPTS,
+    AI_JOB_WORKERS,
+    complete_job,
+    create_job,
+    fail_job,
+    get_job,
+    notify_job_available,
+    requeue_job,
+    run_job_workers,
+)
+from question_stock import (
+    QUESTION_STOCK_TARGET,
+    plan_slots,
+    run_stock_filler,
+    take_from_stock,
+)
+from question_generation import (
+    FOLLOWUP_EXCLUDE_LIMIT,
+    QUESTION_FOLLOWUP_ATTEMPTS,
+    missing_difficulties,
+    plan_chunks,
+    split_difficulties,
+)
+from serializers import (
+    FastJSONResponse,
+    quiz_to_dict,
+    attempt_to_dict,
+    analysis_history_to_dict,
+    paginated,
+)
 
 from dtos import (
     AnalyzeOverallRequest,
@@ -33,6 +101,7 @@ from dtos import (
     AnalyzeResultRequest,
     AnalyzeResultResponse,
     GenerateQuestionsRequest,
+    GeneratedQuestion,
     Question,
     GenerateQuestionsResponse,
     LoginRequest,
@@ -57,6 +126,8 @@ from dtos import (
     PaginatedResponse,
     AnalysisHistoryResponse,
     AnalysisResultData,
+    AIJobAcceptedResponse,
+    AIJobResponse,
     AddToDiscussionRequest,
     QuizDiscussionResponse,
     DiscussionMessageResponse,
@@ -64,14 +135,17 @@ from dtos import (
     GeminiSettingsResponse,
     SystemSettingsResponse,
     LockDefaultKeyRequest,
+    LLMUsageResponse,
 )
 
 from database import (
     get_db,
     init_db,
     create_analysis_history,
+    save_analysis_history,
     get_analysis_history_by_user,
     get_analysis_history_by_id,
+    find_analysis_by_fingerprint,
     delete_analysis_history,
     add_quiz_to_discussion,
     get_quiz_discussions,
@@ -104,6 +178,7 @@ from auth import (
     unlock_user,
     create_quiz,
     get_quiz_by_id,
+    get_quiz_version,
     get_all_quizzes,
     update_quiz,
     delete_quiz,
@@ -111,6 +186,7 @@ from auth import (
     delete_question_from_quiz,
     create_attempt,
     get_attempt_by_id,
+    has_attempts_since,
     get_attempts_by_student,
     get_attempts_by_quiz,
 )
@@ -131,11 +207,37 @@ tags_metadata = [
     {"name": "Cài đặt", "description": "Cài đặt cấu hình AI của người dùng"},
 ]
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    background_tasks = [asyncio.create_task(run_usage_flusher(get_db_sync))]
+    if AI_JOB_WORKERS > 0:
+        background_tasks.append(asyncio.create_task(
+            run_job_workers(get_db_sync, process_ai_job, AI_JOB_WORKERS)
+        ))
+    if len(key_pool) and QUESTION_STOCK_TARGET > 0:
+        background_tasks.append(asyncio.create_task(
+            run_stock_filler(get_db_sync, generate_stock_questions, stock_filler_can_run)
+        ))
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
 app = FastAPI(
     title="Networking Quiz Generator API",
     description="API cho hệ thống trắc nghiệm môn Mạng Máy Tính",
     version="2.4.0",
-    openapi_tags=tags_metadata
+    openapi_tags=tags_metadata,
+    lifespan=lifespan,
+)
+
+# Auth responses carry tokens next to user-supplied input; keep them uncompressed (BREACH)
+COMPRESSION_EXCLUDED_PATHS = ("/api/auth/",)
+
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024")),
+    exclude_paths=COMPRESSION_EXCLUDED_PATHS,
 )
 
 app.add_middleware(
@@ -150,27 +252,69 @@ init_db()
 security = HTTPBearer()
 
 API_KEY = os.getenv("GOOGLE_API_KEY")
+# Extra system keys sharing the load of users without a personal key
+API_KEYS = [key.strip() for key in os.getenv("GOOGLE_API_KEYS", "").split(",") if key.strip()]
 MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash")
-print("GOOGLE_API_KEY configured:", bool(API_KEY))
+key_pool.configure(dict.fromkeys([API_KEY, *API_KEYS]))
+print("GOOGLE_API_KEY configured:", bool(API_KEY), f"({len(key_pool)} system keys)")
 print("GEMINI_MODEL_NAME configured:", MODEL_NAME)
 
+# Read endpoints serialize trusted Mongo documents directly instead of re-validating them
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "false").lower() == "true"
+
+# Static part of every question generation prompt: sent as the system instruction, which
+# gemini_client serves from Gemini's context cache, while build_prompt only holds the request
+QUESTION_INSTRUCTIONS = """Bạn tạo câu hỏi trắc nghiệm môn Mạng máy tính, mỗi câu có 4 lựa chọn.
+
+YÊU CẦU VỀ TÍNH CHÍNH XÁC (BẮT BUỘC):
+1. Mọi thông tin kỹ thuật PHẢI dựa trên chuẩn RFC, IEEE, hoặc tài liệu chính thống.
+2. KHÔNG ĐƯỢC bịa số port, địa chỉ IP, số liệu băng thông, hoặc thông số kỹ thuật.
+   - Ví dụ: DHCP dùng port 67/68, HTTP dùng port 80, HTTPS dùng port 443.
+3. Với câu hỏi tính toán (subnet, bandwidth, delay):
+   - PHẢI kiểm tra lại phép tính trước khi đưa vào đáp án.
+   - Trong "explanation" PHẢI trình bày cách tính để xác minh kết quả.
+4. KHÔNG được nhầm lẫn giữa các giao thức (TCP vs UDP, IPv4 vs IPv6).
+5. Các lớp mạng (Layer) phải chính xác theo mô hình OSI hoặc TCP/IP.
+
+YÊU CẦU VỀ CẤU TRÚC ĐÁP ÁN:
+6. Các đáp án phải:
+   - Có độ dài tương đương nhau (tránh câu dài nhất là đáp án đúng).
+   - Không quá chung chung hoặc quá đặc thù.
+   - Nội dung cùng kiểu (không trộn số liệu, định nghĩa, mô tả).
+7. Đáp án đúng phải ở vị trí NGẪU NHIÊN (không luôn là A hoặc C).
+8. KHÔNG dùng từ khóa như "tất cả", "đúng nhất", "chính xác nhất", "câu trên đều sai".
+
+YÊU CẦU KHÁC:
+9. "explanation" ngắn gọn, khách quan, giải thích tại sao đáp án đúng là đúng.
+10. Ghi đúng "difficulty" của từng câu.
+"""
+
+# Gemini is constrained to these schemas, which carry the output format, so the prompts do not
+# describe it; replies are validated against the same models before falling back to llm_json
+GENERATED_QUESTIONS = TypeAdapter(list[GeneratedQuestion])
+
 GENERATION_CONFIG_QUESTIONS = types.GenerateContentConfig(
     temperature=0.3,
     top_p=0.95,
     top_k=40,
+    response_mime_type="application/json",
+    response_schema=list[GeneratedQuestion],
+    system_instruction=QUESTION_INSTRUCTIONS,
 )
 
 GENERATION_CONFIG_ANALYSIS = types.GenerateContentConfig(
     temperature=0.5,
     top_p=0.95,
     top_k=40,
+    response_mime_type="application/json",
+    response_schema=AnalyzeResultResponse,
 )
 
-client: genai.Client | None = None
-if API_KEY:
-    client = genai.Client(api_key=API_KEY)
-
-def build_prompt(params: GenerateQuestionsRequest) -> str:
+def build_prompt(
+    params: GenerateQuestionsRequest,
+    difficulty_counts: Optional[dict] = None,
+    exclude: Optional[List[str]] = None,
+) -> str:
     prompt = f"Tạo {params.count} câu hỏi trắc nghiệm về môn Mạng máy tính.\n\n"
 
     if params.chapter:
@@ -192,7 +336,11 @@ def build_prompt(params: GenerateQuestionsRequest) -> str:
         prompt += "Loại kiến thức: " + ", ".join(types) + "\n"
 
     if not params.difficulty or params.difficulty == "":
-        prompt += "Độ khó: Hỗn hợp (Yêu cầu: 30% Dễ, 40% Trung bình, 30% Khó). Các câu hỏi phải xuất hiện ngẫu nhiên theo độ khó, không gom nhóm.\n"
+        counts = difficulty_counts or split_difficulties(params.count)
+        prompt += (
+            f"Độ khó: Hỗn hợp (Yêu cầu: đúng {counts['easy']} câu Dễ, {counts['medium']} câu Trung bình, "
+            f"{counts['hard']} câu Khó). Các câu hỏi phải xuất hiện ngẫu nhiên theo độ khó, không gom nhóm.\n"
+        )
     else:
         diff_mapping = {
             "easy": "Dễ",
@@ -201,162 +349,366 @@ def build_prompt(params: GenerateQuestionsRequest) -> str:
         }
         prompt += f"Độ khó: {diff_mapping.get(params.difficulty, params.difficulty)}\n"
 
-    prompt += f"""
-    Tạo một mảng JSON gồm {params.count} câu hỏi trắc nghiệm theo đúng cấu trúc:
-
-    {{
-        "content": "Câu hỏi dạng văn bản",
-        "options": ["Lựa chọn A", "Lựa chọn B", "Lựa chọn C", "Lựa chọn D"],
-        "correctAnswer": 0,
-        "difficulty": "easy" | "medium" | "hard",
-        "explanation": "Giải thích ngắn gọn vì sao đáp án đúng"
-    }}
-
-    YÊU CẦU VỀ TÍNH CHÍNH XÁC (BẮT BUỘC):
-    1. Mọi thông tin kỹ thuật PHẢI dựa trên chuẩn RFC, IEEE, hoặc tài liệu chính thống.
-    2. KHÔNG ĐƯỢC bịa số port, địa chỉ IP, số liệu băng thông, hoặc thông số kỹ thuật.
-       - Ví dụ: DHCP dùng port 67/68, HTTP dùng port 80, HTTPS dùng port 443.
-    3. Với câu hỏi tính toán (subnet, bandwidth, delay):
-       - PHẢI kiểm tra lại phép tính trước khi đưa vào đáp án.
-       - Trong "explanation" PHẢI trình bày cách tính để xác minh kết quả.
-    4. KHÔNG được nhầm lẫn giữa các giao thức (TCP vs UDP, IPv4 vs IPv6).
-    5. Các lớp mạng (Layer) phải chính xác theo mô hình OSI hoặc TCP/IP.
-
-    YÊU CẦU VỀ CẤU TRÚC ĐÁP ÁN:
-    6. "correctAnswer" là chỉ số (index) của đáp án đúng, bắt đầu từ 0.
-    7. Các đáp án phải:
-       - Có độ dài tương đương nhau (tránh câu dài nhất là đáp án đúng).
-       - Không quá chung chung hoặc quá đặc thù.
-       - Nội dung cùng kiểu (không trộn số liệu, định nghĩa, mô tả).
-    8. Đáp án đúng phải ở vị trí NGẪU NHIÊN (không luôn là A hoặc C).
-    9. KHÔNG dùng từ khóa như "tất cả", "đúng nhất", "chính xác nhất", "câu trên đều sai".
-    
-    YÊU CẦU KHÁC:
-    10. "explanation" ngắn gọn, khách quan, giải thích tại sao đáp án đúng là đúng.
-    11. TRẢ VỀ ĐÚNG "difficulty" cho mỗi câu ("easy", "medium", "hard").
-    12. Chỉ trả về JSON THUẦN, không bọc trong ``` và không thêm text khác.
-    """
+    if exclude:
+        prompt += "\n    KHÔNG lặp lại các câu hỏi đã có sau:\n"
+        prompt += "".join(f"    - {content[:150]}\n" for content in exclude)
 
     return prompt
 
-def build_overall_analysis_prompt(params: AnalyzeOverallRequest) -> str:
-    knowledge_payload = [item.model_dump() for item in params.knowledgeAnalysis]
-
-    prompt = f"""
-Bạn là trợ lý dạy học môn Mạng máy tính. Hãy phân tích TỔNG QUAN lịch sử làm bài trắc nghiệm của một sinh viên.
-
-Thông tin tổng quan:
-- Tên sinh viên: {params.studentName or "Không xác định"}
-- Số bài đã làm: {params.attemptCount}
-- Điểm trung bình: {params.avgScore:.1f}/100
-
-Phân tích theo nhóm kiến thức (ở dạng JSON, mỗi phần tử mô tả một nhóm kiến thức với tỉ lệ trả lời đúng):
-{json.dumps(knowledge_payload, ensure_ascii=False, indent=2)}
-
-Yêu cầu:
-1. Đưa ra nhận xét tổng quan về năng lực hiện tại (mạnh/yếu, mức độ nắm vững kiến thức, xu hướng tiến bộ hoặc chững lại nếu có thể suy ra).
-2. Chỉ ra các nhóm kiến thức/chương/chủ đề mà sinh viên làm tốt.
-3. Chỉ ra các nhóm kiến thức/chương/chủ đề mà sinh viên làm chưa tốt, cần ưu tiên ôn lại.
-4. Đề xuất các chủ đề/chương nên ôn luyện tiếp theo.
-5. Đề xuất một số hành động cụ thể để cải thiện (ví dụ: dạng bài nên luyện, chiến lược làm bài, cách phân bổ thời gian).
-
-TRẢ VỀ JSON THUẦN với đúng schema sau, dùng tiếng Việt, không kèm bất kỳ giải thích hay text nào bên ngoài JSON:
-{{
-  "overallFeedback": "nhận xét tổng quan",
-  "strengths": ["điểm mạnh 1", "điểm mạnh 2"],
-  "weaknesses": ["điểm yếu 1", "điểm yếu 2"],
-  "suggestedTopics": ["chủ đề nên ôn 1", "chủ đề nên ôn 2"],
-  "suggestedNextActions": ["hành động 1", "hành động 2"]
-}}
-"""
+def question_from_generated(
+    item: dict, question_id: str, params: GenerateQuestionsRequest
+) -> Question:
+    chapter = params.chapter or "Chương 1"
+    topic = params.topics[0] if params.topics else "Tổng quan"
+    knowledge_type = (params.knowledgeTypes[0] if params.knowledgeTypes else "concept")
+    
+    default_difficulty = params.difficulty if params.difficulty else "medium"
+
+    return Question(
+        id=question_id,
+        content=item["content"],
+        options=item["options"],
+        correctAnswer=item["correctAnswer"],
+        chapter=chapter,
+        topic=topic,
+        knowledgeType=knowledge_type,
+        difficulty=item.get("difficulty", default_difficulty),
+        explanation=item.get("explanation"),
+    )
 
-    return prompt
+def parse_generated_questions(
+    text: str, params: GenerateQuestionsRequest, index: Optional[SimilarityIndex] = None
+) -> List[Question]:
+    """Valid questions of a response, minus near-duplicates of questions already in `index`"""
+    try:
+        items = [item.model_dump(exclude_none=True) for item in GENERATED_QUESTIONS.validate_json(text)]
+        diagnostics = []
+    except ValidationError:
+        # Not the schema-constrained reply: salvage whatever objects decode
+        items, diagnostics = extract_objects(text)
+    questions: List[Question] = []
+    now_ms = int(time.time() * 1000)
+
+    for item in items:
+        try:
+            question = question_from_generated(item, f"q-{now_ms}-{len(questions)}", params)
+        except Exception as exc:
+            diagnostics.append(f"invalid question: {exc}")
+            continue
+        if index is not None and not index.add_if_new(question.content):
+            diagnostics.append(f"near-duplicate question: {question.content[:80]}")
+            continue
+        questions.append(question)
+
+    for diagnostic in diagnostics:
+        print("Skipped part of LLM response:", diagnostic)
+
+    if not questions:
+        raise ValueError("No valid questions found in LLM response")
+    return questions
+
+def assign_question_ids(questions: List[Question]) -> List[Question]:
+    now_ms = int(time.time() * 1000)
+    return [q.model_copy(update={"id": f"q-{now_ms}-{index}"}) for index, q in enumerate(questions)]
+
+async def generate_question_batch(
+    user_client,
+    user_model: str,
+    chunks: list,
+    exclude: Optional[List[str]] = None,
+    endpoint: str = "questions",
+    user_id: Optional[str] = None,
+    index: Optional[SimilarityIndex] = None,
+) -> tuple[List[Question], List[Exception]]:
+    """Generate all chunks concurrently, keeping whatever succeeded"""
+    responses = await asyncio.gather(
+        *(
+            generate_content(
+                user_client,
+                user_model,
+                build_prompt(chunk, counts, exclude),
+                GENERATION_CONFIG_QUESTIONS,
+                endpoint=endpoint,
+                user_id=user_id,
+            )
+            for chunk, counts in chunks
+        ),
+        return_exceptions=True,
+    )
 
-def build_analysis_prompt(params: AnalyzeResultRequest) -> str:
-    questions_payload = []
-    for q in params.questions:
-        questions_payload.append(
-            {
-                "id": q.id,
-                "content": q.content,
-                "options": q.options,
-                "correctAnswer": q.correctAnswer,
-                "userAnswer": params.answers.get(q.id),
-                "chapter": q.chapter,
-                "topic": q.topic,
-                "knowledgeType": q.knowledgeType,
-                "difficulty": q.difficulty,
-            }
+    questions: List[Question] = []
+    errors: List[Exception] = []
+    for (chunk, _), response in zip(chunks, responses):
+        if isinstance(response, BaseException):
+            if not isinstance(response, Exception):
+                raise response
+            errors.append(response)
+            continue
+        try:
+            questions.extend(parse_generated_questions(response.text or "", chunk, index))
+        except ValueError as exc:
+            errors.append(exc)
+    return questions, errors
+
+async def generate_question_set(
+    user_client,
+    user_model: str,
+    params: GenerateQuestionsRequest,
+    endpoint: str = "questions",
+    user_id: Optional[str] = None,
+    db: Optional[Database] = None,
+    index: Optional[SimilarityIndex] = None,
+) -> List[Question]:
+    """Generate questions in concurrent chunks, then top up whatever was lost with small follow-ups"""
+    # Near-duplicates are dropped within the request (and of the questions already in `index`)
+    # and, given a user, against their saved quizzes
+    index = index if index is not None else SimilarityIndex()
+    repeated: List[Question] = []
+
+    async def generate(chunks, exclude=None):
+        batch, errors = await generate_question_batch(
+            user_client, user_model, chunks, exclude, endpoint, user_id, index
+        )
+        if batch and db is not None and user_id:
+            batch, seen_before = await run_in_threadpool(split_stored_duplicates, db, user_id, batch)
+            repeated.extend(seen_before)
+        return batch, errors
+
+    questions, errors = await generate(plan_chunks(params))
+    if not questions and not repeated:
+        raise errors[0]
+
+    for _ in range(QUESTION_FOLLOWUP_ATTEMPTS):
+        missing = params.count - len(questions)
+        if missing <= 0:
+            break
+        print(f"Generating {missing} missing questions after partial failure or duplicates")
+        followup = params.model_copy(update={"count": missing})
+        counts = (
+            missing_difficulties(split_difficulties(params.count), questions, missing)
+            if not params.difficulty else None
         )
+        exclude = [q.content for q in (repeated + questions)[-FOLLOWUP_EXCLUDE_LIMIT:]]
+        extra, errors = await generate(plan_chunks(followup, difficulty_counts=counts), exclude)
+        questions = questions + extra
+        if not extra and any(not isinstance(error, ValueError) for error in errors):
+            # The API itself is failing (quota, overload); return what we have
+            break
+
+    return assign_question_ids(questions[:params.count])
+
+async def generate_stock_questions(params: GenerateQuestionsRequest) -> List[Question]:
+    return await generate_question_set(key_pool.choose(), MODEL_NAME, params, endpoint="stock")
+
+async def stock_filler_can_run(db: Database) -> bool:
+    """The filler only spends a system key while it is idle and the default key is not locked by an admin"""
+    if not key_pool.has_idle_key():
+        return False
+    system_settings = await run_in_threadpool(get_system_settings, db)
+    return not system_settings.get("defaultKeyLocked", False)
+
+async def sample_cached_questions(db: Database, user_model: str, request: GenerateQuestionsRequest) -> Optional[List[Question]]:
+    """Random questions from the generation cache, or None when the pool cannot cover the request"""
+    if GENERATION_CACHE_TTL <= 0:
+        return None
+    pool = await run_in_threadpool(get_cached_pool, db, cache_key(request, user_model))
+    if not pool or len(pool) < request.count:
+        return None
+    return [Question(**q) for q in sample_questions(pool, request.count, not request.difficulty)]
 
-    prompt = f"""
-Bạn là trợ lý dạy học môn Mạng máy tính. Hãy phân tích kết quả làm bài trắc nghiệm của một sinh viên.
-
-Thông tin tổng quan:
-- Tên đề: {params.quizTitle}
-- Điểm: {params.score:.1f}/100
-- Thời gian làm bài: {params.timeSpent} giây
-
-Danh sách câu hỏi (ở dạng JSON, mỗi phần tử là một câu hỏi với cả đáp án đúng và đáp án học sinh chọn):
-{json.dumps(questions_payload, ensure_ascii=False, indent=2)}
-
-Yêu cầu:
-1. Nhận xét tổng quan về mức độ hiểu bài, điểm mạnh/yếu tổng quát.
-2. Chỉ ra những nhóm kiến thức, chương, chủ đề mà sinh viên làm tốt.
-3. Chỉ ra những nhóm kiến thức, chương, chủ đề mà sinh viên hay sai, cần củng cố thêm.
-4. Gợi ý một số chủ đề/chương nên ôn luyện tiếp theo.
-5. Đề xuất một số hành động cụ thể để cải thiện (ví dụ: luyện thêm dạng bài nào, chiến lược làm bài...).
-
-TRẢ VỀ JSON THUẦN với đúng schema sau, dùng tiếng Việt, không kèm bất kỳ giải thích hay text nào bên ngoài JSON:
-{{
-  "overallFeedback": "nhận xét tổng quan",
-  "strengths": ["điểm mạnh 1", "điểm mạnh 2"],
-  "weaknesses": ["điểm yếu 1", "điểm yếu 2"],
-  "suggestedTopics": ["chủ đề nên ôn 1", "chủ đề nên ôn 2"],
-  "suggestedNextActions": ["hành động 1", "hành động 2"]
-}}
-"""
+async def reuse_questions(
+    db: Database, user_model: str, request: GenerateQuestionsRequest, bypass_cache: bool, index: SimilarityIndex
+) -> List[Question]:
+    """Questions for `request` that need no Gemini call, at most `request.count`: a generation cache hit,
+    otherwise stocked questions topped up from the cache. A cache hit costs nothing, so it goes before
+    the stock, whose questions are handed out only once."""
+    if not bypass_cache:
+        cached = await sample_cached_questions(db, user_model, request)
+        if cached is not None:
+            return drop_near_duplicates(cached, index, request.count)
+
+    reused: List[Question] = []
+    if QUESTION_STOCK_TARGET > 0:
+        plans = plan_slots(request)
+        if plans:
+            stocked = [Question(id="stock", **q) for q in await run_in_threadpool(take_from_stock, db, plans)]
+            reused = drop_near_duplicates(stocked, index, request.count)
+
+    missing = request.count - len(reused)
+    if reused and missing > 0 and not bypass_cache:
+        cached = await sample_cached_questions(db, user_model, request.model_copy(update={"count": missing}))
+        reused += drop_near_duplicates(cached or [], index, missing)
+    return reused
+
+async def fill_generation_pool(
+    db: Database,
+    user_client,
+    user_model: str,
+    request: GenerateQuestionsRequest,
+    served: List[Question],
+    user_id: Optional[str] = None,
+) -> None:
+    """Generate the extra questions of a larger cache pool (see `pool_size_for`). Runs as a background
+    task once the user has their `served` questions, which the extra ones must not repeat."""
+    extra = pool_size_for(request.count) - request.count
+    index = SimilarityIndex()
+    for question in served:
+        index.add_if_new(question.content)
+    try:
+        questions = await generate_question_set(
+            user_client, user_model, request.model_copy(update={"count": extra}), user_id=user_id, index=index
+        )
+    except Exception as exc:
+        print("Generating extra questions for the cache failed:", exc)
+        return
+    await run_in_threadpool(
+        store_pool, db, cache_key(request, user_model), user_model, request, [q.model_dump() for q in questions]
+    )
 
-    return prompt
+async def pool_generated_questions(
+    db: Database,
+    user_client,
+    user_model: str,
+    request: GenerateQuestionsRequest,
+    questions: List[Question],
+    user_id: Optional[str] = None,
+    background_tasks: Optional[BackgroundTasks] = None,
+) -> None:
+    """Add freshly generated questions to the cache and, with a pool factor above 1, schedule the extra ones"""
+    if GENERATION_CACHE_TTL <= 0 or not questions:
+        return
+    await run_in_threadpool(
+        store_pool, db, cache_key(request, user_model), user_model, request, [q.model_dump() for q in questions]
+    )
+    if background_tasks is not None and pool_size_for(request.count) > request.count:
+        background_tasks.add_task(fill_generation_pool, db, user_client, user_model, request, questions, user_id)
 
-def parse_generated_questions(
-    text: str, params: GenerateQuestionsRequest
+async def generate_and_pool_questions(
+    db: Database,
+    user_client,
+    user_model: str,
+    request: GenerateQuestionsRequest,
+    user_id: Optional[str] = None,
+    index: Optional[SimilarityIndex] = None,
+    background_tasks: Optional[BackgroundTasks] = None,
 ) -> List[Question]:
-    try:
-        match = re.search(r"\[[\s\S]*\]", text)
-        if not match:
-            raise ValueError("No JSON array found in LLM response")
-
-        raw_json = match.group(0)
-        parsed = json.loads(raw_json)
-
-        questions: List[Question] = []
-        now_ms = int(time.time() * 1000)
-        chapter = params.chapter or "Chương 1"
-        topic = params.topics[0] if params.topics else "Tổng quan"
-        knowledge_type = (params.knowledgeTypes[0] if params.knowledgeTypes else "concept")
-        
-        default_difficulty = params.difficulty if params.difficulty else "medium"
-
-        for index, q in enumerate(parsed):
-            questions.append(
-                Question(
-                    id=f"q-{now_ms}-{index}",
-                    content=q["content"],
-                    options=q["options"],
-                    correctAnswer=q["correctAnswer"],
-                    chapter=chapter,
-                    topic=topic,
-                    knowledgeType=knowledge_type,
-                    difficulty=q.get("difficulty", default_difficulty),
-                    explanation=q.get("explanation"),
-                )
-            )
+    """Generate `request.count` new questions and add them to the cache"""
+    questions = await generate_question_set(user_client, user_model, request, user_id=user_id, db=db, index=index)
+    await pool_generated_questions(db, user_client, user_model, request, questions, user_id, background_tasks)
+    return questions
+
+def generate_local_questions(
+    request: GenerateQuestionsRequest,
+) -> tuple[List[Question], Optional[GenerateQuestionsRequest]]:
+    """Questions built from local templates, and the part of the request left for Gemini (None when nothing is).
+    Whatever the templates cannot supply is left for Gemini, so the two together always make `request.count`."""
+    local_count, remaining = plan_local_calculations(request)
+    questions = generate_calculation_questions(request, local_count) if local_count else []
+    short = local_count - len(questions)
+    if short > 0:
+        # The templates ran out of distinct exercises
+        remaining = request.model_copy(update={"count": short + (remaining.count if remaining else 0)})
+    if remaining is not None:
+        facts = generate_fact_questions(remaining, fact_share(remaining))
+        if facts:
+            questions = questions + facts
+            left = remaining.count - len(facts)
+            remaining = remaining.model_copy(update={"count": left}) if left > 0 else None
+    return questions, remaining
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_generated_questions(
+    user_client,
+    user_model: str,
+    params: Optional[GenerateQuestionsRequest],
+    ready: List[Question] = (),
+    index: Optional[SimilarityIndex] = None,
+    user_id: Optional[str] = None,
+    db: Optional[Database] = None,
+    background_tasks: Optional[BackgroundTasks] = None,
+):
+    """Yield one SSE `question` event per question: the `ready` ones (local, cached, stocked) at once, then
+    the `params.count` written by Gemini as soon as each is finished. Streamed questions that are dropped
+    (invalid, near-duplicates, already in the user's saved quizzes) are replaced by a regular follow-up."""
+    now_ms = int(time.time() * 1000)
+    count = 0
+
+    def event(question: Question) -> str:
+        nonlocal count
+        question = question.model_copy(update={"id": f"q-{now_ms}-{count}"})
+        count += 1
+        return sse_event("question", question.model_dump())
+
+    for question in ready:
+        yield event(question)
+    if params is None:
+        yield sse_event("done", {"count": count})
+        return
 
-        return questions
+    index = index if index is not None else SimilarityIndex()
+    extractor = JsonObjectStream()
+    generated: List[Question] = []
+    try:
+        async with aclosing(generate_content_stream(
+            user_client,
+            user_model,
+            build_prompt(params),
+            GENERATION_CONFIG_QUESTIONS,
+            endpoint="stream",
+            user_id=user_id,
+        )) as chunks:
+            async for chunk in chunks:
+                for item in extractor.feed_decoded(chunk.text or ""):
+                    try:
+                        question = question_from_generated(item, "stream", params)
+                    except Exception as exc:
+                        extractor.diagnostics.append(f"invalid question: {exc}")
+                        continue
+                    if not index.add_if_new(question.content):
+                        extractor.diagnostics.append(f"near-duplicate question: {question.content[:80]}")
+                        continue
+                    if db is not None and user_id:
+                        _, repeated = await run_in_threadpool(split_stored_duplicates, db, user_id, [question])
+                        if repeated:
+                            extractor.diagnostics.append(f"question from a saved quiz: {question.content[:80]}")
+                            continue
+                    generated.append(question)
+                    yield event(question)
+                    if len(generated) >= params.count:
+                        break
+                if len(generated) >= params.count:
+                    break
     except Exception as exc:
-        print("Error parsing questions from LLM:", exc)
-        raise
+        try:
+            handle_gemini_error(exc)
+        except HTTPException as http_exc:
+            yield sse_event("error", {"status": http_exc.status_code, "detail": http_exc.detail})
+            return
+    missing = params.count - len(generated)
+    if missing > 0:
+        extractor.close()
+    for diagnostic in extractor.diagnostics:
+        print("Skipped part of LLM response:", diagnostic)
+
+    if missing > 0:
+        try:
+            extra = await generate_question_set(
+                user_client, user_model, params.model_copy(update={"count": missing}),
+                endpoint="stream", user_id=user_id, db=db, index=index,
+            )
+        except Exception as exc:
+            # The client warns about a short quiz; what was streamed is still usable
+            print("Follow-up generation after streaming failed:", exc)
+            extra = []
+        for question in extra:
+            generated.append(question)
+            yield event(question)
+
+    if db is not None:
+        await pool_generated_questions(db, user_client, user_model, params, generated, user_id, background_tasks)
+    yield sse_event("done", {"count": count})
 
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security_scheme),
@@ -780,6 +1132,18 @@ def toggle_default_key_lock(
     status = "đã khóa" if request.locked else "đã mở khóa"
     return {"message": f"API key mặc định {status}"}
 
+@app.get("/api/admin/llm-usage", response_model=LLMUsageResponse, tags=["Cài đặt"])
+def get_llm_usage(
+    hours: int = Query(24, ge=1, le=24 * 90),
+    admin_user: dict = Depends(get_admin_user),
+    db: Database = Depends(get_db)
+):
+    """Gemini calls, token spend and p50/p95 latency per model and per endpoint,
+    and the current state of every system key (admin only)"""
+    flush_usage(db)
+    since = datetime.now() - timedelta(hours=hours)
+    return LLMUsageResponse(since=since, defaultKeys=key_pool.stats(), **summarize_usage(db, since))
+
 @app.get("/api/settings/default-key-status", tags=["Cài đặt"])
 def get_default_key_status(
     current_user: dict = Depends(get_current_user),
@@ -808,7 +1172,7 @@ def get_gemini_client_for_user(db: Database, user_id: str) -> tuple:
     user_model = settings.get("geminiModel") if settings else None
     
     if user_api_key:
-        user_client = genai.Client(api_key=user_api_key)
+        user_client = get_client(user_api_key)
         active_model = user_model if user_model else MODEL_NAME
         return user_client, active_model
     
@@ -819,15 +1183,29 @@ def get_gemini_client_for_user(db: Database, user_id: str) -> tuple:
             detail="DEFAULT_KEY_LOCKED:Quản trị viên đã khóa API key mặc định. Vui lòng thiết lập API key cá nhân trong phần Cài đặt."
         )
     
-    if not API_KEY:
+    if not len(key_pool):
         return None, None
     
     active_model = user_model if user_model else MODEL_NAME
-    return client, active_model
+    return key_pool.choose(), active_model
 
 def handle_gemini_error(exc: Exception):
     print("Error calling Gemini API:", exc)
     
+    if isinstance(exc, GeminiBusyError):
+        raise HTTPException(
+            status_code=503,
+            detail="[Lỗi 503] Hệ thống AI đang xử lý quá nhiều yêu cầu. Vui lòng thử lại sau ít phút.",
+            headers={"Retry-After": "30"},
+        )
+    
+    if isinstance(exc, GeminiUnavailableError):
+        raise HTTPException(
+            status_code=503,
+            detail="[Lỗi 503] Gemini đang gặp sự cố. Vui lòng thử lại sau ít phút.",
+            headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        )
+    
     status_code = getattr(exc, "status_code", None)
     if not status_code and hasattr(exc, "code"):
         status_code = exc.code
@@ -835,9 +1213,11 @@ def handle_gemini_error(exc: Exception):
     error_msg = str(exc)
     
     if status_code == 429 or "429" in error_msg:
+        retry_after = retry_after_hint(exc)
         raise HTTPException(
             status_code=429, 
-            detail="[Lỗi 429] Quá số lần gọi API. Vui lòng đợi 1-2 phút rồi thử lại."
+            detail="[Lỗi 429] Quá số lần gọi API. Vui lòng đợi 1-2 phút rồi thử lại.",
+            headers={"Retry-After": str(math.ceil(retry_after))} if retry_after is not None else None,
         )
         
     if status_code == 503 or "503" in error_msg:
@@ -866,257 +1246,359 @@ def handle_gemini_error(exc: Exception):
         
     raise HTTPException(status_code=500, detail=f"[Lỗi 500] Lỗi khi gọi Gemini API: {error_msg[:100]}")
 
-@app.post("/api/generate-questions", response_model=GenerateQuestionsResponse, tags=["Tính năng AI"])
-def generate_questions(
-    request: GenerateQuestionsRequest,
-    current_user: dict = Depends(get_current_user),
-    db: Database = Depends(get_db)
-) -> GenerateQuestionsResponse:
-    user_client, user_model = get_gemini_client_for_user(db, current_user["id"])
-    
+async def require_gemini_client(db: Database, user_id: str):
+    user_client, user_model = await run_in_threadpool(get_gemini_client_for_user, db, user_id)
     if user_client is None:
         raise HTTPException(
             status_code=500,
             detail="GOOGLE_API_KEY chưa được cấu hình. Vui lòng cấu hình API Key trong Cài đặt hoặc liên hệ quản trị viên.",
         )
+    return user_client, user_model
+
+def shortfall_of(request: GenerateQuestionsRequest, served: List[Question]) -> Optional[GenerateQuestionsRequest]:
+    """The part of `request` still missing after `served`, or None when nothing is"""
+    missing = request.count - len(served)
+    return request.model_copy(update={"count": missing}) if missing > 0 else None
 
-    prompt = build_prompt(request)
+# Both endpoints run the same pipeline: local templates, then the generation cache and the stock, then Gemini.
+# Template-built questions are distinct by construction, so they never go through the similarity filter;
+# everything else is checked against one index, and Gemini replaces what it drops.
+
+@app.post("/api/generate-questions", response_model=GenerateQuestionsResponse, tags=["Tính năng AI"])
+async def generate_questions(
+    request: GenerateQuestionsRequest,
+    background_tasks: BackgroundTasks,
+    cache_control: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
+) -> GenerateQuestionsResponse:
+    local, remaining = generate_local_questions(request)
+    if remaining is None:
+        return GenerateQuestionsResponse(questions=assign_question_ids(local))
+
+    user_client, user_model = await require_gemini_client(db, current_user["id"])
+    index = SimilarityIndex()
+    bypass_cache = "no-cache" in (cache_control or "").lower()
+    reused = await reuse_questions(db, user_model, remaining, bypass_cache, index)
+    shortfall = shortfall_of(remaining, reused)
+    if shortfall is None:
+        return GenerateQuestionsResponse(questions=assign_question_ids(local + reused))
 
     try:
-        gemini_response = user_client.models.generate_content(
-            model=user_model,
-            contents=prompt,
-            config=GENERATION_CONFIG_QUESTIONS,
+        generated = await generate_and_pool_questions(
+            db, user_client, user_model, shortfall, current_user["id"], index, background_tasks
         )
-
-        generated_text = gemini_response.text
-        questions = parse_generated_questions(generated_text, request)
-        return GenerateQuestionsResponse(questions=questions)
+        return GenerateQuestionsResponse(questions=assign_question_ids(local + reused + generated))
     except HTTPException:
         raise
     except Exception as exc:
         handle_gemini_error(exc)
 
-@app.post("/api/analyze-result", response_model=AnalyzeResultResponse, tags=["Tính năng AI"])
-def analyze_result(
-    request: AnalyzeResultRequest,
+@app.post("/api/generate-questions/stream", tags=["Tính năng AI"])
+async def generate_questions_stream(
+    request: GenerateQuestionsRequest,
+    background_tasks: BackgroundTasks,
+    cache_control: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
     db: Database = Depends(get_db)
-) -> AnalyzeResultResponse:
-    user_client, user_model = get_gemini_client_for_user(db, current_user["id"])
-    
-    if user_client is None:
-        raise HTTPException(
-            status_code=500,
-            detail="GOOGLE_API_KEY chưa được cấu hình. Vui lòng cấu hình API Key trong Cài đặt hoặc liên hệ quản trị viên.",
-        )
-
-    prompt = build_analysis_prompt(request)
+) -> StreamingResponse:
+    local, remaining = generate_local_questions(request)
+    user_client = user_model = None
+    index = SimilarityIndex()
+    ready = local
+    if remaining is not None:
+        user_client, user_model = await require_gemini_client(db, current_user["id"])
+        bypass_cache = "no-cache" in (cache_control or "").lower()
+        reused = await reuse_questions(db, user_model, remaining, bypass_cache, index)
+        ready = local + reused
+        remaining = shortfall_of(remaining, reused)
+
+    return StreamingResponse(
+        stream_generated_questions(
+            user_client, user_model, remaining, ready, index, current_user["id"], db, background_tasks
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    try:
-        gemini_response = user_client.models.generate_content(
-            model=user_model,
-            contents=prompt,
-            config=GENERATION_CONFIG_ANALYSIS,
-        )
+ANALYSIS_FALLBACK_FEEDBACK = {
+    "result": "Không thể phân tích kết quả bài làm.",
+    "overall": "Không thể phân tích tổng quan lịch sử làm bài.",
+    "progress": "Không thể phân tích tiến triển học tập.",
+}
+
+ANALYSIS_REQUEST_MODELS = {
+    "result": AnalyzeResultRequest,
+    "overall": AnalyzeOverallRequest,
+    "progress": AnalyzeProgressRequest,
+}
+
+def build_analysis_history(user_id: str, analysis_type: str, request, result: AnalyzeResultResponse) -> dict:
+    if analysis_type == "result":
+        title = request.quizTitle
+        context = {"score": request.score, "timeSpent": request.timeSpent}
+    elif analysis_type == "overall":
+        title = "Phân tích tổng quan"
+        context = {"attemptCount": request.attemptCount, "avgScore": request.avgScore}
+    else:
+        title = f"Tiến triển: {request.chapter}"
+        context = {"chapter": request.chapter, "trend": request.trend, "avgScore": request.avgScore}
+    return {
+        "id": f"analysis-{int(time.time() * 1000)}",
+        "userId": user_id,
+        "analysisType": analysis_type,
+        "title": title,
+        "result": result.model_dump(),
+        "context": context,
+        "createdAt": datetime.now()
+    }
 
-        generated_text = gemini_response.text or ""
+def analysis_fingerprint(analysis_type: str, request, model: str) -> str:
+    """Hash of the input an analysis depends on, so an unchanged input can reuse the stored result"""
+    if analysis_type == "result":
+        source = {
+            "questions": [question.model_dump() for question in request.questions],
+            "answers": request.answers,
+            "score": request.score,
+        }
+    elif analysis_type == "overall":
+        # Summarizes every attempt of the user; only new (or removed) attempts change it
+        source = {"attemptCount": request.attemptCount}
+    else:
+        source = request.model_dump(exclude={"studentName"})
+    payload = json.dumps({"analysisType": analysis_type, "model": model, **source}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-        try:
-            data = json.loads(generated_text)
-        except json.JSONDecodeError:
-            match = re.search(r"\{[\s\S]*\}", generated_text)
-            if not match:
-                raise ValueError("No JSON object found in LLM response")
-            data = json.loads(match.group(0))
-
-        result = AnalyzeResultResponse(
-            overallFeedback=data.get(
-                "overallFeedback", "Không thể phân tích kết quả bài làm."
-            ),
-            strengths=data.get("strengths", []),
-            weaknesses=data.get("weaknesses", []),
-            suggestedTopics=data.get("suggestedTopics", []),
-            suggestedNextActions=data.get("suggestedNextActions", []),
+def find_memoized_analysis(db: Database, user_id: str, analysis_type: str, fingerprint: str) -> Optional[dict]:
+    entry = find_analysis_by_fingerprint(db, user_id, analysis_type, fingerprint)
+    if entry and analysis_type == "overall" and has_attempts_since(db, user_id, entry["createdAt"]):
+        return None
+    return entry
+
+def is_transient_gemini_error(exc: Exception) -> bool:
+    """Failures expected to clear up on their own: overload, exhausted quota, outages and timeouts"""
+    return isinstance(exc, (GeminiBusyError, GeminiUnavailableError)) or is_retryable(exc)
+
+def enrich_delay(exc: Exception) -> float:
+    """Seconds to wait before asking Gemini again after `exc`"""
+    if isinstance(exc, GeminiUnavailableError):
+        return exc.retry_after
+    if isinstance(exc, HTTPException):
+        # Raised by handle_gemini_error, which passes Gemini's hint on as Retry-After
+        retry_after = (exc.headers or {}).get("Retry-After")
+        return float(retry_after) if retry_after else LOCAL_ANALYSIS_ENRICH_DELAY
+    hint = retry_after_hint(exc)
+    return hint if hint is not None else LOCAL_ANALYSIS_ENRICH_DELAY
+
+async def serve_local_analysis(
+    db: Database,
+    user_id: str,
+    analysis_type: str,
+    request,
+    history_id: Optional[str] = None,
+    response: Optional[Response] = None,
+    failure: Optional[Exception] = None,
+) -> tuple[AnalyzeResultResponse, str]:
+    """Save and return the rule-based analysis; after a transient Gemini `failure`,
+    queue a job that replaces it with Gemini's analysis once Gemini has recovered"""
+    result = analyze_locally(analysis_type, request)
+    history_data = build_analysis_history(user_id, analysis_type, request, result)
+    history_data["source"] = "local"
+    if history_id:
+        history_data["id"] = history_id
+    await run_in_threadpool(save_analysis_history, db, history_data)
+    if response is not None:
+        response.headers["X-Analysis-Source"] = "local"
+
+    if failure is not None and LOCAL_ANALYSIS_ENRICH:
+        job = await run_in_threadpool(
+            create_job, db, user_id, analysis_type, request.model_dump(), enrich_delay(failure), history_data["id"]
         )
-        
-        history_data = {
-            "id": f"analysis-{int(time.time() * 1000)}",
-            "userId": current_user["id"],
-            "analysisType": "result",
-            "title": request.quizTitle,
-            "result": result.model_dump(),
-            "context": {"score": request.score, "timeSpent": request.timeSpent},
-            "createdAt": datetime.now().isoformat()
-        }
-        create_analysis_history(db, history_data)
-        
-        return result
-    except HTTPException:
+        notify_job_available()
+        if response is not None:
+            response.headers["Location"] = f"/api/ai-jobs/{job['id']}"
+    return result, history_data["id"]
+
+async def run_analysis(
+    db: Database,
+    user_id: str,
+    analysis_type: str,
+    request,
+    history_id: Optional[str] = None,
+    response: Optional[Response] = None,
+    local_fallback: bool = True,
+) -> tuple[AnalyzeResultResponse, str]:
+    """Call Gemini for one analysis and save it to the history; returns the result and history id.
+    With `local_fallback`, a missing or locked key and transient Gemini failures are answered by the local analysis."""
+    local_fallback = local_fallback and LOCAL_ANALYSIS_FALLBACK
+    try:
+        user_client, user_model = await run_in_threadpool(get_gemini_client_for_user, db, user_id)
+    except HTTPException as exc:
+        if local_fallback and str(exc.detail).startswith("DEFAULT_KEY_LOCKED"):
+            return await serve_local_analysis(db, user_id, analysis_type, request, history_id, response)
         raise
-    except Exception as exc:
-        handle_gemini_error(exc)
 
-@app.post("/api/analyze-overall", response_model=AnalyzeResultResponse, tags=["Tính năng AI"])
-def analyze_overall(
-    request: AnalyzeOverallRequest,
-    current_user: dict = Depends(get_current_user),
-    db: Database = Depends(get_db)
-) -> AnalyzeResultResponse:
-    user_client, user_model = get_gemini_client_for_user(db, current_user["id"])
+    fingerprint = analysis_fingerprint(analysis_type, request, user_model)
+    memoized = await run_in_threadpool(find_memoized_analysis, db, user_id, analysis_type, fingerprint)
+    if memoized:
+        return AnalyzeResultResponse(**memoized["result"]), memoized["id"]
     
     if user_client is None:
+        if local_fallback:
+            return await serve_local_analysis(db, user_id, analysis_type, request, history_id, response)
         raise HTTPException(
             status_code=500,
             detail="GOOGLE_API_KEY chưa được cấu hình. Vui lòng cấu hình API Key trong Cài đặt hoặc liên hệ quản trị viên.",
         )
 
-    prompt = build_overall_analysis_prompt(request)
+    if analysis_type == "result":
+        prompt = build_analysis_prompt(request)
+    elif analysis_type == "overall":
+        prompt = build_overall_analysis_prompt(request)
+    else:
+        prompt = build_progress_analysis_prompt(request)
 
     try:
-        gemini_response = user_client.models.generate_content(
-            model=user_model,
-            contents=prompt,
-            config=GENERATION_CONFIG_ANALYSIS,
+        gemini_response = await generate_content(
+            user_client,
+            user_model,
+            prompt,
+            GENERATION_CONFIG_ANALYSIS,
+            endpoint="analysis",
+            user_id=user_id,
         )
 
         generated_text = gemini_response.text or ""
 
         try:
-            data = json.loads(generated_text)
-        except json.JSONDecodeError:
-            match = re.search(r"\{[\s\S]*\}", generated_text)
-            if not match:
-                raise ValueError("No JSON object found in LLM response")
-            data = json.loads(match.group(0))
-
-        result = AnalyzeResultResponse(
-            overallFeedback=data.get(
-                "overallFeedback", "Không thể phân tích tổng quan lịch sử làm bài."
-            ),
-            strengths=data.get("strengths", []),
-            weaknesses=data.get("weaknesses", []),
-            suggestedTopics=data.get("suggestedTopics", []),
-            suggestedNextActions=data.get("suggestedNextActions", []),
-        )
+            result = AnalyzeResultResponse.model_validate_json(generated_text)
+        except ValidationError:
+            data = extract_object(generated_text)
+            result = AnalyzeResultResponse(
+                overallFeedback=data.get(
+                    "overallFeedback", ANALYSIS_FALLBACK_FEEDBACK[analysis_type]
+                ),
+                strengths=data.get("strengths", []),
+                weaknesses=data.get("weaknesses", []),
+                suggestedTopics=data.get("suggestedTopics", []),
+                suggestedNextActions=data.get("suggestedNextActions", []),
+            )
         
-        history_data = {
-            "id": f"analysis-{int(time.time() * 1000)}",
-            "userId": current_user["id"],
-            "analysisType": "overall",
-            "title": "Phân tích tổng quan",
-            "result": result.model_dump(),
-            "context": {"attemptCount": request.attemptCount, "avgScore": request.avgScore},
-            "createdAt": datetime.now().isoformat()
-        }
-        create_analysis_history(db, history_data)
+        history_data = build_analysis_history(user_id, analysis_type, request, result)
+        history_data.update({"fingerprint": fingerprint, "model": user_model})
+        if history_id:
+            history_data["id"] = history_id
+            await run_in_threadpool(save_analysis_history, db, history_data)
+        else:
+            await run_in_threadpool(create_analysis_history, db, history_data)
         
-        return result
+        return result, history_data["id"]
     except HTTPException:
         raise
     except Exception as exc:
+        if local_fallback and is_transient_gemini_error(exc):
+            print("Gemini analysis failed, answering with the local analysis:", exc)
+            return await serve_local_analysis(db, user_id, analysis_type, request, history_id, response, exc)
         handle_gemini_error(exc)
 
-def build_progress_analysis_prompt(request) -> str:
-    progress_text = "\n".join([
-        f"- {p.date}: {p.score:.1f} điểm ({p.quizTitle})" 
-        for p in request.progressData
-    ])
-    
-    trend_vi = {
-        "improving": "đang tiến bộ",
-        "declining": "đang giảm sút", 
-        "stable": "ổn định"
-    }.get(request.trend, request.trend)
-    
-    prompt = f"""Bạn là một chuyên gia giáo dục. Hãy phân tích sự tiến triển học tập của sinh viên dựa trên dữ liệu sau:
-
-Sinh viên: {request.studentName or 'Không xác định'}
-Chương/Chủ đề: {request.chapter}
-Xu hướng hiện tại: {trend_vi}
-Điểm trung bình: {request.avgScore:.1f}
-
-Lịch sử làm bài (theo thời gian):
-{progress_text}
-
-Hãy phân tích:
-1. Đánh giá tổng quan về sự tiến triển
-2. Điểm mạnh trong quá trình học
-3. Điểm cần cải thiện
-4. Đề xuất các bước tiếp theo
-
-Trả về JSON với format:
-{{
-    "overallFeedback": "Nhận xét tổng quan về tiến triển...",
-    "strengths": ["Điểm mạnh 1", "Điểm mạnh 2"],
-    "weaknesses": ["Điểm yếu 1", "Điểm yếu 2"],
-    "suggestedTopics": ["Chủ đề nên ôn lại 1", "Chủ đề nên ôn lại 2"],
-    "suggestedNextActions": ["Hành động 1", "Hành động 2"]
-}}
-
-CHỈ trả về JSON, không có text khác."""
-    return prompt
+def wants_async(prefer: Optional[str]) -> bool:
+    return prefer is not None and "respond-async" in prefer.lower()
+
+async def enqueue_analysis(db: Database, user_id: str, analysis_type: str, request) -> JSONResponse:
+    """Queue an analysis and answer 202 right away; the result is pushed over the chat WebSocket"""
+    job = await run_in_threadpool(create_job, db, user_id, analysis_type, request.model_dump())
+    notify_job_available()
+    return JSONResponse(
+        status_code=202,
+        content={"jobId": job["id"], "status": job["status"]},
+        headers={"Location": f"/api/ai-jobs/{job['id']}", "Preference-Applied": "respond-async"},
+    )
 
-@app.post("/api/analyze-progress", response_model=AnalyzeResultResponse, tags=["Tính năng AI"])
-def analyze_progress(
-    request: AnalyzeProgressRequest,
+ANALYSIS_ASYNC_RESPONSES = {202: {"model": AIJobAcceptedResponse, "description": "Đã xếp hàng (khi gửi `Prefer: respond-async`)"}}
+
+@app.post("/api/analyze-result", response_model=AnalyzeResultResponse, responses=ANALYSIS_ASYNC_RESPONSES, tags=["Tính năng AI"])
+async def analyze_result(
+    request: AnalyzeResultRequest,
+    response: Response,
+    prefer: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
     db: Database = Depends(get_db)
-) -> AnalyzeResultResponse:
-    user_client, user_model = get_gemini_client_for_user(db, current_user["id"])
-    
-    if user_client is None:
-        raise HTTPException(
-            status_code=500,
-            detail="GOOGLE_API_KEY chưa được cấu hình. Vui lòng cấu hình API Key trong Cài đặt hoặc liên hệ quản trị viên.",
-        )
+):
+    if wants_async(prefer):
+        return await enqueue_analysis(db, current_user["id"], "result", request)
+    result, _ = await run_analysis(db, current_user["id"], "result", request, response=response)
+    return result
 
-    prompt = build_progress_analysis_prompt(request)
+@app.post("/api/analyze-overall", response_model=AnalyzeResultResponse, responses=ANALYSIS_ASYNC_RESPONSES, tags=["Tính năng AI"])
+async def analyze_overall(
+    request: AnalyzeOverallRequest,
+    response: Response,
+    prefer: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
+):
+    if wants_async(prefer):
+        return await enqueue_analysis(db, current_user["id"], "overall", request)
+    result, _ = await run_analysis(db, current_user["id"], "overall", request, response=response)
+    return result
 
+@app.post("/api/analyze-progress", response_model=AnalyzeResultResponse, responses=ANALYSIS_ASYNC_RESPONSES, tags=["Tính năng AI"])
+async def analyze_progress(
+    request: AnalyzeProgressRequest,
+    response: Response,
+    prefer: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
+):
+    if wants_async(prefer):
+        return await enqueue_analysis(db, current_user["id"], "progress", request)
+    result, _ = await run_analysis(db, current_user["id"], "progress", request, response=response)
+    return result
+
+async def process_ai_job(db: Database, job: dict) -> None:
+    """Run a queued analysis, record the outcome and push it to the user if they are online.
+    Jobs created with a history id replace a local analysis; they wait for Gemini instead of falling back again."""
+    message = {"type": "ai_job", "jobId": job["id"], "analysisType": job["analysisType"]}
+    replaces_local = job.get("historyId") is not None
     try:
-        gemini_response = user_client.models.generate_content(
-            model=user_model,
-            contents=prompt,
-            config=GENERATION_CONFIG_ANALYSIS,
+        request = ANALYSIS_REQUEST_MODELS[job["analysisType"]](**job["payload"])
+        result, history_id = await run_analysis(
+            db,
+            job["userId"],
+            job["analysisType"],
+            request,
+            history_id=job.get("historyId") or f"analysis-{job['id']}",
+            local_fallback=not replaces_local,
         )
-
-        generated_text = gemini_response.text or ""
-
-        try:
-            data = json.loads(generated_text)
-        except json.JSONDecodeError:
-            match = re.search(r"\{[\s\S]*\}", generated_text)
-            if not match:
-                raise ValueError("No JSON object found in LLM response")
-            data = json.loads(match.group(0))
-
-        result = AnalyzeResultResponse(
-            overallFeedback=data.get(
-                "overallFeedback", "Không thể phân tích tiến triển học tập."
-            ),
-            strengths=data.get("strengths", []),
-            weaknesses=data.get("weaknesses", []),
-            suggestedTopics=data.get("suggestedTopics", []),
-            suggestedNextActions=data.get("suggestedNextActions", []),
-        )
-        
-        # Save to analysis history
-        history_data = {
-            "id": f"analysis-{int(time.time() * 1000)}",
-            "userId": current_user["id"],
-            "analysisType": "progress",
-            "title": f"Tiến triển: {request.chapter}",
-            "result": result.model_dump(),
-            "context": {"chapter": request.chapter, "trend": request.trend, "avgScore": request.avgScore},
-            "createdAt": datetime.now().isoformat()
-        }
-        create_analysis_history(db, history_data)
-        
-        return result
-    except HTTPException:
-        raise
+        await run_in_threadpool(complete_job, db, job["id"], result.model_dump(), history_id)
+        message.update({"status": "done", "result": result.model_dump(), "historyId": history_id})
     except Exception as exc:
-        handle_gemini_error(exc)
+        if replaces_local and job["attempts"] < AI_JOB_MAX_ATTEMPTS and is_transient_gemini_error(exc):
+            await run_in_threadpool(requeue_job, db, job["id"], enrich_delay(exc))
+            return
+        if isinstance(exc, HTTPException):
+            error = {"status": exc.status_code, "detail": exc.detail}
+        else:
+            error = {"status": 500, "detail": f"[Lỗi 500] Lỗi khi phân tích: {str(exc)[:100]}"}
+        await run_in_threadpool(fail_job, db, job["id"], error)
+        if replaces_local:
+            # The user already has the local analysis; there is nothing new to tell them
+            return
+        message.update({"status": "failed", "error": error})
+    message["timestamp"] = datetime.now().isoformat()
+    await manager.send_to_user(job["userId"], message)
+
+@app.get("/api/ai-jobs/{job_id}", response_model=AIJobResponse, tags=["Tính năng AI"])
+def get_ai_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
+):
+    """Get the status (and result once done) of a queued analysis"""
+    job = get_job(db, job_id)
+    if not job or job["userId"] != current_user["id"]:
+        raise HTTPException(status_code=404, detail="Không tìm thấy yêu cầu phân tích")
+    return AIJobResponse(**job)
 
 @app.get("/api/analysis-history", response_model=PaginatedResponse[AnalysisHistoryResponse], tags=["Lịch sử phân tích"])
 def get_analysis_history(
@@ -1133,6 +1615,11 @@ def get_analysis_history(
     total = result["total"]
     pages = (total + size - 1) // size if total > 0 else 1
     
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(paginated(
+            [analysis_history_to_dict(item) for item in items], total, page, size, pages
+        ))
+    
     return PaginatedResponse(
         items=[
             AnalysisHistoryResponse(
@@ -1164,6 +1651,39 @@ def delete_analysis_history_endpoint(
         raise HTTPException(status_code=404, detail="Không tìm thấy bản ghi phân tích hoặc bạn không có quyền xóa")
     return {"message": "Xóa bản ghi phân tích thành công"}
 
+# Browsers keep the quiz but must revalidate it with If-None-Match on every use
+QUIZ_CACHE_CONTROL = "private, no-cache"
+
+def quiz_etag(quiz_id: str, version: int) -> str:
+    """Strong ETag for a quiz, derived from its version counter"""
+    return f'"{quiz_id}.v{version}"'
+
+def matching_etag(if_none_match: Optional[str], etag: str) -> Optional[str]:
+    """The If-None-Match entry that matches `etag` under weak comparison (RFC 9110 13.1.2), as the client
+    sent it, or None.
+
+    Content-coding suffixes added by the compression middleware are ignored.
+    """
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == "*":
+        return etag
+    target = etag.strip('"')
+    for entry in if_none_match.split(","):
+        entry = entry.strip()
+        candidate = entry[2:] if entry.startswith("W/") else entry
+        candidate = candidate.strip('"')
+        for suffix in ("-br", "-gzip"):
+            if candidate.endswith(suffix):
+                candidate = candidate[: -len(suffix)]
+        if candidate == target:
+            return entry
+    return None
+
+def not_modified(etag: str) -> Response:
+    """304 carrying the validator the client holds, including any content-coding suffix"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": QUIZ_CACHE_CONTROL})
+
 # Quiz endpoints
 @app.get("/api/quizzes", response_model=PaginatedResponse[QuizResponse], tags=["Quản lý đề thi"])
 def get_quizzes(
@@ -1181,6 +1701,11 @@ def get_quizzes(
     total = result["total"]
     pages = (total + size - 1) // size
     
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(paginated(
+            [quiz_to_dict(q) for q in quizzes], total, page, size, pages
+        ))
+    
     return PaginatedResponse(
         items=[
             QuizResponse(
@@ -1190,7 +1715,7 @@ def get_quizzes(
                 questions=q["questions"],
                 duration=q["duration"],
                 createdBy=q["createdBy"],
-                createdAt=q.get("createdAt", datetime.now().isoformat()),
+                createdAt=q.get("createdAt", datetime.now()),
                 settings=QuizSettings(**q.get("settings", {"questionCount": len(q.get("questions", []))}))
             )
             for q in quizzes
@@ -1204,10 +1729,19 @@ def get_quizzes(
 @app.get("/api/quizzes/{quiz_id}", response_model=QuizResponse, tags=["Quản lý đề thi"])
 def get_quiz(
     quiz_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
     db: Database = Depends(get_db)
 ):
     """Get a specific quiz by ID"""
+    if if_none_match:
+        meta = get_quiz_version(db, quiz_id)
+        if meta and meta["createdBy"] == current_user["id"]:
+            matched = matching_etag(if_none_match, quiz_etag(quiz_id, meta["version"]))
+            if matched:
+                return not_modified(matched)
+    
     quiz = get_quiz_by_id(db, quiz_id)
     if not quiz:
         raise HTTPException(status_code=404, detail="Không tìm thấy đề thi")
@@ -1215,6 +1749,11 @@ def get_quiz(
     if quiz["createdBy"] != current_user["id"]:
         raise HTTPException(status_code=403, detail="Bạn không có quyền xem đề thi này")
     
+    headers = {"ETag": quiz_etag(quiz_id, quiz.get("version", 0)), "Cache-Control": QUIZ_CACHE_CONTROL}
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(quiz_to_dict(quiz), headers=headers)
+    
+    response.headers.update(headers)
     return QuizResponse(
         id=quiz["id"],
         title=quiz["title"],
@@ -1222,7 +1761,7 @@ def get_quiz(
         questions=quiz["questions"],
         duration=quiz["duration"],
         createdBy=quiz["createdBy"],
-        createdAt=quiz.get("createdAt", datetime.now().isoformat()),
+        createdAt=quiz.get("createdAt", datetime.now()),
         settings=QuizSettings(**quiz.get("settings", {"questionCount": len(quiz.get("questions", []))}))
     )
 
@@ -1241,11 +1780,12 @@ def create_quiz_endpoint(
         "questions": [q.model_dump() for q in request.questions],
         "duration": request.duration,
         "createdBy": current_user["id"],
-        "createdAt": datetime.now().isoformat(),
+        "createdAt": datetime.now(),
         "settings": request.settings.model_dump()
     }
     
     created_quiz = create_quiz(db, quiz_data)
+    index_quiz(db, created_quiz)
     
     return QuizResponse(
         id=created_quiz["id"],
@@ -1254,7 +1794,7 @@ def create_quiz_endpoint(
         questions=created_quiz["questions"],
         duration=created_quiz["duration"],
         createdBy=created_quiz["createdBy"],
-        createdAt=created_quiz.get("createdAt", datetime.now().isoformat()),
+        createdAt=created_quiz.get("createdAt", datetime.now()),
         settings=QuizSettings(**created_quiz.get("settings", {"questionCount": len(created_quiz.get("questions", []))}))
     )
 
@@ -1289,6 +1829,8 @@ def update_quiz_endpoint(
     updated_quiz = update_quiz(db, quiz_id, updates)
     if not updated_quiz:
         raise HTTPException(status_code=400, detail="Không thể cập nhật đề thi")
+    if "questions" in updates:
+        index_quiz(db, updated_quiz)
     
     return QuizResponse(
         id=updated_quiz["id"],
@@ -1297,7 +1839,7 @@ def update_quiz_endpoint(
         questions=updated_quiz["questions"],
         duration=updated_quiz["duration"],
         createdBy=updated_quiz["createdBy"],
-        createdAt=updated_quiz.get("createdAt", datetime.now().isoformat()),
+        createdAt=updated_quiz.get("createdAt", datetime.now()),
         settings=QuizSettings(**updated_quiz.get("settings", {"questionCount": len(updated_quiz.get("questions", []))}))
     )
 
@@ -1318,6 +1860,7 @@ def delete_quiz_endpoint(
     success = delete_quiz(db, quiz_id)
     if not success:
         raise HTTPException(status_code=400, detail="Không thể xóa đề thi")
+    remove_quiz_from_index(db, quiz_id)
     
     return {"message": "Xóa đề thi thành công"}
 
@@ -1358,6 +1901,8 @@ def update_question_endpoint(
     updated_quiz = update_question_in_quiz(db, quiz_id, question_id, updates)
     if not updated_quiz:
         raise HTTPException(status_code=404, detail="Không tìm thấy câu hỏi")
+    if "content" in updates:
+        index_quiz(db, updated_quiz)
     
     return QuizResponse(
         id=updated_quiz["id"],
@@ -1366,7 +1911,7 @@ def update_question_endpoint(
         questions=updated_quiz["questions"],
         duration=updated_quiz["duration"],
         createdBy=updated_quiz["createdBy"],
-        createdAt=updated_quiz.get("createdAt", datetime.now().isoformat()),
+        createdAt=updated_quiz.get("createdAt", datetime.now()),
         settings=QuizSettings(**updated_quiz.get("settings", {"questionCount": len(updated_quiz.get("questions", []))}))
     )
 
@@ -1388,6 +1933,7 @@ def delete_question_endpoint(
     updated_quiz = delete_question_from_quiz(db, quiz_id, question_id)
     if not updated_quiz:
         raise HTTPException(status_code=404, detail="Không tìm thấy câu hỏi")
+    index_quiz(db, updated_quiz)
     
     return QuizResponse(
         id=updated_quiz["id"],
@@ -1396,7 +1942,7 @@ def delete_question_endpoint(
         questions=updated_quiz["questions"],
         duration=updated_quiz["duration"],
         createdBy=updated_quiz["createdBy"],
-        createdAt=updated_quiz.get("createdAt", datetime.now().isoformat()),
+        createdAt=updated_quiz.get("createdAt", datetime.now()),
         settings=QuizSettings(**updated_quiz.get("settings", {"questionCount": len(updated_quiz.get("questions", []))}))
     )
 
@@ -1422,7 +1968,7 @@ def create_attempt_endpoint(
         "answers": request.answers,
         "score": request.score,
         "timeSpent": request.timeSpent,
-        "completedAt": datetime.now().isoformat()
+        "completedAt": datetime.now()
     }
     
     created_attempt = create_attempt(db, attempt_data)
@@ -1455,6 +2001,9 @@ def get_attempts_endpoint(
     else:
         attempts = get_attempts_by_student(db, current_user["id"])
     
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse([attempt_to_dict(a) for a in attempts])
+    
     return [
         AttemptResponse(
             id=a["id"],
@@ -1482,6 +2031,9 @@ def get_attempt_endpoint(
     if attempt["studentId"] != current_user["id"]:
         raise HTTPException(status_code=403, detail="Bạn không có quyền xem bài làm này")
     
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(attempt_to_dict(attempt))
+    
     return AttemptResponse(
         id=attempt["id"],
         quizId=attempt["quizId"],
@@ -1550,6 +2102,17 @@ class ConnectionManager:
         """Get list of online users"""
         return [conn_data["user"] for conn_data in self.active_connections.values()]
     
+    async def send_to_user(self, user_id: str, message: dict) -> bool:
+        """Send a message to one connected user"""
+        if user_id not in self.active_connections:
+            return False
+        
+        try:
+            await self.active_connections[user_id]["websocket"].send_json(message)
+            return True
+        except:
+            return False
+    
     async def send_private_message(self, from_user: dict, to_user_id: str, content: str) -> bool:
         """Send a private message to a specific user"""
         if to_user_id not in self.active_connections:
@@ -1618,7 +2181,7 @@ async def websocket_chat(websocket: WebSocket, token: str = Query(None)):
                         "userId": user["id"],
                         "userName": user["name"],
                         "content": content,
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": datetime.now()
                     }
                     db.chat_messages.insert_one(message_data)
                     
@@ -1628,7 +2191,7 @@ async def websocket_chat(websocket: WebSocket, token: str = Query(None)):
                         "userId": user["id"],
                         "userName": user["name"],
                         "content": content,
-                        "timestamp": message_data["timestamp"]
+                        "timestamp": message_data["timestamp"].isoformat()
                     }
                     await manager.broadcast_message(broadcast_msg)
             
@@ -1643,7 +2206,7 @@ async def websocket_chat(websocket: WebSocket, token: str = Query(None)):
                         "fromUserName": user["name"],
                         "toUserId": to_user_id,
                         "content": content,
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": datetime.now()
                     }
                     db.private_messages.insert_one(private_msg_data)
                     
@@ -1653,7 +2216,7 @@ async def websocket_chat(websocket: WebSocket, token: str = Query(None)):
                         "type": "private_sent",
                         "to": to_user_id,
                         "content": content,
-                        "timestamp": private_msg_data["timestamp"]
+                        "timestamp": private_msg_data["timestamp"].isoformat()
                     }
                     await websocket.send_json(sender_msg)
     
@@ -1761,7 +2324,7 @@ def add_to_discussion_endpoint(
         "id": f"disc-{int(time.time() * 1000)}",
         "quizId": request.quizId,
         "addedBy": current_user["id"],
-        "addedAt": datetime.now().isoformat()
+        "addedAt": datetime.now()
     }
     add_quiz_to_discussion(db, discussion_data)
     
@@ -1840,6 +2403,8 @@ def remove_from_discussion_endpoint(
 @app.get("/api/discussions/{quiz_id}/quiz", response_model=QuizResponse, tags=["Thảo luận đề thi"])
 def get_discussion_quiz_endpoint(
     quiz_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
     db: Database = Depends(get_db)
 ):
@@ -1848,10 +2413,22 @@ def get_discussion_quiz_endpoint(
     if not discussion:
         raise HTTPException(status_code=404, detail="Đề thi này chưa được thêm vào thảo luận")
     
+    if if_none_match:
+        meta = get_quiz_version(db, quiz_id)
+        if meta:
+            matched = matching_etag(if_none_match, quiz_etag(quiz_id, meta["version"]))
+            if matched:
+                return not_modified(matched)
+    
     quiz = get_quiz_by_id(db, quiz_id)
     if not quiz:
         raise HTTPException(status_code=404, detail="Không tìm thấy đề thi")
     
+    headers = {"ETag": quiz_etag(quiz_id, quiz.get("version", 0)), "Cache-Control": QUIZ_CACHE_CONTROL}
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(quiz_to_dict(quiz), headers=headers)
+    
+    response.headers.update(headers)
     return QuizResponse(
         id=quiz["id"],
         title=quiz["title"],
@@ -1859,7 +2436,7 @@ def get_discussion_quiz_endpoint(
         questions=quiz["questions"],
         duration=quiz["duration"],
         createdBy=quiz["createdBy"],
-        createdAt=quiz.get("createdAt", datetime.now().isoformat()),
+        createdAt=quiz.get("createdAt", datetime.now()),
         settings=QuizSettings(**quiz.get("settings", {"questionCount": len(quiz.get("questions", []))}))
     )
 
@@ -2004,7 +2581,7 @@ async def websocket_discussion(websocket: WebSocket, quiz_id: str, token: str =
             if data.get("type") == "message":
                 content = data.get("content", "").strip()
                 if content:
-                    timestamp = datetime.now().isoformat()
+                    timestamp = datetime.now()
                     
                     message_data = {
                         "id": f"dmsg-{int(time.time() * 1000)}",
@@ -2022,7 +2599,7 @@ async def websocket_discussion(websocket: WebSocket, quiz_id: str, token: str =
                         "userId": user["id"],
                         "userName": user["name"],
                         "content": content,
-                        "timestamp": timestamp
+                        "timestamp": timestamp.isoformat()
                     })
     
     except WebSocketDisconnect:
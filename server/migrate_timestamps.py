@@ -0,0 +1,30 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Chuyển các trường thời gian lưu dạng chuỗi ISO sang kiểu datetime của MongoDB.
+
+Chạy một lần sau khi nâng cấp:
+    python migrate_timestamps.py
+"""
+
+from database import get_database, migrate_timestamps_to_datetime
+
+def main():
+    db = get_database()
+    summary = migrate_timestamps_to_datetime(db)
+    for collection_name, stats in summary.items():
+        print(f"{collection_name}: converted={stats['converted']} skipped={stats['skipped']}")
+
+if __name__ == "__main__":
+    main()
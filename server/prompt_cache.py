@@ -0,0 +1,143 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Gemini context caching for static system instructions.
+
+When a call's config carries a `system_instruction` string, the instruction
+is stored once per (API key, model) as Gemini cached content and the call
+refers to it by name, so every request only sends its short dynamic prompt
+and the cached tokens are billed at the reduced rate. A cache is recreated
+shortly before its `GEMINI_PROMPT_CACHE_TTL` runs out.
+
+Gemini refuses to cache instructions below a model-specific token minimum,
+and not every key or model supports caching. When creation fails the
+instruction is sent inline, which still gives a stable prompt prefix for
+implicit caching, and creation is tried again after
+`GEMINI_PROMPT_CACHE_RETRY` seconds.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from typing import Optional
+from google.genai import types
+
+GEMINI_PROMPT_CACHE = os.getenv("GEMINI_PROMPT_CACHE", "true").lower() == "true"
+GEMINI_PROMPT_CACHE_TTL = int(os.getenv("GEMINI_PROMPT_CACHE_TTL", "3600"))
+GEMINI_PROMPT_CACHE_RETRY = float(os.getenv("GEMINI_PROMPT_CACHE_RETRY", "600"))
+REFRESH_MARGIN_SECONDS = 60
+CACHE_DISPLAY_NAME = "networking-quiz-instructions"
+
+class GeminiCacheBackend:
+    """Cached contents stored by Gemini"""
+
+    async def create(self, client, model: str, instruction: str, ttl: int) -> str:
+        cached = await client.aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=instruction,
+                ttl=f"{ttl}s",
+                display_name=CACHE_DISPLAY_NAME,
+            ),
+        )
+        return cached.name
+
+class LocalCacheBackend:
+    """In-memory stand-in for tests and offline development; hands out names without calling Gemini"""
+
+    def __init__(self):
+        self.contents: dict[str, tuple[str, str]] = {}
+
+    async def create(self, client, model: str, instruction: str, ttl: int) -> str:
+        name = f"cachedContents/local-{len(self.contents) + 1}"
+        self.contents[name] = (model, instruction)
+        return name
+
+class _CacheEntry:
+    def __init__(self, name: Optional[str], expires_at: float):
+        # With no name, `expires_at` is when creating the cache may be tried again
+        self.name = name
+        self.expires_at = expires_at
+
+class PromptCache:
+    """Names of the cached contents per (API key, model, instruction)"""
+
+    def __init__(
+        self,
+        backend=None,
+        enabled: bool = GEMINI_PROMPT_CACHE,
+        ttl: int = GEMINI_PROMPT_CACHE_TTL,
+        retry_after: float = GEMINI_PROMPT_CACHE_RETRY,
+    ):
+        self.backend = backend or GeminiCacheBackend()
+        self.enabled = enabled
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._entries: dict[tuple, _CacheEntry] = {}
+        self._pending: dict[tuple, asyncio.Future] = {}
+
+    @staticmethod
+    def _key(key_id: str, model: str, instruction: str) -> tuple:
+        return key_id, model, hashlib.sha256(instruction.encode("utf-8")).hexdigest()[:16]
+
+    async def apply(self, client, model: str, config, key_id: str):
+        """`config` with its system instruction replaced by cached content, or unchanged"""
+        instruction = getattr(config, "system_instruction", None)
+        if not self.enabled or not isinstance(instruction, str) or not instruction or config.cached_content:
+            return config
+        name = await self._name(client, model, instruction, key_id)
+        if name is None:
+            return config
+        return config.model_copy(update={"system_instruction": None, "cached_content": name})
+
+    async def _name(self, client, model: str, instruction: str, key_id: str) -> Optional[str]:
+        key = self._key(key_id, model, instruction)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            if entry.name is None and now < entry.expires_at:
+                return None
+            if entry.name is not None and now < entry.expires_at - REFRESH_MARGIN_SECONDS:
+                return entry.name
+
+        # Concurrent calls wait for the same creation; shielded so a cancelled caller does not abort it
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._create(client, model, instruction, key))
+            self._pending[key] = pending
+        return await asyncio.shield(pending)
+
+    async def _create(self, client, model: str, instruction: str, key: tuple) -> Optional[str]:
+        try:
+            name = await self.backend.create(client, model, instruction, self.ttl)
+            self._entries[key] = _CacheEntry(name, time.monotonic() + self.ttl)
+            return name
+        except Exception as exc:
+            print(f"Could not cache the system instruction for {model} ({exc}); sending it inline")
+            self._entries[key] = _CacheEntry(None, time.monotonic() + self.retry_after)
+            return None
+        finally:
+            self._pending.pop(key, None)
+
+    def invalidate(self, key_id: str, model: str, instruction: str) -> None:
+        """Forget a cache Gemini no longer knows, so the next call creates a new one"""
+        self._entries.pop(self._key(key_id, model, instruction), None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._pending.clear()
+
+prompt_cache = PromptCache()
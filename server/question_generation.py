@@ -0,0 +1,108 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Planning helpers for question generation.
+
+Large requests are split into chunks of at most `QUESTION_CHUNK_SIZE`
+questions that are generated concurrently. For mixed difficulty the
+30/40/30 easy/medium/hard mix is computed for the whole request and then
+handed out to the chunks as explicit counts, so the merged result keeps the
+mix even though every chunk is generated independently.
+"""
+
+import os
+import re
+import unicodedata
+from typing import Optional
+from dtos import GenerateQuestionsRequest, Question
+
+QUESTION_CHUNK_SIZE = int(os.getenv("QUESTION_CHUNK_SIZE", "10"))
+QUESTION_FOLLOWUP_ATTEMPTS = int(os.getenv("QUESTION_FOLLOWUP_ATTEMPTS", "2"))
+FOLLOWUP_EXCLUDE_LIMIT = 50
+
+def split_difficulties(count: int) -> dict[str, int]:
+    """Split `count` questions into the 30/40/30 mix, rounding into medium"""
+    easy = hard = int(count * 0.3)
+    return {"easy": easy, "medium": count - easy - hard, "hard": hard}
+
+def _chunk_sizes(count: int, chunk_size: int) -> list[int]:
+    chunks = -(-count // chunk_size)
+    base, extra = divmod(count, chunks)
+    return [base + (1 if i < extra else 0) for i in range(chunks)]
+
+def _distribute_difficulties(total: dict[str, int], sizes: list[int]) -> list[dict[str, int]]:
+    # Largest-remainder allocation per chunk, so every chunk gets its share of each level
+    remaining = dict(total)
+    plans = []
+    for index, size in enumerate(sizes):
+        left_in_chunks = sum(sizes[index:])
+        shares = {level: remaining[level] * size / left_in_chunks for level in remaining}
+        plan = {level: int(share) for level, share in shares.items()}
+        by_remainder = sorted(shares, key=lambda level: shares[level] - plan[level], reverse=True)
+        for level in by_remainder:
+            if sum(plan.values()) >= size:
+                break
+            if plan[level] < remaining[level]:
+                plan[level] += 1
+        for level in plan:
+            remaining[level] -= plan[level]
+        plans.append(plan)
+    return plans
+
+def plan_chunks(
+    params: GenerateQuestionsRequest,
+    chunk_size: int = QUESTION_CHUNK_SIZE,
+    difficulty_counts: Optional[dict[str, int]] = None,
+) -> list[tuple[GenerateQuestionsRequest, Optional[dict[str, int]]]]:
+    """Split a request into sub-requests with explicit difficulty counts for mixed requests"""
+    mixed = not params.difficulty
+    total = (difficulty_counts or split_difficulties(params.count)) if mixed else None
+    if chunk_size <= 0 or params.count <= chunk_size:
+        return [(params, total)]
+
+    sizes = _chunk_sizes(params.count, chunk_size)
+    difficulty_plans = _distribute_difficulties(total, sizes) if mixed else [None] * len(sizes)
+
+    # Spread topics over the chunks so parallel prompts do not all cover the same ground
+    topics = params.topics or []
+    chunks = []
+    for index, size in enumerate(sizes):
+        chunk_topics = topics[index % len(topics)::len(sizes)] if len(topics) > 1 else topics
+        chunk = params.model_copy(update={"count": size, "topics": chunk_topics or params.topics})
+        chunks.append((chunk, difficulty_plans[index]))
+    return chunks
+
+def missing_difficulties(target: dict[str, int], questions: list[Question], missing: int) -> dict[str, int]:
+    """Difficulty counts for a follow-up request that brings `questions` back towards `target`"""
+    have = {level: 0 for level in target}
+    for question in questions:
+        if question.difficulty in have:
+            have[question.difficulty] += 1
+    deficit = {level: max(0, target[level] - have[level]) for level in target}
+    while sum(deficit.values()) > missing:
+        largest = max(deficit, key=deficit.get)
+        deficit[largest] -= 1
+    deficit["medium"] += missing - sum(deficit.values())
+    return deficit
+
+def fold_accents(text: str) -> str:
+    """Case- and accent-folded text ("Định tuyến" -> "dinh tuyen")"""
+    # "đ" has no decomposition, so it is mapped by hand
+    text = unicodedata.normalize("NFKD", text.casefold().replace("đ", "d"))
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+def normalize_content(content: str) -> str:
+    """Case-, accent- and punctuation-insensitive form of a question used for deduplication"""
+    return " ".join(re.sub(r"[^\w\s]", " ", fold_accents(content)).split())
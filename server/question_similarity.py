@@ -0,0 +1,198 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Near-duplicate detection for question content.
+
+A question is reduced to the words and word pairs of its normalized content
+and summarized by a MinHash signature of `MINHASH_PERMUTATIONS` values; the
+share of equal values estimates the Jaccard similarity of two questions.
+Signatures are split into `LSH_BANDS` bands and only questions sharing a
+band are compared, so a lookup touches a few candidates instead of the whole
+bank. `SimilarityIndex` does this in memory for one generation request; the
+`question_index` collection holds the signatures and band keys of every
+question in saved quizzes, looked up through a multikey index on `bands`.
+
+Questions that differ in a single protocol name or number ("DHCP" / "DNS",
+two subnet masks) share most of their words, so two questions only count as
+duplicates when their key terms (the numbers in order, and the acronyms) are
+equal. Indexes built before that rule are refreshed with
+`build_question_index.py`.
+"""
+
+import hashlib
+import os
+import random
+import re
+from functools import lru_cache
+from typing import Iterable, Optional
+from pymongo.database import Database
+from dtos import Question
+from question_generation import fold_accents
+
+QUESTION_SIMILARITY_THRESHOLD = float(os.getenv("QUESTION_SIMILARITY_THRESHOLD", "0.5"))
+MINHASH_PERMUTATIONS = 60
+LSH_BANDS = 20
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20250101)
+# Fixed coefficients keep signatures comparable across processes and with stored ones
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
+# Addresses, masks and ports stay one token ("192.168.1.0/24", "tcp:80")
+_TOKEN = re.compile(r"[\w./:-]+")
+_TOKEN_EDGES = "./:-"
+
+def _tokens(text: str) -> list[str]:
+    return [token.strip(_TOKEN_EDGES) for token in _TOKEN.findall(text) if token.strip(_TOKEN_EDGES)]
+
+def shingles(content: str) -> set[str]:
+    """Words and adjacent word pairs of the case- and accent-folded content"""
+    words = _tokens(fold_accents(content))
+    return set(words) | {f"{first} {second}" for first, second in zip(words, words[1:])}
+
+def key_terms(content: str) -> str:
+    """Tokens containing digits, in order, then the acronyms; they must match for two questions to be duplicates.
+    The numbers keep their order and repeats, so "1 MB / 20 Mbps" and "10 MB / 20 Mbps" stay different."""
+    tokens = _tokens(content)
+    numbers = [token.casefold() for token in tokens if any(char.isdigit() for char in token)]
+    acronyms = {
+        token.casefold() for token in tokens
+        if len(token) > 1 and token.isupper() and not any(char.isdigit() for char in token)
+    }
+    return " ".join(numbers + sorted(acronyms))
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big") % _PRIME
+
+@lru_cache(maxsize=4096)
+def signature(content: str) -> tuple[int, ...]:
+    """MinHash signature of a question's content"""
+    hashes = [_hash(shingle) for shingle in shingles(content)] or [0]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+def band_keys(sig: tuple[int, ...]) -> list[str]:
+    keys = []
+    for band in range(LSH_BANDS):
+        rows = sig[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(repr(rows).encode("ascii"), digest_size=8).hexdigest()
+        keys.append(f"{band}:{digest}")
+    return keys
+
+def similarity(first: tuple[int, ...], second: tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(a == b for a, b in zip(first, second)) / MINHASH_PERMUTATIONS
+
+class SimilarityIndex:
+    """In-memory LSH index answering "is there an indexed question similar to this one?" """
+
+    def __init__(self, threshold: float = QUESTION_SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._entries: list[tuple[tuple[int, ...], str]] = []
+        self._buckets: dict[str, list[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, sig: tuple[int, ...], terms: str) -> None:
+        position = len(self._entries)
+        self._entries.append((tuple(sig), terms))
+        for key in band_keys(sig):
+            self._buckets.setdefault(key, []).append(position)
+
+    def contains_similar(self, sig: tuple[int, ...], terms: str) -> bool:
+        candidates = {position for key in band_keys(sig) for position in self._buckets.get(key, ())}
+        return any(
+            self._entries[position][1] == terms and similarity(sig, self._entries[position][0]) >= self.threshold
+            for position in candidates
+        )
+
+    def add_if_new(self, content: str) -> bool:
+        """Add a question unless a similar one is indexed; returns whether it was added"""
+        sig, terms = signature(content), key_terms(content)
+        if self.contains_similar(sig, terms):
+            return False
+        self.add(sig, terms)
+        return True
+
+def drop_near_duplicates(
+    questions: list[Question], index: Optional[SimilarityIndex] = None, limit: Optional[int] = None
+) -> list[Question]:
+    """Keep the first of every group of similar questions (and none similar to one already in `index`),
+    stopping after `limit` questions"""
+    index = index if index is not None else SimilarityIndex()
+    kept = []
+    for question in questions:
+        if limit is not None and len(kept) >= limit:
+            break
+        if index.add_if_new(question.content):
+            kept.append(question)
+    return kept
+
+def _index_documents(quiz: dict) -> list[dict]:
+    documents = []
+    for question in quiz.get("questions", []):
+        if not question.get("content"):
+            continue
+        sig = signature(question["content"])
+        documents.append({
+            "userId": quiz["createdBy"],
+            "quizId": quiz["id"],
+            "questionId": question.get("id"),
+            "signature": list(sig),
+            "terms": key_terms(question["content"]),
+            "bands": band_keys(sig),
+        })
+    return documents
+
+def index_quiz(db: Database, quiz: dict) -> None:
+    """Replace the indexed signatures of a quiz with those of its current questions"""
+    db.question_index.delete_many({"quizId": quiz["id"]})
+    documents = _index_documents(quiz)
+    if documents:
+        db.question_index.insert_many(documents)
+
+def remove_quiz_from_index(db: Database, quiz_id: str) -> None:
+    db.question_index.delete_many({"quizId": quiz_id})
+
+def rebuild_question_index(db: Database) -> int:
+    """Index every saved quiz; returns the number of questions indexed"""
+    db.question_index.delete_many({})
+    total = 0
+    for quiz in db.quizzes.find({}, {"_id": 0, "id": 1, "createdBy": 1, "questions.id": 1, "questions.content": 1}):
+        documents = _index_documents(quiz)
+        if documents:
+            db.question_index.insert_many(documents)
+            total += len(documents)
+    return total
+
+def split_stored_duplicates(
+    db: Database, user_id: str, questions: Iterable[Question], threshold: float = QUESTION_SIMILARITY_THRESHOLD
+) -> tuple[list[Question], list[Question]]:
+    """Split questions into new ones and ones similar to a question in the user's saved quizzes"""
+    questions = list(questions)
+    signatures = [signature(question.content) for question in questions]
+    terms = [key_terms(question.content) for question in questions]
+    keys = sorted({key for sig in signatures for key in band_keys(sig)})
+    if not keys:
+        return questions, []
+
+    index = SimilarityIndex(threshold)
+    query = {"userId": user_id, "bands": {"$in": keys}}
+    for document in db.question_index.find(query, {"_id": 0, "signature": 1, "terms": 1}):
+        index.add(tuple(document["signature"]), document.get("terms", ""))
+
+    fresh, repeated = [], []
+    for question, sig, question_terms in zip(questions, signatures, terms):
+        (repeated if index.contains_similar(sig, question_terms) else fresh).append(question)
+    return fresh, repeated
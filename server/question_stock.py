@@ -0,0 +1,180 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pre-generated question stock.
+
+Questions are stocked per slot (chapter, topic, knowledgeType, difficulty)
+in the `question_stock` collection and handed out at most once. Every
+generation request records the slots it asked for in
+`question_stock_slots`; a background filler tops up recently requested
+slots to `QUESTION_STOCK_TARGET` questions while the default API key is
+idle, so later requests are served from stock in milliseconds. A slot whose
+batch fails or yields nothing usable is skipped for an exponentially growing
+backoff, so one bad slot cannot starve the others.
+"""
+
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from pymongo.database import Database
+from starlette.concurrency import run_in_threadpool
+from dtos import GenerateQuestionsRequest
+from question_generation import split_difficulties
+
+QUESTION_STOCK_TARGET = int(os.getenv("QUESTION_STOCK_TARGET", "10"))
+QUESTION_STOCK_INTERVAL = float(os.getenv("QUESTION_STOCK_INTERVAL", "300"))
+QUESTION_STOCK_DEMAND_DAYS = int(os.getenv("QUESTION_STOCK_DEMAND_DAYS", "7"))
+QUESTION_STOCK_BATCH = 10
+QUESTION_STOCK_MAX_BACKOFF = 24 * 3600
+SLOT_FIELDS = ("chapter", "topic", "knowledgeType", "difficulty")
+
+def slot_key(labels: dict) -> dict:
+    """Normalized slot used for matching, so case and spacing do not split the stock"""
+    return {field: labels[field].strip().casefold() for field in SLOT_FIELDS}
+
+def plan_slots(params: GenerateQuestionsRequest) -> list[tuple[dict, int]]:
+    """Spread a request over its slots; requests without chapter, topics or knowledge types are not stocked"""
+    if not params.chapter or not params.topics or not params.knowledgeTypes:
+        return []
+
+    if params.difficulty:
+        difficulty_counts = {params.difficulty: params.count}
+    else:
+        difficulty_counts = split_difficulties(params.count)
+
+    combos = [(topic, knowledge_type) for topic in params.topics for knowledge_type in params.knowledgeTypes]
+    counts: dict[tuple, int] = {}
+    position = 0
+    for difficulty, wanted in difficulty_counts.items():
+        for _ in range(wanted):
+            topic, knowledge_type = combos[position % len(combos)]
+            position += 1
+            slot = (params.chapter, topic, knowledge_type, difficulty)
+            counts[slot] = counts.get(slot, 0) + 1
+
+    return [(dict(zip(SLOT_FIELDS, slot)), count) for slot, count in counts.items()]
+
+def is_valid_stock_question(question: dict) -> bool:
+    options = question.get("options") or []
+    answer = question.get("correctAnswer")
+    return (
+        bool(question.get("content"))
+        and len(options) == 4
+        and len(set(options)) == 4
+        and isinstance(answer, int)
+        and 0 <= answer < len(options)
+    )
+
+def record_demand(db: Database, plans: list[tuple[dict, int]]) -> None:
+    now = datetime.now()
+    for labels, _ in plans:
+        db.question_stock_slots.update_one(
+            {"slot": slot_key(labels)},
+            {"$set": {"labels": labels, "lastRequestedAt": now}},
+            upsert=True,
+        )
+
+def take_from_stock(db: Database, plans: list[tuple[dict, int]]) -> list[dict]:
+    """Claim up to the planned number of questions per slot; each stocked question is served once"""
+    record_demand(db, plans)
+    taken = []
+    for labels, count in plans:
+        key = slot_key(labels)
+        for _ in range(count):
+            item = db.question_stock.find_one_and_delete({"slot": key}, sort=[("createdAt", 1)])
+            if not item:
+                break
+            taken.append({k: v for k, v in item.items() if k not in ("_id", "slot", "createdAt")})
+    return taken
+
+def add_to_stock(db: Database, labels: dict, questions: list[dict]) -> int:
+    now = datetime.now()
+    key = slot_key(labels)
+    documents = [
+        {**{k: v for k, v in question.items() if k != "id"}, "slot": key, "createdAt": now}
+        for question in questions
+        if is_valid_stock_question(question) and question.get("difficulty") == labels["difficulty"]
+    ]
+    if documents:
+        db.question_stock.insert_many(documents)
+    return len(documents)
+
+def next_slot_to_fill(db: Database) -> Optional[tuple[dict, int]]:
+    """The most recently requested slot that is below target, with its deficit"""
+    now = datetime.now()
+    since = now - timedelta(days=QUESTION_STOCK_DEMAND_DAYS)
+    query = {"lastRequestedAt": {"$gte": since}, "retryAt": {"$not": {"$gt": now}}}
+    for entry in db.question_stock_slots.find(query).sort("lastRequestedAt", -1):
+        have = db.question_stock.count_documents({"slot": entry["slot"]})
+        if have < QUESTION_STOCK_TARGET:
+            return entry["labels"], QUESTION_STOCK_TARGET - have
+    return None
+
+def record_fill_result(db: Database, labels: dict, stocked: int) -> None:
+    """Clear a slot's backoff after a useful batch, or back it off (doubling per failure) after a failed one"""
+    key = slot_key(labels)
+    if stocked:
+        db.question_stock_slots.update_one({"slot": key}, {"$unset": {"failures": "", "retryAt": ""}})
+        return
+    entry = db.question_stock_slots.find_one({"slot": key}, {"failures": 1}) or {}
+    failures = entry.get("failures", 0) + 1
+    delay = min(QUESTION_STOCK_MAX_BACKOFF, QUESTION_STOCK_INTERVAL * 2 ** (failures - 1))
+    db.question_stock_slots.update_one(
+        {"slot": key},
+        {"$set": {"failures": failures, "retryAt": datetime.now() + timedelta(seconds=delay)}},
+    )
+
+async def fill_next_slot(
+    db: Database, generate: Callable[[GenerateQuestionsRequest], Awaitable[list]]
+) -> int:
+    """Generate one batch for the neediest slot; returns how many questions were stocked"""
+    slot = await run_in_threadpool(next_slot_to_fill, db)
+    if slot is None:
+        return 0
+    labels, deficit = slot
+    params = GenerateQuestionsRequest(
+        chapter=labels["chapter"],
+        topics=[labels["topic"]],
+        knowledgeTypes=[labels["knowledgeType"]],
+        difficulty=labels["difficulty"],
+        count=min(deficit, QUESTION_STOCK_BATCH),
+    )
+    try:
+        questions = await generate(params)
+    except Exception:
+        await run_in_threadpool(record_fill_result, db, labels, 0)
+        raise
+    stocked = await run_in_threadpool(add_to_stock, db, labels, [q.model_dump() for q in questions])
+    await run_in_threadpool(record_fill_result, db, labels, stocked)
+    return stocked
+
+async def run_stock_filler(
+    get_database: Callable[[], Database],
+    generate: Callable[[GenerateQuestionsRequest], Awaitable[list]],
+    can_run: Callable[[Database], Awaitable[bool]],
+) -> None:
+    """Background loop: every interval, fill slots for as long as the default key stays idle"""
+    while True:
+        await asyncio.sleep(QUESTION_STOCK_INTERVAL)
+        try:
+            db = get_database()
+            while await can_run(db):
+                if not await fill_next_slot(db, generate):
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            print("Question stock filler failed:", exc)
@@ -0,0 +1,105 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Fast serialization of trusted MongoDB documents for read endpoints.
+
+Documents written by this server were already validated by the request DTOs,
+so read endpoints can project them straight to the response shape and encode
+them once instead of rebuilding pydantic models and validating them again
+through `response_model`. The output matches the corresponding DTOs.
+"""
+
+import json
+from datetime import datetime
+from typing import Any, Optional
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+QUESTION_FIELDS = (
+    "id", "content", "options", "correctAnswer", "chapter",
+    "topic", "knowledgeType", "difficulty", "explanation",
+)
+QUIZ_SETTINGS_FIELDS = ("chapter", "topic", "knowledgeTypes", "difficulty", "questionCount")
+ANALYSIS_RESULT_FIELDS = (
+    "overallFeedback", "strengths", "weaknesses", "suggestedTopics", "suggestedNextActions",
+)
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content: Any) -> bytes:
+    """Encode content to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+class FastJSONResponse(Response):
+    """JSON response that skips FastAPI's response_model validation"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def question_to_dict(question: dict) -> dict:
+    return {field: question.get(field) for field in QUESTION_FIELDS}
+
+def quiz_to_dict(quiz: dict, now: Optional[datetime] = None) -> dict:
+    """Project a quiz document to the QuizResponse shape"""
+    questions = quiz.get("questions", [])
+    settings = quiz.get("settings") or {"questionCount": len(questions)}
+    return {
+        "id": quiz["id"],
+        "title": quiz["title"],
+        "description": quiz.get("description", ""),
+        "questions": [question_to_dict(q) for q in questions],
+        "duration": quiz["duration"],
+        "createdBy": quiz["createdBy"],
+        "createdAt": quiz.get("createdAt") or now or datetime.now(),
+        "settings": {field: settings.get(field) for field in QUIZ_SETTINGS_FIELDS},
+    }
+
+def attempt_to_dict(attempt: dict) -> dict:
+    """Project an attempt document to the AttemptResponse shape"""
+    return {
+        "id": attempt["id"],
+        "quizId": attempt["quizId"],
+        "studentId": attempt["studentId"],
+        "answers": attempt["answers"],
+        "score": float(attempt["score"]),
+        "completedAt": attempt["completedAt"],
+        "timeSpent": attempt["timeSpent"],
+    }
+
+def analysis_history_to_dict(item: dict) -> dict:
+    """Project an analysis history document to the AnalysisHistoryResponse shape"""
+    result = item["result"]
+    return {
+        "id": item["id"],
+        "userId": item["userId"],
+        "analysisType": item["analysisType"],
+        "title": item["title"],
+        "result": {field: result[field] for field in ANALYSIS_RESULT_FIELDS},
+        "context": item.get("context"),
+        "createdAt": item["createdAt"],
+    }
+
+def paginated(items: list, total: int, page: int, size: int, pages: int) -> dict:
+    return {"items": items, "total": total, "page": page, "size": size, "pages": pages}
@@ -20,7 +20,7 @@ import os
 import sys
 import pytest
 from datetime import datetime, timedelta
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
 from typing import Generator
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -51,6 +51,19 @@ def mock_db(mock_mongo_client):
     db.quiz_discussions.create_index("quizId", unique=True)
     db.otp_codes.create_index("email", unique=True)
     
+    from generation_cache import clear_generation_cache
+    from gemini_client import breaker, key_pool, latency, limiter
+    from llm_usage import usage
+    from prompt_cache import LocalCacheBackend, prompt_cache
+    clear_generation_cache()
+    breaker.reset()
+    latency.reset()
+    key_pool.reset()
+    limiter.reset()
+    usage.clear()
+    prompt_cache.clear()
+    prompt_cache.backend = LocalCacheBackend()
+    
     return db
 
 @pytest.fixture
@@ -241,7 +254,7 @@ def mock_gemini_client():
     mock_client = MagicMock()
     mock_response = MagicMock()
     mock_response.text = '{"overallFeedback": "Good!", "strengths": [], "weaknesses": [], "suggestedTopics": [], "suggestedNextActions": []}'
-    mock_client.models.generate_content.return_value = mock_response
+    mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
     return mock_client
 
 @pytest.fixture
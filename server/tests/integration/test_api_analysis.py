@@ -19,12 +19,17 @@ Tests with mocked Gemini API responses.
 
 import os
 import sys
+import json
+import time
+import asyncio
 import pytest
-from unittest.mock import patch, MagicMock
-from datetime import datetime
+from unittest.mock import patch, MagicMock, AsyncMock
+from datetime import datetime, timedelta
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
+from dtos import AnalyzeResultResponse, GeneratedQuestion
+
 class TestGenerateQuestionsEndpoint:
     """Tests for POST /api/generate-questions endpoint."""
 
@@ -33,7 +38,7 @@ class TestGenerateQuestionsEndpoint:
         """Valid generate questions payload."""
         return {
             "chapter": "Network Fundamentals",
-            "topics": ["OSI Model"],
+            "topics": ["Network Topology"],
             "knowledgeTypes": ["concept"],
             "difficulty": "medium",
             "count": 5
@@ -55,7 +60,7 @@ class TestGenerateQuestionsEndpoint:
     }
 ]
 ```'''
-        mock_client.models.generate_content.return_value = mock_response
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
         mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
 
         response = test_client.post(
@@ -70,6 +75,731 @@ class TestGenerateQuestionsEndpoint:
         assert len(data["questions"]) == 1
         assert data["questions"][0]["content"] == "What is the OSI model?"
 
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_requests_json_schema(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that Gemini is asked for JSON matching the generated question schema."""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = '[{"content": "What is OSI?", "options": ["A", "B", "C", "D"], "correctAnswer": 2, "difficulty": "medium"}]'
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        with patch("main.extract_objects") as scanner:
+            response = test_client.post(
+                "/api/generate-questions",
+                headers=auth_headers_student,
+                json=generate_questions_payload
+            )
+
+        assert response.status_code == 200
+        assert response.json()["questions"][0]["correctAnswer"] == 2
+        scanner.assert_not_called()
+        config = mock_client.aio.models.generate_content.call_args.kwargs["config"]
+        assert config.response_mime_type == "application/json"
+        assert config.response_schema == list[GeneratedQuestion]
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_sends_rules_as_cached_instruction(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that the fixed rules come from the context cache and only the request is sent as contents."""
+        from main import QUESTION_INSTRUCTIONS
+        from prompt_cache import prompt_cache
+
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = '[{"content": "What is OSI?", "options": ["A", "B", "C", "D"], "correctAnswer": 2, "difficulty": "medium"}]'
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json=generate_questions_payload
+        )
+
+        assert response.status_code == 200
+        kwargs = mock_client.aio.models.generate_content.call_args_list[0].kwargs
+        assert "Tạo 5 câu hỏi" in kwargs["contents"]
+        assert "YÊU CẦU VỀ TÍNH CHÍNH XÁC" not in kwargs["contents"]
+        assert kwargs["config"].system_instruction is None
+        assert prompt_cache.backend.contents[kwargs["config"].cached_content] == ("gemini-2.5-flash", QUESTION_INSTRUCTIONS)
+        assert "JSON" not in QUESTION_INSTRUCTIONS
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_skips_malformed_question(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that one malformed question does not fail the whole request."""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = '''[
+    {"content": "What is OSI?", "options": ["A", "B", "C", "D"], "correctAnswer": 0},
+    {"content": "Broken", "options": ["A", "B"] "correctAnswer": 1},
+    {"content": "What is TCP?", "options": ["A", "B", "C", "D"], "correctAnswer": 3,},
+    {"content": "No answer", "options": ["A", "B", "C", "D"]}
+]'''
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json=generate_questions_payload
+        )
+
+        assert response.status_code == 200
+        questions = response.json()["questions"]
+        assert [q["content"] for q in questions] == ["What is OSI?", "What is TCP?"]
+        assert questions[0]["id"] != questions[1]["id"]
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_without_questions(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that a response without any valid question is an error."""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = "Xin lỗi, tôi không thể tạo câu hỏi."
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json=generate_questions_payload
+        )
+
+        assert response.status_code == 500
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_fans_out_large_requests(self, mock_get_client, test_client, auth_headers_student):
+        """Test that a large request is generated in concurrent chunks and merged."""
+        in_flight = {"now": 0, "max": 0}
+        prompts = []
+
+        async def fake_generate(model, contents, config):
+            prompts.append(contents)
+            chunk = len(prompts)
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            await asyncio.sleep(0.01)
+            in_flight["now"] -= 1
+            items = [
+                {"content": f"Câu {chunk}-{i}", "options": ["A", "B", "C", "D"], "correctAnswer": 0}
+                for i in range(9)
+            ]
+            items.append({"content": "Câu chung?", "options": ["A", "B", "C", "D"], "correctAnswer": 1})
+            return MagicMock(text=json.dumps(items))
+
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=fake_generate)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json={"count": 25, "topics": ["Flow control", "Congestion control", "Sockets"], "knowledgeTypes": ["concept"]}
+        )
+
+        assert response.status_code == 200
+        questions = response.json()["questions"]
+        assert len(prompts) == 3
+        assert in_flight["max"] > 1
+        assert sum("câu Dễ" in prompt for prompt in prompts) == 3
+        assert len(questions) == 25
+        assert [q["content"] for q in questions].count("Câu chung?") == 1
+        assert len({q["id"] for q in questions}) == 25
+
+    @staticmethod
+    def questions_json(prefix, count, broken=0):
+        """Build a Gemini response with valid and broken questions."""
+        items = [
+            json.dumps({"content": f"{prefix} {i}", "options": ["A", "B", "C", "D"], "correctAnswer": 0})
+            for i in range(count)
+        ]
+        items += ['{"content": "broken" "options": []}'] * broken
+        return MagicMock(text="[" + ", ".join(items) + "]")
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_regenerates_missing(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that broken questions are replaced by a small follow-up request."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=[
+            self.questions_json("Câu", 3, broken=2),
+            self.questions_json("Câu bổ sung", 2),
+        ])
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json=generate_questions_payload
+        )
+
+        assert response.status_code == 200
+        assert len(response.json()["questions"]) == 5
+        followup_prompt = mock_client.aio.models.generate_content.call_args_list[1].kwargs["contents"]
+        assert "Tạo 2 câu hỏi" in followup_prompt
+        assert "KHÔNG lặp lại" in followup_prompt and "Câu 0" in followup_prompt
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_drops_near_duplicates(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that a reworded repeat within a response is dropped and regenerated."""
+        first = self.questions_json("Câu", 4)
+        items = json.loads(first.text) + [
+            {"content": "câu 0?", "options": ["A", "B", "C", "D"], "correctAnswer": 1},
+        ]
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=[
+            MagicMock(text=json.dumps(items)),
+            self.questions_json("Câu bổ sung", 1),
+        ])
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json=generate_questions_payload
+        )
+
+        assert response.status_code == 200
+        contents = [q["content"] for q in response.json()["questions"]]
+        assert contents == ["Câu 0", "Câu 1", "Câu 2", "Câu 3", "Câu bổ sung 0"]
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_skips_questions_in_saved_quizzes(self, mock_get_client, test_client, mock_db, auth_headers_student, sample_student_data, generate_questions_payload):
+        """Test that questions repeating the creator's saved quizzes are replaced."""
+        from question_similarity import index_quiz
+        saved = [{"id": "old-1", "content": "Mô hình OSI có bao nhiêu tầng?"}]
+        index_quiz(mock_db, {"id": "quiz-old", "createdBy": sample_student_data["id"], "questions": saved})
+        index_quiz(mock_db, {"id": "quiz-other", "createdBy": "someone-else", "questions": [{"content": "Câu 1"}]})
+        repeated = self.questions_json("Câu", 4)
+        items = json.loads(repeated.text) + [
+            {"content": "Mô hình OSI gồm có bao nhiêu tầng?", "options": ["A", "B", "C", "D"], "correctAnswer": 1},
+        ]
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=[
+            MagicMock(text=json.dumps(items)),
+            self.questions_json("Câu mới", 1),
+        ])
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json=generate_questions_payload
+        )
+
+        assert response.status_code == 200
+        contents = [q["content"] for q in response.json()["questions"]]
+        assert "Mô hình OSI gồm có bao nhiêu tầng?" not in contents
+        assert "Câu 1" in contents and "Câu mới 0" in contents
+        followup_prompt = mock_client.aio.models.generate_content.call_args_list[1].kwargs["contents"]
+        assert "Mô hình OSI gồm có bao nhiêu tầng?" in followup_prompt
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_followup_budget(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that follow-ups stop after the retry budget and partial results are returned."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=[
+            self.questions_json(f"Lần {attempt}", 1, broken=4) for attempt in range(5)
+        ])
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        with patch("main.QUESTION_FOLLOWUP_ATTEMPTS", 2):
+            response = test_client.post(
+                "/api/generate-questions",
+                headers=auth_headers_student,
+                json=generate_questions_payload
+            )
+
+        assert response.status_code == 200
+        assert len(response.json()["questions"]) == 3
+        assert mock_client.aio.models.generate_content.await_count == 3
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_salvages_failed_chunk(self, mock_get_client, test_client, auth_headers_student):
+        """Test that a failed chunk is regenerated instead of failing the request."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=[
+            self.questions_json("Phần 1", 10),
+            Exception("503 Service Unavailable"),
+            self.questions_json("Phần 2", 10),
+        ])
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json={"count": 20}
+        )
+
+        assert response.status_code == 200
+        assert len(response.json()["questions"]) == 20
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_all_chunks_fail(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that an API error without any salvaged question is returned as is."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=Exception("429 Resource exhausted"))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json=generate_questions_payload
+        )
+
+        assert response.status_code == 429
+        assert mock_client.aio.models.generate_content.await_count == 1
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_served_from_cache(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that an identical request is answered from the cache without calling Gemini."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(return_value=self.questions_json("Câu", 5))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        first = test_client.post("/api/generate-questions", headers=auth_headers_student, json=generate_questions_payload)
+        reordered = {**generate_questions_payload, "topics": ["network topology"], "count": 3}
+        second = test_client.post("/api/generate-questions", headers=auth_headers_student, json=reordered)
+
+        assert first.status_code == 200 and second.status_code == 200
+        assert mock_client.aio.models.generate_content.await_count == 1
+        contents = {q["content"] for q in first.json()["questions"]}
+        assert len(second.json()["questions"]) == 3
+        assert {q["content"] for q in second.json()["questions"]} <= contents
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_no_cache_header(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that Cache-Control: no-cache forces a fresh generation."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(return_value=self.questions_json("Câu", 5))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        test_client.post("/api/generate-questions", headers=auth_headers_student, json=generate_questions_payload)
+        response = test_client.post(
+            "/api/generate-questions",
+            headers={**auth_headers_student, "Cache-Control": "no-cache"},
+            json=generate_questions_payload
+        )
+
+        assert response.status_code == 200
+        assert mock_client.aio.models.generate_content.await_count == 2
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_pool_factor(self, mock_get_client, test_client, mock_db, auth_headers_student, generate_questions_payload):
+        """Test that a larger pool is generated after the requested questions were returned."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=[
+            self.questions_json("Câu hỏi về cấu trúc mạng hình sao số", 5),
+            self.questions_json("Pool extra item about ring wiring", 5),
+        ])
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        with patch("generation_cache.GENERATION_CACHE_POOL_FACTOR", 2.0):
+            response = test_client.post("/api/generate-questions", headers=auth_headers_student, json=generate_questions_payload)
+
+        assert len(response.json()["questions"]) == 5
+        prompts = [call.kwargs["contents"] for call in mock_client.aio.models.generate_content.await_args_list]
+        assert len(prompts) == 2
+        assert all("Tạo 5 câu hỏi" in prompt for prompt in prompts)
+        assert len(mock_db.generation_cache.find_one({})["questions"]) == 10
+
+    @staticmethod
+    def stock_questions(mock_db, count, difficulty):
+        """Put pre-generated questions into the stock for the payload's slot."""
+        from question_stock import add_to_stock
+        labels = {"chapter": "Network Fundamentals", "topic": "Network Topology", "knowledgeType": "concept", "difficulty": difficulty}
+        add_to_stock(mock_db, labels, [
+            {"content": f"Kho {difficulty} {i}", "options": ["A", "B", "C", "D"], "correctAnswer": 2,
+             "chapter": "Network Fundamentals", "topic": "Network Topology", "knowledgeType": "concept",
+             "difficulty": difficulty, "explanation": None}
+            for i in range(count)
+        ])
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_served_from_stock(self, mock_get_client, test_client, mock_db, auth_headers_student, generate_questions_payload):
+        """Test that a fully stocked request does not call Gemini."""
+        self.stock_questions(mock_db, 6, "medium")
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock()
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post("/api/generate-questions", headers=auth_headers_student, json=generate_questions_payload)
+
+        assert response.status_code == 200
+        questions = response.json()["questions"]
+        assert len(questions) == 5
+        assert all(q["content"].startswith("Kho medium") for q in questions)
+        assert len({q["id"] for q in questions}) == 5
+        mock_client.aio.models.generate_content.assert_not_called()
+        assert mock_db.question_stock.count_documents({}) == 1
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_stock_shortfall(self, mock_get_client, test_client, mock_db, auth_headers_student, generate_questions_payload):
+        """Test that only the shortfall is generated when the stock runs low."""
+        self.stock_questions(mock_db, 2, "medium")
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(return_value=self.questions_json("Mới", 3))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post("/api/generate-questions", headers=auth_headers_student, json=generate_questions_payload)
+
+        contents = [q["content"] for q in response.json()["questions"]]
+        assert len(contents) == 5
+        assert sum(content.startswith("Kho") for content in contents) == 2
+        assert "Tạo 3 câu hỏi" in mock_client.aio.models.generate_content.call_args.kwargs["contents"]
+        assert mock_db.question_stock_slots.count_documents({}) == 1
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_replaces_near_duplicates(self, mock_get_client, test_client, mock_db, auth_headers_student, generate_questions_payload):
+        """Test that a generated question repeating a stocked one is replaced instead of leaving the quiz short."""
+        self.stock_questions(mock_db, 2, "medium")
+        repeat = json.dumps({"content": "Kho medium 0", "options": ["A", "B", "C", "D"], "correctAnswer": 0})
+        fresh = [json.dumps({"content": f"Mới {i}", "options": ["A", "B", "C", "D"], "correctAnswer": 0}) for i in range(2)]
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=[
+            MagicMock(text="[" + ", ".join([repeat, *fresh]) + "]"),
+            self.questions_json("Bổ sung", 1),
+        ])
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post("/api/generate-questions", headers=auth_headers_student, json=generate_questions_payload)
+
+        contents = [q["content"] for q in response.json()["questions"]]
+        assert len(contents) == 5
+        assert contents.count("Kho medium 0") == 1
+        assert "Bổ sung 0" in contents
+        assert "Tạo 1 câu hỏi" in mock_client.aio.models.generate_content.call_args.kwargs["contents"]
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_cache_before_stock(self, mock_get_client, test_client, mock_db, auth_headers_student, generate_questions_payload):
+        """Test that a cache hit is served without claiming stocked questions."""
+        from dtos import GenerateQuestionsRequest
+        from generation_cache import cache_key, store_pool
+        params = GenerateQuestionsRequest(**generate_questions_payload)
+        pooled = [
+            {"id": f"c-{i}", "content": f"Cache {i}", "options": ["A", "B", "C", "D"], "correctAnswer": 1, "chapter": "Network Fundamentals",
+             "topic": "Network Topology", "knowledgeType": "concept", "difficulty": "medium", "explanation": None}
+            for i in range(5)
+        ]
+        store_pool(mock_db, cache_key(params, "gemini-2.5-flash"), "gemini-2.5-flash", params, pooled)
+        self.stock_questions(mock_db, 6, "medium")
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock()
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post("/api/generate-questions", headers=auth_headers_student, json=generate_questions_payload)
+
+        assert all(q["content"].startswith("Cache") for q in response.json()["questions"])
+        assert mock_db.question_stock.count_documents({}) == 6
+        mock_client.aio.models.generate_content.assert_not_called()
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_calculations_served_locally(self, mock_get_client, test_client, auth_headers_student):
+        """Test that calculation exercises on subnetting are generated without calling Gemini."""
+        mock_get_client.return_value = (None, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json={"chapter": "Tầng mạng", "topics": ["Chia mạng con"], "knowledgeTypes": ["example"], "count": 8}
+        )
+
+        assert response.status_code == 200
+        questions = response.json()["questions"]
+        assert len(questions) == 8
+        assert {q["knowledgeType"] for q in questions} == {"example"}
+        assert all(q["explanation"] for q in questions)
+        mock_get_client.assert_not_called()
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_calculations_exhausted(self, mock_get_client, test_client, auth_headers_student):
+        """Test that Gemini writes the exercises the templates cannot supply instead of returning a short quiz."""
+        batches = iter(range(100))
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=lambda **kwargs: self.questions_json(
+            f"Bài tập {next(batches)} -", int(kwargs["contents"].split("Tạo ")[1].split()[0])
+        ))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json={"chapter": "Tầng mạng", "topics": ["Chia mạng con"], "knowledgeTypes": ["example"], "difficulty": "easy", "count": 40}
+        )
+
+        contents = [q["content"] for q in response.json()["questions"]]
+        assert len(contents) == 40
+        generated = sum(content.startswith("Bài tập") for content in contents)
+        assert 0 < generated < 40
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_calculations_share_with_gemini(self, mock_get_client, test_client, auth_headers_student):
+        """Test that only the non-calculation share of a mixed request is sent to Gemini."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(return_value=self.questions_json("Khái niệm", 3))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json={"topics": ["Độ trễ"], "knowledgeTypes": ["concept", "example"], "difficulty": "easy", "count": 6}
+        )
+
+        assert response.status_code == 200
+        questions = response.json()["questions"]
+        assert [q["knowledgeType"] for q in questions].count("example") == 3
+        assert [q["content"] for q in questions][3:] == ["Khái niệm 0", "Khái niệm 1", "Khái niệm 2"]
+        prompt = mock_client.aio.models.generate_content.call_args_list[0].kwargs["contents"]
+        assert "Tạo 3 câu hỏi" in prompt
+        assert "Bài tập tính toán" not in prompt
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_facts_served_locally(self, mock_get_client, test_client, auth_headers_student):
+        """Test that port and protocol questions come from the fact table without calling Gemini."""
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json={"topics": ["Thư điện tử (SMTP, POP3, IMAP)"], "knowledgeTypes": ["rule"], "count": 5}
+        )
+
+        assert response.status_code == 200
+        questions = response.json()["questions"]
+        assert len(questions) == 5
+        assert all(q["topic"] == "Thư điện tử (SMTP, POP3, IMAP)" for q in questions)
+        mock_get_client.assert_not_called()
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_facts_topped_up_by_gemini(self, mock_get_client, test_client, auth_headers_student):
+        """Test that Gemini only generates what the matching facts cannot cover."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(return_value=self.questions_json("Câu DNS", 2))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions",
+            headers=auth_headers_student,
+            json={"topics": ["Phân giải tên miền (DNS)"], "knowledgeTypes": ["concept"], "count": 5}
+        )
+
+        assert response.status_code == 200
+        contents = [q["content"] for q in response.json()["questions"]]
+        assert len(contents) == 5
+        assert contents[3:] == ["Câu DNS 0", "Câu DNS 1"]
+        prompt = mock_client.aio.models.generate_content.call_args_list[0].kwargs["contents"]
+        assert "Tạo 2 câu hỏi" in prompt
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_queue_full(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that a saturated API key returns 503 instead of blocking."""
+        from gemini_client import GeminiBusyError
+        mock_get_client.return_value = (MagicMock(), "gemini-2.5-flash")
+
+        with patch("main.generate_content", AsyncMock(side_effect=GeminiBusyError("busy"))):
+            response = test_client.post(
+                "/api/generate-questions",
+                headers=auth_headers_student,
+                json=generate_questions_payload
+            )
+
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "30"
+
+    @patch("main.get_gemini_client_for_user")
+    def test_generate_questions_circuit_open(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that an open circuit breaker returns 503 with the remaining cooldown."""
+        from gemini_client import GeminiUnavailableError
+        mock_get_client.return_value = (MagicMock(), "gemini-2.5-flash")
+
+        with patch("main.generate_content", AsyncMock(side_effect=GeminiUnavailableError("gemini-2.5-flash", 12.2))):
+            response = test_client.post(
+                "/api/generate-questions",
+                headers=auth_headers_student,
+                json=generate_questions_payload
+            )
+
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "13"
+
+class TestGenerateQuestionsStreamEndpoint:
+    """Tests for POST /api/generate-questions/stream endpoint."""
+
+    @pytest.fixture
+    def generate_questions_payload(self):
+        """Valid generate questions payload."""
+        return {
+            "chapter": "Network Fundamentals",
+            "topics": ["Network Topology"],
+            "knowledgeTypes": ["concept"],
+            "difficulty": "medium",
+            "count": 2
+        }
+
+    @staticmethod
+    def parse_events(body):
+        """Split an SSE body into (event, data) pairs."""
+        events = []
+        for block in body.strip().split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in block.split("\n"))
+            events.append((lines["event"], json.loads(lines["data"])))
+        return events
+
+    @staticmethod
+    def stream_of(*texts):
+        """Build an async iterator of response chunks."""
+        async def chunks():
+            for text in texts:
+                yield MagicMock(text=text)
+        return chunks()
+
+    @patch("main.get_gemini_client_for_user")
+    def test_stream_emits_question_events(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that each completed question is sent as its own event."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content_stream = AsyncMock(return_value=self.stream_of(
+            '```json\n[{"content": "What is OSI?", "options": ["A", "B", "C", "D"],',
+            ' "correctAnswer": 0}, {"content": "Broken", "options": "x"},',
+            ' {"content": "What is TCP?", "options": ["A", "B", "C", "D"], "correctAnswer": 2}]\n```',
+        ))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions/stream",
+            headers=auth_headers_student,
+            json=generate_questions_payload
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = self.parse_events(response.text)
+        assert [event for event, _ in events] == ["question", "question", "done"]
+        assert events[0][1]["content"] == "What is OSI?"
+        assert events[1][1]["correctAnswer"] == 2
+        assert events[0][1]["id"] != events[1][1]["id"]
+        assert events[2][1] == {"count": 2}
+
+    @patch("main.get_gemini_client_for_user")
+    def test_stream_stops_at_requested_count(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that extra questions from the model are not sent."""
+        questions = [
+            '{"content": "Q%d", "options": ["A", "B", "C", "D"], "correctAnswer": 1}' % i for i in range(4)
+        ]
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content_stream = AsyncMock(
+            return_value=self.stream_of("[" + ", ".join(questions) + "]")
+        )
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions/stream",
+            headers=auth_headers_student,
+            json=generate_questions_payload
+        )
+
+        events = self.parse_events(response.text)
+        assert [event for event, _ in events] == ["question", "question", "done"]
+
+    @patch("main.get_gemini_client_for_user")
+    def test_stream_fills_pool_after_the_stream(self, mock_get_client, test_client, mock_db, auth_headers_student, generate_questions_payload):
+        """Test that a pool factor above 1 adds the extra questions after the streamed ones, like the regular endpoint."""
+        questions = [
+            '{"content": "Which topology has a central hub %d?", "options": ["A", "B", "C", "D"], "correctAnswer": 1}' % i
+            for i in range(2)
+        ]
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content_stream = AsyncMock(
+            return_value=self.stream_of("[" + ", ".join(questions) + "]")
+        )
+        mock_client.aio.models.generate_content = AsyncMock(return_value=MagicMock(text=json.dumps([
+            {"content": f"Pool extra item about ring wiring {i}", "options": ["A", "B", "C", "D"], "correctAnswer": 0}
+            for i in range(2)
+        ])))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        with patch("generation_cache.GENERATION_CACHE_POOL_FACTOR", 2.0):
+            response = test_client.post(
+                "/api/generate-questions/stream",
+                headers=auth_headers_student,
+                json=generate_questions_payload
+            )
+
+        events = self.parse_events(response.text)
+        assert [event for event, _ in events] == ["question", "question", "done"]
+        assert mock_client.aio.models.generate_content.await_count == 1
+        assert len(mock_db.generation_cache.find_one({})["questions"]) == 4
+
+    @patch("main.get_gemini_client_for_user")
+    def test_stream_reports_gemini_errors(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that an API error is sent as an error event."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content_stream = AsyncMock(side_effect=Exception("429 Too Many Requests"))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post(
+            "/api/generate-questions/stream",
+            headers=auth_headers_student,
+            json=generate_questions_payload
+        )
+
+        events = self.parse_events(response.text)
+        assert events[0][0] == "error"
+        assert events[0][1]["status"] == 429
+
+    @patch("main.get_gemini_client_for_user")
+    def test_stream_serves_local_questions(self, mock_get_client, test_client, auth_headers_student):
+        """Test that calculation exercises are streamed without calling Gemini."""
+        response = test_client.post(
+            "/api/generate-questions/stream",
+            headers=auth_headers_student,
+            json={"chapter": "Tầng mạng", "topics": ["Chia mạng con"], "knowledgeTypes": ["example"], "count": 5}
+        )
+
+        events = self.parse_events(response.text)
+        assert [event for event, _ in events] == ["question"] * 5 + ["done"]
+        assert {data["knowledgeType"] for _, data in events[:5]} == {"example"}
+        mock_get_client.assert_not_called()
+
+    @patch("main.get_gemini_client_for_user")
+    def test_stream_sends_stock_first_and_generates_the_rest(self, mock_get_client, test_client, mock_db, auth_headers_student, generate_questions_payload):
+        """Test that stocked questions are sent first, Gemini streams only the shortfall and the result is pooled."""
+        TestGenerateQuestionsEndpoint.stock_questions(mock_db, 1, "medium")
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content_stream = AsyncMock(return_value=self.stream_of(
+            '[{"content": "What is a star topology?", "options": ["A", "B", "C", "D"], "correctAnswer": 1}]'
+        ))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post("/api/generate-questions/stream", headers=auth_headers_student, json=generate_questions_payload)
+
+        events = self.parse_events(response.text)
+        assert [data.get("content") for _, data in events[:2]] == ["Kho medium 0", "What is a star topology?"]
+        assert events[2] == ("done", {"count": 2})
+        assert "Tạo 1 câu hỏi" in mock_client.aio.models.generate_content_stream.call_args.kwargs["contents"]
+        assert mock_db.generation_cache.count_documents({}) == 1
+
+    @patch("main.get_gemini_client_for_user")
+    def test_stream_tops_up_dropped_questions(self, mock_get_client, test_client, auth_headers_student, generate_questions_payload):
+        """Test that questions dropped from the stream are replaced by a follow-up request."""
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content_stream = AsyncMock(return_value=self.stream_of(
+            '[{"content": "What is a bus topology?", "options": ["A", "B", "C", "D"], "correctAnswer": 0},',
+            ' {"content": "What is a bus topology?", "options": ["A", "B", "C", "D"], "correctAnswer": 0}]',
+        ))
+        mock_client.aio.models.generate_content = AsyncMock(return_value=MagicMock(
+            text='[{"content": "Which device sits at the centre of a star network?", "options": ["A", "B", "C", "D"], "correctAnswer": 3}]'
+        ))
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+
+        response = test_client.post("/api/generate-questions/stream", headers=auth_headers_student, json=generate_questions_payload)
+
+        events = self.parse_events(response.text)
+        assert [data.get("content") for _, data in events[:2]] == ["What is a bus topology?", "Which device sits at the centre of a star network?"]
+        assert events[2] == ("done", {"count": 2})
+        assert events[0][1]["id"] != events[1][1]["id"]
+
+    def test_stream_requires_auth(self, test_client, generate_questions_payload):
+        """Test that the stream endpoint requires authentication."""
+        response = test_client.post("/api/generate-questions/stream", json=generate_questions_payload)
+        
+        assert response.status_code in [401, 403]
+
 class TestAnalyzeResultEndpoint:
     """Tests for POST /api/analyze endpoint."""
 
@@ -99,7 +829,7 @@ class TestAnalyzeResultEndpoint:
     "suggestedNextActions": ["Continue learning"]
 }
 ```'''
-        mock_client.models.generate_content.return_value = mock_response
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
         mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
         
         response = test_client.post(
@@ -114,6 +844,98 @@ class TestAnalyzeResultEndpoint:
         assert "strengths" in data
         assert "weaknesses" in data
 
+    @patch("main.get_gemini_client_for_user")
+    def test_analyze_result_requests_json_schema(self, mock_get_client, test_client, auth_headers_student, analyze_request_payload):
+        """Test that Gemini is asked for JSON matching the analysis response schema."""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = '{"overallFeedback": "Tốt", "strengths": ["OSI"], "weaknesses": [], "suggestedTopics": [], "suggestedNextActions": []}'
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+        
+        with patch("main.extract_object") as scanner:
+            response = test_client.post(
+                "/api/analyze-result",
+                headers=auth_headers_student,
+                json=analyze_request_payload
+            )
+        
+        assert response.status_code == 200
+        assert response.json()["overallFeedback"] == "Tốt"
+        scanner.assert_not_called()
+        config = mock_client.aio.models.generate_content.call_args.kwargs["config"]
+        assert config.response_mime_type == "application/json"
+        assert config.response_schema is AnalyzeResultResponse
+        assert "overallFeedback" not in mock_client.aio.models.generate_content.call_args.kwargs["contents"]
+
+    @patch("main.get_gemini_client_for_user")
+    def test_analyze_result_with_prose_and_trailing_comma(self, mock_get_client, test_client, auth_headers_student, analyze_request_payload):
+        """Test that analysis JSON is found inside prose and tolerates trailing commas."""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = '''Kết quả phân tích {theo yêu cầu}:
+{
+    "overallFeedback": "Làm tốt {phần OSI}",
+    "strengths": ["OSI Model understanding",],
+    "weaknesses": [],
+}
+Chúc bạn học tốt!'''
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+        
+        response = test_client.post(
+            "/api/analyze-result",
+            headers=auth_headers_student,
+            json=analyze_request_payload
+        )
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["overallFeedback"] == "Làm tốt {phần OSI}"
+        assert data["strengths"] == ["OSI Model understanding"]
+
+    @patch("main.get_gemini_client_for_user")
+    def test_analyze_result_reuses_same_attempt(self, mock_get_client, test_client, mock_db, auth_headers_student, analyze_request_payload):
+        """Test that analyzing the same attempt again returns the stored result."""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = '{"overallFeedback": "Tốt", "strengths": ["OSI"], "weaknesses": []}'
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+        
+        first = test_client.post("/api/analyze-result", headers=auth_headers_student, json=analyze_request_payload)
+        second = test_client.post(
+            "/api/analyze-result",
+            headers=auth_headers_student,
+            json={**analyze_request_payload, "timeSpent": 90}
+        )
+        
+        assert second.status_code == 200
+        assert second.json() == first.json()
+        assert mock_client.aio.models.generate_content.call_count == 1
+        assert mock_db.analysis_history.count_documents({}) == 1
+
+    @patch("main.get_gemini_client_for_user")
+    def test_analyze_result_changed_input_or_model(self, mock_get_client, test_client, mock_db, auth_headers_student, analyze_request_payload):
+        """Test that different answers or another model produce a new analysis."""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = '{"overallFeedback": "Tốt", "strengths": [], "weaknesses": []}'
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+        
+        test_client.post("/api/analyze-result", headers=auth_headers_student, json=analyze_request_payload)
+        test_client.post(
+            "/api/analyze-result",
+            headers=auth_headers_student,
+            json={**analyze_request_payload, "answers": {"q-001": 1}, "score": 0.0}
+        )
+        mock_get_client.return_value = (mock_client, "gemini-2.5-pro")
+        test_client.post("/api/analyze-result", headers=auth_headers_student, json=analyze_request_payload)
+        
+        assert mock_client.aio.models.generate_content.call_count == 3
+        assert mock_db.analysis_history.count_documents({}) == 3
+
     def test_analyze_result_no_auth(self, test_client, analyze_request_payload):
         """Test analysis without authentication."""
         response = test_client.post(
@@ -160,7 +982,7 @@ class TestAnalyzeOverallEndpoint:
     "suggestedNextActions": ["Practice more quizzes"]
 }
 ```'''
-        mock_client.models.generate_content.return_value = mock_response
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
         mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
         
         response = test_client.post(
@@ -171,6 +993,34 @@ class TestAnalyzeOverallEndpoint:
         
         assert response.status_code == 200
 
+    @patch("main.get_gemini_client_for_user")
+    def test_analyze_overall_reused_until_new_attempt(self, mock_get_client, test_client, mock_db, auth_headers_student, analyze_overall_payload):
+        """Test that the overall analysis is only regenerated after a new attempt."""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = '{"overallFeedback": "Ổn định", "strengths": [], "weaknesses": []}'
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+        
+        test_client.post("/api/analyze-overall", headers=auth_headers_student, json=analyze_overall_payload)
+        test_client.post("/api/analyze-overall", headers=auth_headers_student, json=analyze_overall_payload)
+        
+        assert mock_client.aio.models.generate_content.call_count == 1
+        
+        mock_db.attempts.insert_one({
+            "id": "attempt-new",
+            "quizId": "quiz-001",
+            "studentId": "student-123",
+            "answers": {},
+            "score": 50.0,
+            "timeSpent": 30,
+            "completedAt": datetime.now() + timedelta(seconds=1),
+        })
+        response = test_client.post("/api/analyze-overall", headers=auth_headers_student, json=analyze_overall_payload)
+        
+        assert response.status_code == 200
+        assert mock_client.aio.models.generate_content.call_count == 2
+
 class TestAnalyzeProgressEndpoint:
     """Tests for POST /api/analyze/progress endpoint."""
 
@@ -204,7 +1054,7 @@ class TestAnalyzeProgressEndpoint:
     "suggestedNextActions": ["Keep up the good work"]
 }
 ```'''
-        mock_client.models.generate_content.return_value = mock_response
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
         mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
         
         response = test_client.post(
@@ -215,6 +1065,211 @@ class TestAnalyzeProgressEndpoint:
         
         assert response.status_code == 200
 
+class TestAsyncAnalysisJobs:
+    """Tests for queued analyses (Prefer: respond-async) and GET /api/ai-jobs/{job_id}."""
+
+    @pytest.fixture
+    def analyze_request_payload(self, sample_question):
+        """Valid analyze request payload."""
+        return {
+            "quizTitle": "Test Quiz",
+            "questions": [sample_question],
+            "answers": {"q-001": 0},
+            "score": 100.0,
+            "timeSpent": 60
+        }
+
+    @staticmethod
+    def wait_for_job(test_client, headers, job_id):
+        for _ in range(100):
+            response = test_client.get(f"/api/ai-jobs/{job_id}", headers=headers)
+            if response.json()["status"] in ("done", "failed"):
+                return response
+            time.sleep(0.02)
+        raise AssertionError("job did not finish")
+
+    @patch("main.manager.send_to_user", new_callable=AsyncMock)
+    @patch("main.get_gemini_client_for_user")
+    def test_queued_analysis_completes(self, mock_get_client, mock_send, test_client, mock_db, auth_headers_student, analyze_request_payload):
+        """Test that a queued analysis is accepted with 202 and finished by a worker."""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = '{"overallFeedback": "Tốt", "strengths": ["OSI"], "weaknesses": []}'
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+        
+        response = test_client.post(
+            "/api/analyze-result",
+            headers={**auth_headers_student, "Prefer": "respond-async"},
+            json=analyze_request_payload
+        )
+        
+        assert response.status_code == 202
+        job_id = response.json()["jobId"]
+        assert response.json()["status"] == "queued"
+        assert response.headers["location"] == f"/api/ai-jobs/{job_id}"
+        assert response.headers["preference-applied"] == "respond-async"
+        
+        data = self.wait_for_job(test_client, auth_headers_student, job_id).json()
+        
+        assert data["status"] == "done"
+        assert data["analysisType"] == "result"
+        assert data["result"]["overallFeedback"] == "Tốt"
+        assert mock_db.analysis_history.find_one({"id": data["historyId"]}) is not None
+        user_id, message = mock_send.call_args.args
+        assert user_id == "student-123"
+        assert message["type"] == "ai_job"
+        assert message["jobId"] == job_id
+        assert message["status"] == "done"
+
+    @patch("main.manager.send_to_user", new_callable=AsyncMock)
+    @patch("main.get_gemini_client_for_user")
+    def test_queued_analysis_records_failure(self, mock_get_client, mock_send, test_client, auth_headers_student, analyze_request_payload):
+        """Test that a failed queued analysis keeps the error for polling."""
+        mock_get_client.return_value = (None, "gemini-2.5-flash")
+        
+        with patch("main.LOCAL_ANALYSIS_FALLBACK", False):
+            response = test_client.post(
+                "/api/analyze-result",
+                headers={**auth_headers_student, "Prefer": "respond-async"},
+                json=analyze_request_payload
+            )
+            
+            data = self.wait_for_job(test_client, auth_headers_student, response.json()["jobId"]).json()
+        
+        assert data["status"] == "failed"
+        assert data["error"]["status"] == 500
+        assert mock_send.call_args.args[1]["status"] == "failed"
+
+    def test_get_job_of_other_user(self, test_client, mock_db, auth_headers_student):
+        """Test that a job is only visible to the user who queued it."""
+        mock_db.ai_jobs.insert_one({
+            "id": "job-other",
+            "userId": "admin-456",
+            "analysisType": "overall",
+            "payload": {},
+            "status": "done",
+            "attempts": 1,
+            "createdAt": datetime.now(),
+        })
+        
+        response = test_client.get("/api/ai-jobs/job-other", headers=auth_headers_student)
+        
+        assert response.status_code == 404
+
+    def test_get_job_not_found(self, test_client, auth_headers_student):
+        """Test polling an unknown job."""
+        response = test_client.get("/api/ai-jobs/job-missing", headers=auth_headers_student)
+        
+        assert response.status_code == 404
+
+class TestLocalAnalysisFallback:
+    """Tests for answering analyses locally when Gemini cannot."""
+
+    @pytest.fixture
+    def analyze_request_payload(self, sample_question):
+        """Attempt with one correct and one incorrect answer."""
+        second = {**sample_question, "id": "q-002", "topic": "Subnetting", "knowledgeType": "example"}
+        return {
+            "quizTitle": "Test Quiz",
+            "questions": [sample_question, second],
+            "answers": {"q-001": 0, "q-002": 1},
+            "score": 50.0,
+            "timeSpent": 60
+        }
+
+    @staticmethod
+    def gemini_client(text):
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = text
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        return mock_client
+
+    @patch("main.get_gemini_client_for_user")
+    def test_missing_key_answers_locally(self, mock_get_client, test_client, mock_db, auth_headers_student, analyze_request_payload):
+        """Test that an analysis without any API key is computed locally and saved."""
+        mock_get_client.return_value = (None, "gemini-2.5-flash")
+        
+        response = test_client.post("/api/analyze-result", headers=auth_headers_student, json=analyze_request_payload)
+        
+        assert response.status_code == 200
+        assert response.headers["x-analysis-source"] == "local"
+        assert "location" not in response.headers
+        data = response.json()
+        assert data["suggestedTopics"] == ["Subnetting"]
+        assert any("OSI Model" in strength for strength in data["strengths"])
+        history = mock_db.analysis_history.find_one({"userId": "student-123"})
+        assert history["source"] == "local"
+        assert "fingerprint" not in history
+        assert mock_db.ai_jobs.count_documents({}) == 0
+
+    @patch("main.get_gemini_client_for_user")
+    def test_locked_default_key_answers_locally(self, mock_get_client, test_client, auth_headers_student):
+        """Test that a locked default key does not block the progress analysis."""
+        from fastapi import HTTPException
+        mock_get_client.side_effect = HTTPException(status_code=403, detail="DEFAULT_KEY_LOCKED:locked")
+        
+        response = test_client.post("/api/analyze-progress", headers=auth_headers_student, json={
+            "chapter": "Network Fundamentals",
+            "progressData": [
+                {"date": "2024-01-01", "score": 80.0, "quizTitle": "Quiz 1"},
+                {"date": "2024-01-05", "score": 60.0, "quizTitle": "Quiz 2"}
+            ],
+            "avgScore": 70.0,
+            "trend": "declining"
+        })
+        
+        assert response.status_code == 200
+        assert response.headers["x-analysis-source"] == "local"
+        assert "Điểm số giảm từ 80.0 xuống 60.0" in response.json()["weaknesses"]
+
+    @patch("main.manager.send_to_user", new_callable=AsyncMock)
+    @patch("main.get_gemini_client_for_user")
+    def test_outage_answers_locally_then_enriches(self, mock_get_client, mock_send, test_client, mock_db, auth_headers_student, analyze_request_payload):
+        """Test that Gemini replaces the local analysis once it is reachable again."""
+        from ai_jobs import notify_job_available
+        from gemini_client import GeminiUnavailableError
+        mock_get_client.return_value = (MagicMock(), "gemini-2.5-flash")
+        
+        with patch("main.generate_content", AsyncMock(side_effect=GeminiUnavailableError("gemini-2.5-flash", 12.2))):
+            response = test_client.post("/api/analyze-result", headers=auth_headers_student, json=analyze_request_payload)
+        
+        assert response.status_code == 200
+        assert response.headers["x-analysis-source"] == "local"
+        job_id = response.headers["location"].rsplit("/", 1)[1]
+        job = mock_db.ai_jobs.find_one({"id": job_id})
+        assert job["status"] == "queued"
+        assert job["availableAt"] > datetime.now() + timedelta(seconds=10)
+        local_history = mock_db.analysis_history.find_one({"userId": "student-123"})
+        assert job["historyId"] == local_history["id"]
+        
+        mock_get_client.return_value = (self.gemini_client('{"overallFeedback": "Phân tích từ Gemini", "strengths": [], "weaknesses": []}'), "gemini-2.5-flash")
+        mock_db.ai_jobs.update_one({"id": job_id}, {"$set": {"availableAt": datetime.now()}})
+        test_client.portal.call(notify_job_available)
+        data = TestAsyncAnalysisJobs.wait_for_job(test_client, auth_headers_student, job_id).json()
+        
+        assert data["status"] == "done"
+        assert data["historyId"] == local_history["id"]
+        histories = list(mock_db.analysis_history.find({"userId": "student-123"}))
+        assert len(histories) == 1
+        assert histories[0]["result"]["overallFeedback"] == "Phân tích từ Gemini"
+        assert "source" not in histories[0]
+        assert mock_send.call_args.args[1]["status"] == "done"
+
+    @patch("main.get_gemini_client_for_user")
+    def test_invalid_key_still_fails(self, mock_get_client, test_client, auth_headers_student, analyze_request_payload):
+        """Test that errors the user has to fix are not hidden by the local analysis."""
+        error = Exception("403 API key not valid")
+        error.code = 403
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(side_effect=error)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+        
+        response = test_client.post("/api/analyze-result", headers=auth_headers_student, json=analyze_request_payload)
+        
+        assert response.status_code == 403
+
 class TestAnalysisHistoryEndpoint:
     """Tests for GET /api/analysis/history endpoint."""
 
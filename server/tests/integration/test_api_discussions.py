@@ -231,6 +231,36 @@ class TestDiscussionMessagesEndpoint:
         data = response.json()
         assert isinstance(data, list)
 
+class TestGetDiscussionQuizEndpoint:
+    """Tests for GET /api/discussions/{quiz_id}/quiz endpoint."""
+
+    def test_get_discussion_quiz_etag(self, test_client, auth_headers_student, mock_db, sample_student_data, quiz_in_db):
+        """Test conditional GET on a discussion quiz."""
+        mock_db.quiz_discussions.insert_one({
+            "id": "discussion-001",
+            "quizId": quiz_in_db["id"],
+            "addedBy": sample_student_data["id"],
+            "addedAt": datetime.utcnow()
+        })
+        
+        first = test_client.get(f"/api/discussions/{quiz_in_db['id']}/quiz", headers=auth_headers_student)
+        second = test_client.get(
+            f"/api/discussions/{quiz_in_db['id']}/quiz",
+            headers={**auth_headers_student, "If-None-Match": first.headers["etag"]}
+        )
+        
+        assert first.status_code == 200
+        assert second.status_code == 304
+
+    def test_get_discussion_quiz_not_in_discussion(self, test_client, auth_headers_student, quiz_in_db):
+        """Test that a matching ETag does not bypass the discussion check."""
+        response = test_client.get(
+            f"/api/discussions/{quiz_in_db['id']}/quiz",
+            headers={**auth_headers_student, "If-None-Match": f'"{quiz_in_db["id"]}.v0"'}
+        )
+        
+        assert response.status_code == 404
+
 class TestGetDiscussionOnlineUsersEndpoint:
     """Tests for GET /api/discussions/{quiz_id}/online endpoint."""
 
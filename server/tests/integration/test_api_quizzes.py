@@ -19,7 +19,8 @@ Integration tests for quiz API endpoints.
 import os
 import sys
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta
+from unittest.mock import patch
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
@@ -84,6 +85,93 @@ class TestGetQuizEndpoint:
         assert data["id"] == quiz_in_db["id"]
         assert data["title"] == quiz_in_db["title"]
 
+    def test_get_quiz_fast_path_matches_model_path(self, test_client, auth_headers_student, quiz_in_db):
+        """Test that the fast serialization path returns the same body as response_model."""
+        with patch("main.FAST_JSON_RESPONSES", True):
+            fast = test_client.get(f"/api/quizzes/{quiz_in_db['id']}", headers=auth_headers_student)
+        slow = test_client.get(f"/api/quizzes/{quiz_in_db['id']}", headers=auth_headers_student)
+        
+        assert fast.status_code == slow.status_code == 200
+        assert fast.json() == slow.json()
+
+    def test_get_quiz_returns_etag(self, test_client, auth_headers_student, quiz_in_db):
+        """Test that the quiz response carries a strong ETag."""
+        response = test_client.get(
+            f"/api/quizzes/{quiz_in_db['id']}",
+            headers={**auth_headers_student, "Accept-Encoding": "identity"}
+        )
+        
+        assert response.status_code == 200
+        assert response.headers["etag"] == f'"{quiz_in_db["id"]}.v0"'
+        assert response.headers["cache-control"] == "private, no-cache"
+
+    def test_get_quiz_not_modified(self, test_client, auth_headers_student, quiz_in_db, mock_db):
+        """Test that a matching If-None-Match returns 304 without loading the quiz."""
+        first = test_client.get(f"/api/quizzes/{quiz_in_db['id']}", headers=auth_headers_student)
+        etag = first.headers["etag"]
+        
+        with patch("main.get_quiz_by_id") as mock_get_quiz:
+            response = test_client.get(
+                f"/api/quizzes/{quiz_in_db['id']}",
+                headers={**auth_headers_student, "If-None-Match": etag}
+            )
+        
+        assert response.status_code == 304
+        assert response.content == b""
+        mock_get_quiz.assert_not_called()
+
+    def test_not_modified_echoes_the_client_validator(self, test_client, auth_headers_student, quiz_in_db):
+        """Test that the 304 carries the content-coded ETag the client sent, not the bare one."""
+        etag = f'"{quiz_in_db["id"]}.v0-gzip"'
+        
+        response = test_client.get(
+            f"/api/quizzes/{quiz_in_db['id']}",
+            headers={**auth_headers_student, "If-None-Match": f'"other", {etag}'}
+        )
+        
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+
+    def test_get_quiz_modified_by_another_worker(self, test_client, auth_headers_student, quiz_in_db, mock_db):
+        """Test that an edit written by another process is seen at once."""
+        etag = test_client.get(f"/api/quizzes/{quiz_in_db['id']}", headers=auth_headers_student).headers["etag"]
+        mock_db.quizzes.update_one({"id": quiz_in_db["id"]}, {"$set": {"title": "Elsewhere"}, "$inc": {"version": 1}})
+        
+        response = test_client.get(
+            f"/api/quizzes/{quiz_in_db['id']}",
+            headers={**auth_headers_student, "If-None-Match": etag}
+        )
+        
+        assert response.status_code == 200
+        assert response.json()["title"] == "Elsewhere"
+
+    def test_get_quiz_modified_after_update(self, test_client, auth_headers_student, quiz_in_db):
+        """Test that an update invalidates the previous ETag."""
+        etag = test_client.get(f"/api/quizzes/{quiz_in_db['id']}", headers=auth_headers_student).headers["etag"]
+        test_client.put(
+            f"/api/quizzes/{quiz_in_db['id']}",
+            headers=auth_headers_student,
+            json={"title": "Changed"}
+        )
+        
+        response = test_client.get(
+            f"/api/quizzes/{quiz_in_db['id']}",
+            headers={**auth_headers_student, "If-None-Match": etag}
+        )
+        
+        assert response.status_code == 200
+        assert response.json()["title"] == "Changed"
+        assert response.headers["etag"] != etag
+
+    def test_get_quiz_not_modified_requires_owner(self, test_client, auth_headers_admin, admin_user, quiz_in_db):
+        """Test that a matching ETag does not bypass the owner check."""
+        response = test_client.get(
+            f"/api/quizzes/{quiz_in_db['id']}",
+            headers={**auth_headers_admin, "If-None-Match": f'"{quiz_in_db["id"]}.v0"'}
+        )
+        
+        assert response.status_code == 403
+
     def test_get_quiz_not_found(self, test_client, auth_headers_student):
         """Test getting non-existent quiz."""
         response = test_client.get(
@@ -136,6 +224,34 @@ class TestCreateQuizEndpoint:
         assert "id" in data
         assert "createdAt" in data
 
+    def test_create_quiz_stores_native_datetime(self, test_client, auth_headers_student, create_quiz_payload, mock_db):
+        """Test that createdAt is stored as a datetime and returned as an ISO string."""
+        response = test_client.post(
+            "/api/quizzes",
+            headers=auth_headers_student,
+            json=create_quiz_payload
+        )
+        
+        assert response.status_code == 200
+        stored = mock_db.quizzes.find_one({"id": response.json()["id"]})
+        assert isinstance(stored["createdAt"], datetime)
+        returned = datetime.fromisoformat(response.json()["createdAt"])
+        assert abs(returned - stored["createdAt"]) < timedelta(milliseconds=1)
+
+    def test_create_quiz_indexes_questions(self, test_client, auth_headers_student, create_quiz_payload, mock_db, sample_student_data):
+        """Test that the questions of a new quiz are added to the near-duplicate index."""
+        response = test_client.post(
+            "/api/quizzes",
+            headers=auth_headers_student,
+            json=create_quiz_payload
+        )
+        
+        assert response.status_code == 200
+        indexed = list(mock_db.question_index.find({"quizId": response.json()["id"]}))
+        assert [doc["questionId"] for doc in indexed] == ["q-001"]
+        assert indexed[0]["userId"] == sample_student_data["id"]
+        assert indexed[0]["terms"] == "http"
+
     def test_create_quiz_no_auth(self, test_client, create_quiz_payload):
         """Test creating quiz without authentication."""
         response = test_client.post(
@@ -208,6 +324,19 @@ class TestDeleteQuizEndpoint:
         )
         assert get_response.status_code == 404
 
+    def test_delete_quiz_removes_indexed_questions(self, test_client, auth_headers_student, quiz_in_db, mock_db):
+        """Test that deleting a quiz removes its questions from the near-duplicate index."""
+        from question_similarity import index_quiz
+        index_quiz(mock_db, quiz_in_db)
+        
+        response = test_client.delete(
+            f"/api/quizzes/{quiz_in_db['id']}",
+            headers=auth_headers_student
+        )
+        
+        assert response.status_code == 200
+        assert mock_db.question_index.count_documents({"quizId": quiz_in_db["id"]}) == 0
+
     def test_delete_quiz_not_found(self, test_client, auth_headers_student):
         """Test deleting non-existent quiz."""
         response = test_client.delete(
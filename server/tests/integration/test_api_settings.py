@@ -19,6 +19,7 @@ Integration tests for settings API endpoints.
 import os
 import sys
 import pytest
+from unittest.mock import patch, MagicMock, AsyncMock
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
@@ -90,3 +91,61 @@ class TestAdminSettingsEndpoints:
         )
         
         assert response.status_code == 200
+
+class TestLLMUsageEndpoint:
+    """Tests for GET /api/admin/llm-usage."""
+
+    @patch("main.get_gemini_client_for_user")
+    def test_llm_usage_after_analysis(self, mock_get_client, test_client, auth_headers_student, auth_headers_admin, sample_question):
+        """Test that a Gemini call shows up per model and per endpoint."""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = '{"overallFeedback": "Tốt", "strengths": [], "weaknesses": []}'
+        mock_response.usage_metadata = MagicMock(
+            prompt_token_count=120, candidates_token_count=30, thoughts_token_count=None, total_token_count=150
+        )
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+        mock_get_client.return_value = (mock_client, "gemini-2.5-flash")
+        test_client.post(
+            "/api/analyze-result",
+            headers=auth_headers_student,
+            json={
+                "quizTitle": "Test Quiz",
+                "questions": [sample_question],
+                "answers": {"q-001": 0},
+                "score": 100.0,
+                "timeSpent": 60
+            }
+        )
+        
+        response = test_client.get("/api/admin/llm-usage", headers=auth_headers_admin)
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["byModel"][0]["key"] == "gemini-2.5-flash"
+        assert data["byModel"][0]["calls"] == 1
+        assert data["byModel"][0]["promptTokens"] == 120
+        assert data["byModel"][0]["totalTokens"] == 150
+        assert data["byModel"][0]["p50Ms"] is not None
+        assert data["byEndpoint"][0]["key"] == "analysis"
+
+    def test_llm_usage_lists_system_keys(self, test_client, auth_headers_admin):
+        """Test that the state of every system key is reported without the key itself."""
+        from gemini_client import KeyPool, api_key_id
+        pool = KeyPool(["system-key-1", "system-key-2"])
+        pool.record_rate_limited(api_key_id("system-key-2"))
+        
+        with patch("main.key_pool", pool):
+            response = test_client.get("/api/admin/llm-usage", headers=auth_headers_admin)
+        
+        keys = {entry["key"]: entry for entry in response.json()["defaultKeys"]}
+        assert set(keys) == {api_key_id("system-key-1"), api_key_id("system-key-2")}
+        assert keys[api_key_id("system-key-2")]["rateLimited"] == 1
+        assert keys[api_key_id("system-key-2")]["coolingDownFor"] > 0
+        assert "system-key" not in response.text
+
+    def test_llm_usage_as_student(self, test_client, auth_headers_student):
+        """Test that usage statistics are admin only."""
+        response = test_client.get("/api/admin/llm-usage", headers=auth_headers_student)
+        
+        assert response.status_code == 403
@@ -0,0 +1,169 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for ai_jobs.py module.
+"""
+
+import os
+import sys
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from ai_jobs import (
+    claim_next_job,
+    complete_job,
+    create_job,
+    fail_job,
+    get_job,
+    notify_job_available,
+    requeue_job,
+    run_job_workers,
+)
+
+class TestJobQueue:
+    """Tests for queue operations."""
+
+    def test_create_job(self, mock_db):
+        """Test that a new job is queued and has no Mongo id."""
+        job = create_job(mock_db, "user-1", "result", {"score": 80})
+        
+        assert job["status"] == "queued"
+        assert "_id" not in job
+        assert get_job(mock_db, job["id"])["payload"] == {"score": 80}
+
+    def test_claim_oldest_first(self, mock_db):
+        """Test that jobs are claimed in creation order and only once."""
+        first = create_job(mock_db, "user-1", "result", {})
+        second = create_job(mock_db, "user-1", "overall", {})
+        mock_db.ai_jobs.update_one({"id": second["id"]}, {"$set": {"createdAt": datetime.now() + timedelta(seconds=1)}})
+        
+        claimed = claim_next_job(mock_db)
+        
+        assert claimed["id"] == first["id"]
+        assert claimed["status"] == "running"
+        assert claimed["attempts"] == 1
+        assert claim_next_job(mock_db)["id"] == second["id"]
+        assert claim_next_job(mock_db) is None
+
+    def test_expired_lease_is_reclaimed(self, mock_db):
+        """Test that a job abandoned by a dead worker is picked up again."""
+        job = create_job(mock_db, "user-1", "result", {})
+        claim_next_job(mock_db)
+        mock_db.ai_jobs.update_one({"id": job["id"]}, {"$set": {"leaseExpiresAt": datetime.now() - timedelta(seconds=1)}})
+        
+        reclaimed = claim_next_job(mock_db)
+        
+        assert reclaimed["id"] == job["id"]
+        assert reclaimed["attempts"] == 2
+
+    def test_abandoned_job_fails_after_max_attempts(self, mock_db):
+        """Test that a job is failed once its attempts are used up."""
+        job = create_job(mock_db, "user-1", "result", {})
+        
+        with patch("ai_jobs.AI_JOB_MAX_ATTEMPTS", 1):
+            claim_next_job(mock_db)
+            mock_db.ai_jobs.update_one({"id": job["id"]}, {"$set": {"leaseExpiresAt": datetime.now() - timedelta(seconds=1)}})
+            assert claim_next_job(mock_db) is None
+        
+        stored = get_job(mock_db, job["id"])
+        assert stored["status"] == "failed"
+        assert stored["error"]["status"] == 500
+
+    def test_delayed_job_waits_until_available(self, mock_db):
+        """Test that a delayed or requeued job is only claimed once its delay has passed."""
+        job = create_job(mock_db, "user-1", "result", {}, delay=60, history_id="analysis-local")
+        
+        assert claim_next_job(mock_db) is None
+        assert get_job(mock_db, job["id"])["historyId"] == "analysis-local"
+        
+        mock_db.ai_jobs.update_one({"id": job["id"]}, {"$set": {"availableAt": datetime.now() - timedelta(seconds=1)}})
+        claimed = claim_next_job(mock_db)
+        assert claimed["id"] == job["id"]
+        
+        requeue_job(mock_db, job["id"], 60)
+        assert get_job(mock_db, job["id"])["status"] == "queued"
+        assert claim_next_job(mock_db) is None
+
+    def test_job_without_available_time_is_claimed(self, mock_db):
+        """Test that jobs queued before delays existed are still claimed."""
+        job = create_job(mock_db, "user-1", "result", {})
+        mock_db.ai_jobs.update_one({"id": job["id"]}, {"$unset": {"availableAt": ""}})
+        
+        assert claim_next_job(mock_db)["id"] == job["id"]
+
+    def test_complete_and_fail(self, mock_db):
+        """Test that finished jobs record their outcome."""
+        done = create_job(mock_db, "user-1", "result", {})
+        failed = create_job(mock_db, "user-1", "result", {})
+        
+        complete_job(mock_db, done["id"], {"overallFeedback": "Tốt"}, "analysis-1")
+        fail_job(mock_db, failed["id"], {"status": 429, "detail": "quota"})
+        
+        assert get_job(mock_db, done["id"])["status"] == "done"
+        assert get_job(mock_db, done["id"])["historyId"] == "analysis-1"
+        assert get_job(mock_db, failed["id"])["error"] == {"status": 429, "detail": "quota"}
+
+@pytest.mark.asyncio
+class TestJobWorkers:
+    """Tests for the worker loop."""
+
+    async def test_workers_process_jobs(self, mock_db):
+        """Test that queued jobs are processed with bounded concurrency."""
+        for _ in range(5):
+            create_job(mock_db, "user-1", "result", {})
+        running = {"now": 0, "max": 0}
+        processed = []
+
+        async def process(db, job):
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            await asyncio.sleep(0.01)
+            running["now"] -= 1
+            processed.append(job["id"])
+            complete_job(db, job["id"], {}, "h")
+
+        with patch("ai_jobs.AI_JOB_POLL_INTERVAL", 0.01):
+            task = asyncio.create_task(run_job_workers(lambda: mock_db, process, concurrency=2))
+            for _ in range(100):
+                if len(processed) == 5:
+                    break
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        
+        assert len(set(processed)) == 5
+        assert running["max"] == 2
+
+    async def test_notify_wakes_idle_worker(self, mock_db):
+        """Test that a notification starts a job before the next poll."""
+        processed = asyncio.Event()
+
+        async def process(db, job):
+            processed.set()
+
+        with patch("ai_jobs.AI_JOB_POLL_INTERVAL", 30):
+            task = asyncio.create_task(run_job_workers(lambda: mock_db, process, concurrency=1))
+            await asyncio.sleep(0.05)
+            create_job(mock_db, "user-1", "result", {})
+            notify_job_available()
+            await asyncio.wait_for(processed.wait(), 2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
@@ -0,0 +1,190 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for analysis_prompt.py module.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from dtos import AnalyzeOverallRequest, AnalyzeProgressRequest, AnalyzeResultRequest, KnowledgeAnalysisItem, Question
+from analysis_prompt import (
+    build_analysis_prompt,
+    build_overall_analysis_prompt,
+    build_progress_analysis_prompt,
+    encode_attempt,
+    encode_knowledge_groups,
+    estimate_tokens,
+    topic_statistics,
+)
+
+def make_attempt(count=10, wrong_every=3, topics=("TCP", "UDP")):
+    questions = [
+        Question(
+            id=f"q-{i}",
+            content=f"Câu hỏi số {i} về giao thức tầng vận chuyển",
+            options=["TCP", "UDP", "IP", "ICMP"],
+            correctAnswer=i % 4,
+            chapter="Chương 3",
+            topic=topics[i % len(topics)],
+            knowledgeType="concept",
+            difficulty=("easy", "medium", "hard")[i % 3],
+        )
+        for i in range(count)
+    ]
+    answers = {
+        q.id: (q.correctAnswer + 1) % 4 if i % wrong_every == 0 else q.correctAnswer
+        for i, q in enumerate(questions)
+    }
+    return AnalyzeResultRequest(quizTitle="Đề 1", questions=questions, answers=answers, score=60, timeSpent=300)
+
+class TestTopicStatistics:
+    """Tests for per-topic statistics lines."""
+
+    def test_counts_per_topic_with_breakdowns(self):
+        """Test that each topic line has correct/total and breakdowns."""
+        attempt = make_attempt(count=6, wrong_every=3)
+        
+        lines = topic_statistics(attempt)
+        
+        # q-0 and q-3 are wrong; even ids are TCP, odd ids are UDP
+        assert lines == [
+            "- Chương 3 / TCP: 2/3 đúng (loại: concept 2/3; độ khó: easy 0/1, hard 1/1, medium 1/1)",
+            "- Chương 3 / UDP: 2/3 đúng (loại: concept 2/3; độ khó: medium 1/1, easy 0/1, hard 1/1)",
+        ]
+
+    def test_unanswered_counts_as_incorrect(self):
+        """Test that a missing answer is not counted as correct."""
+        attempt = make_attempt(count=2, topics=("TCP",))
+        attempt.answers.pop("q-1")
+        
+        assert topic_statistics(attempt)[0].startswith("- Chương 3 / TCP: 0/2 đúng")
+
+class TestEncodeAttempt:
+    """Tests for the compact attempt encoding."""
+
+    def test_only_incorrect_answers_are_listed_in_full(self):
+        """Test that every incorrect answer has a line with both options."""
+        attempt = make_attempt(count=10, wrong_every=3)
+        
+        encoded = encode_attempt(attempt)
+        
+        wrong_section = encoded.split("Các câu trả lời sai")[1].split("Một số câu trả lời đúng")[0]
+        for i in (0, 3, 6, 9):
+            assert f"Câu hỏi số {i} " in wrong_section
+        assert "Câu hỏi số 1 " not in wrong_section
+        assert "| đúng: A. TCP | chọn: B. UDP" in wrong_section
+
+    def test_one_correct_example_per_topic(self):
+        """Test that correct examples are limited to one per topic."""
+        attempt = make_attempt(count=10, wrong_every=3)
+        
+        correct_section = encode_attempt(attempt).split("Một số câu trả lời đúng tiêu biểu:")[1]
+        
+        assert correct_section.count("\n- [TCP|") == 1
+        assert correct_section.count("\n- [UDP|") == 1
+
+    def test_unanswered_question(self):
+        """Test that an unanswered question is shown as left blank."""
+        attempt = make_attempt(count=2)
+        attempt.answers.pop("q-1")
+        
+        assert "chọn: bỏ trống" in encode_attempt(attempt)
+
+    def test_budget_truncates_incorrect_answers(self):
+        """Test that incorrect answers beyond the budget are summarized."""
+        attempt = make_attempt(count=50, wrong_every=1)
+        
+        encoded = encode_attempt(attempt, max_chars=1500)
+        
+        assert len(encoded) <= 1600
+        shown = encoded.count("\n- [")
+        assert 0 < shown < 50
+        assert f"(còn {50 - shown} câu sai khác, đã được tính trong thống kê)" in encoded
+        assert "- Chương 3 / TCP: 0/25 đúng" in encoded
+
+    def test_all_correct_has_no_incorrect_section(self):
+        """Test that a perfect attempt only has statistics and examples."""
+        attempt = make_attempt(count=4, wrong_every=100)
+        attempt.answers["q-0"] = 0
+        
+        encoded = encode_attempt(attempt)
+        
+        assert "Các câu trả lời sai" not in encoded
+        assert "Một số câu trả lời đúng tiêu biểu:" in encoded
+
+class TestBuildPrompts:
+    """Tests for the analysis prompt builders."""
+
+    def test_compact_prompt_is_much_smaller(self):
+        """Test that the compact prompt uses far fewer tokens than the legacy JSON."""
+        attempt = make_attempt(count=50, wrong_every=3)
+        
+        legacy = build_analysis_prompt(attempt, compact=False)
+        compact = build_analysis_prompt(attempt, compact=True)
+        
+        assert '"userAnswer"' in legacy
+        assert '"userAnswer"' not in compact
+        assert "- Số câu: 50" in compact
+        assert estimate_tokens(compact) < estimate_tokens(legacy) / 2
+
+    def test_overall_prompt_lists_groups_on_one_line(self):
+        """Test that knowledge groups are encoded as one line each."""
+        params = AnalyzeOverallRequest(
+            attemptCount=3,
+            avgScore=72.5,
+            knowledgeAnalysis=[
+                KnowledgeAnalysisItem(
+                    chapter="Chương 3", topic="TCP", knowledgeType="concept",
+                    totalQuestions=8, correctAnswers=6, accuracy=75,
+                ),
+            ],
+        )
+        
+        compact = build_overall_analysis_prompt(params, compact=True)
+        legacy = build_overall_analysis_prompt(params, compact=False)
+        
+        assert encode_knowledge_groups(params.knowledgeAnalysis) == "- Chương 3 / TCP / concept: 6/8 đúng (75%)"
+        assert "- Chương 3 / TCP / concept: 6/8 đúng (75%)" in compact
+        assert '"correctAnswers": 6' in legacy
+
+    def test_progress_prompt_lists_attempts(self):
+        """Test that the progress prompt lists each attempt with its score and the trend."""
+        params = AnalyzeProgressRequest(
+            chapter="Chương 4",
+            progressData=[{"date": "2025-01-02", "score": 65, "quizTitle": "Đề 2"}],
+            avgScore=65,
+            trend="improving",
+        )
+        
+        prompt = build_progress_analysis_prompt(params)
+        
+        assert "- 2025-01-02: 65.0 điểm (Đề 2)" in prompt
+        assert "Xu hướng hiện tại: đang tiến bộ" in prompt
+        assert "Sinh viên: Không xác định" in prompt
+
+    def test_prompts_leave_the_format_to_the_schema(self):
+        """Test that no prompt repeats the JSON format enforced by the response schema."""
+        prompts = [
+            build_analysis_prompt(make_attempt(count=5, wrong_every=2)),
+            build_overall_analysis_prompt(AnalyzeOverallRequest(attemptCount=1, avgScore=50, knowledgeAnalysis=[])),
+            build_progress_analysis_prompt(AnalyzeProgressRequest(chapter="Chương 4", progressData=[], avgScore=0, trend="stable")),
+        ]
+        
+        for prompt in prompts:
+            assert "suggestedNextActions" not in prompt
+            assert "Trả lời bằng tiếng Việt." in prompt
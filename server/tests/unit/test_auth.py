@@ -20,7 +20,7 @@ Tests for password hashing, JWT tokens, and user CRUD operations.
 import os
 import sys
 import pytest
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
@@ -43,10 +43,12 @@ from auth import (
     delete_quiz,
     update_question_in_quiz,
     delete_question_from_quiz,
+    get_quiz_version,
     create_attempt,
     get_attempt_by_id,
     get_attempts_by_student,
     get_attempts_by_quiz,
+    has_attempts_since,
     update_user,
     update_user_password,
 )
@@ -327,6 +329,50 @@ class TestQuizCRUD:
         assert len(result["questions"]) == 0
         assert result["settings"]["questionCount"] == 0
 
+class TestQuizVersion:
+    """Tests for the quiz version counter used by ETags."""
+
+    def test_create_quiz_starts_at_version_one(self, mock_db, sample_quiz_data):
+        """Test that new quizzes get version 1."""
+        create_quiz(mock_db, sample_quiz_data.copy())
+        
+        assert mock_db.quizzes.find_one({"id": sample_quiz_data["id"]})["version"] == 1
+        assert get_quiz_version(mock_db, sample_quiz_data["id"])["version"] == 1
+
+    def test_legacy_quiz_is_version_zero(self, mock_db, quiz_in_db):
+        """Test quizzes stored before versioning."""
+        meta = get_quiz_version(mock_db, quiz_in_db["id"])
+        
+        assert meta == {"version": 0, "createdBy": quiz_in_db["createdBy"]}
+
+    def test_update_quiz_bumps_version(self, mock_db, quiz_in_db):
+        """Test that update_quiz increments the version."""
+        update_quiz(mock_db, quiz_in_db["id"], {"title": "New title"})
+        
+        assert get_quiz_version(mock_db, quiz_in_db["id"])["version"] == 1
+
+    def test_question_mutations_bump_version(self, mock_db, quiz_in_db):
+        """Test that question update and delete increment the version."""
+        question_id = quiz_in_db["questions"][0]["id"]
+        update_question_in_quiz(mock_db, quiz_in_db["id"], question_id, {"content": "Changed"})
+        delete_question_from_quiz(mock_db, quiz_in_db["id"], question_id)
+        
+        assert get_quiz_version(mock_db, quiz_in_db["id"])["version"] == 2
+
+    def test_version_sees_writes_of_other_workers(self, mock_db, quiz_in_db):
+        """Test that a version bumped outside this process is seen on the next lookup."""
+        get_quiz_version(mock_db, quiz_in_db["id"])
+        mock_db.quizzes.update_one({"id": quiz_in_db["id"]}, {"$inc": {"version": 1}})
+        
+        assert get_quiz_version(mock_db, quiz_in_db["id"])["version"] == 1
+
+    def test_delete_quiz_invalidates_version(self, mock_db, quiz_in_db):
+        """Test that deleted quizzes have no version."""
+        get_quiz_version(mock_db, quiz_in_db["id"])
+        delete_quiz(mock_db, quiz_in_db["id"])
+        
+        assert get_quiz_version(mock_db, quiz_in_db["id"]) is None
+
 class TestAttemptCRUD:
     """Tests for attempt CRUD operations."""
 
@@ -356,4 +402,12 @@ class TestAttemptCRUD:
         attempts = get_attempts_by_quiz(mock_db, sample_quiz_data["id"])
         
         assert len(attempts) == 1
-        assert attempts[0]["quizId"] == sample_quiz_data["id"]
\ No newline at end of file
+        assert attempts[0]["quizId"] == sample_quiz_data["id"]
+
+    def test_has_attempts_since(self, mock_db, sample_attempt_data, sample_student_data):
+        """Test checking for attempts completed after a point in time."""
+        create_attempt(mock_db, {**sample_attempt_data, "completedAt": datetime(2025, 1, 2)})
+        
+        assert has_attempts_since(mock_db, sample_student_data["id"], datetime(2025, 1, 1)) is True
+        assert has_attempts_since(mock_db, sample_student_data["id"], datetime(2025, 1, 2)) is False
+        assert has_attempts_since(mock_db, "other-student", datetime(2025, 1, 1)) is False
\ No newline at end of file
@@ -0,0 +1,209 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for calculation_questions.py module.
+"""
+
+import os
+import sys
+import ipaddress
+import random
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from dtos import GenerateQuestionsRequest
+from calculation_questions import (
+    FAMILIES,
+    broadcast_address,
+    end_to_end_delay,
+    generate_calculation_questions,
+    hosts_per_subnet,
+    matching_families,
+    network_address,
+    plan_local_calculations,
+    same_subnet,
+    subnet_mask,
+)
+
+def make_request(**kwargs):
+    defaults = {"chapter": "Chương 4", "topics": ["Chia mạng con"], "knowledgeTypes": ["example"], "count": 10}
+    return GenerateQuestionsRequest(**{**defaults, **kwargs})
+
+ALL_TEMPLATES = [
+    template
+    for family in FAMILIES.values()
+    for templates in family["templates"].values()
+    for template in templates
+]
+
+class TestTemplates:
+    """Tests for the individual question templates."""
+
+    @pytest.mark.parametrize("template", ALL_TEMPLATES, ids=lambda template: template.__name__)
+    def test_answer_is_not_a_distractor(self, template):
+        """Test that every template has at least three distractors different from the answer."""
+        for seed in range(200):
+            _, answer, candidates, explanation = template(random.Random(seed))
+            
+            assert len({c for c in candidates if c != answer}) >= 3
+            assert answer in explanation
+
+    def test_network_and_broadcast_addresses(self):
+        """Test the network and broadcast answers against the ipaddress module."""
+        for seed in range(100):
+            content, answer, _, _ = network_address(random.Random(seed))
+            interface = ipaddress.IPv4Interface(content.split()[4])
+            assert answer == str(interface.network.network_address)
+            
+            content, answer, _, _ = broadcast_address(random.Random(seed))
+            interface = ipaddress.IPv4Interface(content.split()[-3])
+            assert answer == str(interface.network.broadcast_address)
+
+    def test_subnet_mask(self):
+        """Test that the mask answer matches the prefix in the question."""
+        content, answer, _, _ = subnet_mask(random.Random(3))
+        prefix = int(content.split("/")[1].split()[0])
+        
+        assert answer == str(ipaddress.IPv4Network(f"0.0.0.0/{prefix}").netmask)
+
+    def test_hosts_per_subnet_borrows_enough_bits(self):
+        """Test that the borrowed bits give at least the requested number of subnets."""
+        for seed in range(100):
+            content, answer, _, _ = hosts_per_subnet(random.Random(seed))
+            network = ipaddress.IPv4Network(content.split()[3])
+            subnets = int(content.split()[7])
+            host_bits = (int(answer) + 2).bit_length() - 1
+            
+            assert 2 ** (32 - network.prefixlen - host_bits) >= subnets
+            assert 2 ** (32 - network.prefixlen - host_bits - 1) < subnets
+
+    def test_same_subnet_only_answer_is_inside(self):
+        """Test that only the correct option lies in the host's subnet."""
+        for seed in range(100):
+            content, answer, candidates, _ = same_subnet(random.Random(seed))
+            network = ipaddress.IPv4Interface(content.split()[-1].rstrip("?")).network
+            
+            assert ipaddress.IPv4Address(answer) in network
+            assert not any(ipaddress.IPv4Address(c) in network for c in candidates)
+
+    def test_end_to_end_delay(self):
+        """Test the store-and-forward formula on a fixed draw."""
+        rng = random.Random(0)
+        content, answer, _, explanation = end_to_end_delay(rng)
+        
+        assert "store-and-forward" in content
+        assert explanation.endswith(f"= {answer}.")
+
+class TestPlanLocalCalculations:
+    """Tests for splitting a request between local templates and the LLM."""
+
+    def test_example_only_request_is_served_locally(self):
+        """Test that a request for calculation exercises on covered topics needs no LLM."""
+        assert plan_local_calculations(make_request()) == (10, None)
+
+    def test_mixed_knowledge_types_leave_the_rest(self):
+        """Test that only the example share is local and removed from the LLM request."""
+        local, rest = plan_local_calculations(make_request(knowledgeTypes=["concept", "example", "rule"]))
+        
+        assert local == 4
+        assert rest.count == 6
+        assert rest.knowledgeTypes == ["concept", "rule"]
+
+    def test_uncovered_topic_goes_to_llm(self):
+        """Test that requests with a topic the templates do not cover are left to the LLM."""
+        request = make_request(topics=["Chia mạng con", "Mô hình OSI"])
+        
+        assert plan_local_calculations(request) == (0, request)
+
+    def test_no_topics_uses_chapter(self):
+        """Test that without topics the chapter decides whether the templates apply."""
+        assert plan_local_calculations(make_request(topics=None, chapter="Độ trễ và thông lượng"))[0] == 10
+        assert plan_local_calculations(make_request(topics=None, chapter="Tầng ứng dụng"))[0] == 0
+
+    def test_network_layer_concepts_are_not_subnetting(self):
+        """Test that network layer topics and chapters without addressing are left to the LLM."""
+        for request in (
+            make_request(topics=["Khái niệm tầng mạng và mạch ảo/mạng gói"]),
+            make_request(topics=None, chapter="Chương 4 - Tầng mạng"),
+            make_request(topics=["Network layer services"]),
+        ):
+            assert plan_local_calculations(request) == (0, request)
+
+    def test_keywords_match_whole_words(self):
+        """Test that keywords inside longer words do not select a family."""
+        assert matching_families(make_request(topics=["Masking dữ liệu nhạy cảm"])) == []
+        assert matching_families(make_request(topics=["Subnetwork masking"])) == []
+
+    def test_ipv6_only_topics_skip_subnetting(self):
+        """Test that IPv6 topics are not served by the IPv4 subnet templates."""
+        assert matching_families(make_request(topics=["Địa chỉ IPv6"])) == []
+        assert matching_families(make_request(topics=["IPv6 subnetting"])) == []
+        
+        mixed = "Giao thức IP (IPv4/IPv6, địa chỉ IP, subnetting, VLSM, CIDR)"
+        assert matching_families(make_request(topics=[mixed])) == [("subnet", mixed)]
+
+    def test_delay_topic_is_covered(self):
+        """Test that the delay topic offered by the quiz form reaches the delay templates."""
+        topic = "Độ trễ, thông lượng và băng thông"
+        
+        assert matching_families(make_request(topics=[topic])) == [("delay", topic)]
+
+    def test_other_knowledge_types_go_to_llm(self):
+        """Test that requests without the example type are not served locally."""
+        request = make_request(knowledgeTypes=["concept"])
+        
+        assert plan_local_calculations(request) == (0, request)
+
+class TestGenerateCalculationQuestions:
+    """Tests for generating a set of calculation questions."""
+
+    def test_mixed_difficulty_and_topics(self):
+        """Test the difficulty mix, labels and distinct content of a generated set."""
+        request = make_request(topics=["Chia mạng con", "Độ trễ"])
+        
+        questions = generate_calculation_questions(request, 10, random.Random(7))
+        
+        assert len(questions) == 10
+        assert [q.difficulty for q in questions].count("easy") == 3
+        assert [q.difficulty for q in questions].count("hard") == 3
+        assert {q.topic for q in questions} == {"Chia mạng con", "Độ trễ"}
+        assert {q.knowledgeType for q in questions} == {"example"}
+        assert len({q.content for q in questions}) == 10
+        for question in questions:
+            assert len(set(question.options)) == 4
+            assert question.options[question.correctAnswer] in question.explanation
+
+    def test_fixed_difficulty(self):
+        """Test that a fixed difficulty is used for every question."""
+        questions = generate_calculation_questions(make_request(difficulty="hard"), 5, random.Random(1))
+        
+        assert {q.difficulty for q in questions} == {"hard"}
+
+    def test_exhausted_topic_borrows_from_the_others(self):
+        """Test that a topic out of distinct exercises is made up from the other requested topics."""
+        request = make_request(topics=["Chia mạng con", "Độ trễ"], difficulty="easy")
+        
+        questions = generate_calculation_questions(request, 40, random.Random(3))
+        
+        assert len(questions) == 40
+        assert len({q.content for q in questions}) == 40
+
+    def test_stops_when_templates_run_out(self):
+        """Test that only distinct exercises are returned once the templates are exhausted."""
+        questions = generate_calculation_questions(make_request(difficulty="easy"), 40, random.Random(1))
+        
+        assert 0 < len(questions) < 40
+        assert len({q.content for q in questions}) == len(questions)
@@ -0,0 +1,152 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for compression.py module.
+"""
+
+import os
+import sys
+import pytest
+from fastapi import FastAPI, WebSocket
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from compression import CompressionMiddleware, select_encoding, brotli
+
+LARGE_BODY = "Mạng máy tính " * 500
+
+@pytest.fixture
+def compressed_client():
+    """Small app wrapped in the compression middleware."""
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=1024, exclude_paths=("/api/auth/",))
+
+    @app.get("/large")
+    def large():
+        return PlainTextResponse(LARGE_BODY)
+
+    @app.get("/etag")
+    def etag():
+        return PlainTextResponse(LARGE_BODY, headers={"ETag": '"quiz-1.v3"'})
+
+    @app.get("/small")
+    def small():
+        return PlainTextResponse("ok")
+
+    @app.get("/api/auth/me")
+    def excluded():
+        return PlainTextResponse(LARGE_BODY)
+
+    @app.get("/events")
+    def events():
+        return StreamingResponse(iter(["data: " + LARGE_BODY + "\n\n"]), media_type="text/event-stream")
+
+    @app.websocket("/ws")
+    async def ws(websocket: WebSocket):
+        await websocket.accept()
+        await websocket.send_text(LARGE_BODY)
+        await websocket.close()
+
+    return TestClient(app)
+
+class TestSelectEncoding:
+    """Tests for Accept-Encoding negotiation."""
+
+    def test_prefers_brotli_on_tie(self):
+        """Test server preference when q-values are equal."""
+        assert select_encoding("gzip, br", ["br", "gzip"]) == "br"
+
+    def test_respects_q_values(self):
+        """Test that a higher q-value wins."""
+        assert select_encoding("br;q=0.5, gzip;q=0.9", ["br", "gzip"]) == "gzip"
+
+    def test_q_zero_rejects(self):
+        """Test that q=0 excludes a coding."""
+        assert select_encoding("gzip;q=0", ["gzip"]) is None
+
+    def test_wildcard(self):
+        """Test the * wildcard."""
+        assert select_encoding("*", ["gzip"]) == "gzip"
+
+    def test_identity_only(self):
+        """Test that no supported coding returns None."""
+        assert select_encoding("identity, deflate", ["br", "gzip"]) is None
+
+    def test_empty_header(self):
+        """Test missing Accept-Encoding."""
+        assert select_encoding("", ["br", "gzip"]) is None
+
+class TestCompressionMiddleware:
+    """Tests for CompressionMiddleware."""
+
+    def test_gzip_large_response(self, compressed_client):
+        """Test that large responses are gzip compressed."""
+        response = compressed_client.get("/large", headers={"Accept-Encoding": "gzip"})
+        
+        assert response.headers["content-encoding"] == "gzip"
+        assert "accept-encoding" in response.headers["vary"].lower()
+        assert response.text == LARGE_BODY
+
+    @pytest.mark.skipif(brotli is None, reason="brotli not installed")
+    def test_brotli_large_response(self, compressed_client):
+        """Test that brotli is used when accepted."""
+        response = compressed_client.get("/large", headers={"Accept-Encoding": "gzip, br"})
+        
+        assert response.headers["content-encoding"] == "br"
+        assert response.text == LARGE_BODY
+
+    def test_small_response_not_compressed(self, compressed_client):
+        """Test the size threshold."""
+        response = compressed_client.get("/small", headers={"Accept-Encoding": "gzip"})
+        
+        assert "content-encoding" not in response.headers
+
+    def test_no_accept_encoding(self, compressed_client):
+        """Test that clients without compression support get identity."""
+        response = compressed_client.get("/large", headers={"Accept-Encoding": "identity"})
+        
+        assert "content-encoding" not in response.headers
+        assert response.text == LARGE_BODY
+
+    def test_excluded_path(self, compressed_client):
+        """Test per-route opt-out."""
+        response = compressed_client.get("/api/auth/me", headers={"Accept-Encoding": "gzip"})
+        
+        assert "content-encoding" not in response.headers
+
+    def test_event_stream_not_compressed(self, compressed_client):
+        """Test that Server-Sent Events are streamed uncompressed."""
+        response = compressed_client.get("/events", headers={"Accept-Encoding": "gzip"})
+        
+        assert "content-encoding" not in response.headers
+
+    def test_websocket_passthrough(self, compressed_client):
+        """Test that WebSocket connections are not affected."""
+        with compressed_client.websocket_connect("/ws") as ws:
+            assert ws.receive_text() == LARGE_BODY
+
+    def test_etag_gets_coding_suffix(self, compressed_client):
+        """Test that compressed representations get a distinct strong ETag."""
+        response = compressed_client.get("/etag", headers={"Accept-Encoding": "gzip"})
+        
+        assert response.headers["etag"] == '"quiz-1.v3-gzip"'
+
+    def test_etag_unchanged_when_not_compressed(self, compressed_client):
+        """Test that identity responses keep the original ETag."""
+        response = compressed_client.get("/etag", headers={"Accept-Encoding": "identity"})
+        
+        assert response.headers["etag"] == '"quiz-1.v3"'
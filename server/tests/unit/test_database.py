@@ -29,6 +29,7 @@ from database import (
     get_analysis_history_by_user,
     get_analysis_history_by_id,
     delete_analysis_history,
+    find_analysis_by_fingerprint,
     add_quiz_to_discussion,
     get_quiz_discussions,
     count_quiz_discussions,
@@ -44,6 +45,8 @@ from database import (
     save_user_settings,
     get_system_settings,
     save_system_settings,
+    parse_legacy_timestamp,
+    migrate_timestamps_to_datetime,
 )
 
 class TestAnalysisHistory:
@@ -123,6 +126,23 @@ class TestAnalysisHistory:
         
         assert result is False
 
+    def test_find_analysis_by_fingerprint(self, mock_db, sample_student_data):
+        """Test that the latest analysis with the same fingerprint is found."""
+        for i, fingerprint in enumerate(["abc", "abc", "def"]):
+            create_analysis_history(mock_db, {
+                "id": f"analysis-{i}",
+                "userId": sample_student_data["id"],
+                "analysisType": "result",
+                "fingerprint": fingerprint,
+                "createdAt": datetime(2025, 1, 1 + i),
+            })
+        
+        result = find_analysis_by_fingerprint(mock_db, sample_student_data["id"], "result", "abc")
+        
+        assert result["id"] == "analysis-1"
+        assert find_analysis_by_fingerprint(mock_db, sample_student_data["id"], "overall", "abc") is None
+        assert find_analysis_by_fingerprint(mock_db, "other-user", "result", "abc") is None
+
 class TestQuizDiscussions:
     """Tests for quiz discussion functions."""
 
@@ -390,4 +410,55 @@ class TestSystemSettings:
         
         result = get_system_settings(mock_db)
         
-        assert result["defaultKeyLocked"] is False
\ No newline at end of file
+        assert result["defaultKeyLocked"] is False
+
+class TestTimestampMigration:
+    """Tests for converting legacy ISO string timestamps to datetimes."""
+
+    def test_parse_legacy_timestamp(self):
+        """Test parsing a naive ISO timestamp."""
+        result = parse_legacy_timestamp("2025-12-30T10:15:30.123456")
+        
+        assert result == datetime(2025, 12, 30, 10, 15, 30, 123456)
+
+    def test_parse_legacy_timestamp_invalid(self):
+        """Test that unparseable values return None."""
+        assert parse_legacy_timestamp("not a date") is None
+
+    def test_parse_legacy_timestamp_aware_becomes_naive(self):
+        """Test that timezone-aware strings are normalized to naive datetimes."""
+        result = parse_legacy_timestamp("2025-12-30T10:15:30+00:00")
+        
+        assert result.tzinfo is None
+
+    def test_migrate_converts_string_fields(self, mock_db):
+        """Test that string timestamps are converted in place."""
+        mock_db.quizzes.insert_one({"id": "quiz-1", "createdAt": "2025-01-01T08:00:00"})
+        mock_db.chat_messages.insert_one({"id": "msg-1", "timestamp": "2025-01-02T09:30:00"})
+        
+        summary = migrate_timestamps_to_datetime(mock_db)
+        
+        assert summary["quizzes"]["converted"] == 1
+        assert summary["chat_messages"]["converted"] == 1
+        assert mock_db.quizzes.find_one({"id": "quiz-1"})["createdAt"] == datetime(2025, 1, 1, 8, 0, 0)
+        assert isinstance(mock_db.chat_messages.find_one({"id": "msg-1"})["timestamp"], datetime)
+
+    def test_migrate_is_idempotent(self, mock_db):
+        """Test that already converted documents are left untouched."""
+        mock_db.attempts.insert_one({"id": "attempt-1", "completedAt": datetime(2025, 1, 1)})
+        mock_db.attempts.insert_one({"id": "attempt-2", "completedAt": "2025-01-03T00:00:00"})
+        
+        first = migrate_timestamps_to_datetime(mock_db)
+        second = migrate_timestamps_to_datetime(mock_db)
+        
+        assert first["attempts"]["converted"] == 1
+        assert second["attempts"]["converted"] == 0
+
+    def test_migrate_skips_unparseable(self, mock_db):
+        """Test that unparseable strings are counted and left as-is."""
+        mock_db.quiz_discussions.insert_one({"id": "disc-1", "quizId": "quiz-1", "addedAt": "garbage"})
+        
+        summary = migrate_timestamps_to_datetime(mock_db)
+        
+        assert summary["quiz_discussions"] == {"converted": 0, "skipped": 1}
+        assert mock_db.quiz_discussions.find_one({"id": "disc-1"})["addedAt"] == "garbage"
@@ -0,0 +1,168 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for fact_questions.py module.
+"""
+
+import os
+import sys
+import random
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from dtos import GenerateQuestionsRequest
+from fact_questions import (
+    OSI_LAYERS,
+    OVERLAPPING_PROTOCOLS,
+    PROTOCOLS,
+    fact_share,
+    generate_fact_questions,
+    matching_facts,
+    port_of,
+    purpose_of,
+    server_endpoint,
+)
+
+def make_request(**kwargs):
+    defaults = {
+        "chapter": "Chương 6 - Tầng ứng dụng",
+        "topics": ["Thư điện tử (SMTP, POP3, IMAP)"],
+        "knowledgeTypes": ["concept", "rule"],
+        "count": 10,
+    }
+    return GenerateQuestionsRequest(**{**defaults, **kwargs})
+
+def protocol(name):
+    return next(entry for entry in PROTOCOLS if entry["name"] == name)
+
+class TestFactTable:
+    """Tests for the curated facts and question templates."""
+
+    def test_ports_are_unique(self):
+        """Test that no two protocols claim the same default port."""
+        ports = [entry["port"] for entry in PROTOCOLS if entry["port"]]
+        
+        assert len(ports) == len(set(ports))
+
+    def test_port_question(self):
+        """Test the answer and distractors of a port question."""
+        content, answer, explanation, candidates, knowledge_type = port_of(protocol("SMTP"), random.Random(0))
+        
+        assert content == "Giao thức SMTP mặc định sử dụng cổng (port) nào?"
+        assert answer == "25"
+        assert "25" not in candidates
+        assert knowledge_type == "rule"
+        assert "TCP" in explanation
+
+    def test_dns_endpoint_uses_udp(self):
+        """Test that a DNS query goes to UDP 53 and TCP 53 is never offered as a wrong option."""
+        _, answer, explanation, candidates, _ = server_endpoint(protocol("DNS"), random.Random(0))
+        
+        assert answer == "UDP 53"
+        assert "TCP 53" not in candidates
+        assert "zone transfer" in explanation
+
+    def test_overlapping_protocols_are_not_distractors(self):
+        """Test that a purpose question never offers a protocol that also fits the purpose."""
+        for group in OVERLAPPING_PROTOCOLS:
+            for name in group:
+                for seed in range(20):
+                    _, answer, _, candidates, _ = purpose_of(protocol(name), random.Random(seed))
+                    
+                    assert answer == name
+                    assert not (group - {name}) & set(candidates)
+                    assert len(candidates) >= 3
+
+class TestMatchingFacts:
+    """Tests for selecting facts from topics and chapters."""
+
+    def test_protocols_named_in_topic(self):
+        """Test that protocols listed in a topic are matched by name."""
+        names = {fact["name"] for _, fact, _ in matching_facts(make_request())}
+        
+        assert names == {"SMTP", "POP3", "IMAP"}
+
+    def test_layer_topic(self):
+        """Test that the OSI/TCP-IP topic matches the layer facts."""
+        request = make_request(topics=["Kiến trúc phân tầng (OSI, TCP/IP)"])
+        
+        layers = [fact for kind, fact, _ in matching_facts(request) if kind == "layer"]
+        
+        assert len(layers) == len(OSI_LAYERS)
+
+    def test_chapter_without_topics(self):
+        """Test that without topics the facts of the chapter's layer are used."""
+        request = make_request(topics=None, chapter="Chương 5 - Tầng giao vận")
+        
+        assert {fact["name"] for _, fact, _ in matching_facts(request)} == {"TCP", "UDP"}
+
+    def test_unrelated_topic(self):
+        """Test that a topic naming no protocol, device or layer model matches nothing."""
+        assert matching_facts(make_request(topics=["Mô hình ứng dụng (client-server, P2P)"])) == []
+
+class TestGenerateFactQuestions:
+    """Tests for generating fact questions."""
+
+    def test_questions_are_valid_and_distinct(self):
+        """Test that generated questions have four distinct options and the answer in the explanation."""
+        request = make_request(topics=["Web và HTTP/HTTPS", "Thư điện tử (SMTP, POP3, IMAP)"], count=20)
+        
+        questions = generate_fact_questions(request, 20, random.Random(4))
+        
+        assert len(questions) == 20
+        assert len({q.content for q in questions}) == 20
+        for question in questions:
+            assert len(set(question.options)) == 4
+            assert question.knowledgeType in ("concept", "rule")
+        assert [q.difficulty for q in questions].count("medium") == 8
+
+    def test_limited_by_available_facts(self):
+        """Test that no more questions are returned than the matching facts allow."""
+        request = make_request(topics=["Phân giải tên miền (DNS)"], knowledgeTypes=["concept"])
+        
+        questions = generate_fact_questions(request, 10, random.Random(0))
+        
+        assert {q.content for q in questions} == {
+            "Giao thức nào được dùng để phân giải tên miền thành địa chỉ IP?",
+            "Giao thức DNS hoạt động ở tầng nào của mô hình OSI?",
+            "Giao thức nào sau đây KHÔNG hoạt động ở tầng Mạng (Network) của mô hình OSI?",
+        }
+
+    def test_fixed_difficulty_and_knowledge_type(self):
+        """Test that only the requested difficulty and knowledge types are produced."""
+        request = make_request(knowledgeTypes=["rule"], difficulty="easy")
+        
+        questions = generate_fact_questions(request, 10, random.Random(0))
+        
+        assert {q.content for q in questions} == {
+            f"Giao thức {name} mặc định sử dụng cổng (port) nào?" for name in ("SMTP", "POP3", "IMAP")
+        }
+
+class TestFactShare:
+    """Tests for the share of a request served from the fact table."""
+
+    def test_share_of_covered_knowledge_types(self):
+        """Test that the share follows the concept and rule part of the request."""
+        assert fact_share(make_request()) == 10
+        assert fact_share(make_request(knowledgeTypes=["concept", "mechanism", "scenario"], count=9)) == 3
+        assert fact_share(make_request(knowledgeTypes=["mechanism"])) == 0
+
+    def test_share_setting(self):
+        """Test that LOCAL_FACT_QUESTIONS_SHARE scales or disables the share."""
+        with patch("fact_questions.LOCAL_FACT_QUESTIONS_SHARE", 0.5):
+            assert fact_share(make_request()) == 5
+        with patch("fact_questions.LOCAL_FACT_QUESTIONS_SHARE", 0):
+            assert fact_share(make_request()) == 0
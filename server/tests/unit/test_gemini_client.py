@@ -0,0 +1,815 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for gemini_client.py module.
+"""
+
+import os
+import sys
+import asyncio
+import time
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import gemini_client
+from gemini_client import (
+    AdaptiveConcurrencyLimiter,
+    CircuitBreaker,
+    GeminiBusyError,
+    GeminiUnavailableError,
+    KeyConcurrencyLimiter,
+    KeyPool,
+    api_key_id,
+    breaker,
+    client_key_id,
+    get_client,
+    generate_content,
+    generate_content_stream,
+    hedge_delay,
+    latency,
+    limiter,
+    models_for,
+    retry_after_hint,
+    retry_delay,
+    slot_id,
+)
+
+class FakeAPIError(Exception):
+    """Minimal stand-in for google.genai.errors.APIError."""
+
+    def __init__(self, code, details=None, headers=None):
+        super().__init__(f"{code} error")
+        self.code = code
+        self.details = details or {}
+        self.response = MagicMock(headers=headers or {})
+
+class TestKeyIdentity:
+    """Tests for API key identifiers and client caching."""
+
+    def test_api_key_id_hides_key(self):
+        """Test that the identifier does not contain the key."""
+        key_id = api_key_id("AIzaSySecretKey123")
+        
+        assert "Secret" not in key_id
+        assert key_id == api_key_id("AIzaSySecretKey123")
+
+    def test_client_key_id_from_sdk_client(self):
+        """Test deriving the key id from a real SDK client."""
+        client = get_client("test-key-1")
+        
+        assert client_key_id(client) == api_key_id("test-key-1")
+
+    def test_get_client_is_cached(self):
+        """Test that the same key reuses one client."""
+        assert get_client("test-key-2") is get_client("test-key-2")
+        assert get_client("test-key-2") is not get_client("test-key-3")
+
+@pytest.mark.asyncio
+class TestKeyConcurrencyLimiter:
+    """Tests for the per-key limiter."""
+
+    async def test_limits_concurrency(self):
+        """Test that no more than the limit run at once."""
+        limiter = KeyConcurrencyLimiter(max_concurrency=2, max_waiting=10, wait_timeout=5)
+        running = 0
+        peak = 0
+
+        async def task():
+            nonlocal running, peak
+            async with limiter.acquire("key"):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(task() for _ in range(6)))
+        
+        assert peak == 2
+        assert "key" not in limiter.stats()
+
+    async def test_keys_are_independent(self):
+        """Test that one busy key does not block another."""
+        limiter = KeyConcurrencyLimiter(max_concurrency=1, max_waiting=0, wait_timeout=5)
+        
+        async with limiter.acquire("key-a"):
+            async with limiter.acquire("key-b"):
+                assert limiter.stats()["key-b"]["active"] == 1
+
+    async def test_is_idle(self):
+        """Test that a key is idle only when nothing runs or waits on it."""
+        limiter = KeyConcurrencyLimiter(max_concurrency=1, max_waiting=1, wait_timeout=5)
+        
+        assert limiter.is_idle("key")
+        async with limiter.acquire("key"):
+            assert not limiter.is_idle("key")
+        assert limiter.is_idle("key")
+
+    async def test_full_queue_rejects(self):
+        """Test that callers beyond the wait queue are rejected."""
+        limiter = KeyConcurrencyLimiter(max_concurrency=1, max_waiting=1, wait_timeout=5)
+        release = asyncio.Event()
+
+        async def holder():
+            async with limiter.acquire("key"):
+                await release.wait()
+
+        tasks = [asyncio.create_task(holder()) for _ in range(2)]
+        await asyncio.sleep(0)
+        
+        with pytest.raises(GeminiBusyError):
+            async with limiter.acquire("key"):
+                pass
+        
+        release.set()
+        await asyncio.gather(*tasks)
+
+    async def test_wait_timeout(self):
+        """Test that waiting too long raises GeminiBusyError and frees the queue spot."""
+        limiter = KeyConcurrencyLimiter(max_concurrency=1, max_waiting=5, wait_timeout=0.01)
+        
+        async with limiter.acquire("key"):
+            with pytest.raises(GeminiBusyError):
+                async with limiter.acquire("key"):
+                    pass
+            assert limiter.stats()["key"]["waiting"] == 0
+
+    async def test_cancelled_waiter_does_not_leak(self):
+        """Test that cancelling a queued caller keeps the slot count correct."""
+        limiter = KeyConcurrencyLimiter(max_concurrency=1, max_waiting=5, wait_timeout=5)
+
+        async def waiter():
+            async with limiter.acquire("key"):
+                pass
+
+        async with limiter.acquire("key"):
+            task = asyncio.create_task(waiter())
+            await asyncio.sleep(0)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert limiter.stats()["key"] == {"active": 1, "waiting": 0, "limit": 1}
+        
+        assert limiter.is_idle("key")
+        assert "key" not in limiter.stats()
+
+    async def test_idle_slots_are_dropped(self):
+        """Test that released slots are forgotten while the busy models of a key stay tracked."""
+        limiter = KeyConcurrencyLimiter(max_concurrency=1, max_waiting=0, wait_timeout=5)
+        
+        async with limiter.acquire(slot_id("key", "model-a")):
+            async with limiter.acquire(slot_id("key", "model-b")):
+                assert limiter.load("key") == 2
+            
+            assert list(limiter.stats()) == [slot_id("key", "model-a")]
+            assert limiter.load("key") == 1
+            assert limiter.load("other-key") == 0
+        
+        assert limiter.stats() == {}
+        assert limiter.is_idle("key")
+
+@pytest.mark.asyncio
+class TestAdaptiveConcurrencyLimiter:
+    """Tests for the AIMD limit per key and model."""
+
+    async def test_limit_grows_while_calls_succeed(self):
+        """Test that about one slot is added per window of successes, up to the ceiling."""
+        limiter = AdaptiveConcurrencyLimiter(max_concurrency=2, max_waiting=10, wait_timeout=5, max_limit=3)
+        
+        limiter.record_success("key")
+        limiter.record_success("key")
+        assert limiter.limit_for("key") == 2
+        limiter.record_success("key")
+        assert limiter.limit_for("key") == 3
+        
+        for _ in range(20):
+            limiter.record_success("key")
+        assert limiter.limit_for("key") == 3
+
+    async def test_limit_halves_on_overload(self):
+        """Test that a throttled call halves the limit, down to the floor."""
+        limiter = AdaptiveConcurrencyLimiter(max_concurrency=8, max_waiting=10, wait_timeout=5, min_limit=2)
+        
+        limiter.record_overload("key", time.monotonic())
+        assert limiter.limit_for("key") == 4
+        limiter.record_overload("key", time.monotonic())
+        limiter.record_overload("key", time.monotonic())
+        assert limiter.limit_for("key") == 2
+        assert limiter.limit_for("other-key") == 8
+
+    async def test_one_burst_halves_once(self):
+        """Test that failures of calls admitted before the last decrease are ignored."""
+        limiter = AdaptiveConcurrencyLimiter(max_concurrency=8, max_waiting=10, wait_timeout=5)
+        started = time.monotonic()
+        
+        limiter.record_overload("key", started)
+        limiter.record_overload("key", started)
+        
+        assert limiter.limit_for("key") == 4
+
+    async def test_raised_limit_admits_waiters(self):
+        """Test that a queued call starts as soon as the limit grows."""
+        limiter = AdaptiveConcurrencyLimiter(max_concurrency=1, max_waiting=10, wait_timeout=5)
+        started = asyncio.Event()
+
+        async def waiter():
+            async with limiter.acquire("key"):
+                started.set()
+
+        async with limiter.acquire("key"):
+            task = asyncio.create_task(waiter())
+            await asyncio.sleep(0)
+            assert limiter.stats()["key"]["waiting"] == 1
+            
+            limiter.record_success("key")
+            await asyncio.wait_for(started.wait(), 1)
+        await task
+        
+        assert limiter.limit_for("key") == 2
+        assert "key" not in limiter.stats()
+
+    async def test_lowered_limit_holds_back_waiters(self):
+        """Test that a finishing call does not hand its slot on while over the lowered limit."""
+        limiter = AdaptiveConcurrencyLimiter(max_concurrency=2, max_waiting=10, wait_timeout=5)
+        first, second = asyncio.Event(), asyncio.Event()
+
+        async def holder(release):
+            async with limiter.acquire("key"):
+                await release.wait()
+
+        holders = [asyncio.create_task(holder(first)), asyncio.create_task(holder(second))]
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(holder(asyncio.Event()))
+        await asyncio.sleep(0)
+        
+        limiter.record_overload("key", time.monotonic())
+        first.set()
+        await asyncio.sleep(0.01)
+        
+        assert limiter.stats()["key"] == {"active": 1, "waiting": 1, "limit": 1}
+        
+        waiter.cancel()
+        second.set()
+        await asyncio.gather(*holders, waiter, return_exceptions=True)
+
+    async def test_released_key_leaves_no_state(self):
+        """Test that the learned limit of a key is forgotten once it has been idle for the TTL."""
+        limiter = AdaptiveConcurrencyLimiter(max_concurrency=2, max_waiting=10, wait_timeout=5, idle_ttl=0)
+        
+        async with limiter.acquire("key"):
+            limiter.record_overload("key", time.monotonic())
+            assert limiter.limit_for("key") == 1
+        
+        assert limiter.limit_for("key") == 2
+        assert (limiter._slots, limiter._limits, limiter._decreased_at, limiter._idle_since) == ({}, {}, {}, {})
+
+    async def test_limit_is_kept_between_calls(self):
+        """Test that a key used again within the TTL keeps its learned limit."""
+        limiter = AdaptiveConcurrencyLimiter(max_concurrency=2, max_waiting=10, wait_timeout=5, idle_ttl=60)
+        
+        async with limiter.acquire("key"):
+            limiter.record_overload("key", time.monotonic())
+        async with limiter.acquire("key"):
+            assert limiter.limit_for("key") == 1
+        
+        assert limiter.limit_for("key") == 1
+
+    async def test_state_of_unused_slot_expires(self):
+        """Test that state recorded on a slot with no running call is expired too."""
+        limiter = AdaptiveConcurrencyLimiter(max_concurrency=2, max_waiting=10, wait_timeout=5, idle_ttl=0)
+        
+        limiter.record_success("key")
+        
+        assert limiter._limits == {}
+        assert limiter._idle_since == {}
+
+    async def test_disabled_limit_is_static(self):
+        """Test that the limit stays at the configured value when adaptation is off."""
+        limiter = AdaptiveConcurrencyLimiter(max_concurrency=4, max_waiting=10, wait_timeout=5, enabled=False)
+        
+        limiter.record_overload("key", time.monotonic())
+        limiter.record_success("key")
+        
+        assert limiter.limit_for("key") == 4
+
+    async def test_throttled_call_lowers_the_limit(self):
+        """Test that a 429 from Gemini halves the limit of that key and model only."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=[FakeAPIError(429), "response"])
+        
+        adaptive = AdaptiveConcurrencyLimiter(max_concurrency=4, max_waiting=10, wait_timeout=5)
+        
+        with patch.object(gemini_client, "limiter", adaptive), \
+             patch("gemini_client.asyncio.sleep", AsyncMock()):
+            await generate_content(client, "aimd-model", "prompt", None, key_id="aimd-key")
+        
+        assert adaptive.limit_for(slot_id("aimd-key", "aimd-model")) == 2
+        assert adaptive.limit_for(slot_id("aimd-key", "other-model")) == 4
+
+@pytest.mark.asyncio
+class TestGenerateContent:
+    """Tests for the async generate_content wrapper."""
+
+    async def test_uses_async_client(self):
+        """Test that the call goes to client.aio."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(return_value="response")
+        
+        result = await generate_content(client, "gemini-2.5-flash", "prompt", None, key_id="key")
+        
+        assert result == "response"
+        client.aio.models.generate_content.assert_awaited_once_with(
+            model="gemini-2.5-flash", contents="prompt", config=None
+        )
+        client.models.generate_content.assert_not_called()
+
+    async def test_stream_holds_slot_until_closed(self):
+        """Test that a streaming call keeps its key slot until the stream is closed."""
+        async def chunks():
+            for text in ("a", "b"):
+                yield text
+
+        client = MagicMock()
+        client.aio.models.generate_content_stream = AsyncMock(return_value=chunks())
+        
+        stream = generate_content_stream(client, "gemini-2.5-flash", "prompt", None, key_id="stream-key")
+        first = await stream.__anext__()
+        
+        assert first == "a"
+        assert limiter.stats()[slot_id("stream-key", "gemini-2.5-flash")]["active"] == 1
+        
+        await stream.aclose()
+        
+        assert limiter.is_idle("stream-key")
+
+class TestRetryPolicy:
+    """Tests for retry classification and delays."""
+
+    def test_retry_hint_from_error_details(self):
+        """Test reading RetryInfo.retryDelay from the error body."""
+        exc = FakeAPIError(429, {"error": {"code": 429, "details": [
+            {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "7s"}
+        ]}})
+        
+        assert retry_after_hint(exc) == 7.0
+
+    def test_retry_hint_from_header(self):
+        """Test reading the Retry-After header."""
+        assert retry_after_hint(FakeAPIError(503, headers={"retry-after": "3"})) == 3.0
+        assert retry_after_hint(FakeAPIError(503)) is None
+
+    def test_retry_delay_uses_hint(self):
+        """Test that a retry hint replaces the backoff, unless it is too long."""
+        assert retry_delay(FakeAPIError(429, headers={"retry-after": "2"}), 0) == 2.0
+        assert retry_delay(FakeAPIError(429, headers={"retry-after": "600"}), 0) is None
+
+    def test_retry_delay_backoff_is_capped(self):
+        """Test that jittered backoff stays within the exponential bound."""
+        with patch.object(gemini_client, "GEMINI_MAX_RETRIES", 10):
+            for attempt in range(6):
+                delay = retry_delay(FakeAPIError(503), attempt)
+                assert 0 <= delay <= min(gemini_client.GEMINI_RETRY_MAX_DELAY, gemini_client.GEMINI_RETRY_BASE_DELAY * 2 ** attempt)
+
+    def test_no_retry_for_client_errors_or_last_attempt(self):
+        """Test that 4xx errors and exhausted attempts are not retried."""
+        assert retry_delay(FakeAPIError(400), 0) is None
+        assert retry_delay(FakeAPIError(503), gemini_client.GEMINI_MAX_RETRIES) is None
+        assert retry_delay(ValueError("bad json"), 0) is None
+
+@pytest.mark.asyncio
+class TestRetries:
+    """Tests for retries around generate_content."""
+
+    async def test_retries_transient_error(self):
+        """Test that a 503 is retried and the later success is returned."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=[FakeAPIError(503), "response"])
+        
+        with patch("gemini_client.asyncio.sleep", AsyncMock()) as sleep:
+            result = await generate_content(client, "retry-model", "prompt", None, key_id="key")
+        
+        assert result == "response"
+        assert client.aio.models.generate_content.await_count == 2
+        sleep.assert_awaited_once()
+        assert limiter.is_idle("key")
+
+    async def test_gives_up_after_max_retries(self):
+        """Test that the last error is raised once retries are exhausted."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=FakeAPIError(429))
+        
+        with patch("gemini_client.asyncio.sleep", AsyncMock()):
+            with pytest.raises(FakeAPIError):
+                await generate_content(client, "quota-model", "prompt", None, key_id="key")
+        
+        assert client.aio.models.generate_content.await_count == gemini_client.GEMINI_MAX_RETRIES + 1
+        assert "quota-model" not in breaker.stats()
+
+    async def test_client_error_not_retried(self):
+        """Test that a 400 fails immediately."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=FakeAPIError(400))
+        
+        with pytest.raises(FakeAPIError):
+            await generate_content(client, "bad-model", "prompt", None, key_id="key")
+        
+        assert client.aio.models.generate_content.await_count == 1
+
+class TestCircuitBreaker:
+    """Tests for the per-model circuit breaker."""
+
+    def test_opens_after_threshold(self):
+        """Test that consecutive failures open the breaker for that model only."""
+        circuit = CircuitBreaker(failure_threshold=2, cooldown=30)
+        circuit.record_failure("model-a")
+        circuit.before_call("model-a")
+        circuit.record_failure("model-a")
+        
+        with pytest.raises(GeminiUnavailableError) as exc_info:
+            circuit.before_call("model-a")
+        
+        assert exc_info.value.retry_after > 0
+        circuit.before_call("model-b")
+
+    def test_success_resets_failures(self):
+        """Test that a success clears the failure count."""
+        circuit = CircuitBreaker(failure_threshold=2, cooldown=30)
+        circuit.record_failure("model-a")
+        circuit.record_success("model-a")
+        circuit.record_failure("model-a")
+        
+        circuit.before_call("model-a")
+
+    def test_half_open_allows_single_probe(self):
+        """Test that after the cooldown one probe goes through and decides the state."""
+        circuit = CircuitBreaker(failure_threshold=1, cooldown=30)
+        circuit.record_failure("model-a")
+        
+        with patch("gemini_client.time.monotonic", return_value=gemini_client.time.monotonic() + 31):
+            circuit.before_call("model-a")
+            with pytest.raises(GeminiUnavailableError):
+                circuit.before_call("model-a")
+            circuit.record_failure("model-a")
+            with pytest.raises(GeminiUnavailableError):
+                circuit.before_call("model-a")
+        
+        with patch("gemini_client.time.monotonic", return_value=gemini_client.time.monotonic() + 62):
+            circuit.before_call("model-a")
+            circuit.record_success("model-a")
+            circuit.before_call("model-a")
+
+@pytest.mark.asyncio
+class TestBreakerIntegration:
+    """Tests for the breaker around generate_content."""
+
+    async def test_open_breaker_fails_fast(self):
+        """Test that calls stop reaching Gemini once the breaker is open."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=FakeAPIError(503))
+        
+        with patch.object(breaker, "failure_threshold", 2), patch("gemini_client.asyncio.sleep", AsyncMock()):
+            with pytest.raises(GeminiUnavailableError):
+                await generate_content(client, "down-model", "prompt", None, key_id="key")
+            calls = client.aio.models.generate_content.await_count
+            with pytest.raises(GeminiUnavailableError):
+                await generate_content(client, "down-model", "prompt", None, key_id="key")
+        
+        assert calls == 2
+        assert client.aio.models.generate_content.await_count == calls
+        assert breaker.stats()["down-model"]["open"] is True
+        breaker.reset()
+
+class TestLatencyTracker:
+    """Tests for latency tracking and the hedge delay."""
+
+    def test_no_hedge_without_enough_samples(self):
+        """Test that hedging waits for enough latency samples."""
+        latency.reset()
+        latency.record("latency-model", 1.0)
+        
+        assert hedge_delay("latency-model") is None
+
+    def test_hedge_delay_is_p90(self):
+        """Test that the hedge delay follows the 90th percentile latency."""
+        latency.reset()
+        for i in range(1, 101):
+            latency.record("latency-model", i / 10)
+        
+        assert hedge_delay("latency-model") == pytest.approx(9.1)
+        latency.reset()
+
+    def test_hedge_delay_has_floor(self):
+        """Test that very fast models are not hedged immediately."""
+        latency.reset()
+        for _ in range(50):
+            latency.record("fast-model", 0.01)
+        
+        assert hedge_delay("fast-model") == gemini_client.GEMINI_HEDGE_MIN_DELAY
+        latency.reset()
+
+@pytest.mark.asyncio
+class TestHedging:
+    """Tests for hedged generate_content calls."""
+
+    @pytest.fixture(autouse=True)
+    def hedged_endpoint(self):
+        latency.reset()
+        for _ in range(50):
+            latency.record("hedge-model", 0.05)
+        with patch.object(gemini_client, "GEMINI_HEDGE_ENDPOINTS", {"questions"}), \
+             patch.object(gemini_client, "GEMINI_HEDGE_MIN_DELAY", 0.05):
+            yield
+        latency.reset()
+
+    async def test_slow_call_is_hedged(self):
+        """Test that a slow first call is raced by a second one and cancelled."""
+        cancelled = []
+
+        async def fake_generate(model, contents, config):
+            if not cancelled:
+                cancelled.append(False)
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled[0] = True
+                    raise
+                return "slow"
+            return "fast"
+
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=fake_generate)
+        
+        result = await generate_content(client, "hedge-model", "prompt", None, key_id="hedge-key", endpoint="questions")
+        await asyncio.sleep(0)
+        
+        assert result == "fast"
+        assert client.aio.models.generate_content.await_count == 2
+        assert cancelled == [True]
+        assert limiter.is_idle("hedge-key")
+
+    async def test_fast_call_is_not_hedged(self):
+        """Test that a call answering before the hedge delay is sent once."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(return_value="response")
+        
+        result = await generate_content(client, "hedge-model", "prompt", None, key_id="hedge-key", endpoint="questions")
+        
+        assert result == "response"
+        assert client.aio.models.generate_content.await_count == 1
+
+    async def test_other_endpoints_are_not_hedged(self):
+        """Test that hedging only applies to the configured endpoints."""
+        async def slow_generate(model, contents, config):
+            await asyncio.sleep(0.1)
+            return "slow"
+
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=slow_generate)
+        
+        result = await generate_content(client, "hedge-model", "prompt", None, key_id="hedge-key", endpoint="analysis")
+        
+        assert result == "slow"
+        assert client.aio.models.generate_content.await_count == 1
+
+@pytest.mark.asyncio
+class TestModelFallback:
+    """Tests for ordered model fallback."""
+
+    @pytest.fixture(autouse=True)
+    def fallback_models(self):
+        with patch.object(gemini_client, "GEMINI_FALLBACK_MODELS", ["lite-model", "tiny-model"]), \
+             patch.object(gemini_client, "GEMINI_FALLBACK_ENDPOINTS", {"analysis"}), \
+             patch.object(gemini_client, "GEMINI_MAX_RETRIES", 0):
+            yield
+
+    def test_models_for_endpoint(self):
+        """Test that fallback models are only used for configured endpoints."""
+        assert models_for("analysis", "main-model") == ["main-model", "lite-model", "tiny-model"]
+        assert models_for("analysis", "lite-model") == ["lite-model", "tiny-model"]
+        assert models_for("questions", "main-model") == ["main-model"]
+
+    async def test_overloaded_model_falls_back_in_order(self):
+        """Test that an overloaded primary moves on to the next model."""
+        async def fake_generate(model, contents, config):
+            if model == "main-model":
+                raise FakeAPIError(503)
+            return f"from {model}"
+
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=fake_generate)
+        
+        result = await generate_content(client, "main-model", "prompt", None, key_id="key", endpoint="analysis")
+        
+        assert result == "from lite-model"
+        models = [call.kwargs["model"] for call in client.aio.models.generate_content.await_args_list]
+        assert models == ["main-model", "lite-model"]
+        breaker.reset()
+
+    async def test_bad_request_does_not_fall_back(self):
+        """Test that errors unrelated to load are raised without trying other models."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=FakeAPIError(400))
+        
+        with pytest.raises(FakeAPIError):
+            await generate_content(client, "main-model", "prompt", None, key_id="key", endpoint="analysis")
+        
+        assert client.aio.models.generate_content.await_count == 1
+
+    async def test_last_error_raised_when_all_models_fail(self):
+        """Test that the error of the last fallback model is raised."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=FakeAPIError(429))
+        
+        with pytest.raises(FakeAPIError):
+            await generate_content(client, "main-model", "prompt", None, key_id="key", endpoint="analysis")
+        
+        assert client.aio.models.generate_content.await_count == 3
+
+    async def test_stream_falls_back_when_opening(self):
+        """Test that a stream that cannot be opened moves to the fallback model."""
+        async def chunks():
+            yield "a"
+
+        async def open_stream(model, contents, config):
+            if model == "main-model":
+                raise FakeAPIError(503)
+            return chunks()
+
+        client = MagicMock()
+        client.aio.models.generate_content_stream = AsyncMock(side_effect=open_stream)
+        
+        received = [chunk async for chunk in generate_content_stream(
+            client, "main-model", "prompt", None, key_id="key", endpoint="analysis"
+        )]
+        
+        assert received == ["a"]
+        assert client.aio.models.generate_content_stream.await_args.kwargs["model"] == "lite-model"
+        breaker.reset()
+
+    async def test_stream_fallback_credits_the_held_slot(self):
+        """Test that a stream opened on a fallback model adapts the limit of the slot it holds."""
+        async def chunks():
+            yield "a"
+
+        async def open_stream(model, contents, config):
+            if model == "main-model":
+                raise FakeAPIError(503)
+            return chunks()
+
+        client = MagicMock()
+        client.aio.models.generate_content_stream = AsyncMock(side_effect=open_stream)
+        adaptive = AdaptiveConcurrencyLimiter(max_concurrency=1, max_waiting=10, wait_timeout=5, min_limit=1, max_limit=4)
+        
+        with patch.object(gemini_client, "limiter", adaptive):
+            received = [chunk async for chunk in generate_content_stream(
+                client, "main-model", "prompt", None, key_id="key", endpoint="analysis"
+            )]
+        
+        assert received == ["a"]
+        assert adaptive.limit_for(slot_id("key", "main-model")) == 2
+        assert adaptive.limit_for(slot_id("key", "lite-model")) == 1
+        assert adaptive.is_idle("key")
+        breaker.reset()
+
+def make_pool_clients(*api_keys):
+    """Mock clients that client_key_id maps to their API key"""
+    clients = {}
+    for api_key in api_keys:
+        client = MagicMock()
+        client._api_client.api_key = api_key
+        clients[api_key] = client
+    return clients
+
+@pytest.mark.asyncio
+class TestKeyPool:
+    """Tests for choosing among the system API keys."""
+
+    @pytest.fixture
+    def clients(self):
+        clients = make_pool_clients("pool-key-1", "pool-key-2")
+        with patch("gemini_client.get_client", side_effect=clients.__getitem__):
+            yield clients
+
+    async def test_least_loaded_key_is_chosen(self, clients):
+        """Test that a call goes to the key with the fewest running calls."""
+        pool = KeyPool(["pool-key-1", "pool-key-2"])
+        
+        async with limiter.acquire(api_key_id("pool-key-1")):
+            assert pool.choose() is clients["pool-key-2"]
+            assert pool.has_idle_key()
+        
+        async with limiter.acquire(api_key_id("pool-key-2")):
+            assert pool.choose() is clients["pool-key-1"]
+
+    async def test_rate_limited_key_cools_down(self, clients):
+        """Test that a key answering 429 is skipped until its cooldown ends."""
+        pool = KeyPool(["pool-key-1", "pool-key-2"], cooldown=60)
+        
+        pool.record_rate_limited(api_key_id("pool-key-1"))
+        
+        assert pool.choose() is clients["pool-key-2"]
+        assert pool.has_alternative(api_key_id("pool-key-2")) is False
+        stats = {entry["key"]: entry for entry in pool.stats()}
+        assert stats[api_key_id("pool-key-1")]["rateLimited"] == 1
+        assert stats[api_key_id("pool-key-1")]["coolingDownFor"] > 0
+        
+        pool.record_rate_limited(api_key_id("pool-key-2"), retry_after=120)
+        
+        assert pool.choose() is clients["pool-key-1"]
+        assert pool.choose(exclude={api_key_id("pool-key-1")}) is None
+        
+        pool.reset()
+        assert pool.has_alternative(api_key_id("pool-key-1"))
+
+    async def test_per_minute_budget(self, clients):
+        """Test that a key which used its requests-per-minute budget is skipped."""
+        pool = KeyPool(["pool-key-1", "pool-key-2"], requests_per_minute=1)
+        
+        pool.record_call(api_key_id("pool-key-1"))
+        
+        assert pool.choose() is clients["pool-key-2"]
+        assert pool.stats()[0]["callsLastMinute"] == 1
+
+    async def test_unknown_keys_are_ignored(self, clients):
+        """Test that personal keys are not tracked and an empty pool has no client."""
+        pool = KeyPool([None, "pool-key-1"])
+        
+        pool.record_rate_limited(api_key_id("personal-key"))
+        pool.record_call(api_key_id("personal-key"))
+        
+        assert len(pool) == 1
+        assert api_key_id("personal-key") not in pool
+        assert KeyPool().choose() is None
+
+    async def test_rate_limited_call_moves_to_another_key(self, clients):
+        """Test that a 429 on a pooled key is retried at once on another key."""
+        clients["pool-key-1"].aio.models.generate_content = AsyncMock(side_effect=FakeAPIError(429))
+        clients["pool-key-2"].aio.models.generate_content = AsyncMock(return_value="response")
+        
+        with patch.object(gemini_client, "key_pool", KeyPool(["pool-key-1", "pool-key-2"])) as pool, \
+             patch("gemini_client.asyncio.sleep", AsyncMock()) as sleep:
+            result = await generate_content(clients["pool-key-1"], "pool-model", "prompt", None)
+        
+        assert result == "response"
+        assert clients["pool-key-1"].aio.models.generate_content.await_count == 1
+        sleep.assert_not_awaited()
+        assert pool.choose() is clients["pool-key-2"]
+
+    async def test_rate_limited_key_rotates_before_model_fallback(self, clients):
+        """Test that a 429 on a pooled key keeps the requested model and moves to another key."""
+        clients["pool-key-1"].aio.models.generate_content = AsyncMock(side_effect=FakeAPIError(429))
+        clients["pool-key-2"].aio.models.generate_content = AsyncMock(return_value="response")
+        
+        with patch.object(gemini_client, "key_pool", KeyPool(["pool-key-1", "pool-key-2"])), \
+             patch.object(gemini_client, "GEMINI_FALLBACK_MODELS", ["lite-model"]), \
+             patch.object(gemini_client, "GEMINI_FALLBACK_ENDPOINTS", {"analysis"}):
+            result = await generate_content(clients["pool-key-1"], "pool-model", "prompt", None, endpoint="analysis")
+        
+        assert result == "response"
+        assert clients["pool-key-1"].aio.models.generate_content.await_count == 1
+        assert clients["pool-key-2"].aio.models.generate_content.call_args.kwargs["model"] == "pool-model"
+
+    async def test_exhausted_pool_falls_back_to_lighter_model(self, clients):
+        """Test that the lighter model is tried once every pooled key is throttled."""
+        async def throttled_main(model, contents, config):
+            if model == "pool-model":
+                raise FakeAPIError(429)
+            return f"from {model}"
+
+        for client in clients.values():
+            client.aio.models.generate_content = AsyncMock(side_effect=throttled_main)
+        
+        with patch.object(gemini_client, "key_pool", KeyPool(["pool-key-1", "pool-key-2"])), \
+             patch.object(gemini_client, "GEMINI_FALLBACK_MODELS", ["lite-model"]), \
+             patch.object(gemini_client, "GEMINI_FALLBACK_ENDPOINTS", {"analysis"}), \
+             patch.object(gemini_client, "GEMINI_MAX_RETRIES", 0):
+            result = await generate_content(clients["pool-key-1"], "pool-model", "prompt", None, endpoint="analysis")
+        
+        assert result == "from lite-model"
+        assert [call.kwargs["model"] for call in clients["pool-key-1"].aio.models.generate_content.await_args_list] == ["pool-model"]
+        assert [call.kwargs["model"] for call in clients["pool-key-2"].aio.models.generate_content.await_args_list] == ["pool-model", "lite-model"]
+
+    async def test_rate_limited_everywhere_raises(self, clients):
+        """Test that the 429 is raised once every pooled key is throttled."""
+        for client in clients.values():
+            client.aio.models.generate_content = AsyncMock(side_effect=FakeAPIError(429))
+        
+        with patch.object(gemini_client, "key_pool", KeyPool(["pool-key-1", "pool-key-2"])), \
+             patch.object(gemini_client, "GEMINI_MAX_RETRIES", 0):
+            with pytest.raises(FakeAPIError):
+                await generate_content(clients["pool-key-1"], "pool-model", "prompt", None)
+        
+        assert all(client.aio.models.generate_content.await_count == 1 for client in clients.values())
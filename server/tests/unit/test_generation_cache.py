@@ -0,0 +1,131 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for generation_cache.py module.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from dtos import GenerateQuestionsRequest
+from generation_cache import (
+    cache_key,
+    clear_generation_cache,
+    get_cached_pool,
+    pool_size_for,
+    sample_questions,
+    store_pool,
+)
+
+def make_questions(prefix, count, difficulty="medium"):
+    return [
+        {"id": f"{prefix}-{i}", "content": f"{prefix} {i}", "options": ["A", "B", "C", "D"],
+         "correctAnswer": 0, "difficulty": difficulty}
+        for i in range(count)
+    ]
+
+class TestCacheKey:
+    """Tests for request normalization."""
+
+    def test_order_case_and_count_are_ignored(self):
+        """Test that equivalent requests share a key."""
+        a = GenerateQuestionsRequest(chapter="Chương 3", topics=["TCP", "UDP"], count=10)
+        b = GenerateQuestionsRequest(chapter=" chương 3 ", topics=["udp", "tcp", "TCP"], count=20)
+        
+        assert cache_key(a, "gemini-2.5-flash") == cache_key(b, "gemini-2.5-flash")
+
+    def test_model_and_difficulty_are_part_of_key(self):
+        """Test that a different model or difficulty gets its own pool."""
+        params = GenerateQuestionsRequest(topics=["TCP"], count=10)
+        
+        assert cache_key(params, "gemini-2.5-flash") != cache_key(params, "gemini-2.5-pro")
+        assert cache_key(params, "m") != cache_key(params.model_copy(update={"difficulty": "hard"}), "m")
+
+    def test_pool_size(self):
+        """Test that the pool factor is applied and capped, and adds nothing by default."""
+        assert pool_size_for(10) == 10
+        
+        with patch("generation_cache.GENERATION_CACHE_POOL_FACTOR", 2.0), \
+                patch("generation_cache.GENERATION_CACHE_MAX_POOL", 30):
+            assert pool_size_for(10) == 20
+            assert pool_size_for(20) == 30
+            assert pool_size_for(40) == 40
+
+class TestPoolStorage:
+    """Tests for storing and reading pools."""
+
+    def test_store_and_get(self, mock_db):
+        """Test that a stored pool is readable from Mongo after the memory front is cleared."""
+        params = GenerateQuestionsRequest(topics=["TCP"], count=3)
+        store_pool(mock_db, "key", "m", params, make_questions("q", 3))
+        clear_generation_cache()
+        
+        pool = get_cached_pool(mock_db, "key")
+        
+        assert [q["content"] for q in pool] == ["q 0", "q 1", "q 2"]
+        assert mock_db.generation_cache.find_one({"key": "key"})["params"]["topics"] == ["tcp"]
+
+    def test_expired_pool_is_ignored(self, mock_db):
+        """Test that an expired entry is a miss."""
+        mock_db.generation_cache.insert_one({
+            "key": "old",
+            "questions": make_questions("q", 3),
+            "expiresAt": datetime.now() - timedelta(seconds=1),
+        })
+        
+        assert get_cached_pool(mock_db, "old") is None
+
+    def test_merge_dedupes_and_caps(self, mock_db):
+        """Test that new questions are merged first and the pool is capped."""
+        params = GenerateQuestionsRequest(count=3)
+        store_pool(mock_db, "key", "m", params, make_questions("a", 3))
+        
+        with patch("generation_cache.GENERATION_CACHE_MAX_POOL", 4):
+            pool = store_pool(mock_db, "key", "m", params, make_questions("b", 2) + make_questions("a", 1))
+        
+        assert [q["content"] for q in pool] == ["b 0", "b 1", "a 0", "a 1"]
+
+class TestSampleQuestions:
+    """Tests for sampling from a pool."""
+
+    def test_mixed_sample_keeps_mix(self):
+        """Test that a mixed sample follows 30/40/30 when the pool allows it."""
+        pool = make_questions("e", 10, "easy") + make_questions("m", 10, "medium") + make_questions("h", 10, "hard")
+        
+        sample = sample_questions(pool, 10, mixed=True)
+        
+        levels = [q["difficulty"] for q in sample]
+        assert (levels.count("easy"), levels.count("medium"), levels.count("hard")) == (3, 4, 3)
+
+    def test_mixed_sample_fills_shortfall(self):
+        """Test that a level with too few questions is filled from the others."""
+        pool = make_questions("m", 10, "medium")
+        
+        sample = sample_questions(pool, 5, mixed=True)
+        
+        assert len(sample) == 5
+        assert len({q["id"] for q in sample}) == 5
+
+    def test_samples_vary(self):
+        """Test that repeated samples from a larger pool differ."""
+        pool = make_questions("q", 40)
+        
+        samples = {tuple(q["id"] for q in sample_questions(pool, 10, mixed=False)) for _ in range(5)}
+        
+        assert len(samples) > 1
@@ -0,0 +1,134 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for llm_json.py module.
+"""
+
+import os
+import sys
+import json
+import pytest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from llm_json import JsonObjectStream, extract_object, extract_objects
+
+RESPONSE = '''```json
+[
+    {"content": "Giao thức {TCP} là gì?", "options": ["A", "B"], "correctAnswer": 0},
+    {"content": "Ký tự \\\\\\" và \\\\\\\\ trong chuỗi", "options": ["}", "{"], "correctAnswer": 1}
+]
+```'''
+
+class TestJsonObjectStream:
+    """Tests for incremental object extraction."""
+
+    def test_extracts_objects_from_fenced_array(self):
+        """Test that each top-level object is returned once."""
+        objects = JsonObjectStream().feed(RESPONSE)
+        
+        assert len(objects) == 2
+        assert json.loads(objects[0])["content"] == "Giao thức {TCP} là gì?"
+        assert json.loads(objects[1])["options"] == ["}", "{"]
+
+    def test_chunk_boundaries_do_not_matter(self):
+        """Test that splitting the text anywhere gives the same objects."""
+        expected = JsonObjectStream().feed(RESPONSE)
+        
+        for size in (1, 2, 3, 7, 16):
+            stream = JsonObjectStream()
+            objects = []
+            for i in range(0, len(RESPONSE), size):
+                objects.extend(stream.feed(RESPONSE[i:i + size]))
+            assert objects == expected
+
+    def test_object_is_returned_when_closed(self):
+        """Test that an object is returned by the chunk that closes it."""
+        stream = JsonObjectStream()
+        
+        assert stream.feed('[{"content": "a", "nested": {"x": 1}') == []
+        assert stream.feed('}, {"content"') == ['{"content": "a", "nested": {"x": 1}}']
+        assert stream.feed(': "b"}]') == ['{"content": "b"}']
+
+    def test_text_without_objects(self):
+        """Test that prose without objects yields nothing."""
+        assert JsonObjectStream().feed("Xin lỗi, tôi không thể tạo câu hỏi.") == []
+
+class TestExtractObjects:
+    """Tests for tolerant decoding of complete responses."""
+
+    def test_broken_object_is_skipped_with_diagnostic(self):
+        """Test that one malformed object does not discard the others."""
+        text = '[{"content": "a"}, {"content": "b" "options": []}, {"content": "c"}]'
+        
+        objects, diagnostics = extract_objects(text)
+        
+        assert [o["content"] for o in objects] == ["a", "c"]
+        assert len(diagnostics) == 1
+        assert diagnostics[0].startswith("offset 19:")
+
+    def test_trailing_commas_are_tolerated(self):
+        """Test that trailing commas inside an object are dropped."""
+        objects, diagnostics = extract_objects('{"strengths": ["TCP", "UDP",], "score": 1,}')
+        
+        assert objects == [{"strengths": ["TCP", "UDP"], "score": 1}]
+        assert diagnostics == []
+
+    def test_unterminated_object_is_reported(self):
+        """Test that a truncated response reports the unfinished object."""
+        objects, diagnostics = extract_objects('[{"content": "a"}, {"content": "b", "opt')
+        
+        assert objects == [{"content": "a"}]
+        assert "unterminated object" in diagnostics[0]
+
+    def test_plain_json_array_is_decoded_directly(self):
+        """Test that a schema-constrained array is decoded without scanning."""
+        text = json.dumps([{"content": "a", "note": "{"}, {"content": "b"}, 3])
+        
+        with patch.object(JsonObjectStream, "feed") as feed:
+            objects, diagnostics = extract_objects(text)
+        
+        feed.assert_not_called()
+        assert objects == [{"content": "a", "note": "{"}, {"content": "b"}]
+        assert diagnostics == ["index 2: not an object"]
+
+    def test_plain_json_object_is_decoded_directly(self):
+        """Test that a schema-constrained object is returned as the only object."""
+        objects, diagnostics = extract_objects('{"overallFeedback": "Tốt", "strengths": ["OSI"]}')
+        
+        assert objects == [{"overallFeedback": "Tốt", "strengths": ["OSI"]}]
+        assert diagnostics == []
+
+    def test_extract_object_skips_prose(self):
+        """Test that the first object is found inside prose and fences."""
+        text = 'Đây là kết quả:\n```json\n{"overallFeedback": "Tốt", "strengths": []}\n```\nCảm ơn!'
+        
+        assert extract_object(text) == {"overallFeedback": "Tốt", "strengths": []}
+
+    def test_extract_object_without_object(self):
+        """Test that a response without any object raises ValueError."""
+        with pytest.raises(ValueError):
+            extract_object("Không có dữ liệu")
+
+    def test_large_response_is_linear(self):
+        """Test that a large response with many objects is handled in one pass."""
+        item = '{"content": "' + "x" * 200 + '", "options": ["A", "B", "C", "D"], "correctAnswer": 0}'
+        text = "[" + ",".join([item] * 5000) + "]" + "{" * 10000
+        
+        objects, diagnostics = extract_objects(text)
+        
+        assert len(objects) == 5000
+        assert len(diagnostics) == 1
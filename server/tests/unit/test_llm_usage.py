@@ -0,0 +1,148 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for llm_usage.py module.
+"""
+
+import os
+import sys
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from llm_usage import (
+    bucket_start,
+    flush_usage,
+    histogram_quantile,
+    latency_label,
+    summarize_usage,
+    token_counts,
+    usage,
+)
+
+class TestHelpers:
+    """Tests for bucketing and token extraction."""
+
+    def test_bucket_start_is_hourly(self):
+        """Test that calls in the same hour share a bucket."""
+        assert bucket_start(datetime(2025, 1, 1, 10, 5)) == bucket_start(datetime(2025, 1, 1, 10, 55))
+        assert bucket_start(datetime(2025, 1, 1, 10, 5)) != bucket_start(datetime(2025, 1, 1, 11, 5))
+
+    def test_latency_label(self):
+        """Test mapping latencies to histogram buckets."""
+        assert latency_label(0.1) == "250"
+        assert latency_label(1.0) == "1000"
+        assert latency_label(1.2) == "1500"
+        assert latency_label(500) == "inf"
+
+    def test_token_counts(self):
+        """Test reading usage metadata, treating missing counts as zero."""
+        metadata = MagicMock(prompt_token_count=10, candidates_token_count=5, thoughts_token_count=None, total_token_count=15)
+        
+        assert token_counts(metadata) == {
+            "promptTokens": 10, "responseTokens": 5, "thoughtTokens": 0, "cachedTokens": 0, "totalTokens": 15,
+        }
+        assert token_counts(None)["totalTokens"] == 0
+
+    def test_histogram_quantile(self):
+        """Test quantiles over a latency histogram."""
+        histogram = {"500": 50, "1000": 40, "5000": 10}
+        
+        assert histogram_quantile(histogram, 0.5) == 500.0
+        assert histogram_quantile(histogram, 0.95) == 5000.0
+        assert histogram_quantile({}, 0.5) is None
+
+class TestRecordAndFlush:
+    """Tests for aggregating and flushing call records."""
+
+    @pytest.fixture(autouse=True)
+    def clean_usage(self):
+        usage.clear()
+        yield
+        usage.clear()
+
+    def test_records_are_merged_per_bucket(self, mock_db):
+        """Test that calls of one model and endpoint end up in one document."""
+        metadata = MagicMock(prompt_token_count=100, candidates_token_count=20, thoughts_token_count=5, total_token_count=125)
+        usage.record("gemini-2.5-flash", "questions", "student-123", 0.8, metadata)
+        usage.record("gemini-2.5-flash", "questions", "student-123", 2.5, metadata)
+        usage.record("gemini-2.5-flash", "questions", "student-456", 0.1, error=True)
+        
+        assert flush_usage(mock_db) == 1
+        
+        document = mock_db.llm_usage.find_one({}, {"_id": 0})
+        assert document["calls"] == 3
+        assert document["errors"] == 1
+        assert document["promptTokens"] == 200
+        assert document["totalTokens"] == 250
+        assert document["latency"] == {"1000": 1, "3000": 1}
+        assert document["users"]["student-123"] == {"calls": 2, "tokens": 250}
+        assert document["users"]["student-456"] == {"calls": 1}
+
+    def test_flush_increments_existing_document(self, mock_db):
+        """Test that later flushes add to the stored bucket."""
+        usage.record("gemini-2.5-flash", "analysis", None, 1.0)
+        flush_usage(mock_db)
+        usage.record("gemini-2.5-flash", "analysis", None, 1.0)
+        flush_usage(mock_db)
+        
+        assert mock_db.llm_usage.count_documents({}) == 1
+        assert mock_db.llm_usage.find_one()["calls"] == 2
+        assert flush_usage(mock_db) == 0
+
+    def test_summarize_per_model_and_endpoint(self, mock_db):
+        """Test the per-model and per-endpoint summaries."""
+        metadata = MagicMock(prompt_token_count=10, candidates_token_count=10, thoughts_token_count=0, total_token_count=20)
+        for _ in range(19):
+            usage.record("gemini-2.5-flash", "questions", None, 0.4, metadata)
+        usage.record("gemini-2.5-flash", "analysis", None, 9.0, metadata)
+        usage.record("gemini-2.5-pro", "analysis", None, 2.0, metadata)
+        flush_usage(mock_db)
+        
+        summary = summarize_usage(mock_db, datetime.now() - timedelta(hours=1))
+        
+        flash = next(item for item in summary["byModel"] if item["key"] == "gemini-2.5-flash")
+        assert flash["calls"] == 20
+        assert flash["totalTokens"] == 400
+        assert flash["p50Ms"] == 500.0
+        assert flash["p95Ms"] == 500.0
+        analysis = next(item for item in summary["byEndpoint"] if item["key"] == "analysis")
+        assert analysis["calls"] == 2
+        assert analysis["p95Ms"] == 10000.0
+        assert summarize_usage(mock_db, datetime.now() + timedelta(hours=2)) == {"byModel": [], "byEndpoint": []}
+
+    def test_concurrency_gauges(self, mock_db):
+        """Test that the queue length and limit keep their extremes across flushes."""
+        usage.record_concurrency("gemini-2.5-flash", "questions", 8, 0)
+        usage.record_concurrency("gemini-2.5-flash", "questions", 4, 3)
+        flush_usage(mock_db)
+        usage.record_concurrency("gemini-2.5-flash", "questions", 2, 1)
+        flush_usage(mock_db)
+        
+        document = mock_db.llm_usage.find_one({}, {"_id": 0})
+        assert document["maxWaiting"] == 3
+        assert document["minConcurrencyLimit"] == 2
+        assert document["maxConcurrencyLimit"] == 8
+        
+        usage.record("gemini-2.5-pro", "questions", None, 1.0)
+        flush_usage(mock_db)
+        summary = summarize_usage(mock_db, datetime.now() - timedelta(hours=1))
+        
+        questions = summary["byEndpoint"][0]
+        assert (questions["maxWaiting"], questions["minConcurrencyLimit"], questions["maxConcurrencyLimit"]) == (3, 2, 8)
+        pro = next(item for item in summary["byModel"] if item["key"] == "gemini-2.5-pro")
+        assert pro["minConcurrencyLimit"] is None
@@ -0,0 +1,186 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for local_analysis.py module.
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from dtos import AnalyzeOverallRequest, AnalyzeProgressRequest, AnalyzeResultRequest, Question
+from local_analysis import (
+    LOCAL_ANALYSIS_NOTE,
+    MAX_SUGGESTED_TOPICS,
+    analyze_locally,
+    analyze_overall_locally,
+    analyze_progress_locally,
+    analyze_result_locally,
+)
+
+def make_question(index, topic, knowledge_type="concept", difficulty="medium", chapter="Chương 4"):
+    return Question(
+        id=f"q{index}", content=f"Câu {index}", options=["A", "B", "C", "D"], correctAnswer=0,
+        chapter=chapter, topic=topic, knowledgeType=knowledge_type, difficulty=difficulty,
+    )
+
+def make_attempt(rows, unanswered=()):
+    """rows: (topic, knowledge type, difficulty, answered correctly)"""
+    questions = [make_question(i, topic, kind, level) for i, (topic, kind, level, _) in enumerate(rows)]
+    answers = {q.id: (0 if correct else 1) for q, (_, _, _, correct) in zip(questions, rows) if q.id not in unanswered}
+    return AnalyzeResultRequest(quizTitle="Đề", questions=questions, answers=answers, score=0, timeSpent=60)
+
+class TestAnalyzeResultLocally:
+    """Tests for the rule-based analysis of one attempt."""
+
+    def test_strong_and_weak_topics(self):
+        """Test that topics are split into strengths and weaknesses by accuracy."""
+        params = make_attempt(
+            [("IP", "concept", "medium", True)] * 4
+            + [("Định tuyến", "mechanism", "medium", False)] * 3 + [("Định tuyến", "mechanism", "medium", True)]
+        )
+        
+        result = analyze_result_locally(params)
+        
+        assert "Nắm vững IP (Chương 4): đúng 4/4 câu" in result.strengths
+        assert "Chưa vững Định tuyến (Chương 4): đúng 1/4 câu" in result.weaknesses
+        assert "Còn yếu ở dạng câu hỏi cơ chế hoạt động: đúng 1/4 câu" in result.weaknesses
+        assert result.suggestedTopics == ["Định tuyến"]
+        assert result.overallFeedback.startswith("Kết quả trung bình: bạn trả lời đúng 5/8 câu (62%).")
+        assert "tốt nhất ở chủ đề IP" in result.overallFeedback
+        assert result.overallFeedback.endswith(LOCAL_ANALYSIS_NOTE)
+        assert "Luyện thêm câu hỏi dạng cơ chế hoạt động" in result.suggestedNextActions
+
+    def test_suggested_topics_weakest_first(self):
+        """Test that every topic below the strong threshold is suggested, weakest first."""
+        rows = []
+        for i in range(MAX_SUGGESTED_TOPICS + 2):
+            rows += [(f"Chủ đề {i}", "concept", "medium", True)] * i + [(f"Chủ đề {i}", "concept", "medium", False)] * 2
+        
+        result = analyze_result_locally(make_attempt(rows))
+        
+        assert result.suggestedTopics == [f"Chủ đề {i}" for i in range(MAX_SUGGESTED_TOPICS)]
+
+    def test_difficulty_and_unanswered(self):
+        """Test the findings on easy and hard questions and skipped answers."""
+        params = make_attempt(
+            [("IP", "concept", "easy", False), ("IP", "concept", "easy", True),
+             ("IP", "concept", "hard", True), ("IP", "concept", "hard", True)],
+            unanswered={"q0"},
+        )
+        
+        result = analyze_result_locally(params)
+        
+        assert "Làm tốt các câu hỏi khó: đúng 2/2 câu" in result.strengths
+        assert "Còn sai 1/2 câu dễ, cần củng cố kiến thức nền tảng" in result.weaknesses
+        assert "Bỏ trống 1 câu" in result.weaknesses
+        assert "Phân bổ thời gian để trả lời hết các câu hỏi" in result.suggestedNextActions
+
+    def test_perfect_attempt(self):
+        """Test that a perfect attempt suggests harder quizzes and no review."""
+        result = analyze_result_locally(make_attempt([("IP", "concept", "hard", True)] * 3))
+        
+        assert result.weaknesses == []
+        assert result.suggestedTopics == []
+        assert result.suggestedNextActions == ["Thử sức với đề có độ khó cao hơn"]
+        assert result.overallFeedback.startswith("Kết quả rất tốt")
+
+    def test_empty_attempt(self):
+        """Test that an attempt without questions gives an empty analysis."""
+        result = analyze_result_locally(make_attempt([]))
+        
+        assert result.strengths == [] and result.weaknesses == []
+        assert "không có câu hỏi" in result.overallFeedback
+
+class TestAnalyzeOverallLocally:
+    """Tests for the rule-based overall analysis."""
+
+    def test_groups_are_merged_by_topic(self):
+        """Test that knowledge groups of the same topic are counted together."""
+        params = AnalyzeOverallRequest(attemptCount=2, avgScore=45, knowledgeAnalysis=[
+            {"knowledgeType": "concept", "chapter": "Chương 3", "topic": "TCP", "totalQuestions": 4, "correctAnswers": 1, "accuracy": 25},
+            {"knowledgeType": "rule", "chapter": "Chương 3", "topic": "TCP", "totalQuestions": 6, "correctAnswers": 3, "accuracy": 50},
+            {"knowledgeType": "concept", "chapter": "Chương 3", "topic": "UDP", "totalQuestions": 5, "correctAnswers": 5, "accuracy": 100},
+        ])
+        
+        result = analyze_overall_locally(params)
+        
+        assert "Chưa vững TCP (Chương 3): đúng 4/10 câu" in result.weaknesses
+        assert "Nắm vững UDP (Chương 3): đúng 5/5 câu" in result.strengths
+        assert result.suggestedTopics == ["TCP"]
+        assert result.overallFeedback.startswith("Kết quả chưa đạt: sau 2 lần làm bài, điểm trung bình của bạn là 45.0.")
+        assert "Làm thêm vài đề để có đủ dữ liệu đánh giá" in result.suggestedNextActions
+
+    def test_groups_without_questions_are_ignored(self):
+        """Test that empty groups are neither strengths nor weaknesses."""
+        params = AnalyzeOverallRequest(attemptCount=5, avgScore=90, knowledgeAnalysis=[
+            {"knowledgeType": "concept", "chapter": "Chương 3", "topic": "TCP", "totalQuestions": 0, "correctAnswers": 0, "accuracy": 0},
+        ])
+        
+        result = analyze_overall_locally(params)
+        
+        assert result.strengths == [] and result.weaknesses == [] and result.suggestedTopics == []
+
+class TestAnalyzeProgressLocally:
+    """Tests for the rule-based progress analysis."""
+
+    @staticmethod
+    def make_progress(scores, trend, avg=None):
+        points = [{"date": f"2025-01-0{i + 1}", "score": score, "quizTitle": f"Đề {i + 1}"} for i, score in enumerate(scores)]
+        avg = avg if avg is not None else sum(scores) / len(scores)
+        return AnalyzeProgressRequest(chapter="Chương 5", progressData=points, avgScore=avg, trend=trend)
+
+    def test_improving_trend(self):
+        """Test that rising scores are a strength."""
+        result = analyze_progress_locally(self.make_progress([60, 70, 85], "improving"))
+        
+        assert "Điểm số tăng từ 60.0 lên 85.0" in result.strengths
+        assert 'Điểm cao nhất 85.0 ở bài "Đề 3" (2025-01-03)' in result.strengths
+        assert result.suggestedTopics == ["Chương 5"]
+        assert "Duy trì lịch ôn tập hiện tại" in result.suggestedNextActions
+
+    def test_declining_and_unsteady(self):
+        """Test that falling, low and scattered scores are weaknesses."""
+        result = analyze_progress_locally(self.make_progress([90, 40, 45], "declining"))
+        
+        assert "Điểm số giảm từ 90.0 xuống 45.0" in result.weaknesses
+        assert 'Điểm thấp nhất 40.0 ở bài "Đề 2" (2025-01-02)' in result.weaknesses
+        assert "Điểm số chưa ổn định giữa các lần làm bài (chênh lệch 50.0 điểm)" in result.weaknesses
+        assert "xu hướng đang giảm sút" in result.overallFeedback
+
+    def test_stable_high_scores(self):
+        """Test that stable high scores suggest harder quizzes."""
+        result = analyze_progress_locally(self.make_progress([88, 90, 89], "stable"))
+        
+        assert "Giữ phong độ ổn định ở mức cao" in result.strengths
+        assert result.weaknesses == []
+        assert result.suggestedTopics == []
+        assert result.suggestedNextActions == ["Thử sức với đề có độ khó cao hơn"]
+
+class TestAnalyzeLocally:
+    """Tests for choosing the analyzer by analysis type."""
+
+    @pytest.mark.parametrize("analysis_type, params", [
+        ("result", make_attempt([("IP", "concept", "easy", True)])),
+        ("overall", AnalyzeOverallRequest(attemptCount=1, avgScore=100, knowledgeAnalysis=[])),
+        ("progress", AnalyzeProgressRequest(chapter="Chương 5", progressData=[], avgScore=0, trend="stable")),
+    ])
+    def test_every_type_has_an_analyzer(self, analysis_type, params):
+        """Test that every analysis type has a local analyzer."""
+        result = analyze_locally(analysis_type, params)
+        
+        assert LOCAL_ANALYSIS_NOTE in result.overallFeedback
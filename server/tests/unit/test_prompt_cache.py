@@ -0,0 +1,194 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for prompt_cache.py module.
+"""
+
+import os
+import sys
+import asyncio
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+from google.genai import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from gemini_client import generate_content, generate_content_stream
+from prompt_cache import GeminiCacheBackend, LocalCacheBackend, PromptCache, prompt_cache
+
+INSTRUCTION = "Quy tắc tạo câu hỏi"
+
+def make_config(**kwargs):
+    return types.GenerateContentConfig(temperature=0.3, system_instruction=INSTRUCTION, **kwargs)
+
+class FailingBackend:
+    """Backend whose cache creation always fails, like an instruction below the token minimum."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, client, model, instruction, ttl):
+        self.calls += 1
+        raise ValueError("400 cached content is too small")
+
+class FakeAPIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"{code} error")
+        self.code = code
+
+@pytest.mark.asyncio
+class TestPromptCache:
+    """Tests for replacing system instructions with cached content."""
+
+    async def test_instruction_is_replaced_by_cache_name(self):
+        """Test that the cached config refers to the cache and keeps other settings."""
+        backend = LocalCacheBackend()
+        cache = PromptCache(backend, enabled=True)
+        
+        config = await cache.apply(MagicMock(), "flash", make_config(response_mime_type="application/json"), "key")
+        
+        assert config.system_instruction is None
+        assert config.cached_content == "cachedContents/local-1"
+        assert config.response_mime_type == "application/json"
+        assert backend.contents["cachedContents/local-1"] == ("flash", INSTRUCTION)
+
+    async def test_cache_is_reused_per_key_and_model(self):
+        """Test that one cache is created per API key and model."""
+        backend = LocalCacheBackend()
+        cache = PromptCache(backend, enabled=True)
+        
+        first = await cache.apply(MagicMock(), "flash", make_config(), "key")
+        again = await cache.apply(MagicMock(), "flash", make_config(), "key")
+        other_model = await cache.apply(MagicMock(), "lite", make_config(), "key")
+        other_key = await cache.apply(MagicMock(), "flash", make_config(), "other-key")
+        
+        assert again.cached_content == first.cached_content
+        assert len({first.cached_content, other_model.cached_content, other_key.cached_content}) == 3
+
+    async def test_cache_is_recreated_before_it_expires(self):
+        """Test that a cache close to its TTL is replaced by a new one."""
+        backend = LocalCacheBackend()
+        cache = PromptCache(backend, enabled=True, ttl=30)
+        
+        first = await cache.apply(MagicMock(), "flash", make_config(), "key")
+        second = await cache.apply(MagicMock(), "flash", make_config(), "key")
+        
+        assert first.cached_content != second.cached_content
+
+    async def test_concurrent_calls_share_one_creation(self):
+        """Test that calls arriving together wait for the same cache."""
+        backend = LocalCacheBackend()
+        cache = PromptCache(backend, enabled=True)
+        
+        configs = await asyncio.gather(*(cache.apply(MagicMock(), "flash", make_config(), "key") for _ in range(5)))
+        
+        assert len(backend.contents) == 1
+        assert {config.cached_content for config in configs} == {"cachedContents/local-1"}
+
+    async def test_failed_creation_sends_instruction_inline(self):
+        """Test that a failed creation falls back to the inline instruction and is not retried at once."""
+        backend = FailingBackend()
+        cache = PromptCache(backend, enabled=True, retry_after=600)
+        config = make_config()
+        
+        first = await cache.apply(MagicMock(), "flash", config, "key")
+        second = await cache.apply(MagicMock(), "flash", config, "key")
+        
+        assert first is config and second is config
+        assert backend.calls == 1
+
+    async def test_failed_creation_is_retried_later(self):
+        """Test that creation is tried again once the retry delay has passed."""
+        backend = FailingBackend()
+        cache = PromptCache(backend, enabled=True, retry_after=0)
+        
+        await cache.apply(MagicMock(), "flash", make_config(), "key")
+        await cache.apply(MagicMock(), "flash", make_config(), "key")
+        
+        assert backend.calls == 2
+
+    async def test_configs_without_instruction_are_unchanged(self):
+        """Test that configs without a system instruction, or with caching disabled, are left alone."""
+        backend = LocalCacheBackend()
+        plain = types.GenerateContentConfig(temperature=0.5)
+        
+        assert await PromptCache(backend, enabled=True).apply(MagicMock(), "flash", plain, "key") is plain
+        assert await PromptCache(backend, enabled=True).apply(MagicMock(), "flash", None, "key") is None
+        config = make_config()
+        assert await PromptCache(backend, enabled=False).apply(MagicMock(), "flash", config, "key") is config
+        assert backend.contents == {}
+
+    async def test_gemini_backend_creates_cached_content(self):
+        """Test the request sent to Gemini's caches API."""
+        client = MagicMock()
+        client.aio.caches.create = AsyncMock(return_value=types.CachedContent(name="cachedContents/abc"))
+        
+        name = await GeminiCacheBackend().create(client, "flash", INSTRUCTION, 3600)
+        
+        assert name == "cachedContents/abc"
+        kwargs = client.aio.caches.create.await_args.kwargs
+        assert kwargs["model"] == "flash"
+        assert kwargs["config"].system_instruction == INSTRUCTION
+        assert kwargs["config"].ttl == "3600s"
+
+@pytest.mark.asyncio
+class TestCachedCalls:
+    """Tests for Gemini calls using the shared prompt cache."""
+
+    @pytest.fixture(autouse=True)
+    def local_cache(self):
+        with patch.object(prompt_cache, "backend", LocalCacheBackend()), patch.object(prompt_cache, "enabled", True):
+            prompt_cache.clear()
+            yield
+            prompt_cache.clear()
+
+    async def test_call_uses_cached_content(self):
+        """Test that generate_content sends the cache name instead of the instruction."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(return_value="response")
+        
+        await generate_content(client, "flash", "Tạo 5 câu hỏi", make_config(), key_id="key")
+        
+        config = client.aio.models.generate_content.await_args.kwargs["config"]
+        assert config.cached_content == "cachedContents/local-1"
+        assert config.system_instruction is None
+
+    async def test_stale_cache_falls_back_inline_and_is_recreated(self):
+        """Test that a cache Gemini no longer knows is dropped and the call repeated inline."""
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=[FakeAPIError(404), "inline", "cached"])
+        
+        result = await generate_content(client, "flash", "prompt", make_config(), key_id="key")
+        again = await generate_content(client, "flash", "prompt", make_config(), key_id="key")
+        
+        assert (result, again) == ("inline", "cached")
+        configs = [call.kwargs["config"] for call in client.aio.models.generate_content.await_args_list]
+        assert configs[0].cached_content == "cachedContents/local-1"
+        assert configs[1].system_instruction == INSTRUCTION and configs[1].cached_content is None
+        assert configs[2].cached_content == "cachedContents/local-2"
+
+    async def test_stream_uses_cached_content(self):
+        """Test that streaming calls use the cache as well."""
+        async def chunks():
+            yield "a"
+        
+        client = MagicMock()
+        client.aio.models.generate_content_stream = AsyncMock(return_value=chunks())
+        
+        received = [chunk async for chunk in generate_content_stream(client, "flash", "prompt", make_config(), key_id="key")]
+        
+        assert received == ["a"]
+        config = client.aio.models.generate_content_stream.await_args.kwargs["config"]
+        assert config.cached_content == "cachedContents/local-1"
@@ -0,0 +1,147 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for question_generation.py module.
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from dtos import GenerateQuestionsRequest, Question
+from question_generation import (
+    fold_accents,
+    missing_difficulties,
+    normalize_content,
+    plan_chunks,
+    split_difficulties,
+)
+
+def make_question(content, index=0, difficulty="easy"):
+    return Question(
+        id=f"q-{index}",
+        content=content,
+        options=["A", "B", "C", "D"],
+        correctAnswer=0,
+        chapter="Chương 1",
+        topic="TCP",
+        knowledgeType="concept",
+        difficulty=difficulty,
+    )
+
+class TestSplitDifficulties:
+    """Tests for the 30/40/30 difficulty split."""
+
+    @pytest.mark.parametrize("count,expected", [
+        (10, {"easy": 3, "medium": 4, "hard": 3}),
+        (50, {"easy": 15, "medium": 20, "hard": 15}),
+        (5, {"easy": 1, "medium": 3, "hard": 1}),
+        (1, {"easy": 0, "medium": 1, "hard": 0}),
+    ])
+    def test_split(self, count, expected):
+        """Test that counts follow the mix and add up."""
+        assert split_difficulties(count) == expected
+
+class TestPlanChunks:
+    """Tests for splitting a request into concurrent sub-requests."""
+
+    def test_small_request_is_not_split(self):
+        """Test that a request within the chunk size stays whole."""
+        params = GenerateQuestionsRequest(count=8, topics=["TCP"])
+        
+        chunks = plan_chunks(params, chunk_size=10)
+        
+        assert len(chunks) == 1
+        assert chunks[0][0] is params
+        assert chunks[0][1] == {"easy": 2, "medium": 4, "hard": 2}
+
+    def test_mixed_request_keeps_total_mix(self):
+        """Test that chunk difficulty counts add up to the whole-request mix."""
+        params = GenerateQuestionsRequest(count=23)
+        
+        chunks = plan_chunks(params, chunk_size=10)
+        
+        assert [chunk.count for chunk, _ in chunks] == [8, 8, 7]
+        for chunk, counts in chunks:
+            assert sum(counts.values()) == chunk.count
+        totals = {level: sum(counts[level] for _, counts in chunks) for level in ("easy", "medium", "hard")}
+        assert totals == split_difficulties(23)
+
+    def test_fixed_difficulty_has_no_counts(self):
+        """Test that a single-difficulty request is split without difficulty counts."""
+        params = GenerateQuestionsRequest(count=25, difficulty="hard")
+        
+        chunks = plan_chunks(params, chunk_size=10)
+        
+        assert sum(chunk.count for chunk, _ in chunks) == 25
+        assert all(counts is None and chunk.difficulty == "hard" for chunk, counts in chunks)
+
+    def test_topics_are_spread_over_chunks(self):
+        """Test that every topic is covered and chunks get different topics."""
+        params = GenerateQuestionsRequest(count=30, topics=["TCP", "UDP", "IP", "DNS"])
+        
+        chunks = plan_chunks(params, chunk_size=10)
+        
+        assert [chunk.topics for chunk, _ in chunks] == [["TCP", "DNS"], ["UDP"], ["IP"]]
+
+    def test_disabled_chunking(self):
+        """Test that a chunk size of 0 disables splitting."""
+        assert len(plan_chunks(GenerateQuestionsRequest(count=50), chunk_size=0)) == 1
+
+class TestMissingDifficulties:
+    """Tests for follow-up difficulty counts."""
+
+    def test_fills_the_levels_that_are_short(self):
+        """Test that the follow-up asks for the levels that were lost."""
+        target = {"easy": 3, "medium": 4, "hard": 3}
+        questions = (
+            [make_question(f"e{i}", i, "easy") for i in range(3)]
+            + [make_question(f"m{i}", i, "medium") for i in range(4)]
+            + [make_question("h0", 0, "hard")]
+        )
+        
+        assert missing_difficulties(target, questions, 2) == {"easy": 0, "medium": 0, "hard": 2}
+
+    def test_counts_add_up_to_missing(self):
+        """Test that the follow-up never asks for more or fewer than missing."""
+        target = {"easy": 3, "medium": 4, "hard": 3}
+        questions = [make_question(f"e{i}", i, "easy") for i in range(7)]
+        
+        counts = missing_difficulties(target, questions, 3)
+        
+        assert sum(counts.values()) == 3
+        assert counts["easy"] == 0
+
+    def test_plan_chunks_uses_given_counts(self):
+        """Test that explicit difficulty counts override the default mix."""
+        params = GenerateQuestionsRequest(count=2)
+        
+        chunks = plan_chunks(params, difficulty_counts={"easy": 0, "medium": 0, "hard": 2})
+        
+        assert chunks == [(params, {"easy": 0, "medium": 0, "hard": 2})]
+
+class TestNormalizeContent:
+    """Tests for the text normalization shared by the deduplication helpers."""
+
+    def test_fold_accents(self):
+        """Test that case and Vietnamese accents, including "đ", are folded."""
+        assert fold_accents("Định tuyến ĐỘNG") == "dinh tuyen dong"
+
+    def test_normalize_content(self):
+        """Test that case, accents and punctuation are ignored."""
+        assert normalize_content("Giao thức TCP là gì?") == normalize_content("giao thuc  TCP la gi")
+        assert normalize_content("Địa chỉ đích?") == "dia chi dich"
@@ -0,0 +1,171 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for question_similarity.py module.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from dtos import Question
+from question_similarity import (
+    SimilarityIndex,
+    drop_near_duplicates,
+    index_quiz,
+    key_terms,
+    rebuild_question_index,
+    remove_quiz_from_index,
+    signature,
+    similarity,
+    split_stored_duplicates,
+)
+
+def make_question(content, question_id="q-1"):
+    return Question(
+        id=question_id,
+        content=content,
+        options=["A", "B", "C", "D"],
+        correctAnswer=0,
+        chapter="Chương 2",
+        topic="DHCP",
+        knowledgeType="concept",
+        difficulty="easy",
+    )
+
+def make_quiz(quiz_id, user_id, *contents):
+    return {
+        "id": quiz_id,
+        "createdBy": user_id,
+        "questions": [{"id": f"{quiz_id}-{i}", "content": content} for i, content in enumerate(contents)],
+    }
+
+class TestSimilarity:
+    """Tests for signatures and key terms."""
+
+    def test_reworded_question_is_similar(self):
+        """Test that small wording changes keep the estimated similarity high."""
+        first = signature("Giao thức DHCP dùng để làm gì trong mạng cục bộ?")
+        second = signature("Trong mạng cục bộ, giao thức DHCP được dùng để làm gì?")
+        
+        assert similarity(first, second) >= 0.5
+        assert similarity(first, signature("Cổng mặc định của giao thức SSH là bao nhiêu?")) < 0.3
+
+    def test_case_and_accents_are_ignored(self):
+        """Test that case and Vietnamese accents do not change the signature."""
+        assert signature("Địa chỉ IP là gì?") == signature("dia chi ip LA GI?")
+
+    def test_key_terms(self):
+        """Test that acronyms, addresses and numbers are key terms."""
+        assert key_terms("Mạng 192.168.1.0/24 có bao nhiêu địa chỉ dùng được cho DHCP?") == "192.168.1.0/24 dhcp"
+
+    def test_key_terms_keep_number_order(self):
+        """Test that the same numbers in a different order or count are different key terms."""
+        first = "Truyền một tệp 1 MB qua đường truyền 20 Mbps mất bao lâu? (1 MB = 10^6 byte)"
+        second = "Truyền một tệp 10 MB qua đường truyền 20 Mbps mất bao lâu? (1 MB = 10^6 byte)"
+        
+        assert key_terms(first) == "1 20 1 10 6 mb"
+        assert key_terms(first) != key_terms(second)
+        assert key_terms("Tệp 20 MB, đường truyền 10 Mbps") != key_terms("Tệp 10 MB, đường truyền 20 Mbps")
+
+class TestSimilarityIndex:
+    """Tests for the in-memory LSH index."""
+
+    def test_reworded_question_is_found(self):
+        """Test that a reworded question is reported as a duplicate."""
+        index = SimilarityIndex()
+        
+        assert index.add_if_new("Giao thức DHCP dùng để làm gì trong mạng cục bộ?")
+        assert not index.add_if_new("Trong mạng cục bộ, giao thức DHCP được dùng để làm gì?")
+        assert len(index) == 1
+
+    def test_different_key_terms_are_kept(self):
+        """Test that questions differing in a protocol or address are not duplicates."""
+        index = SimilarityIndex()
+        
+        assert index.add_if_new("Giao thức DHCP hoạt động ở tầng nào của mô hình OSI?")
+        assert index.add_if_new("Giao thức DNS hoạt động ở tầng nào của mô hình OSI?")
+        assert index.add_if_new("Mạng 10.0.0.0/8 có bao nhiêu địa chỉ host?")
+        assert index.add_if_new("Mạng 172.16.0.0/12 có bao nhiêu địa chỉ host?")
+
+    def test_drop_near_duplicates_keeps_first(self):
+        """Test that the first question of each similar group is kept."""
+        questions = [
+            make_question("Giao thức DHCP dùng để làm gì trong mạng cục bộ?", "q-1"),
+            make_question("Cổng mặc định của giao thức SSH là bao nhiêu?", "q-2"),
+            make_question("Trong mạng cục bộ, giao thức DHCP được dùng để làm gì?", "q-3"),
+        ]
+        
+        assert [q.id for q in drop_near_duplicates(questions)] == ["q-1", "q-2"]
+
+    def test_drop_near_duplicates_with_index_and_limit(self):
+        """Test that questions similar to indexed ones are skipped and the limit is kept."""
+        index = SimilarityIndex()
+        index.add_if_new("Giao thức DHCP dùng để làm gì trong mạng cục bộ?")
+        questions = [
+            make_question("Trong mạng cục bộ, giao thức DHCP được dùng để làm gì?", "q-1"),
+            make_question("Cổng mặc định của giao thức SSH là bao nhiêu?", "q-2"),
+            make_question("Giao thức DNS dùng cổng nào?", "q-3"),
+        ]
+        
+        assert [q.id for q in drop_near_duplicates(questions, index, limit=1)] == ["q-2"]
+
+class TestStoredIndex:
+    """Tests for the question_index collection."""
+
+    def test_index_quiz_replaces_previous_entries(self, mock_db):
+        """Test that reindexing a quiz replaces its questions."""
+        index_quiz(mock_db, make_quiz("quiz-1", "user-1", "Câu hỏi A về DHCP", "Câu hỏi B về DNS"))
+        index_quiz(mock_db, make_quiz("quiz-1", "user-1", "Câu hỏi C về ARP"))
+        
+        indexed = list(mock_db.question_index.find({"quizId": "quiz-1"}))
+        assert [doc["questionId"] for doc in indexed] == ["quiz-1-0"]
+        assert indexed[0]["terms"] == "arp"
+        assert len(indexed[0]["bands"]) == 20
+
+    def test_remove_quiz_from_index(self, mock_db):
+        """Test that removing a quiz only removes its own questions."""
+        index_quiz(mock_db, make_quiz("quiz-1", "user-1", "Câu hỏi A về DHCP"))
+        index_quiz(mock_db, make_quiz("quiz-2", "user-1", "Câu hỏi B về DNS"))
+        
+        remove_quiz_from_index(mock_db, "quiz-1")
+        
+        assert [doc["quizId"] for doc in mock_db.question_index.find()] == ["quiz-2"]
+
+    def test_rebuild_question_index(self, mock_db):
+        """Test that the index is rebuilt from every saved quiz."""
+        mock_db.quizzes.insert_many([
+            make_quiz("quiz-1", "user-1", "Câu hỏi A về DHCP", "Câu hỏi B về DNS"),
+            make_quiz("quiz-2", "user-2", "Câu hỏi C về ARP"),
+        ])
+        mock_db.question_index.insert_one({"quizId": "deleted", "userId": "user-1", "bands": []})
+        
+        assert rebuild_question_index(mock_db) == 3
+        assert sorted(mock_db.question_index.distinct("quizId")) == ["quiz-1", "quiz-2"]
+
+    def test_split_stored_duplicates_per_user(self, mock_db):
+        """Test that only the user's own saved questions count as duplicates."""
+        index_quiz(mock_db, make_quiz("quiz-1", "user-1", "Giao thức DHCP dùng để làm gì trong mạng cục bộ?"))
+        index_quiz(mock_db, make_quiz("quiz-2", "user-2", "Cổng mặc định của giao thức SSH là bao nhiêu?"))
+        questions = [
+            make_question("Trong mạng cục bộ, giao thức DHCP được dùng để làm gì?", "q-1"),
+            make_question("Cổng mặc định của giao thức SSH là bao nhiêu?", "q-2"),
+        ]
+        
+        fresh, repeated = split_stored_duplicates(mock_db, "user-1", questions)
+        
+        assert [q.id for q in fresh] == ["q-2"]
+        assert [q.id for q in repeated] == ["q-1"]
@@ -0,0 +1,188 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for question_stock.py module.
+"""
+
+import os
+import sys
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from dtos import GenerateQuestionsRequest, Question
+from question_stock import (
+    add_to_stock,
+    fill_next_slot,
+    is_valid_stock_question,
+    next_slot_to_fill,
+    plan_slots,
+    take_from_stock,
+)
+
+LABELS = {"chapter": "Chương 3", "topic": "TCP", "knowledgeType": "concept", "difficulty": "easy"}
+
+def make_question(content, difficulty="easy", options=None):
+    return {
+        "id": "q",
+        "content": content,
+        "options": options or ["A", "B", "C", "D"],
+        "correctAnswer": 1,
+        "chapter": "Chương 3",
+        "topic": "TCP",
+        "knowledgeType": "concept",
+        "difficulty": difficulty,
+        "explanation": None,
+    }
+
+class TestPlanSlots:
+    """Tests for spreading a request over stock slots."""
+
+    def test_mixed_request(self):
+        """Test that the difficulty mix and topics are spread over slots."""
+        params = GenerateQuestionsRequest(chapter="Chương 3", topics=["TCP", "UDP"], knowledgeTypes=["concept"], count=10)
+        
+        plans = plan_slots(params)
+        
+        assert sum(count for _, count in plans) == 10
+        by_slot = {(labels["topic"], labels["difficulty"]): count for labels, count in plans}
+        assert by_slot[("TCP", "easy")] + by_slot[("UDP", "easy")] == 3
+        assert by_slot[("TCP", "medium")] + by_slot[("UDP", "medium")] == 4
+
+    def test_request_without_topics_is_not_stocked(self):
+        """Test that open-ended requests bypass the stock."""
+        assert plan_slots(GenerateQuestionsRequest(chapter="Chương 3", count=5)) == []
+
+class TestStockStorage:
+    """Tests for adding and taking stocked questions."""
+
+    def test_invalid_questions_are_not_stocked(self, mock_db):
+        """Test that malformed or wrongly labelled questions are rejected."""
+        questions = [
+            make_question("ok"),
+            make_question("hard one", difficulty="hard"),
+            make_question("three options", options=["A", "B", "C"]),
+            make_question("duplicate options", options=["A", "A", "B", "C"]),
+        ]
+        
+        assert add_to_stock(mock_db, LABELS, questions) == 1
+        assert not is_valid_stock_question({**make_question("x"), "correctAnswer": 4})
+
+    def test_questions_are_served_once(self, mock_db):
+        """Test that a stocked question is removed when taken."""
+        add_to_stock(mock_db, LABELS, [make_question("q1"), make_question("q2")])
+        
+        first = take_from_stock(mock_db, [({**LABELS, "topic": "tcp "}, 1)])
+        second = take_from_stock(mock_db, [(LABELS, 5)])
+        
+        assert [q["content"] for q in first] == ["q1"]
+        assert [q["content"] for q in second] == ["q2"]
+        assert "slot" not in first[0] and "_id" not in first[0]
+
+    def test_demand_is_recorded(self, mock_db):
+        """Test that taking from stock records the requested slot."""
+        take_from_stock(mock_db, [(LABELS, 3)])
+        
+        with patch("question_stock.QUESTION_STOCK_TARGET", 5):
+            assert next_slot_to_fill(mock_db) == (LABELS, 5)
+
+    def test_stale_or_full_slots_are_not_filled(self, mock_db):
+        """Test that old demand and full slots are skipped."""
+        take_from_stock(mock_db, [(LABELS, 1)])
+        add_to_stock(mock_db, LABELS, [make_question(f"q{i}") for i in range(2)])
+        mock_db.question_stock_slots.insert_one({
+            "slot": {"chapter": "old"}, "labels": {**LABELS, "chapter": "old"},
+            "lastRequestedAt": datetime.now() - timedelta(days=30),
+        })
+        
+        with patch("question_stock.QUESTION_STOCK_TARGET", 2):
+            assert next_slot_to_fill(mock_db) is None
+
+@pytest.mark.asyncio
+class TestFillNextSlot:
+    """Tests for one filler step."""
+
+    async def test_generates_deficit_for_slot(self, mock_db):
+        """Test that the filler asks for the deficit and stocks the result."""
+        take_from_stock(mock_db, [(LABELS, 1)])
+        requests = []
+
+        async def generate(params):
+            requests.append(params)
+            return [Question(**make_question(f"q{i}")) for i in range(params.count)]
+
+        with patch("question_stock.QUESTION_STOCK_TARGET", 3):
+            added = await fill_next_slot(mock_db, generate)
+        
+        assert added == 3
+        assert requests[0].topics == ["TCP"] and requests[0].difficulty == "easy"
+        assert mock_db.question_stock.count_documents({}) == 3
+
+    async def test_failing_slot_backs_off(self, mock_db):
+        """Test that a slot whose batch fails is skipped so the next slot gets its turn."""
+        other = {**LABELS, "topic": "UDP"}
+        take_from_stock(mock_db, [(LABELS, 1), (other, 1)])
+        mock_db.question_stock_slots.update_one(
+            {"labels.topic": "UDP"}, {"$set": {"lastRequestedAt": datetime.now() - timedelta(hours=1)}}
+        )
+        requests = []
+
+        async def generate(params):
+            requests.append(params.topics[0])
+            if params.topics[0] == "TCP":
+                raise RuntimeError("quota")
+            return [Question(**make_question(f"{params.topics[0]} {i}")) for i in range(params.count)]
+
+        with patch("question_stock.QUESTION_STOCK_TARGET", 2):
+            with pytest.raises(RuntimeError):
+                await fill_next_slot(mock_db, generate)
+            added = await fill_next_slot(mock_db, generate)
+        
+        assert requests == ["TCP", "UDP"]
+        assert added == 2
+        assert mock_db.question_stock_slots.find_one({"labels.topic": "TCP"})["failures"] == 1
+
+    async def test_backoff_grows_and_clears(self, mock_db):
+        """Test that repeated empty batches double the backoff and a useful one clears it."""
+        take_from_stock(mock_db, [(LABELS, 1)])
+        results = [[], [], [Question(**make_question("q"))]]
+
+        async def generate(params):
+            return results.pop(0)
+
+        with patch("question_stock.QUESTION_STOCK_TARGET", 1), \
+             patch("question_stock.QUESTION_STOCK_INTERVAL", 100):
+            for failures in (1, 2):
+                assert await fill_next_slot(mock_db, generate) == 0
+                entry = mock_db.question_stock_slots.find_one({})
+                assert entry["failures"] == failures
+                assert next_slot_to_fill(mock_db) is None
+                delay = (entry["retryAt"] - datetime.now()).total_seconds()
+                assert 100 * 2 ** (failures - 1) - 5 < delay <= 100 * 2 ** (failures - 1)
+                mock_db.question_stock_slots.update_one({}, {"$set": {"retryAt": datetime.now()}})
+            
+            assert await fill_next_slot(mock_db, generate) == 1
+        
+        entry = mock_db.question_stock_slots.find_one({})
+        assert "failures" not in entry and "retryAt" not in entry
+
+    async def test_nothing_to_fill(self, mock_db):
+        """Test that the filler does nothing without demand."""
+        async def generate(params):
+            raise AssertionError("should not generate")
+
+        assert await fill_next_slot(mock_db, generate) == 0
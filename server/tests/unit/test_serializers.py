@@ -0,0 +1,117 @@
+# Copyright 2025 Nguyễn Ngọc Phú Tỷ
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit tests for serializers.py module.
+The fast path must produce the same JSON as the pydantic response models.
+"""
+
+import os
+import sys
+import json
+import pytest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from dtos import QuizResponse, AttemptResponse, AnalysisHistoryResponse
+from serializers import (
+    dumps,
+    FastJSONResponse,
+    quiz_to_dict,
+    attempt_to_dict,
+    analysis_history_to_dict,
+    paginated,
+)
+
+class TestDumps:
+    """Tests for JSON encoding."""
+
+    def test_dumps_datetime(self):
+        """Test that datetimes are encoded as ISO strings."""
+        result = json.loads(dumps({"at": datetime(2025, 1, 1, 8, 30, 0, 123000)}))
+        
+        assert result["at"] == "2025-01-01T08:30:00.123000"
+
+    def test_dumps_unicode(self):
+        """Test that Vietnamese text round-trips."""
+        result = json.loads(dumps({"title": "Mạng máy tính"}))
+        
+        assert result["title"] == "Mạng máy tính"
+
+    def test_fast_json_response_media_type(self):
+        """Test the response content type."""
+        response = FastJSONResponse({"ok": True})
+        
+        assert response.media_type == "application/json"
+        assert json.loads(response.body) == {"ok": True}
+
+class TestQuizToDict:
+    """Tests for quiz projection."""
+
+    def test_matches_quiz_response(self, sample_quiz_data):
+        """Test parity with QuizResponse serialization."""
+        doc = {**sample_quiz_data, "_id": "mongo-id", "createdAt": datetime(2025, 1, 1, 8, 0, 0)}
+        
+        expected = json.loads(QuizResponse(**{k: v for k, v in doc.items() if k != "_id"}).model_dump_json())
+        
+        assert json.loads(dumps(quiz_to_dict(doc))) == expected
+
+    def test_drops_mongo_id(self, sample_quiz_data):
+        """Test that internal fields are not leaked."""
+        result = quiz_to_dict({**sample_quiz_data, "_id": "mongo-id"})
+        
+        assert "_id" not in result
+
+    def test_missing_settings_defaults_question_count(self, sample_quiz_data):
+        """Test default settings when the document has none."""
+        doc = {k: v for k, v in sample_quiz_data.items() if k != "settings"}
+        
+        result = quiz_to_dict(doc)
+        
+        assert result["settings"]["questionCount"] == 1
+        assert result["settings"]["chapter"] is None
+
+    def test_missing_explanation_is_null(self, sample_quiz_data, sample_question):
+        """Test that optional question fields are filled in."""
+        question = {k: v for k, v in sample_question.items() if k != "explanation"}
+        
+        result = quiz_to_dict({**sample_quiz_data, "questions": [question]})
+        
+        assert result["questions"][0]["explanation"] is None
+
+class TestAttemptAndHistoryToDict:
+    """Tests for attempt and analysis history projection."""
+
+    def test_attempt_matches_attempt_response(self, sample_attempt_data):
+        """Test parity with AttemptResponse serialization."""
+        doc = {**sample_attempt_data, "_id": "mongo-id", "score": 100, "completedAt": datetime(2025, 1, 1)}
+        
+        expected = json.loads(AttemptResponse(**{k: v for k, v in doc.items() if k != "_id"}).model_dump_json())
+        
+        assert json.loads(dumps(attempt_to_dict(doc))) == expected
+
+    def test_history_matches_history_response(self, sample_analysis_history):
+        """Test parity with AnalysisHistoryResponse serialization."""
+        doc = {**sample_analysis_history, "_id": "mongo-id", "createdAt": datetime(2025, 1, 1)}
+        
+        expected = json.loads(AnalysisHistoryResponse(**{k: v for k, v in doc.items() if k != "_id"}).model_dump_json())
+        
+        assert json.loads(dumps(analysis_history_to_dict(doc))) == expected
+
+    def test_paginated(self):
+        """Test pagination wrapper."""
+        result = paginated([1, 2], total=12, page=1, size=2, pages=6)
+        
+        assert result == {"items": [1, 2], "total": 12, "page": 1, "size": 2, "pages": 6}